@@ -21,6 +21,7 @@ def pyxrf_api():
 
         Dask client:
           dask_client_create - returns Dask client for use in batch scripts
+          dask_client_manager - manager of the Dask client shared by processing functions
 
         Simulation of datasets:
           gen_hdf5_qa_dataset - generate quantitative analysis dataset
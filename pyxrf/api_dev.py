@@ -3,9 +3,14 @@
 
 import logging
 
-from .core.map_processing import dask_client_create  # noqa: F401
+from .core.instrumentation import QtSignalProgressSink  # noqa: F401
+from .core.instrumentation import TerminalProgressSink  # noqa: F401
+from .core.instrumentation import JSONProgressSink, LogProgressSink, ProgressMonitor  # noqa: F401
+from .core.live_processing import ArrayRowSource, HDF5RowSource, LiveMapProcessor  # noqa: F401
+from .core.map_processing import dask_client_create, dask_client_manager  # noqa: F401
+from .core.result_cache import ResultCache  # noqa: F401
 from .gui_support.gpc_class import autofind_emission_lines  # noqa: F401, E402
-from .model.command_tools import fit_pixel_data_and_save, pyxrf_batch  # noqa: F401
+from .model.command_tools import fit_pixel_data_and_save, fit_pixel_data_sweep_and_save, pyxrf_batch  # noqa: F401
 from .model.fileio import combine_data_to_recon  # noqa: F401
 from .model.fileio import create_movie  # noqa: F401
 from .model.fileio import export_to_view  # noqa: F401
@@ -1,5 +1,5 @@
 import numpy as np
-from scipy.optimize import nnls
+from numba import jit
 
 
 def rfactor_compute(spectrum, fit_results, ref_spectra):
@@ -236,7 +236,10 @@ def fit_spectrum(data, ref_spectra, *, method="nnls", axis=0, maxiter=100, rate=
 
 def _fitting_nnls(data, ref_spectra, *, maxiter=100):
     r"""
-    Fitting of multiple spectra using NNLS method.
+    Fitting of multiple spectra using NNLS method. The reference matrix is the same for
+    all spectra, so the Gram matrix ``A^T A`` and the projections ``A^T y`` are computed
+    once for the whole set of spectra and the small ``Q x Q`` NNLS problems are solved
+    for each spectrum using the active set (Lawson-Hanson) algorithm.
 
     Parameters
     ----------
@@ -261,15 +264,18 @@ def _fitting_nnls(data, ref_spectra, *, maxiter=100):
         map that represents R-factor for the fitting, shape (M,N).
 
     map_residual : ndarray(float), 2D
-        residual returned by NNLS algorithm
+        residual (2-norm of the difference between the observed and fitted spectra)
+
+    Raises
+    ------
+    RuntimeError
+        if the maximum number of iterations is reached
     """
     assert data.ndim == 2, "Data array 'data' must have 2 dimensions"
     assert ref_spectra.ndim == 2, "Data array 'ref_spectra' must have 2 dimensions"
 
     n_pts = data.shape[0]
-    n_pixels = data.shape[1]
     n_pts_2 = ref_spectra.shape[0]
-    n_refs = ref_spectra.shape[1]
 
     assert (
         n_pts == n_pts_2
@@ -277,22 +283,131 @@ def _fitting_nnls(data, ref_spectra, *, maxiter=100):
 
     assert maxiter > 0, f"The parameter 'maxiter' is zero or negative ({maxiter})"
 
-    map_data_fitted = np.zeros(shape=[n_refs, n_pixels])
-    map_rfactor = np.zeros(shape=[n_pixels])
-    map_residual = np.zeros(shape=[n_pixels])
-    for n in range(n_pixels):
-        map_sel = data[:, n]
-        result, residual = nnls(ref_spectra, map_sel, maxiter=maxiter)
+    data = np.asarray(data, dtype=np.float64)
+    ref_spectra = np.asarray(ref_spectra, dtype=np.float64)
 
-        rfactor = rfactor_compute(map_sel, result, ref_spectra)
+    # The reference matrix is the same for all pixels: the Gram matrix is computed once and
+    #   the projections of all spectra are computed using a single matrix multiplication.
+    ata = np.matmul(np.transpose(ref_spectra), ref_spectra)
+    aty = np.ascontiguousarray(np.matmul(np.transpose(ref_spectra), data))
 
-        map_data_fitted[:, n] = result
-        map_rfactor[n] = rfactor
-        map_residual[n] = residual
+    map_data_fitted, n_iter_exceeded = _nnls_gram_numba(ata, aty, maxiter)
+    if n_iter_exceeded:
+        raise RuntimeError(f"NNLS: maximum number of iterations reached for {n_iter_exceeded} spectra.")
+
+    spectrum_fit = np.matmul(ref_spectra, map_data_fitted)
+    map_residual = np.sqrt(np.sum(np.square(data - spectrum_fit), axis=0))
+    map_rfactor = rfactor(data, spectrum_fit)
 
     return map_data_fitted, map_rfactor, map_residual
 
 
+@jit(nopython=True, nogil=True, cache=True)
+def _solve_passive_set(ata, aty, passive):
+    """
+    Solve the unconstrained least squares problem for the variables in the passive set
+    using the Gram matrix `ata` and the projection `aty`. Variables outside the passive set are zero.
+    """
+    n_refs = ata.shape[0]
+    indices = np.nonzero(passive)[0]
+    n_passive = indices.size
+
+    s = np.zeros(n_refs)
+    if not n_passive:
+        return s
+
+    m = np.empty((n_passive, n_passive))
+    v = np.empty(n_passive)
+    for i in range(n_passive):
+        v[i] = aty[indices[i]]
+        for j in range(n_passive):
+            m[i, j] = ata[indices[i], indices[j]]
+
+    try:
+        sol = np.linalg.solve(m, v)
+    except Exception:
+        # The Gram matrix is singular (e.g. references are linearly dependent)
+        sol = np.linalg.lstsq(m, v)[0]
+
+    for i in range(n_passive):
+        s[indices[i]] = sol[i]
+    return s
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _nnls_gram_numba(ata, aty, maxiter):
+    """
+    Active set NNLS algorithm (Lawson-Hanson) formulated in terms of the Gram matrix
+    `ata` (shape `(Q, Q)`) and projections `aty` of the spectra (shape `(Q, N)`).
+    Returns the array of weights (shape `(Q, N)`) and the number of spectra for which
+    the maximum number of iterations was reached.
+    """
+    n_refs, n_pixels = aty.shape
+    weights = np.zeros((n_refs, n_pixels))
+    n_iter_exceeded = 0
+    eps = np.finfo(np.float64).eps
+
+    for n in range(n_pixels):
+        b = aty[:, n].copy()
+        tol = 10 * eps * n_refs * max(np.max(np.abs(b)), 1e-300)
+
+        x = np.zeros(n_refs)
+        passive = np.zeros(n_refs, dtype=np.bool_)
+        w = b.copy()  # Gradient at x = 0
+        n_iter = 0
+        exceeded = False
+
+        while not exceeded:
+            # Select the variable from the active set with the largest gradient
+            j_max, w_max = -1, tol
+            for j in range(n_refs):
+                if not passive[j] and w[j] > w_max:
+                    j_max, w_max = j, w[j]
+            if j_max < 0:
+                break
+
+            passive[j_max] = True
+            s = _solve_passive_set(ata, b, passive)
+            if s[j_max] <= 0:
+                # The variable can not be moved to the passive set (round-off errors)
+                passive[j_max] = False
+                w[j_max] = 0
+                continue
+
+            while True:
+                n_iter += 1
+                if n_iter > maxiter:
+                    exceeded = True
+                    break
+
+                # Move towards the solution 's' until one of the passive variables becomes zero
+                alpha, j_min = 2.0, -1
+                for j in range(n_refs):
+                    if passive[j] and s[j] <= 0:
+                        a = x[j] / (x[j] - s[j])
+                        if a < alpha:
+                            alpha, j_min = a, j
+                if j_min < 0:
+                    break
+
+                for j in range(n_refs):
+                    if passive[j]:
+                        x[j] += alpha * (s[j] - x[j])
+                        if x[j] <= 0 or j == j_min:
+                            x[j] = 0
+                            passive[j] = False
+                s = _solve_passive_set(ata, b, passive)
+
+            x[:] = s
+            w = b - np.dot(ata, x)
+
+        if exceeded:
+            n_iter_exceeded += 1
+        weights[:, n] = x
+
+    return weights, n_iter_exceeded
+
+
 def _fitting_admm(data, ref_spectra, *, rate=0.2, maxiter=100, epsilon=1e-30, non_negative=True):
     r"""
     Fitting of multiple spectra using ADMM method.
@@ -0,0 +1,288 @@
+import json
+import logging
+import threading
+import time as ttime
+
+import psutil
+from progress.bar import Bar
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressMonitor:
+    """
+    Monitor progress and throughput of processing of XRF maps. The monitor generates
+    structured progress events and passes them to the sinks. The monitor implements the interface
+    of the progress bar (methods `start()`, `__call__(percent_completed)` and `finish()`),
+    so it can be passed as a parameter `progress_bar` to the processing functions, such as
+    `fit_xrf_map`, `compute_selected_rois` or `compute_total_spectrum_and_count`. The processing
+    functions supply information on the workload (`set_workload()`) and Dask client
+    (`set_client()`) before the computations are started and report each block of data
+    that is processed (`block_completed()`). The numbers of processed blocks, pixels and bytes
+    are the sums of the reported values. Those numbers remain zero if the monitor is driven
+    only by percent of completion.
+
+    Each event is a dictionary with the following keys:
+
+    - ``event`` - type of the event: ``"start"``, ``"progress"`` or ``"finish"``;
+    - ``title`` - title of the monitor;
+    - ``timestamp`` - time of the event (seconds since the epoch);
+    - ``elapsed`` - time since the start of processing, s;
+    - ``percent_completed`` - progress, %;
+    - ``n_blocks``, ``n_blocks_completed`` - total number and the number of processed blocks;
+    - ``n_pixels``, ``n_pixels_completed`` - total number and the number of processed pixels;
+    - ``pixels_per_second`` - processing rate;
+    - ``bytes_total``, ``bytes_read`` - size of the data and the total size of the processed blocks;
+    - ``bytes_per_second`` - data reading rate;
+    - ``seconds_per_block`` - average time of processing of one block by the cluster
+      (elapsed time divided by the number of processed blocks);
+    - ``worker_memory`` - memory used by Dask workers (or the local process if processing is
+      performed using local thread pool), bytes, None if not available.
+
+    Sinks are callable objects that accept an event as the only parameter, e.g.
+    `TerminalProgressSink`, `LogProgressSink`, `JSONProgressSink` or `QtSignalProgressSink`.
+    Sinks are called from the thread that drives the computations (not necessarily the main thread).
+
+    Parameters
+    ----------
+    title: str
+        title of the monitor, included in each event
+    sinks: list(callable) or callable or None
+        sinks that receive events
+    min_interval: float
+        minimum time interval between consecutive ``"progress"`` events (s). Events
+        ``"start"`` and ``"finish"`` are always generated.
+
+    Examples
+    --------
+    .. code-block:: python
+
+        monitor = ProgressMonitor(
+            "NNLS fitting", sinks=[TerminalProgressSink(), JSONProgressSink("fitting_progress.jsonl")]
+        )
+        fit_xrf_map(data, data_sel_indices, matv, snip_param, progress_bar=monitor)
+    """
+
+    def __init__(self, title, *, sinks=None, min_interval=0.5):
+        if sinks is None:
+            sinks = []
+        elif callable(sinks):
+            sinks = [sinks]
+        self.title = title
+        self.sinks = list(sinks)
+        self.min_interval = min_interval
+
+        self._lock = threading.Lock()
+        self._client = None
+        self.set_workload()
+        self._reset()
+
+    def _reset(self):
+        self._t_start = None
+        self._t_last_event = None
+        self._percent_completed = 0.0
+        self._n_blocks_completed = 0
+        self._n_pixels_completed = 0
+        self._bytes_read = 0
+
+    def set_workload(self, *, n_blocks=0, n_pixels=0, n_bytes=0):
+        """
+        Set the total number of blocks, pixels and bytes of data to be processed.
+        """
+        self._n_blocks, self._n_pixels, self._n_bytes = n_blocks, n_pixels, n_bytes
+
+    def block_completed(self, *, n_pixels, n_bytes):
+        """
+        Report that a block of data was processed. ``n_pixels`` and ``n_bytes`` are the number
+        of pixels and the size of the block of input data.
+        """
+        with self._lock:
+            self._n_blocks_completed += 1
+            self._n_pixels_completed += n_pixels
+            self._bytes_read += n_bytes
+
+    def set_client(self, client):
+        """
+        Set Dask client used for computations (None if local thread pool is used).
+        The client is used to obtain memory used by the workers.
+        """
+        self._client = client
+
+    def _worker_memory(self):
+        try:
+            if self._client is not None:
+                workers = self._client.scheduler_info()["workers"].values()
+                return int(sum([_["metrics"]["memory"] for _ in workers]))
+            return int(psutil.Process().memory_info().rss)
+        except Exception:
+            return None
+
+    def _create_event(self, event_type):
+        t = ttime.time()
+        elapsed = t - self._t_start if self._t_start is not None else 0.0
+        n_blocks_completed = self._n_blocks_completed
+        n_pixels_completed = self._n_pixels_completed
+        bytes_read = self._bytes_read
+
+        def _rate(v):
+            return v / elapsed if elapsed > 0 else 0.0
+
+        return {
+            "event": event_type,
+            "title": self.title,
+            "timestamp": t,
+            "elapsed": elapsed,
+            "percent_completed": self._percent_completed,
+            "n_blocks": self._n_blocks,
+            "n_blocks_completed": n_blocks_completed,
+            "n_pixels": self._n_pixels,
+            "n_pixels_completed": n_pixels_completed,
+            "pixels_per_second": _rate(n_pixels_completed),
+            "bytes_total": self._n_bytes,
+            "bytes_read": bytes_read,
+            "bytes_per_second": _rate(bytes_read),
+            "seconds_per_block": elapsed / n_blocks_completed if n_blocks_completed else None,
+            "worker_memory": self._worker_memory(),
+        }
+
+    def _emit(self, event_type):
+        event = self._create_event(event_type)
+        self._t_last_event = event["timestamp"]
+        for sink in self.sinks:
+            try:
+                sink(event)
+            except Exception as ex:
+                logger.error(f"Failed to send progress event to the sink {sink!r}: {ex}")
+
+    def start(self):
+        with self._lock:
+            self._reset()
+            self._t_start = ttime.time()
+            self._emit("start")
+
+    def __call__(self, percent_completed):
+        with self._lock:
+            if self._t_start is None:
+                self._t_start = ttime.time()
+            self._percent_completed = min(max(float(percent_completed), self._percent_completed), 100.0)
+            if (self._t_last_event is None) or (ttime.time() - self._t_last_event >= self.min_interval):
+                self._emit("progress")
+
+    def finish(self):
+        with self._lock:
+            if self._t_start is None:
+                self._t_start = ttime.time()
+            self._percent_completed = 100.0
+            self._emit("finish")
+
+
+class TerminalProgressSink:
+    """
+    Display progress and processing rate in the terminal. Similarly to `TerminalProgressBar`,
+    the progress bar is displayed only in the terminal (or emulated terminal).
+    """
+
+    def __init__(self):
+        self._bar = None
+
+    def __call__(self, event):
+        if event["event"] == "start" or self._bar is None:
+            self._bar = Bar(event["title"], max=100, suffix="%(percent)d%%")
+        self._bar.suffix = f"%(percent)d%% {event['pixels_per_second']:.0f} pixels/s"
+        while self._bar.index < min(event["percent_completed"], 100):
+            self._bar.next()
+        if event["event"] == "finish":
+            self._bar.finish()
+            self._bar = None
+
+
+class LogProgressSink:
+    """
+    Print progress events to the log. Events ``"start"`` and ``"finish"`` are always printed,
+    ``"progress"`` events are printed at most once per `interval` seconds.
+
+    Parameters
+    ----------
+    log: logging.Logger or None
+        logger. If None, then the logger of this module is used.
+    level: int
+        logging level
+    interval: float
+        minimum time interval between printed ``"progress"`` events, s
+    """
+
+    def __init__(self, log=None, *, level=logging.INFO, interval=10.0):
+        self._logger = log if log is not None else logger
+        self._level = level
+        self._interval = interval
+        self._t_last = None
+
+    def __call__(self, event):
+        if event["event"] == "progress":
+            if (self._t_last is not None) and (event["timestamp"] - self._t_last < self._interval):
+                return
+        self._t_last = event["timestamp"]
+
+        msg = (
+            f"{event['title']}: {event['event']}, {event['percent_completed']:.1f}% "
+            f"({event['n_blocks_completed']}/{event['n_blocks']} blocks), elapsed {event['elapsed']:.1f} s, "
+            f"{event['pixels_per_second']:.0f} pixels/s, {event['bytes_per_second'] / 1024**2:.1f} MB/s"
+        )
+        if event["worker_memory"] is not None:
+            msg += f", worker memory {event['worker_memory'] / 1024**2:.0f} MB"
+        self._logger.log(self._level, msg)
+
+
+class JSONProgressSink:
+    """
+    Append progress events to a file (one JSON object per line).
+
+    Parameters
+    ----------
+    file_path: str
+        path to the file. The file is created if it does not exist.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            with open(self.file_path, "a") as f:
+                f.write(json.dumps(event) + "\n")
+
+
+class QtSignalProgressSink:
+    """
+    Emit progress events as a Qt signal. The events are emitted from the thread that drives
+    the computations, the connected slots of GUI widgets are called in the main thread.
+
+    Parameters
+    ----------
+    signal: Signal
+        bound Qt signal that accepts one parameter of type ``object``, e.g. the signal
+        declared as ``signal_progress = Signal(object)``
+
+    Examples
+    --------
+    .. code-block:: python
+
+        class Widget(QWidget):
+            signal_progress = Signal(object)
+
+            def start_fitting(self):
+                self.signal_progress.connect(self.slot_progress)
+                sink = QtSignalProgressSink(self.signal_progress)
+                # ... start fitting in the background thread with 'progress_sinks=sink'
+
+            @Slot(object)
+            def slot_progress(self, event):
+                self.progress_bar.setValue(int(event["percent_completed"]))
+    """
+
+    def __init__(self, signal):
+        self._signal = signal
+
+    def __call__(self, event):
+        self._signal.emit(dict(event))
@@ -0,0 +1,301 @@
+import logging
+import threading
+import time as ttime
+
+import h5py
+import numpy as np
+
+from .map_processing import (
+    _check_data_sel_indices,
+    _check_data_sel_range,
+    _check_matv,
+    _check_snip_param,
+    _fit_xrf_block,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class HDF5RowSource:
+    """
+    Source of rows of the XRF map, which is written to HDF5 file while the scan is in progress.
+    The file is opened for reading in SWMR (single writer, multiple readers) mode. The writer
+    is expected to extend the dataset (with unlimited size along axis 0) by one or more rows
+    once the rows are complete and then flush the dataset, e.g.
+
+    .. code-block:: python
+
+        with h5py.File(file_path, "w", libver="latest") as f:
+            dset = f.create_dataset(
+                "xrfmap/detsum/counts", (0, nx, ne), dtype=np.float32, maxshape=(None, nx, ne), chunks=(1, nx, ne)
+            )
+            f.swmr_mode = True
+            for row in acquired_rows:
+                dset.resize(dset.shape[0] + 1, axis=0)
+                dset[-1] = row
+                dset.flush()
+
+    The rows of the dataset that exist at the time of the refresh are considered complete, so
+    the dataset must not be allocated in full before the data is written.
+
+    Parameters
+    ----------
+    file_path: str
+        path to the HDF5 file
+    dset_name: str
+        name of the dataset with raw data, shape ``(ny, nx, ne)``
+    n_rows: int or None
+        the total number of rows in the complete map. If None, then the size of the dataset
+        along axis 0 is used if the size is limited (``maxshape``), otherwise the total number
+        of rows is unknown and the scan is considered complete only when following is stopped.
+    """
+
+    def __init__(self, file_path, dset_name="xrfmap/detsum/counts", *, n_rows=None):
+        self.file_path = file_path
+        self.dset_name = dset_name
+        self._file = h5py.File(file_path, "r", libver="latest", swmr=True)
+        try:
+            self._dset = self._file[dset_name]
+            if self._dset.ndim != 3:
+                raise ValueError(f"Dataset '{dset_name}' must be 3D array: shape = {self._dset.shape}")
+            if n_rows is None:
+                n_rows = self._dset.maxshape[0]
+        except Exception:
+            self._file.close()
+            raise
+        self.n_rows = n_rows
+
+    @property
+    def map_shape(self):
+        """Shape of the complete map ``(ny, nx, ne)`` (``ny`` is None if the number of rows is unknown)"""
+        return (self.n_rows,) + tuple(self._dset.shape[1:])
+
+    def refresh(self):
+        """Refresh the dataset and return the number of completed rows."""
+        self._dset.refresh()
+        return self._dset.shape[0]
+
+    def read_rows(self, n_start, n_end):
+        """Read the completed rows ``n_start .. n_end - 1``."""
+        return self._dset[n_start:n_end, ...]
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ArrayRowSource:
+    """
+    Stand-in for the source of rows of the XRF map acquired row by row (e.g. data from
+    a scan in progress loaded from Tiled). The map ``data`` is complete, but only the first
+    ``n_rows_completed`` rows are visible to the reader. The number of completed rows is advanced
+    by calling `set_rows_completed()` (e.g. from a different thread).
+
+    Parameters
+    ----------
+    data: array-like
+        XRF map, shape ``(ny, nx, ne)``. The object must support slicing along axis 0.
+    n_rows_completed: int
+        the number of rows that are initially completed
+    """
+
+    def __init__(self, data, *, n_rows_completed=0):
+        if len(data.shape) != 3:
+            raise ValueError(f"XRF map must be 3D array: shape = {data.shape}")
+        self._data = data
+        self.n_rows = data.shape[0]
+        self._lock = threading.Lock()
+        self._n_rows_completed = 0
+        self.set_rows_completed(n_rows_completed)
+
+    @property
+    def map_shape(self):
+        return tuple(self._data.shape)
+
+    def set_rows_completed(self, n_rows_completed):
+        with self._lock:
+            self._n_rows_completed = min(max(int(n_rows_completed), self._n_rows_completed), self.n_rows)
+
+    def refresh(self):
+        with self._lock:
+            return self._n_rows_completed
+
+    def read_rows(self, n_start, n_end):
+        return np.asarray(self._data[n_start:n_end, ...])
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class LiveMapProcessor:
+    """
+    Incremental processing of the XRF map while the scan is in progress. The processor follows
+    the source of rows (`HDF5RowSource`, `ArrayRowSource` or any object with the same interface)
+    and processes only the rows completed since the previous update: the rows are added to
+    the total spectrum, the total count map (preview) is filled and the spectra are fitted
+    using the fitting model (``matv``), which is prepared once and reused for all updates.
+    The results for the rows that are not yet acquired are zeros.
+
+    Parameters
+    ----------
+    source: HDF5RowSource or ArrayRowSource
+        the source of rows
+    data_sel_indices, matv, snip_param, use_snip
+        parameters of fitting (see `fit_xrf_map`). If ``matv`` is None, then spectra are not fitted
+        and only the total spectrum and the total count map are computed.
+    n_rows_in_batch: int
+        the maximum number of rows processed at once (limits memory used for processing
+        when the processor falls behind the scan, e.g. when following is started late)
+    consume_block: callable or None
+        function `consume_block(block, block_slice)` that receives the fitting results for new rows
+        as soon as they are computed (see `fit_xrf_map`). The results are also assembled
+        in `fit_results`.
+
+    Examples
+    --------
+    .. code-block:: python
+
+        with HDF5RowSource("scan2D_1000.h5", n_rows=200) as source:
+            processor = LiveMapProcessor(source, data_sel_indices=(100, 1100), matv=matv, snip_param=snip_param)
+            processor.follow(callback=lambda p, n_start, n_end: display(p.fit_results))
+    """
+
+    def __init__(
+        self,
+        source,
+        *,
+        data_sel_indices=None,
+        matv=None,
+        snip_param=None,
+        use_snip=True,
+        n_rows_in_batch=10,
+        consume_block=None,
+    ):
+        if not isinstance(n_rows_in_batch, (int, np.integer)) or (n_rows_in_batch < 1):
+            raise ValueError(f"Parameter 'n_rows_in_batch' must be a positive integer: {n_rows_in_batch!r}")
+
+        ny, nx, ne = source.map_shape
+        if matv is not None:
+            if snip_param is None:
+                snip_param = {}  # For consistency
+            _check_data_sel_indices(data_sel_indices)
+            _check_matv(matv, data_sel_indices)
+            _check_snip_param(snip_param, keys_required=use_snip)
+            _check_data_sel_range(data_sel_indices, ne)
+
+        self.source = source
+        self.data_sel_indices = data_sel_indices
+        self.matv = matv
+        self.snip_param = snip_param
+        self.use_snip = use_snip
+        self.n_rows_in_batch = int(n_rows_in_batch)
+        self.consume_block = consume_block
+
+        # The maps are extended if the number of rows is unknown
+        ny = ny or 0
+        self.total_spectrum = np.zeros(ne)
+        self.total_count = np.zeros((ny, nx))
+        self.fit_results = None if matv is None else np.zeros((ny, nx, matv.shape[1] + 4))
+        self.n_rows_processed = 0
+
+    @property
+    def is_complete(self):
+        """True if all rows of the map are processed (the total number of rows must be known)."""
+        n_rows = self.source.n_rows
+        return (n_rows is not None) and (self.n_rows_processed >= n_rows)
+
+    def _extend_maps(self, n_rows):
+        n_extra = n_rows - self.total_count.shape[0]
+        if n_extra > 0:
+            self.total_count = np.concatenate(
+                (self.total_count, np.zeros((n_extra,) + self.total_count.shape[1:]))
+            )
+            if self.fit_results is not None:
+                self.fit_results = np.concatenate(
+                    (self.fit_results, np.zeros((n_extra,) + self.fit_results.shape[1:]))
+                )
+
+    def _process_rows(self, n_start, n_end):
+        data = np.nan_to_num(np.asarray(self.source.read_rows(n_start, n_end), dtype=np.float64))
+        self._extend_maps(n_end)
+        self.total_spectrum += np.sum(data, axis=(0, 1))
+        self.total_count[n_start:n_end, :] = np.sum(data, axis=2)
+        if self.fit_results is not None:
+            block = _fit_xrf_block(data, self.data_sel_indices, self.matv, self.snip_param, self.use_snip)
+            self.fit_results[n_start:n_end, :, :] = block
+            if self.consume_block is not None:
+                self.consume_block(block, np.s_[n_start:n_end, 0 : block.shape[1], 0 : block.shape[2]])
+        self.n_rows_processed = n_end
+
+    def update(self):
+        """
+        Process the rows completed since the previous update.
+
+        Returns
+        -------
+        tuple(int)
+            the range of processed rows ``(n_start, n_end)``, ``n_start == n_end`` if no new rows
+            are completed
+        """
+        n_start = self.n_rows_processed
+        n_completed = self.source.refresh()
+        if self.source.n_rows is not None:
+            n_completed = min(n_completed, self.source.n_rows)
+        for ns in range(n_start, n_completed, self.n_rows_in_batch):
+            self._process_rows(ns, min(ns + self.n_rows_in_batch, n_completed))
+        if n_completed > n_start:
+            logger.debug(f"Live processing: rows {n_start} .. {n_completed - 1} are processed")
+        return n_start, self.n_rows_processed
+
+    def follow(self, *, callback=None, poll_interval=1.0, idle_timeout=None, stop_event=None):
+        """
+        Follow the source and process new rows until the map is complete, ``stop_event`` is set
+        or no new rows are completed within ``idle_timeout``.
+
+        Parameters
+        ----------
+        callback: callable or None
+            function ``callback(processor, n_start, n_end)`` called after new rows ``n_start .. n_end - 1``
+            are processed, e.g. to refresh the displayed maps
+        poll_interval: float
+            time between checks for new rows, s
+        idle_timeout: float or None
+            stop following if no new rows are completed within ``idle_timeout`` seconds (e.g. the scan
+            was aborted). Wait indefinitely if None.
+        stop_event: threading.Event or None
+            stop following once the event is set (e.g. from a different thread)
+
+        Returns
+        -------
+        bool
+            True if the map is complete, False otherwise
+        """
+        t_last_row = ttime.monotonic()
+        while True:
+            n_start, n_end = self.update()
+            if n_end > n_start:
+                t_last_row = ttime.monotonic()
+                if callback is not None:
+                    callback(self, n_start, n_end)
+            if self.is_complete:
+                return True
+            if (stop_event is not None) and stop_event.is_set():
+                return False
+            if (idle_timeout is not None) and (ttime.monotonic() - t_last_row > idle_timeout):
+                logger.warning(f"Live processing: no new rows were completed in {idle_timeout} s")
+                return False
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                ttime.sleep(poll_interval)
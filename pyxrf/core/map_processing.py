@@ -1,21 +1,34 @@
+import atexit
+import concurrent.futures
 import getpass
+import itertools
 import logging
 import math
 import os
 import platform
 import tempfile
+import threading
 import time as ttime
+import uuid
+import zlib
+from collections import OrderedDict
+from collections.abc import Iterable
 
 import dask
 import dask.array as da
 import h5py
 import numpy as np
-from dask.distributed import Client, wait
+import psutil
+from dask.callbacks import Callback
+from dask.distributed import Client, LocalCluster, as_completed, futures_of, wait
+from dask.highlevelgraph import HighLevelGraph
 from numba import jit
 from progress.bar import Bar
 
 from .dask_h5py_serializers import dask_close_all_files, dask_set_custom_serializers
 from .fitting import fit_spectrum
+from .result_cache import compute_cache_key
+from .shared_arrays import detach_shared_segments, find_shared_array, load_shared_block
 
 logger = logging.getLogger(__name__)
 
@@ -71,6 +84,145 @@ def dask_client_create(**kwargs):
     return client
 
 
+class DaskClientManager:
+    """
+    Manager of the Dask client shared by all processing functions in the process.
+    The client is created when it is requested for the first time (or in the background
+    by calling `prewarm()`), and the same client is returned to all callers. The client
+    is closed after it was not used for `idle_timeout` seconds or when the program exits.
+
+    Typically the global instance `dask_client_manager` is used:
+
+    .. code:: python
+
+        client = dask_client_manager.acquire()
+        # <-- code that runs computations -->
+        dask_client_manager.release()
+
+    Parameters
+    ----------
+    idle_timeout: float or None
+        The time (in seconds) after which the idle client is closed. The client remains
+        open until the program exits if `idle_timeout` is None.
+    client_kwargs: dict or None
+        kwargs passed to `dask_client_create` when the client is created.
+    """
+
+    def __init__(self, *, idle_timeout=600, client_kwargs=None):
+        self.idle_timeout = idle_timeout
+        self.client_kwargs = client_kwargs or {}
+
+        self._client = None
+        self._n_users = 0
+        self._lock = threading.RLock()
+        self._idle_timer = None
+        self._prewarm_thread = None
+
+    @property
+    def is_running(self):
+        """Returns True if the client is created and running"""
+        with self._lock:
+            return self._client_is_running()
+
+    def _client_is_running(self):
+        return (self._client is not None) and (self._client.status == "running")
+
+    def _start_client(self):
+        if not self._client_is_running():
+            if self._client is not None:
+                self._close_client()
+            # The shared client should not become the default scheduler for all computations
+            kwargs = {"set_as_default": False}
+            kwargs.update(self.client_kwargs)
+            self._client = dask_client_create(**kwargs)
+        return self._client
+
+    def _close_client(self):
+        client, self._client = self._client, None
+        try:
+            client.close()
+        except Exception as ex:
+            logger.debug(f"Failed to close Dask client: {ex}")
+
+    def _cancel_idle_timer(self):
+        if self._idle_timer is not None:
+            self._idle_timer.cancel()
+            self._idle_timer = None
+
+    def _close_if_idle(self, timer):
+        with self._lock:
+            # The timer may fire while waiting for the lock after it was cancelled and replaced
+            if self._idle_timer is not timer:
+                return
+            self._idle_timer = None
+            if (self._n_users == 0) and (self._client is not None):
+                logger.info("Closing idle Dask client ...")
+                self._close_client()
+
+    def prewarm(self):
+        """
+        Start the client in the background thread. The function returns immediately.
+        The client is closed if it is not used within `idle_timeout` seconds.
+        """
+
+        def _prewarm():
+            with self._lock:
+                self._start_client()
+                if self._n_users == 0:
+                    self._restart_idle_timer()
+
+        if self._prewarm_thread is None or not self._prewarm_thread.is_alive():
+            self._prewarm_thread = threading.Thread(target=_prewarm, daemon=True)
+            self._prewarm_thread.start()
+
+    def _restart_idle_timer(self):
+        self._cancel_idle_timer()
+        if self.idle_timeout is not None:
+            timer = threading.Timer(self.idle_timeout, lambda: self._close_if_idle(timer))
+            timer.daemon = True
+            self._idle_timer = timer
+            timer.start()
+
+    def acquire(self):
+        """
+        Returns the shared client. The client is created if necessary. Call `release()`
+        when the client is no longer needed.
+
+        Returns
+        -------
+        client: dask.distributed.Client
+            Dask client object
+        """
+        with self._lock:
+            self._cancel_idle_timer()
+            client = self._start_client()
+            self._n_users += 1
+            return client
+
+    def release(self):
+        """
+        Notify the manager that the client acquired by `acquire()` is no longer used.
+        The idle timer is started when the client is released by all users.
+        """
+        with self._lock:
+            self._n_users = max(self._n_users - 1, 0)
+            if self._n_users == 0 and self._client is not None:
+                self._restart_idle_timer()
+
+    def shutdown(self):
+        """Close the client. The new client will be created when it is requested."""
+        with self._lock:
+            self._cancel_idle_timer()
+            if self._client is not None:
+                self._close_client()
+            self._n_users = 0
+
+
+# Dask client shared by the processing functions
+dask_client_manager = DaskClientManager()
+atexit.register(dask_client_manager.shutdown)
+
+
 class TerminalProgressBar:
     """
     Custom class that displays the progress bar in the terminal. Progress
@@ -163,6 +315,393 @@ def wait_and_display_progress(fut, progress_bar=None):
         progress_bar.finish()
 
 
+# Supported execution backends for processing of XRF maps:
+#   "threads" - in-process thread pool (no Dask client is needed, small startup overhead),
+#   "distributed" - Dask distributed client (high startup overhead if client is created),
+#   "auto" - the backend is selected based on the map size and the number of available cores.
+execution_backends = ("auto", "threads", "distributed")
+
+# Maps with size (in bytes) below the limit are processed using the thread pool by default.
+_auto_backend_size_limit = 512 * 1024**2
+
+
+def _get_number_of_cores():
+    """Returns the number of CPU cores available to the process"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Not supported on some platforms (e.g. OSX, Windows)
+        return os.cpu_count() or 1
+
+
+def select_execution_backend(data, *, backend="auto", client=None, n_cores=None):
+    """
+    Select execution backend for processing of XRF map. If Dask client is provided,
+    then it is used for processing (distributed backend) unless the thread pool
+    is explicitly requested. If `backend` is `"auto"`, then small maps or maps processed
+    on computers with few available cores are processed using the in-process thread pool,
+    which avoids the overhead of starting Dask distributed client. Large maps
+    are processed using Dask distributed client.
+
+    Parameters
+    ----------
+    data: da.core.Array, np.ndarray or RawHDF5Dataset
+        Raw XRF map. Only the size of the map is used by the function.
+    backend: str
+        Requested backend: `"auto"`, `"threads"` or `"distributed"`.
+    client: dask.distributed.Client or None
+        Dask client (if available).
+    n_cores: int or None
+        The number of available CPU cores. If None, then the number of cores
+        available to the process is used.
+
+    Returns
+    -------
+    str
+        Selected backend: `"threads"` or `"distributed"`.
+
+    Raises
+    ------
+    ValueError if the backend is not supported.
+    """
+    if backend not in execution_backends:
+        raise ValueError(
+            f"Execution backend {backend!r} is not supported. Supported backends: {execution_backends}"
+        )
+
+    if backend != "auto":
+        return backend
+    if client is not None:
+        return "distributed"
+
+    if not hasattr(data, "shape"):
+        return "threads"  # The type of 'data' is not supported and the error is reported by 'prepare_xrf_map'
+
+    n_cores = _get_number_of_cores() if n_cores is None else n_cores
+    shape = data.shape
+    itemsize = np.dtype(data.dtype).itemsize if hasattr(data, "dtype") else np.dtype(float).itemsize
+    map_size = int(np.prod(shape)) * itemsize
+
+    if (map_size <= _auto_backend_size_limit) or (n_cores <= 2):
+        return "threads"
+    return "distributed"
+
+
+class _BlockAccounting:
+    """
+    Reports the blocks of input data processed during computations to the progress monitor
+    (see `ProgressMonitor.block_completed`). The blocks of the result that are aligned with
+    the blocks of the input data (the result has the same number of blocks along axes 0 and 1
+    as the input data, e.g. the result of `map_blocks`) are mapped to the blocks of input data.
+    The block of input data is reported once, when the first block of the result that depends
+    on it is computed. The number of pixels and bytes is the size of the block of input data.
+    The blocks of the results that are not aligned with input data (e.g. the results of reductions)
+    are not reported.
+
+    Parameters
+    ----------
+    progress_bar: callable or None
+        the progress bar. The blocks are not reported if the progress bar does not support
+        the interface.
+    result: list(dask.array)
+        the list of computed arrays
+    workload: dask.array, list(dask.array) or None
+        the input data. If `workload` is a list, then the arrays correspond to the arrays of `result`.
+    """
+
+    def __init__(self, progress_bar, result, workload):
+        self._progress_bar = progress_bar if hasattr(progress_bar, "block_completed") else None
+        self._block_ids = {}  # Key of the block of the result -> ID of the input block
+        self._block_sizes = {}  # ID of the input block -> (n_pixels, n_bytes)
+        self._completed = set()
+        if (self._progress_bar is None) or (workload is None):
+            return
+
+        workload = list(workload) if isinstance(workload, (tuple, list)) else [workload] * len(result)
+        for arr, data in zip(result, workload):
+            if (arr.ndim < 2) or (data.ndim < 2) or (arr.numblocks[0:2] != data.numblocks[0:2]):
+                continue
+            bytes_per_pixel = int(np.prod(data.shape[2:])) * data.dtype.itemsize
+            for index in np.ndindex(arr.numblocks):
+                # The same input array may be used to compute multiple results
+                block_id = (id(data),) + index[0:2]
+                n_pixels = data.chunks[0][index[0]] * data.chunks[1][index[1]]
+                self._block_ids[(arr.name,) + index] = block_id
+                self._block_sizes[block_id] = (n_pixels, n_pixels * bytes_per_pixel)
+
+    def complete(self, key):
+        """Report that the block of the result with the key `key` is computed."""
+        block_id = self._block_ids.get(key, None)
+        if (block_id is None) or (block_id in self._completed):
+            return
+        self._completed.add(block_id)
+        n_pixels, n_bytes = self._block_sizes[block_id]
+        self._progress_bar.block_completed(n_pixels=n_pixels, n_bytes=n_bytes)
+
+
+class _ThreadsProgressCallback(Callback):
+    """
+    Drives progress bar (e.g. `TerminalProgressBar`) during computations performed
+    using the local thread pool. See `wait_and_display_progress` for the description
+    of the progress bar interface. The computed blocks are reported to `accounting`
+    (see `_BlockAccounting`).
+    """
+
+    def __init__(self, progress_bar, accounting=None):
+        super().__init__()
+        self._progress_bar = progress_bar
+        self._accounting = accounting
+        self._n_total = 0
+        self._n_done = 0
+
+    def _start_state(self, dsk, state):
+        self._n_total = len(dsk)
+        self._n_done = 0
+        if hasattr(self._progress_bar, "start"):
+            self._progress_bar.start()
+        self._progress_bar(1.0)
+
+    def _posttask(self, key, result, dsk, state, worker_id):
+        if self._accounting is not None:
+            self._accounting.complete(key)
+        self._n_done += 1
+        percent_completed = self._n_done / self._n_total * 100.0 if self._n_total else 100.0
+        self._progress_bar(percent_completed)
+
+    def _finish(self, dsk, state, errored):
+        self._progress_bar(100.0)
+        if hasattr(self._progress_bar, "finish"):
+            self._progress_bar.finish()
+
+
+class ComputationCancelledError(Exception):
+    """
+    Exception raised when processing of an XRF map is cancelled (see ``cancel_event``
+    parameter of ``fit_xrf_map``).
+    """
+
+    pass
+
+
+_cancel_poll_interval = 0.1  # Interval for checking if computations were cancelled, s
+
+
+class _DaskExecutor:
+    """
+    Executes Dask computations using the selected backend. The object is used as context
+    manager. If distributed backend is used and no client is provided, then the shared client
+    is acquired from `dask_client_manager` on entering the context and released on exit.
+    Files opened by the workers are closed on exit.
+
+    Parameters
+    ----------
+    backend: str
+        `"threads"` or `"distributed"`.
+    client: dask.distributed.Client or None
+        Dask client. Ignored if `backend` is `"threads"`.
+    """
+
+    def __init__(self, *, backend, client=None):
+        if backend not in ("threads", "distributed"):
+            raise ValueError(f"Unsupported execution backend: {backend!r}")
+        self.backend = backend
+        self.client = client if backend == "distributed" else None
+        self._client_is_shared = False
+
+    def __enter__(self):
+        if self.backend == "distributed":
+            if self.client is None:
+                self.client = dask_client_manager.acquire()
+                self._client_is_shared = True
+            self.client.run(dask_set_custom_serializers)
+            dask_set_custom_serializers()
+
+            n_workers = len(self.client.scheduler_info()["workers"])
+            logger.info(f"Dask distributed client: {n_workers} workers")
+        else:
+            logger.info(f"Processing using local thread pool: {_get_number_of_cores()} threads")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.backend == "distributed":
+            self.client.run(dask_close_all_files)
+            self.client.run(detach_shared_segments)
+        dask_close_all_files()
+        if self._client_is_shared:
+            dask_client_manager.release()
+            self.client = None
+
+    def scatter(self, data):
+        """Scatter data to the workers. Data is returned unchanged if the thread pool is used"""
+        return self.client.scatter(data) if self.backend == "distributed" else data
+
+    def _set_progress_workload(self, progress_bar, workload):
+        """
+        Pass information on the workload (Dask array or a list of Dask arrays with input data) and Dask client to
+        the progress monitor (see `ProgressMonitor`). Progress bars that don't support
+        the interface are not affected.
+        """
+        if (workload is not None) and hasattr(progress_bar, "set_workload"):
+            workload = workload if isinstance(workload, (tuple, list)) else [workload]
+            progress_bar.set_workload(
+                n_blocks=sum([_.npartitions for _ in workload]),
+                n_pixels=sum([_.shape[0] * _.shape[1] for _ in workload]),
+                n_bytes=sum([_.nbytes for _ in workload]),
+            )
+        if hasattr(progress_bar, "set_client"):
+            progress_bar.set_client(self.client)
+
+    def compute(self, result, *, progress_bar=None, workload=None):
+        """
+        Compute Dask array `result` and return the computed numpy array. If `result` is
+        a tuple or a list of Dask arrays, then the arrays are computed together (as one graph,
+        so the shared input data is loaded once) and the tuple of numpy arrays is returned.
+        The progress bar is driven during the computations (see `wait_and_display_progress`).
+        `workload` is the Dask array with input data, used to report the progress
+        (see `ProgressMonitor`). The blocks of the results are reported to the progress monitor
+        as they are computed (see `_BlockAccounting`).
+        """
+        self._set_progress_workload(progress_bar, workload)
+        is_sequence = isinstance(result, (tuple, list))
+        results = tuple(result) if is_sequence else (result,)
+        accounting = _BlockAccounting(progress_bar, results, workload)
+
+        if self.backend == "distributed":
+            # The shared client is not set as default, so it is explicitly set as current
+            with self.client.as_current():
+                results_fut = dask.persist(*results, scheduler=self.client)
+                # Call the progress monitor
+                self._wait_and_display_progress(results_fut, progress_bar, accounting)
+                computed = dask.compute(*results_fut, scheduler=self.client)
+        else:
+            kwargs = {"scheduler": "threads", "num_workers": _get_number_of_cores()}
+            if progress_bar is None:
+                computed = dask.compute(*results, **kwargs)
+            else:
+                with _ThreadsProgressCallback(progress_bar, accounting):
+                    computed = dask.compute(*results, **kwargs)
+
+        return computed if is_sequence else computed[0]
+
+    @staticmethod
+    def _wait_and_display_progress(results, progress_bar, accounting):
+        """
+        Wait for the blocks of the persisted arrays `results` to be computed and drive
+        the progress bar (see `wait_and_display_progress`). The computed blocks are reported
+        to `accounting` (see `_BlockAccounting`).
+        """
+        if progress_bar is None:
+            return
+
+        if hasattr(progress_bar, "start"):
+            progress_bar.start()
+        progress_bar(1.0)
+
+        futures = futures_of(list(results))
+        for n_completed, fut in enumerate(as_completed(futures), 1):
+            accounting.complete(fut.key)
+            progress_bar(n_completed / len(futures) * 100.0)
+        progress_bar(100.0)
+
+        if hasattr(progress_bar, "finish"):
+            progress_bar.finish()
+
+    def compute_blocks(self, result, *, consume_block, progress_bar=None, workload=None, cancel_event=None):
+        """
+        Compute Dask array `result` block by block. Each computed block is passed to
+        `consume_block(block, block_slice)` as soon as it is available and then released,
+        so the full array is never assembled in memory. `block_slice` is the tuple of slices
+        that define position of the block in `result`. `consume_block` is always called
+        from the calling thread, so it can safely write data to files.
+
+        If `result` is a tuple or a list of Dask arrays, then `consume_block` must be a list
+        of functions (one function for each array). The blocks of all arrays are computed together.
+
+        If `cancel_event` (`threading.Event`) is set during computations, then the blocks
+        that are not yet computed are cancelled and `ComputationCancelledError` is raised.
+        The blocks that were already passed to `consume_block` remain valid.
+
+        The consumed blocks are reported to the progress monitor (see `_BlockAccounting`).
+        """
+        self._set_progress_workload(progress_bar, workload)
+        if not isinstance(result, (tuple, list)):
+            result, consume_block = [result], [consume_block]
+        accounting = _BlockAccounting(progress_bar, result, workload)
+
+        block_list, slice_list, consumer_list = [], [], []
+        for arr, consumer in zip(result, consume_block):
+            blocks = arr.to_delayed()
+            boundaries = [np.cumsum((0,) + c) for c in arr.chunks]
+            for index in np.ndindex(blocks.shape):
+                block_list.append(blocks[index])
+                slice_list.append(tuple(slice(b[n], b[n + 1]) for b, n in zip(boundaries, index)))
+                consumer_list.append(consumer)
+        n_blocks = len(block_list)
+
+        if progress_bar is not None:
+            if hasattr(progress_bar, "start"):
+                progress_bar.start()
+            progress_bar(1.0)
+
+        def _report_progress(n_completed):
+            if progress_bar is not None:
+                progress_bar(n_completed / n_blocks * 100.0 if n_blocks else 100.0)
+
+        def _check_cancelled(timeout=0):
+            if (cancel_event is not None) and cancel_event.wait(timeout):
+                raise ComputationCancelledError("Computations were cancelled")
+
+        if self.backend == "distributed":
+            with self.client.as_current():
+                futures = self.client.compute(block_list)
+                # Futures are removed from 'pending' as soon as the results are consumed
+                pending = {fut.key: (n, fut) for n, fut in enumerate(futures)}
+                completed = as_completed(futures)
+                del futures
+                try:
+                    for n_completed in range(1, n_blocks + 1):
+                        if cancel_event is not None:
+                            while not completed.has_ready():
+                                _check_cancelled(_cancel_poll_interval)
+                            _check_cancelled()
+                        fut = next(completed)
+                        n, _ = pending.pop(fut.key)
+                        # Results are gathered one at a time, the rest remain on the workers
+                        consumer_list[n](fut.result(), slice_list[n])
+                        fut.release()
+                        accounting.complete(block_list[n].key)
+                        _report_progress(n_completed)
+                except BaseException:
+                    self.client.cancel([fut for _, fut in pending.values()])
+                    raise
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=_get_number_of_cores()) as pool:
+                futures = {pool.submit(_.compute, scheduler="synchronous"): n for n, _ in enumerate(block_list)}
+                timeout = _cancel_poll_interval if cancel_event is not None else None
+                n_completed = 0
+                try:
+                    while futures:
+                        done, _ = concurrent.futures.wait(
+                            futures, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        _check_cancelled()
+                        for fut in done:
+                            n = futures.pop(fut)
+                            consumer_list[n](fut.result(), slice_list[n])
+                            accounting.complete(block_list[n].key)
+                            n_completed += 1
+                            _report_progress(n_completed)
+                except BaseException:
+                    # Blocks that are already being computed are allowed to complete
+                    for fut in futures:
+                        fut.cancel()
+                    raise
+
+        if progress_bar is not None:
+            _report_progress(n_blocks)
+            if hasattr(progress_bar, "finish"):
+                progress_bar.finish()
+
+
 class RawHDF5Dataset:
     """
     Instead of actual data we may store the HDF5 file name and dataset name within the
@@ -187,6 +726,360 @@ class RawHDF5Dataset:
         self.dset_name = _dset_name
         self.shape = shape
 
+    def get_pixel_spectra(self, pixels):
+        """
+        Read spectra of the selected pixels from the file. Only the HDF5 chunks that contain
+        the pixels are read. Recently read chunks are kept in memory (see `get_pixel_spectra`).
+
+        Parameters
+        ----------
+        pixels: iterable(tuple(int))
+            list of pixel coordinates `(ny, nx)`
+
+        Returns
+        -------
+        ndarray
+            array of spectra with the shape `(n_pixels, n_energy_bins)`
+        """
+        return get_pixel_spectra(self, pixels)
+
+
+class _ChunkCache:
+    """
+    Thread-safe LRU cache for the blocks of data read from HDF5 files. The total size
+    of the cached blocks is limited by `max_bytes`.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._blocks = OrderedDict()
+        self._n_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            block = self._blocks.get(key, None)
+            if block is not None:
+                self._blocks.move_to_end(key)
+            return block
+
+    def put(self, key, block):
+        with self._lock:
+            if key in self._blocks:
+                self._n_bytes -= self._blocks.pop(key).nbytes
+            self._blocks[key] = block
+            self._n_bytes += block.nbytes
+            while self._n_bytes > self.max_bytes and len(self._blocks) > 1:
+                _, b = self._blocks.popitem(last=False)
+                self._n_bytes -= b.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
+            self._n_bytes = 0
+
+
+# The blocks of raw data recently read by 'get_pixel_spectra'
+_pixel_chunk_cache = _ChunkCache(max_bytes=512 * 1024**2)
+
+
+def _check_pixels(pixels, map_shape):
+    """
+    Verify that `pixels` is a list of pixel coordinates `(ny, nx)` within the map of size `map_shape`.
+    Returns the array of coordinates with the shape `(n_pixels, 2)`.
+    """
+    try:
+        pixels_array = np.asarray(pixels, dtype=int)
+    except (TypeError, ValueError):
+        pixels_array = None
+    if (pixels_array is None) or (pixels_array.ndim != 2) or (pixels_array.shape[1] != 2):
+        raise TypeError(f"Parameter 'pixels' must be a list of pixel coordinates (ny, nx): pixels = {pixels!r}")
+    pixels = pixels_array
+    if np.any(pixels < 0) or np.any(pixels >= np.asarray(map_shape)):
+        raise ValueError(f"Some pixels are outside the map with dimensions {tuple(map_shape)}: pixels = {pixels}")
+    return pixels
+
+
+def get_pixel_spectra(data, pixels):
+    """
+    Get spectra of the selected pixels of XRF map. If the data is stored in HDF5 file
+    (`RawHDF5Dataset`), then only the chunks of the dataset that contain the selected pixels
+    are read and decompressed. Each chunk is read once per call and the recently read chunks
+    are kept in memory (LRU cache), so the spectra of the same or neighboring pixels are
+    returned without accessing the file. The cache is invalidated if the file is modified.
+    If the dataset is not chunked, then only the spectra of the selected pixels are read.
+
+    Parameters
+    ----------
+    data: da.core.Array, np.ndarray or RawHDF5Dataset
+        XRF map with the shape `(ny, nx, n_energy_bins)`
+    pixels: iterable(tuple(int))
+        list of pixel coordinates `(ny, nx)`
+
+    Returns
+    -------
+    ndarray
+        array of spectra with the shape `(n_pixels, n_energy_bins)`
+
+    Raises
+    ------
+    TypeError or ValueError if input parameters are invalid.
+    """
+    if isinstance(data, np.ndarray):
+        pixels = _check_pixels(pixels, data.shape[0:2])
+        return data[pixels[:, 0], pixels[:, 1], :]
+    elif isinstance(data, da.core.Array):
+        pixels = _check_pixels(pixels, data.shape[0:2])
+        return data.vindex[pixels[:, 0], pixels[:, 1]].compute(scheduler="threads")
+    elif not isinstance(data, RawHDF5Dataset):
+        raise TypeError(f"Type of parameter 'data' is not supported: type(data)={type(data)}")
+
+    fpath, dset_name = data.abs_path, data.dset_name
+    # The cached blocks are invalidated once the file is modified
+    file_version = os.stat(fpath).st_mtime_ns
+    with h5py.File(fpath, "r") as f:
+        dset = f[dset_name]
+        if dset.ndim != 3:
+            raise TypeError(
+                f"Dataset '{dset_name}' in file '{fpath}' has {dset.ndim} dimensions: 3D dataset is expected"
+            )
+        pixels = _check_pixels(pixels, dset.shape[0:2])
+        block_size = dset.chunks[0:2] if dset.chunks else (1, 1)
+
+        spectra = np.zeros(shape=(len(pixels), dset.shape[2]), dtype=dset.dtype)
+        block_indices = pixels // np.asarray(block_size)
+        for nb in np.unique(block_indices, axis=0):
+            key = (fpath, dset_name, file_version, tuple(nb))
+            block = _pixel_chunk_cache.get(key)
+            if block is None:
+                # Read the block that includes the full spectra (all chunks along the energy axis)
+                ny0, nx0 = nb * np.asarray(block_size)
+                block_selection = (slice(ny0, ny0 + block_size[0]), slice(nx0, nx0 + block_size[1]), slice(None))
+                if _supports_parallel_decompression(dset):
+                    block = _read_hdf5_block(dset, block_selection)
+                else:
+                    block = dset[block_selection]
+                _pixel_chunk_cache.put(key, block)
+            sel = np.all(block_indices == nb, axis=1)
+            spectra[sel] = block[pixels[sel, 0] % block_size[0], pixels[sel, 1] % block_size[1], :]
+
+    return spectra
+
+
+# Thread pool used for decompression of HDF5 chunks (created on first use in each process)
+_decompression_pool = None
+_decompression_pool_lock = threading.Lock()
+
+
+def _get_decompression_pool():
+    global _decompression_pool
+    with _decompression_pool_lock:
+        if _decompression_pool is None:
+            _decompression_pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=_get_number_of_cores(), thread_name_prefix="pyxrf-decompress"
+            )
+        return _decompression_pool
+
+
+def _supports_parallel_decompression(dset):
+    """
+    Returns True if the chunks of HDF5 dataset should be decompressed by `_read_hdf5_block`:
+    the dataset is chunked and compressed with gzip (with or without shuffle filter),
+    no other filters are applied and multiple CPU cores are available. Parallel decompression
+    may be disabled by setting Dask configuration value ``pyxrf.parallel-decompression`` to False.
+    """
+    return bool(
+        (_get_number_of_cores() > 1)
+        and dset.chunks
+        and dset.compression == "gzip"
+        and not dset.fletcher32
+        and dset.scaleoffset is None
+        and dask.config.get("pyxrf.parallel-decompression", True)
+    )
+
+
+def _decode_gzip_chunk(raw_chunk, chunk_shape, dtype, shuffle):
+    """Decompress the chunk read from HDF5 file with `read_direct_chunk`."""
+    chunk = np.frombuffer(zlib.decompress(raw_chunk), dtype=np.uint8)
+    if shuffle and dtype.itemsize > 1:
+        # HDF5 shuffle filter stores the n-th bytes of all elements together
+        chunk = chunk.reshape(dtype.itemsize, -1).T.copy()
+    return chunk.view(dtype).reshape(chunk_shape)
+
+
+def _read_hdf5_block(dset, selection):
+    """
+    Read the block of chunked gzip-compressed HDF5 dataset (see `_supports_parallel_decompression`).
+    Compressed chunks are read from the file using `read_direct_chunk` (the HDF5 library
+    does not decompress the data) and decompressed in a thread pool. Decompression releases
+    the GIL, so the chunks are decompressed in parallel. The chunks that are not allocated
+    are filled with the fill value of the dataset.
+
+    Parameters
+    ----------
+    dset: h5py.Dataset
+        the dataset
+    selection: tuple(slice)
+        selection of the block: a slice with step 1 for each dimension of the dataset
+
+    Returns
+    -------
+    ndarray
+        the block of the dataset
+    """
+    bounds = [sl.indices(n)[0:2] for sl, n in zip(selection, dset.shape)]
+    block = np.empty(shape=tuple(max(b[1] - b[0], 0) for b in bounds), dtype=dset.dtype)
+    if not block.size:
+        return block
+
+    chunk_shape, shuffle = dset.chunks, dset.shuffle
+
+    def _decode(raw_chunk, src, dest):
+        block[dest] = _decode_gzip_chunk(raw_chunk, chunk_shape, dset.dtype, shuffle)[src]
+
+    pool = _get_decompression_pool()
+    futures = []
+    ranges = [range(b[0] // c * c, b[1], c) for b, c in zip(bounds, chunk_shape)]
+    for chunk_offset in itertools.product(*ranges):
+        # Intersection of the chunk and the block: position in the chunk and in the block
+        src = tuple(
+            slice(max(b[0] - o, 0), min(b[1] - o, c)) for b, o, c in zip(bounds, chunk_offset, chunk_shape)
+        )
+        dest = tuple(slice(o + s.start - b[0], o + s.stop - b[0]) for b, o, s in zip(bounds, chunk_offset, src))
+        try:
+            filter_mask, raw_chunk = dset.id.read_direct_chunk(chunk_offset)
+        except RuntimeError:
+            # The chunk is not allocated
+            block[dest] = dset.fillvalue
+            continue
+        if filter_mask:
+            # Some filters were not applied to the chunk, let the HDF5 library decode it
+            block[dest] = dset[tuple(slice(o + s.start, o + s.stop) for o, s in zip(chunk_offset, src))]
+            continue
+        futures.append(pool.submit(_decode, raw_chunk, src, dest))
+
+    for fut in futures:
+        fut.result()
+    return block
+
+
+class _CompressedHDF5Reader:
+    """
+    Array-like object that reads blocks of gzip-compressed HDF5 dataset using `_read_hdf5_block`.
+    The object is passed to `dask.array.from_array`. The object is serialized as the path to
+    the file and the name of the dataset, so it may be sent to the workers of distributed client.
+    """
+
+    def __init__(self, abs_path, dset_name, *, shape, dtype):
+        self.abs_path = abs_path
+        self.dset_name = dset_name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.ndim = len(self.shape)
+        self._file_version = os.stat(abs_path).st_mtime_ns
+
+    def __dask_tokenize__(self):
+        return (type(self).__name__, self.abs_path, self.dset_name, self.shape, self._file_version)
+
+    def __getitem__(self, selection):
+        if not isinstance(selection, tuple):
+            selection = (selection,)
+        selection = selection + (slice(None),) * (self.ndim - len(selection))
+        with h5py.File(self.abs_path, "r") as f:
+            return _read_hdf5_block(f[self.dset_name], selection)
+
+
+# Parameters used for automatic selection of chunk size
+_chunk_bytes_min = 4 * 1024**2  # Smaller chunks create unnecessary scheduling overhead
+_chunk_bytes_max = 256 * 1024**2
+_chunk_memory_fraction = 0.25  # Fraction of memory available to a worker thread
+_chunk_memory_factor = 4  # The number of float64 copies of the block created during processing
+_chunks_per_thread = 4  # The desired number of chunks per worker thread (load balancing)
+
+
+def _get_worker_resources(client=None):
+    """
+    Returns the total number of worker threads and memory available to each thread (bytes).
+    If `client` is not None, then the resources are obtained from the scheduler, otherwise
+    resources of the local machine are used.
+    """
+    if client is not None:
+        try:
+            workers = list(client.scheduler_info()["workers"].values())
+            n_threads = sum([_["nthreads"] for _ in workers])
+            memory = min([_["memory_limit"] / _["nthreads"] for _ in workers])
+            if n_threads and memory:
+                return n_threads, memory
+        except Exception as ex:
+            logger.debug(f"Failed to obtain information on worker resources: {ex}")
+
+    n_threads = _get_number_of_cores()
+    memory = psutil.virtual_memory().available / n_threads
+    return n_threads, memory
+
+
+def _auto_chunk_pixels(data_shape, dtype, *, file_chunksize=None, compression=None, client=None):
+    """
+    Select the number of pixels in a chunk of XRF map based on the size of the map and
+    the spectrum, the data type, the resources available to the workers and layout of
+    the data in HDF5 file. The chunk is large enough to keep scheduling overhead low,
+    small enough to fit in the memory available to a worker thread and the map is split
+    into enough chunks to load all worker threads. The selected value may be overridden
+    by setting Dask configuration value `pyxrf.chunk-pixels`, e.g.
+    `dask.config.set({"pyxrf.chunk-pixels": 5000})`.
+
+    Parameters
+    ----------
+    data_shape: tuple(int)
+        shape of the XRF map `(ny, nx, ne)`
+    dtype: numpy.dtype or str
+        type of the data elements
+    file_chunksize: tuple(int) or None
+        chunk size of the HDF5 dataset, None if the dataset is not chunked
+    compression: str or None
+        compression filter applied to the HDF5 dataset, None if the data is not compressed
+    client: dask.distributed.Client or None
+        Dask client. If None, then resources of the local machine are used.
+
+    Returns
+    -------
+    chunk_pixels: int
+        the desired number of pixels in a chunk
+    """
+    chunk_pixels = dask.config.get("pyxrf.chunk-pixels", None)
+    if chunk_pixels:
+        return int(chunk_pixels)
+
+    ny, nx, ne = data_shape
+    n_threads, memory_per_thread = _get_worker_resources(client)
+
+    # Memory occupied by the raw data and the intermediate results of processing of one pixel
+    bytes_per_pixel = ne * (np.dtype(dtype).itemsize + _chunk_memory_factor * 8)
+    bytes_max = min(_chunk_bytes_max, memory_per_thread * _chunk_memory_fraction)
+    pixels_max = max(int(bytes_max // bytes_per_pixel), 1)
+    pixels_min = min(max(int(_chunk_bytes_min // bytes_per_pixel), 1), pixels_max)
+
+    pixels_parallel = int(math.ceil(ny * nx / (n_threads * _chunks_per_thread)))
+    chunk_pixels = min(max(pixels_parallel, pixels_min), pixels_max)
+
+    if file_chunksize and compression:
+        # Compressed HDF5 chunks are decompressed as a whole: each Dask chunk should contain
+        #   at least one HDF5 chunk, otherwise the same HDF5 chunk is decompressed multiple times.
+        file_chunk_pixels = file_chunksize[0] * file_chunksize[1]
+        if file_chunk_pixels > pixels_max:
+            logger.warning(
+                f"The size of chunks of compressed HDF5 dataset {file_chunksize} is too large: "
+                f"processing of the map may require large amount of memory"
+            )
+        chunk_pixels = max(chunk_pixels, file_chunk_pixels)
+
+    logger.debug(
+        f"Automatically selected chunk size: {chunk_pixels} pixels (map shape: {data_shape}, "
+        f"dtype: {dtype}, worker threads: {n_threads}, memory per thread: {memory_per_thread / 1024**2:.0f} MB)"
+    )
+
+    return chunk_pixels
+
 
 def _compute_optimal_chunk_size(chunk_pixels, data_chunksize, data_shape, n_chunks_min=4):
     """
@@ -240,7 +1133,17 @@ def _compute_optimal_chunk_size(chunk_pixels, data_chunksize, data_shape, n_chun
     return chunk_y, chunk_x
 
 
-def _chunk_numpy_array(data, chunk_size):
+def _client_is_local_processes(client):
+    """
+    Returns True if the workers of Dask client run in separate processes on the local machine
+    (the client was created with `LocalCluster` with ``processes=True``), so they have access
+    to shared memory of the local process.
+    """
+    cluster = getattr(client, "cluster", None)
+    return isinstance(cluster, LocalCluster) and bool(getattr(cluster, "processes", False))
+
+
+def _chunk_numpy_array(data, chunk_size, *, client=None):
     """
     Convert a numpy array into Dask array with chunks of given size. The function
     splits the array into chunks along axes 0 and 1. If the array has more than 2 dimensions,
@@ -249,6 +1152,17 @@ def _chunk_numpy_array(data, chunk_size):
     data into chunks, therefore the array can not be loaded block by block by workers
     controlled by a distributed scheduler.
 
+    The graph of the created array contains one entry per chunk and no tasks. If `client`
+    is None, then the entries are views of `data` (no data is copied), which is efficient
+    for computations performed using the local thread pool. If `data` is registered for placing
+    in shared memory (see `core.shared_arrays.SharedArray`) and the workers of the distributed
+    client run in separate processes on the local machine, then the array is copied to shared
+    memory (once, the segment is owned by the `SharedArray` object) and the graph contains tasks
+    that read the chunks directly from shared memory, so no data is sent to the workers. Otherwise the chunks are
+    scattered to the workers of the distributed client and the graph contains only
+    references to the scattered data, so each chunk is serialized exactly once
+    and the data is never sent to the workers as part of the graph.
+
     Parameters
     ----------
     data: ndarray(float), 2 or more dimensions
@@ -257,6 +1171,8 @@ def _chunk_numpy_array(data, chunk_size):
     chunk_size: tuple(int, int) or list(int, int)
          Chunk size for axis 0 and 1: `(chunk_y, chunk_x`). The function will accept
          chunk size values that are larger then the respective `data` array dimensions.
+    client: dask.distributed.Client or None
+        Dask client used for computations or None if the local thread pool is used.
 
     Returns
     -------
@@ -266,30 +1182,34 @@ def _chunk_numpy_array(data, chunk_size):
 
     chunk_y, chunk_x = chunk_size
     ny, nx = data.shape[0:2]
-    chunk_y, chunk_x = min(chunk_y, ny), min(chunk_x, nx)
-
-    def _get_slice(n1, n2):
-        data_slice = data[
-            slice(n1 * chunk_y, min(n1 * chunk_y + chunk_y, ny)),
-            slice(n2 * chunk_x, min(n2 * chunk_x + chunk_x, nx)),
-        ]
-        # Wrap the slice into a list wiht appropriate dimensions
-        for _ in range(2, data.ndim):
-            data_slice = [data_slice]
-        return data_slice
-
-    # Chunk the numpy array and assemble it as a dask array
-    data_dask = da.block(
-        [
-            [_get_slice(_1, _2) for _2 in range(int(math.ceil(nx / chunk_x)))]
-            for _1 in range(int(math.ceil(ny / chunk_y)))
-        ]
-    )
+    chunk_y, chunk_x = max(min(chunk_y, ny), 1), max(min(chunk_x, nx), 1)
+
+    def _split(n, chunk):
+        return (chunk,) * (n // chunk) + ((n % chunk,) if n % chunk else ())
+
+    chunks = (_split(ny, chunk_y), _split(nx, chunk_x)) + tuple((_,) for _ in data.shape[2:])
+    name = f"numpy-chunked-{uuid.uuid4().hex}"
 
-    return data_dask
+    shared_descriptor = find_shared_array(data, allocate=True) if _client_is_local_processes(client) else None
 
+    keys, blocks = [], []
+    for n1 in range(len(chunks[0])):
+        for n2 in range(len(chunks[1])):
+            keys.append((name, n1, n2) + (0,) * (data.ndim - 2))
+            index = (slice(n1 * chunk_y, (n1 + 1) * chunk_y), slice(n2 * chunk_x, (n2 + 1) * chunk_x))
+            if shared_descriptor is not None:
+                blocks.append((load_shared_block, shared_descriptor, index))
+            else:
+                blocks.append(data[index])
 
-def _array_numpy_to_dask(data, chunk_pixels, n_chunks_min=4):
+    if (client is not None) and (shared_descriptor is None):
+        blocks = client.scatter(blocks, hash=False)
+
+    graph = HighLevelGraph.from_collections(name, dict(zip(keys, blocks)), dependencies=())
+    return da.Array(graph, name, chunks, dtype=data.dtype)
+
+
+def _array_numpy_to_dask(data, chunk_pixels, n_chunks_min=4, *, pixel_bin=1, client=None):
     """
     Convert an array (e.g. XRF map) from numpy array to chunked Dask array. Select chunk
     size based on the desired number of pixels `chunk_pixels`. The array is considered
@@ -308,6 +1228,12 @@ def _array_numpy_to_dask(data, chunk_pixels, n_chunks_min=4):
         minimum number of chunks, which should be selected based on the minimum number of
         workers that should be used to process the map. Each chunk will contain at least
         one pixel: if there is not enough pixels, then the number of chunks will be reduced.
+    pixel_bin: int
+        chunk sizes along axes 0 and 1 are selected as multiples of `pixel_bin`, so that
+        the blocks could be binned spatially (see `bin_xrf_map`).
+    client: dask.distributed.Client or None
+        Dask client used for computations. If not None, then the chunks are read by the workers
+        from shared memory or scattered to the workers (see `_chunk_numpy_array`).
 
     Results
     -------
@@ -322,13 +1248,16 @@ def _array_numpy_to_dask(data, chunk_pixels, n_chunks_min=4):
     # Since numpy array is not chunked by default, set the original chunk size to (1,1)
     #   because here we are performing 'original' chunking
     chunk_y, chunk_x = _compute_optimal_chunk_size(
-        chunk_pixels=chunk_pixels, data_chunksize=(1, 1), data_shape=(ny, nx), n_chunks_min=n_chunks_min
+        chunk_pixels=chunk_pixels,
+        data_chunksize=(pixel_bin, pixel_bin),
+        data_shape=(ny, nx),
+        n_chunks_min=n_chunks_min,
     )
 
-    return _chunk_numpy_array(data, (chunk_y, chunk_x))
+    return _chunk_numpy_array(data, (chunk_y, chunk_x), client=client)
 
 
-def prepare_xrf_map(data, chunk_pixels=5000, n_chunks_min=4):
+def prepare_xrf_map(data, chunk_pixels="auto", n_chunks_min=4, *, client=None, pixel_bin=1):
     """
     Convert XRF map from it's initial representation to properly chunked Dask array.
 
@@ -338,15 +1267,27 @@ def prepare_xrf_map(data, chunk_pixels=5000, n_chunks_min=4):
         Raw XRF map represented as Dask array, numpy array or reference to a dataset in
         HDF5 file. The XRF map must have dimensions `(ny, nx, ne)`, where `ny` and `nx`
         define image size and `ne` is the number of spectrum points
-    chunk_pixels: int
+    chunk_pixels: int or str
         The number of pixels in a single chunk. The XRF map will be rechunked so that
         each block contains approximately `chunk_pixels` pixels and contain all `ne`
-        spectrum points for each pixel.
+        spectrum points for each pixel. If `"auto"`, then the number of pixels is selected
+        based on the size of the map, data type, available resources and layout of
+        the HDF5 dataset (see `_auto_chunk_pixels`).
     n_chunks_min: int
         Minimum number of chunks. The algorithm will try to split the map into the number
         of chunks equal or greater than `n_chunks_min`. If HDF5 dataset is not chunked,
         then the whole map is treated as one chunk. This should happen only to very small
         files, so parallelism is not important.
+    client: dask.distributed.Client or None
+        Dask client used for processing or None if the map is processed using the local
+        thread pool. The client is used to obtain information on the resources available
+        to the workers if `chunk_pixels="auto"`. If `data` is a numpy array, then the chunks
+        are read by the workers from shared memory or scattered to the workers of the client
+        (see `_chunk_numpy_array`).
+    pixel_bin: int
+        the size of the window used for spatial binning of the map (see `bin_xrf_map`).
+        The chunk sizes along axes 0 and 1 are selected as multiples of `pixel_bin`,
+        so that the binning windows never cross the boundaries of the blocks.
 
     Returns
     -------
@@ -367,16 +1308,30 @@ def prepare_xrf_map(data, chunk_pixels=5000, n_chunks_min=4):
 
     file_obj = None  # It will remain None, unless 'data' is 'RawHDF5Dataset'
 
+    if isinstance(chunk_pixels, str) and chunk_pixels != "auto":
+        raise ValueError(f"Parameter 'chunk_pixels' must be an integer or 'auto': chunk_pixels = {chunk_pixels!r}")
+    auto_chunks = chunk_pixels == "auto"
+    _check_bin_size(pixel_bin, "pixel_bin")
+
+    def _align_chunksize(chunksize):
+        # Chunk sizes must be multiples of 'pixel_bin'
+        return tuple(int(_) * pixel_bin // math.gcd(int(_), pixel_bin) for _ in chunksize)
+
+    if isinstance(data, (da.core.Array, np.ndarray)) and auto_chunks:
+        chunk_pixels = _auto_chunk_pixels(data.shape, data.dtype, client=client)
+
     if isinstance(data, da.core.Array):
         chunk_size = _compute_optimal_chunk_size(
             chunk_pixels=chunk_pixels,
-            data_chunksize=data.chunksize[0:2],
+            data_chunksize=_align_chunksize(data.chunksize[0:2]),
             data_shape=data.shape[0:2],
             n_chunks_min=n_chunks_min,
         )
         data = data.rechunk(chunks=(*chunk_size, data.shape[2]))
     elif isinstance(data, np.ndarray):
-        data = _array_numpy_to_dask(data, chunk_pixels=chunk_pixels, n_chunks_min=n_chunks_min)
+        data = _array_numpy_to_dask(
+            data, chunk_pixels=chunk_pixels, n_chunks_min=n_chunks_min, pixel_bin=pixel_bin, client=client
+        )
     elif isinstance(data, RawHDF5Dataset):
         fpath, dset_name = data.abs_path, data.dset_name
 
@@ -390,17 +1345,32 @@ def prepare_xrf_map(data, chunk_pixels=5000, n_chunks_min=4):
             )
         ny, nx, ne = dset.shape
 
+        if auto_chunks:
+            chunk_pixels = _auto_chunk_pixels(
+                dset.shape, dset.dtype, file_chunksize=dset.chunks, compression=dset.compression, client=client
+            )
+
         if dset.chunks:
+            file_chunksize = dset.chunks[0:2]
+            if auto_chunks and not dset.compression and file_chunksize[0] * file_chunksize[1] > chunk_pixels:
+                # Uncompressed HDF5 chunks can be efficiently read partially. Don't align Dask chunks
+                #   with large HDF5 chunks to avoid excessive memory use.
+                file_chunksize = (1, 1)
             chunk_size = _compute_optimal_chunk_size(
                 chunk_pixels=chunk_pixels,
-                data_chunksize=dset.chunks[0:2],
+                data_chunksize=_align_chunksize(file_chunksize),
                 data_shape=(ny, nx),
                 n_chunks_min=n_chunks_min,
             )
         else:
             # The data is not chunked. Process data as one chunk.
             chunk_size = (ny, nx)
-        data = da.from_array(dset, chunks=(*chunk_size, ne))
+        if _supports_parallel_decompression(dset):
+            # Decompress the chunks in parallel instead of decoding them serially by the HDF5 library
+            reader = _CompressedHDF5Reader(fpath, dset_name, shape=dset.shape, dtype=dset.dtype)
+            data = da.from_array(reader, chunks=(*chunk_size, ne))
+        else:
+            data = da.from_array(dset, chunks=(*chunk_size, ne))
     else:
         raise TypeError(f"Type of parameter 'data' is not supported: type(data)={type(data)}")
 
@@ -469,14 +1439,16 @@ def _prepare_xrf_mask(data, mask=None, selection=None):
     return mask
 
 
-def _masked_sum(data, mask):
-    mask = np.broadcast_to(np.expand_dims(mask, axis=2), data.shape)
-    sm = np.sum(np.sum(data * mask, axis=0), axis=0)
-    return np.array([[sm]])
-
-
 def compute_total_spectrum(
-    data, *, selection=None, mask=None, chunk_pixels=5000, n_chunks_min=4, progress_bar=None, client=None
+    data,
+    *,
+    selection=None,
+    mask=None,
+    chunk_pixels="auto",
+    n_chunks_min=4,
+    progress_bar=None,
+    client=None,
+    backend="auto",
 ):
     """
     Parameters
@@ -489,10 +1461,11 @@ def compute_total_spectrum(
         selected area represented as (y0, x0, ny_sel, nx_sel)
     mask: ndarray or None
         mask represented as numpy array with dimensions (ny, nx)
-    chunk_pixels: int
+    chunk_pixels: int or str
         The number of pixels in a single chunk. The XRF map will be rechunked so that
         each block contains approximately `chunk_pixels` pixels and contain all `ne`
-        spectrum points for each pixel.
+        spectrum points for each pixel. If `"auto"`, then the number of pixels is selected
+        automatically (see `prepare_xrf_map`).
     n_chunks_min: int
         Minimum number of chunks. The algorithm will try to split the map into the number
         of chunks equal or greater than `n_chunks_min`.
@@ -500,7 +1473,11 @@ def compute_total_spectrum(
         reference to the callable object that implements progress bar. The example of
         such a class for progress bar object is `TerminalProgressBar`.
     client: dask.distributed.Client or None
-        Dask client. If None, then local client will be created
+        Dask client. If None, then the shared client (see `dask_client_manager`) is used
+        if distributed backend is selected
+    backend: str
+        Execution backend: `"threads"` (local thread pool), `"distributed"` (Dask distributed client)
+        or `"auto"` (the backend is selected based on the map size, see `select_execution_backend`).
 
     Returns
     -------
@@ -511,70 +1488,60 @@ def compute_total_spectrum(
     if not isinstance(mask, np.ndarray) and (mask is not None):
         raise TypeError(f"Parameter 'mask' must be a numpy array or None: type(mask) = {type(mask)}")
 
-    data, file_obj = prepare_xrf_map(data, chunk_pixels=chunk_pixels, n_chunks_min=n_chunks_min)
-    mask = _prepare_xrf_mask(data, mask=mask, selection=selection)
-
-    if client is None:
-        client = dask_client_create()
-        client_is_local = True
-    else:
-        client_is_local = False
-
-    client.run(dask_set_custom_serializers)
-    dask_set_custom_serializers()
-
-    n_workers = len(client.scheduler_info()["workers"])
-    logger.info(f"Dask distributed client: {n_workers} workers")
-
-    if mask is None:
-        result_fut = da.sum(da.sum(data, axis=0), axis=0).persist(scheduler=client)
-    else:
-        result_fut = da.blockwise(_masked_sum, "ijk", data, "ijk", mask, "ij", dtype="float").persist(
-            scheduler=client
+    backend = select_execution_backend(data, backend=backend, client=client)
+    with _DaskExecutor(backend=backend, client=client) as executor:
+        data, file_obj = prepare_xrf_map(
+            data, chunk_pixels=chunk_pixels, n_chunks_min=n_chunks_min, client=executor.client
         )
+        mask = _prepare_xrf_mask(data, mask=mask, selection=selection)
 
-    # Call the progress monitor
-    wait_and_display_progress(result_fut, progress_bar)
-
-    result = result_fut.compute(scheduler=client)
-    if file_obj:
-        file_obj.close()
+        result = _reduce_spatially_by_block(_apply_xrf_mask(data, mask), np.sum)
+        result = executor.compute(result, progress_bar=progress_bar, workload=data).sum(axis=(0, 1))
 
-    client.run(dask_close_all_files)
-    dask_close_all_files()
+        if file_obj:
+            file_obj.close()
 
-    # # The following code is needed to cause Dask 'distributed>=2021.7.0' to close the h5file.
-    # del result_fut
-    # _dask_release_file_descriptors(client=client)
+    return result
 
-    if client_is_local:
-        client.close()
 
-    if mask is not None:
-        # The sum computed for each block still needs to be assembled,
-        #   but 'result' is much smaller array than 'data'
-        result = np.sum(np.sum(result, axis=0), axis=0)
-    return result
+def _apply_xrf_mask(data, mask):
+    """
+    Multiply each spectrum of XRF map `data` by the respective pixel of the `mask`
+    (Dask array with the same chunks along axes 0 and 1). Returns `data` if `mask` is None.
+    """
+    if mask is None:
+        return data
+    return data * mask[:, :, np.newaxis]
 
 
-def _process_block(data):
-    data = data[0]  # Data is passed as a list of ndarrays
-    _spectrum = np.sum(np.sum(data, axis=0), axis=0)
-    _count_total = np.sum(data, axis=2)
-    return np.array([[{"spectrum": _spectrum, "count_total": _count_total}]])
+def _reduce_block_spatially(block, *, reduce_func):
+    return reduce_func(block, axis=(0, 1), keepdims=True)
 
 
-def _process_block_with_mask(data, mask):
-    data = data[0]  # Data is passed as a list of ndarrays
-    mask = np.broadcast_to(np.expand_dims(mask, axis=2), data.shape)
-    masked_data = data * mask
-    _spectrum = np.sum(np.sum(masked_data, axis=0), axis=0)
-    _count_total = np.sum(masked_data, axis=2)
-    return np.array([[{"spectrum": _spectrum, "count_total": _count_total}]])
+def _reduce_spatially_by_block(data, func):
+    """
+    Apply the reduction `func` (e.g. `np.sum` or `np.max`) over axes 0 and 1 to each block of
+    XRF map `data` (Dask array). Returns Dask array of the shape `(n_blocks_y, n_blocks_x, ne)`
+    with the partial results for each block. The blocks of the returned array are aligned with
+    the blocks of `data`, so the progress of computations is reported block by block
+    (see `_BlockAccounting`). The partial results are small and reduced by the caller
+    (using the same function) after they are computed.
+    """
+    dtype = func(np.zeros((1, 1, 1), dtype=data.dtype), axis=(0, 1)).dtype
+    chunks = tuple((1,) * _ for _ in data.numblocks[0:2]) + data.chunks[2:]
+    return da.map_blocks(_reduce_block_spatially, data, reduce_func=func, chunks=chunks, dtype=dtype)
 
 
 def compute_total_spectrum_and_count(
-    data, *, selection=None, mask=None, chunk_pixels=5000, n_chunks_min=4, progress_bar=None, client=None
+    data,
+    *,
+    selection=None,
+    mask=None,
+    chunk_pixels="auto",
+    n_chunks_min=4,
+    progress_bar=None,
+    client=None,
+    backend="auto",
 ):
     """
     The function is similar to `compute_total_spectrum`, but computes both total
@@ -590,10 +1557,11 @@ def compute_total_spectrum_and_count(
         selected area represented as (y0, x0, ny_sel, nx_sel)
     mask: ndarray or None
         mask represented as numpy array with dimensions (ny, nx)
-    chunk_pixels: int
+    chunk_pixels: int or str
         The number of pixels in a single chunk. The XRF map will be rechunked so that
         each block contains approximately `chunk_pixels` pixels and contain all `ne`
-        spectrum points for each pixel.
+        spectrum points for each pixel. If `"auto"`, then the number of pixels is selected
+        automatically (see `prepare_xrf_map`).
     n_chunks_min: int
         Minimum number of chunks. The algorithm will try to split the map into the number
         of chunks equal or greater than `n_chunks_min`.
@@ -601,7 +1569,11 @@ def compute_total_spectrum_and_count(
         reference to the callable object that implements progress bar. The example of
         such a class for progress bar object is `TerminalProgressBar`.
     client: dask.distributed.Client or None
-        Dask client. If None, then local client will be created
+        Dask client. If None, then the shared client (see `dask_client_manager`) is used
+        if distributed backend is selected
+    backend: str
+        Execution backend: `"threads"` (local thread pool), `"distributed"` (Dask distributed client)
+        or `"auto"` (the backend is selected based on the map size, see `select_execution_backend`).
 
     Returns
     -------
@@ -612,67 +1584,258 @@ def compute_total_spectrum_and_count(
     if not isinstance(mask, np.ndarray) and (mask is not None):
         raise TypeError(f"Parameter 'mask' must be a numpy array or None: type(mask) = {type(mask)}")
 
-    data, file_obj = prepare_xrf_map(data, chunk_pixels=chunk_pixels, n_chunks_min=n_chunks_min)
-    mask = _prepare_xrf_mask(data, mask=mask, selection=selection)
+    backend = select_execution_backend(data, backend=backend, client=client)
+    with _DaskExecutor(backend=backend, client=client) as executor:
+        data, file_obj = prepare_xrf_map(
+            data, chunk_pixels=chunk_pixels, n_chunks_min=n_chunks_min, client=executor.client
+        )
+        mask = _prepare_xrf_mask(data, mask=mask, selection=selection)
+
+        # The partial spectra of the blocks are reduced after they are computed,
+        #   the count map is assembled from numeric blocks
+        data = _apply_xrf_mask(data, mask)
+        total_spectrum, total_counts = executor.compute(
+            (_reduce_spatially_by_block(data, np.sum), da.sum(data, axis=2)),
+            progress_bar=progress_bar,
+            workload=data,
+        )
+        total_spectrum = total_spectrum.sum(axis=(0, 1))
 
-    if client is None:
-        client = dask_client_create()
-        client_is_local = True
-    else:
-        client_is_local = False
+        if file_obj:
+            file_obj.close()
 
-    client.run(dask_set_custom_serializers)
-    dask_set_custom_serializers()
+    return total_spectrum, total_counts
 
-    n_workers = len(client.scheduler_info()["workers"])
-    logger.info(f"Dask distributed client: {n_workers} workers")
 
-    if mask is None:
-        result_fut = da.blockwise(_process_block, "ij", data, "ijk", dtype=float).persist(scheduler=client)
-    else:
-        result_fut = da.blockwise(_process_block_with_mask, "ij", data, "ijk", mask, "ij", dtype=float).persist(
-            scheduler=client
+def _check_data_sel_indices(data_sel_indices):
+    """
+    Verify that `data_sel_indices` is a valid selection of spectrum points `(n_start, n_end)`.
+    """
+    if not isinstance(data_sel_indices, (tuple, list)):
+        raise TypeError(
+            f"Parameter 'data_sel_indices' must be tuple or list: "
+            f"type(data_sel_indices) = {type(data_sel_indices)}"
         )
 
-    # Call the progress monitor
-    wait_and_display_progress(result_fut, progress_bar)
+    if not len(data_sel_indices) == 2:
+        raise TypeError(
+            f"Parameter 'data_sel_indices' must contain two elements: data_sel_indices = {data_sel_indices}"
+        )
 
-    result = result_fut.compute(scheduler=client)
+    if any([_ < 0 for _ in data_sel_indices]):
+        raise ValueError(
+            f"Some of the indices in 'data_sel_indices' are negative: data_sel_indices = {data_sel_indices}"
+        )
 
-    if file_obj:
-        file_obj.close()
+    if data_sel_indices[1] <= data_sel_indices[0]:
+        raise ValueError(
+            f"Parameter 'data_sel_indices' must select at least 1 element: "
+            f"data_sel_indices = {data_sel_indices}"
+        )
 
-    client.run(dask_close_all_files)
-    dask_close_all_files()
 
-    # # The following code is needed to cause Dask 'distributed>=2021.7.0' to close the h5file.
-    # del result_fut
-    # _dask_release_file_descriptors(client=client)
+def _check_data_sel_range(data_sel_indices, ne):
+    """
+    Verify that `data_sel_indices` select points within the spectrum with `ne` points.
+    """
+    if data_sel_indices[0] >= ne or data_sel_indices[1] > ne:
+        raise ValueError(f"Selection indices {data_sel_indices} are outside the allowed range 0 .. {ne}")
 
-    if client_is_local:
-        client.close()
 
-    # Assemble results
-    total_counts = np.block([[_2["count_total"] for _2 in _1] for _1 in result])
-    total_spectrum = sum([_["spectrum"] for _ in result.flatten()])
+def _check_matv(matv, data_sel_indices):
+    """
+    Verify that the matrix of reference spectra `matv` matches the selection `data_sel_indices`.
+    """
+    if not isinstance(matv, np.ndarray) or matv.ndim != 2:
+        raise TypeError(f"Parameter 'matv' must be 2D ndarray: type(matv) = {type(matv)}, matv = {matv}")
 
-    return total_spectrum, total_counts
+    ne_spec, _ = matv.shape
+    nsel = data_sel_indices[1] - data_sel_indices[0]
+    if ne_spec != nsel:
+        raise ValueError(
+            f"The number of selected points ({nsel}) is not equal "
+            f"to the number of points in reference spectrum ({ne_spec})"
+        )
 
 
-def _fit_xrf_block(data, data_sel_indices, matv, snip_param, use_snip):
+def _check_snip_param(snip_param, *, keys_required):
     """
-    Spectrum fitting for a block of XRF dataset. The function is intended to be
-    called using `map_blocks` function for parallel processing using Dask distributed
-    package.
+    Verify that `snip_param` is a dictionary. If `keys_required` is True, then the dictionary
+    must contain all parameters of the energy axis and SNIP window width.
+    """
+    if not isinstance(snip_param, dict):
+        raise TypeError(f"Parameter 'snip_param' must be a dictionary: type(snip_param) = {type(snip_param)}")
 
-    Parameters
-    ----------
-    data : ndarray
-        block of an XRF dataset. Shape=(ny, nx, ne).
-    data_sel_indices: tuple
-        tuple `(n_start, n_end)` which defines the indices along axis 2 of `data` array
-        that are used for fitting. Note that `ne` (in `data`) and `ne_model` (in `matv`)
-        are not equal. But `n_end - n_start` MUST be equal to `ne_model`! Indexes
+    required_keys = ("e_offset", "e_linear", "e_quadratic", "b_width")
+    if keys_required and not all([_ in snip_param.keys() for _ in required_keys]):
+        raise TypeError(
+            f"Parameter 'snip_param' must a dictionary with keys {required_keys}: "
+            f"snip_param.keys() = {snip_param.keys()}"
+        )
+
+
+def _check_bin_size(bin_size, name):
+    """
+    Check that the binning parameter `bin_size` is a positive integer. `name` is the name
+    of the parameter used in error messages.
+    """
+    if not isinstance(bin_size, (int, np.integer)) or isinstance(bin_size, bool) or bin_size < 1:
+        raise ValueError(f"Parameter '{name}' must be a positive integer: {name} = {bin_size!r}")
+
+
+def _bin_xrf_block(data, pixel_bin, energy_bin):
+    """
+    Bin a block of XRF map. Spectra within each `pixel_bin` x `pixel_bin` window are averaged
+    (the windows at the bottom and right edge of the block may contain fewer pixels), groups of
+    `energy_bin` adjacent spectral channels are summed (the last group may contain fewer channels).
+    The function is intended to be called using `map_blocks` function.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if energy_bin > 1:
+        data = np.add.reduceat(data, np.arange(0, data.shape[2], energy_bin), axis=2)
+    if pixel_bin > 1:
+        ny, nx = data.shape[0:2]
+        iy, ix = np.arange(0, ny, pixel_bin), np.arange(0, nx, pixel_bin)
+        data = np.add.reduceat(np.add.reduceat(data, iy, axis=0), ix, axis=1)
+        n_pixels = np.outer(np.diff(iy, append=ny), np.diff(ix, append=nx))
+        data /= n_pixels[:, :, np.newaxis]
+    return data
+
+
+def bin_xrf_map(data, *, pixel_bin=1, energy_bin=1):
+    """
+    Bin XRF map spatially and along the energy axis. Binning is performed lazily (block by block)
+    as part of the Dask computation graph. Spectra in each `pixel_bin` x `pixel_bin` window
+    of pixels are averaged, so the binned map represents spectra of a pixel of the original map.
+    Groups of `energy_bin` adjacent spectral channels are summed, so the energy axis of
+    the binned map is described by the calibration coefficients computed using
+    `_bin_energy_calibration`. If the map size is not a multiple of `pixel_bin` or the number of
+    spectral channels is not a multiple of `energy_bin`, then the last bin contains fewer pixels
+    or channels.
+
+    Parameters
+    ----------
+    data: da.core.Array
+        XRF map with dimensions `(ny, nx, ne)`. The array must have one chunk along axis 2.
+        Chunk sizes along axes 0 and 1 should be multiples of `pixel_bin`
+        (see `prepare_xrf_map`), otherwise the array is rechunked.
+    pixel_bin: int
+        the size of the window for spatial binning. No spatial binning if `pixel_bin=1`.
+    energy_bin: int
+        the number of spectral channels combined in one bin. No energy binning if `energy_bin=1`.
+
+    Returns
+    -------
+    da.core.Array
+        binned XRF map with dimensions `(ceil(ny / pixel_bin), ceil(nx / pixel_bin), ceil(ne / energy_bin))`
+
+    Raises
+    ------
+    TypeError if `data` is not a 3D Dask array, ValueError if binning parameters are invalid.
+    """
+    if not isinstance(data, da.core.Array) or (data.ndim != 3):
+        raise TypeError(f"Parameter 'data' must be 3D Dask array: type(data) = {type(data)}")
+    _check_bin_size(pixel_bin, "pixel_bin")
+    _check_bin_size(energy_bin, "energy_bin")
+
+    if len(data.chunks[2]) > 1:
+        data = data.rechunk(chunks={2: -1})
+    if any([_ % pixel_bin for axis in (0, 1) for _ in data.chunks[axis][:-1]]):
+        chunksize = [int(math.ceil(_ / pixel_bin) * pixel_bin) for _ in data.chunksize[0:2]]
+        data = data.rechunk(chunks=(*chunksize, -1))
+
+    def _n_bins(n, bin_size):
+        return int(math.ceil(n / bin_size))
+
+    chunks = (
+        tuple(_n_bins(_, pixel_bin) for _ in data.chunks[0]),
+        tuple(_n_bins(_, pixel_bin) for _ in data.chunks[1]),
+        (_n_bins(data.shape[2], energy_bin),),
+    )
+    return da.map_blocks(
+        _bin_xrf_block, data, pixel_bin=pixel_bin, energy_bin=energy_bin, dtype=np.float64, chunks=chunks
+    )
+
+
+def _bin_energy_calibration(e_offset, e_linear, e_quadratic, energy_bin):
+    """
+    Compute coefficients of the energy axis after combining groups of `energy_bin` adjacent
+    channels. The energy of the binned channel is the energy at the center of the group.
+    Returns a tuple `(e_offset, e_linear, e_quadratic)`.
+    """
+    c = (energy_bin - 1) / 2
+    return (
+        e_offset + e_linear * c + e_quadratic * c**2,
+        (e_linear + 2 * e_quadratic * c) * energy_bin,
+        e_quadratic * energy_bin**2,
+    )
+
+
+def _bin_fitting_model(data_sel_indices, matv, snip_param, energy_bin):
+    """
+    Convert the model used for fitting (selected range, matrix of reference spectra and
+    parameters of SNIP) so that it could be applied to spectra binned along the energy axis
+    (see `bin_xrf_map`). The selected range is narrowed to include only complete bins,
+    rows of `matv` are summed the same way as the spectral channels.
+
+    Returns
+    -------
+    tuple
+        `(data_sel_indices, matv, snip_param)` for binned spectra
+
+    Raises
+    ------
+    ValueError if the selected range does not contain a complete bin.
+    """
+    if energy_bin == 1:
+        return data_sel_indices, matv, snip_param
+
+    n_start, n_end = data_sel_indices
+    nb_start, nb_end = int(math.ceil(n_start / energy_bin)), n_end // energy_bin
+    if nb_end <= nb_start:
+        raise ValueError(
+            f"The range selected by 'data_sel_indices' {tuple(data_sel_indices)} is too narrow "
+            f"for binning with 'energy_bin' = {energy_bin}"
+        )
+    n_rows = (nb_end - nb_start) * energy_bin
+    n_row_start = nb_start * energy_bin - n_start
+    matv = matv[n_row_start : n_row_start + n_rows, :].reshape(nb_end - nb_start, energy_bin, -1).sum(axis=1)
+
+    snip_param = dict(snip_param)
+    if all([_ in snip_param for _ in ("e_offset", "e_linear", "e_quadratic")]):
+        e_coefs = (snip_param["e_offset"], snip_param["e_linear"], snip_param["e_quadratic"])
+        e_coefs = _bin_energy_calibration(*e_coefs, energy_bin)
+        snip_param["e_offset"], snip_param["e_linear"], snip_param["e_quadratic"] = e_coefs
+
+    return (nb_start, nb_end), matv, snip_param
+
+
+def _expand_binned_block(data, pixel_bin, block_info=None):
+    """
+    Expand the block of the spatially binned map to the original resolution: the value of each
+    binned pixel is assigned to each pixel of the respective `pixel_bin` x `pixel_bin` window.
+    The function is intended to be called using `map_blocks`: the shape of the output block
+    is obtained from `block_info`.
+    """
+    chunk_shape = block_info[None]["chunk-shape"]
+    data = np.repeat(np.repeat(data, pixel_bin, axis=0), pixel_bin, axis=1)
+    return data[: chunk_shape[0], : chunk_shape[1]]
+
+
+def _fit_xrf_block(data, data_sel_indices, matv, snip_param, use_snip):
+    """
+    Spectrum fitting for a block of XRF dataset. The function is intended to be
+    called using `map_blocks` function for parallel processing using Dask distributed
+    package.
+
+    Parameters
+    ----------
+    data : ndarray
+        block of an XRF dataset. Shape=(ny, nx, ne).
+    data_sel_indices: tuple
+        tuple `(n_start, n_end)` which defines the indices along axis 2 of `data` array
+        that are used for fitting. Note that `ne` (in `data`) and `ne_model` (in `matv`)
+        are not equal. But `n_end - n_start` MUST be equal to `ne_model`! Indexes
         `n_start .. n_end - 1` will be selected from each pixel.
     matv: ndarray
         Matrix of spectra of the selected elements (emission lines). Shape=(ne_model, n_lines)
@@ -693,28 +1856,41 @@ def _fit_xrf_block(data, data_sel_indices, matv, snip_param, use_snip):
     """
     spec = data
     spec_sel = spec[:, :, data_sel_indices[0] : data_sel_indices[1]]
+    bg_sel = _snip_background(spec_sel, snip_param, use_snip)
+    return _fit_selected_spectra(spec_sel, bg_sel, np.sum(spec, axis=2), matv)
 
-    if use_snip:
-        bg_sel = np.apply_along_axis(
-            snip_method_numba,
-            2,
-            spec_sel,
-            snip_param["e_offset"],
-            snip_param["e_linear"],
-            snip_param["e_quadratic"],
-            width=snip_param["b_width"],
-        )
 
+def _snip_background(spec_sel, snip_param, use_snip):
+    """
+    Compute SNIP background for the block of spectra (along axis 2). Returns None if
+    background subtraction is disabled.
+    """
+    if not use_snip:
+        return None
+    return snip_method_block(
+        spec_sel,
+        snip_param["e_offset"],
+        snip_param["e_linear"],
+        snip_param["e_quadratic"],
+        width=snip_param["b_width"],
+    )
+
+
+def _fit_selected_spectra(spec_sel, bg_sel, total_cnt, matv):
+    """
+    Fit the block of spectra `spec_sel` (selected energy range) with precomputed background
+    `bg_sel` (None if background is not subtracted). `total_cnt` is total count of the full
+    spectra. Returns the array in the format described for `_fit_xrf_block`.
+    """
+    if bg_sel is not None:
         y = spec_sel - bg_sel
         bg_sum = np.sum(bg_sel, axis=2)
-
     else:
         y = spec_sel
-        bg_sum = np.zeros(shape=data.shape[0:2])
+        bg_sum = np.zeros(shape=spec_sel.shape[0:2])
 
     weights, rfactor, _ = fit_spectrum(y, matv, axis=2, method="nnls")
 
-    total_cnt = np.sum(spec, axis=2)
     sel_cnt = np.sum(spec_sel, axis=2)
 
     # Stack depth-wise (along axis 2)
@@ -755,10 +1931,16 @@ def fit_xrf_map(
     matv,
     snip_param=None,
     use_snip=True,
-    chunk_pixels=5000,
+    chunk_pixels="auto",
     n_chunks_min=4,
     progress_bar=None,
     client=None,
+    backend="auto",
+    consume_block=None,
+    cancel_event=None,
+    pixel_bin=1,
+    energy_bin=1,
+    result_cache=None,
 ):
     """
     Fit XRF map.
@@ -783,10 +1965,11 @@ def fit_xrf_map(
         It may be an empty dictionary or None if `use_snip` is `False`.
     use_snip: bool, optional
         enable/disable background removal using snip algorithm
-    chunk_pixels: int
+    chunk_pixels: int or str
         The number of pixels in a single chunk. The XRF map will be rechunked so that
         each block contains approximately `chunk_pixels` pixels and contain all `ne`
-        spectrum points for each pixel.
+        spectrum points for each pixel. If `"auto"`, then the number of pixels is selected
+        automatically (see `prepare_xrf_map`).
     n_chunks_min: int
         Minimum number of chunks. The algorithm will try to split the map into the number
         of chunks equal or greater than `n_chunks_min`.
@@ -794,123 +1977,525 @@ def fit_xrf_map(
         reference to the callable object that implements progress bar. The example of
         such a class for progress bar object is `TerminalProgressBar`.
     client: dask.distributed.Client or None
-        Dask client. If None, then local client will be created
+        Dask client. If None, then the shared client (see `dask_client_manager`) is used
+        if distributed backend is selected
+    backend: str
+        Execution backend: `"threads"` (local thread pool), `"distributed"` (Dask distributed client)
+        or `"auto"` (the backend is selected based on the map size, see `select_execution_backend`).
+    consume_block: callable or None
+        If None, then the results are assembled in memory and returned. Otherwise the fitting
+        results are passed to `consume_block(block, block_slice)` block by block as soon as each
+        block is computed and the full array of results is never assembled. `block` is an array
+        with shape `(ny_block, nx_block, ne_model + 4)`, `block_slice` is a tuple of slices,
+        which define position of the block in the map. The function is called from the thread
+        in which `fit_xrf_map` is called.
+    cancel_event: threading.Event or None
+        If the event is set (e.g. from a different thread), then the computations are cancelled:
+        the blocks that are not yet computed are cancelled, the files are closed and
+        `ComputationCancelledError` is raised. The blocks already passed to `consume_block`
+        remain valid, so partial results may be kept.
+    pixel_bin: int
+        the size of the window for spatial binning. If `pixel_bin > 1`, then spectra in
+        each `pixel_bin` x `pixel_bin` window are averaged and fitted as one spectrum and
+        the results are assigned to each pixel of the window, so the shape of the results
+        is not changed (see `bin_xrf_map`). Binning is intended for quick-look processing.
+    energy_bin: int
+        the number of adjacent spectral channels combined in one bin. If `energy_bin > 1`,
+        then the spectra, the matrix `matv` and the parameters of SNIP are binned consistently
+        and the selected range is narrowed to include only complete bins.
+    result_cache: ResultCache or None
+        cache for the fitting results (see `ResultCache`). If the results for the same raw data,
+        model, selected range, SNIP and binning parameters are found in the cache, then they are
+        returned (or passed to `consume_block` as a single block) without computations. Otherwise
+        the computed results are saved to the cache. The results are assembled in memory before
+        they are saved even if `consume_block` is specified. No caching if None.
 
     Returns
     -------
-    results: ndarray
+    results: ndarray or None
         array with fitting results. Shape: `(ny, nx, ne_model + 4)`. For each pixel
         the output data contains: `ne_model` values that represent area under the emission
         line spectra; background area (only in the selected energy range), error (R-factor),
         total count in the selected energy range, total count of the full experimental spectrum.
+        None if the results are passed to `consume_block`.
     """
 
-    logger.info("Starting single-pixel fitting ...")
-    logger.info(f"Baseline subtraction (SNIP): {'enabled' if use_snip else 'disabled'}.")
+    results = fit_xrf_maps(
+        [{"data": data, "data_sel_indices": data_sel_indices, "matv": matv, "snip_param": snip_param}],
+        use_snip=use_snip,
+        chunk_pixels=chunk_pixels,
+        n_chunks_min=n_chunks_min,
+        progress_bar=progress_bar,
+        client=client,
+        backend=backend,
+        consume_block=None if consume_block is None else [consume_block],
+        cancel_event=cancel_event,
+        pixel_bin=pixel_bin,
+        energy_bin=energy_bin,
+        result_cache=result_cache,
+    )
+    return None if results is None else results[0]
 
-    if snip_param is None:
-        snip_param = {}  # For consistency
 
-    # Verify that input parameters are valid
-    if not isinstance(data_sel_indices, (tuple, list)):
-        raise TypeError(
-            f"Parameter 'data_sel_indices' must be tuple or list: "
-            f"type(data_sel_indices) = {type(data_sel_indices)}"
-        )
+def fit_xrf_maps(
+    datasets,
+    *,
+    use_snip=True,
+    chunk_pixels="auto",
+    n_chunks_min=4,
+    progress_bar=None,
+    client=None,
+    backend="auto",
+    consume_block=None,
+    cancel_event=None,
+    pixel_bin=1,
+    energy_bin=1,
+    result_cache=None,
+):
+    """
+    Fit multiple XRF maps (e.g. the sum and individual channels of the detector) as one
+    Dask computation. The graphs for all maps are submitted together, so the workers are kept
+    busy while switching between the maps and the overhead of building and tearing down
+    the graph is paid only once. Each map is fitted with its own model.
 
-    if not len(data_sel_indices) == 2:
-        raise TypeError(
-            f"Parameter 'data_sel_indices' must contain two elements: data_sel_indices = {data_sel_indices}"
-        )
+    Parameters
+    ----------
+    datasets: list(dict)
+        list of dictionaries with the keys `data`, `data_sel_indices`, `matv` and `snip_param`
+        (see the respective parameters of `fit_xrf_map`). The key `snip_param` is optional.
+    consume_block: list(callable) or None
+        If None, then the results are assembled in memory and returned. Otherwise it must be
+        the list of functions `consume_block(block, block_slice)`, one for each map
+        (see `fit_xrf_map`). The blocks of different maps arrive in arbitrary order.
+    use_snip, chunk_pixels, n_chunks_min, progress_bar, client, backend, cancel_event, pixel_bin, energy_bin
+        see the description of the parameters of `fit_xrf_map`. The parameters are the same for all maps.
+    result_cache: ResultCache or None
+        cache for the fitting results (see `fit_xrf_map`). Only the maps that are not found
+        in the cache are computed.
 
-    if any([_ < 0 for _ in data_sel_indices]):
-        raise ValueError(
-            f"Some of the indices in 'data_sel_indices' are negative: data_sel_indices = {data_sel_indices}"
-        )
+    Returns
+    -------
+    results: list(ndarray) or None
+        list of arrays with fitting results (see `fit_xrf_map`) in the same order as `datasets`.
+        None if the results are passed to `consume_block`.
 
-    if data_sel_indices[1] <= data_sel_indices[0]:
-        raise ValueError(
-            f"Parameter 'data_sel_indices' must select at least 1 element: "
-            f"data_sel_indices = {data_sel_indices}"
-        )
+    Raises
+    ------
+    TypeError or ValueError if input parameters are invalid.
+    """
+    if not isinstance(datasets, (list, tuple)) or not datasets or not all([isinstance(_, dict) for _ in datasets]):
+        raise TypeError(f"Parameter 'datasets' must be a non-empty list of dictionaries: datasets = {datasets!r}")
+    n_datasets = len(datasets)
+    if (consume_block is not None) and (
+        not isinstance(consume_block, (list, tuple)) or (len(consume_block) != n_datasets)
+    ):
+        raise TypeError(f"Parameter 'consume_block' must be None or a list of {n_datasets} callable objects")
+
+    fit_kwargs = dict(
+        use_snip=use_snip,
+        chunk_pixels=chunk_pixels,
+        n_chunks_min=n_chunks_min,
+        progress_bar=progress_bar,
+        client=client,
+        backend=backend,
+        cancel_event=cancel_event,
+        pixel_bin=pixel_bin,
+        energy_bin=energy_bin,
+    )
+    if result_cache is not None:
+        return _fit_xrf_maps_cached(datasets, consume_block=consume_block, result_cache=result_cache, **fit_kwargs)
 
-    if not isinstance(matv, np.ndarray) or matv.ndim != 2:
-        raise TypeError(f"Parameter 'matv' must be 2D ndarray: type(matv) = {type(matv)}, matv = {matv}")
+    logger.info("Starting single-pixel fitting ..." if n_datasets == 1 else f"Fitting {n_datasets} XRF maps ...")
+    logger.info(f"Baseline subtraction (SNIP): {'enabled' if use_snip else 'disabled'}.")
 
-    ne_spec, _ = matv.shape
-    nsel = data_sel_indices[1] - data_sel_indices[0]
-    if ne_spec != nsel:
-        raise ValueError(
-            f"The number of selected points ({nsel}) is not equal "
-            f"to the number of points in reference spectrum ({ne_spec})"
+    _check_bin_size(pixel_bin, "pixel_bin")
+    _check_bin_size(energy_bin, "energy_bin")
+    if (pixel_bin > 1) or (energy_bin > 1):
+        logger.info(f"Binning: {pixel_bin}x{pixel_bin} pixels, {energy_bin} spectral channel(s).")
+
+    file_objs = []
+    try:
+        checked = []
+        for ds in datasets:
+            data_sel_indices, matv = ds["data_sel_indices"], ds["matv"]
+            snip_param = ds.get("snip_param", None)
+            if snip_param is None:
+                snip_param = {}  # For consistency
+
+            # Verify that input parameters are valid
+            _check_data_sel_indices(data_sel_indices)
+
+            _check_matv(matv, data_sel_indices)
+
+            _check_snip_param(snip_param, keys_required=use_snip)
+
+            checked.append((ds["data"], data_sel_indices, matv, snip_param))
+
+        # All maps are processed using the same backend
+        backends = [select_execution_backend(_[0], backend=backend, client=client) for _ in checked]
+        backend = "distributed" if "distributed" in backends else "threads"
+        with _DaskExecutor(backend=backend, client=client) as executor:
+            inputs = []
+            for data, data_sel_indices, matv, snip_param in checked:
+                # Convert data to Dask array
+                data, file_obj = prepare_xrf_map(
+                    data,
+                    chunk_pixels=chunk_pixels,
+                    n_chunks_min=n_chunks_min,
+                    client=executor.client,
+                    pixel_bin=pixel_bin,
+                )
+                if file_obj:
+                    file_objs.append(file_obj)
+
+                # Verify that selection makes sense (data is Dask array at this point)
+                _check_data_sel_range(data_sel_indices, data.shape[2])
+
+                # The model is binned along the energy axis the same way as the data
+                data_sel_fit, matv_fit, snip_param_fit = _bin_fitting_model(
+                    data_sel_indices, matv, snip_param, energy_bin
+                )
+                inputs.append((data, data_sel_fit, matv_fit, snip_param_fit))
+
+            results = [
+                _create_fit_graph(
+                    data,
+                    data_sel_indices=data_sel_fit,
+                    matv=matv_fit,
+                    snip_param=snip_param_fit,
+                    use_snip=use_snip,
+                    pixel_bin=pixel_bin,
+                    energy_bin=energy_bin,
+                    executor=executor,
+                )
+                for data, data_sel_fit, matv_fit, snip_param_fit in inputs
+            ]
+            workload = [_[0] for _ in inputs]
+
+            if (consume_block is None) and (cancel_event is None):
+                results = list(executor.compute(tuple(results), progress_bar=progress_bar, workload=workload))
+            else:
+                if consume_block is None:
+                    # Computations can be cancelled only if the results are computed block by block
+                    results_assembled = [np.zeros(shape=_.shape, dtype=_.dtype) for _ in results]
+                    consume_block = [_create_block_assembler(_) for _ in results_assembled]
+                else:
+                    results_assembled = None
+
+                executor.compute_blocks(
+                    results,
+                    consume_block=list(consume_block),
+                    progress_bar=progress_bar,
+                    workload=workload,
+                    cancel_event=cancel_event,
+                )
+                results = results_assembled
+    finally:
+        for file_obj in file_objs:
+            file_obj.close()
+
+    return results
+
+
+def _fit_xrf_maps_cached(datasets, *, consume_block, result_cache, **kwargs):
+    """
+    Load the fitting results from the cache and fit the maps that are not found in the cache
+    (see `fit_xrf_maps`). The computed results are saved to the cache.
+    """
+    keys = [
+        compute_cache_key(
+            data=ds["data"],
+            operation="fit_xrf_map",
+            data_sel_indices=tuple(ds["data_sel_indices"]),
+            matv=np.asarray(ds["matv"]),
+            snip_param=ds.get("snip_param", None) or {},
+            use_snip=kwargs["use_snip"],
+            pixel_bin=kwargs["pixel_bin"],
+            energy_bin=kwargs["energy_bin"],
         )
+        for ds in datasets
+    ]
+
+    results = []
+    for key in keys:
+        entry = result_cache.get(key)
+        results.append(None if entry is None else entry["results"])
+    n_missing = [n for n, r in enumerate(results) if r is None]
+    logger.info(
+        f"Result cache: fitting results for {len(datasets) - len(n_missing)} of {len(datasets)} map(s) found."
+    )
 
-    if not isinstance(snip_param, dict):
-        raise TypeError(f"Parameter 'snip_param' must be a dictionary: type(snip_param) = {type(snip_param)}")
+    if consume_block is not None:
+        # The cached results are passed to 'consume_block' as a single block
+        for n, r in enumerate(results):
+            if r is not None:
+                consume_block[n](r, tuple(slice(0, _) for _ in r.shape))
 
-    required_keys = ("e_offset", "e_linear", "e_quadratic", "b_width")
-    if use_snip and not all([_ in snip_param.keys() for _ in required_keys]):
-        raise TypeError(
-            f"Parameter 'snip_param' must a dictionary with keys {required_keys}: "
-            f"snip_param.keys() = {snip_param.keys()}"
-        )
+    if n_missing:
+        datasets_missing = [datasets[n] for n in n_missing]
+        if consume_block is None:
+            computed = fit_xrf_maps(datasets_missing, **kwargs)
+        else:
+            # The blocks are passed to 'consume_block' and assembled in memory
+            computed = [
+                np.zeros(shape=tuple(ds["data"].shape[0:2]) + (np.shape(ds["matv"])[1] + 4,))
+                for ds in datasets_missing
+            ]
 
-    # Convert data to Dask array
-    data, file_obj = prepare_xrf_map(data, chunk_pixels=chunk_pixels, n_chunks_min=n_chunks_min)
-    data_is_from_file = bool(file_obj)
+            def _create_consumer(consumer, data_out):
+                assemble_block = _create_block_assembler(data_out)
 
-    # Verify that selection makes sense (data is Dask array at this point)
-    _, _, ne = data.shape
-    if data_sel_indices[0] >= ne or data_sel_indices[1] > ne:
-        raise ValueError(f"Selection indices {data_sel_indices} are outside the allowed range 0 .. {ne}")
+                def _consume_block(block, block_slice):
+                    assemble_block(block, block_slice)
+                    consumer(block, block_slice)
+
+                return _consume_block
+
+            consumers = [_create_consumer(consume_block[n], r) for n, r in zip(n_missing, computed)]
+            fit_xrf_maps(datasets_missing, consume_block=consumers, **kwargs)
+
+        for n, r in zip(n_missing, computed):
+            results[n] = r
+            try:
+                result_cache.put(keys[n], {"results": r})
+            except Exception as ex:
+                logger.warning(f"Failed to save fitting results to the cache: {ex}")
+
+    return None if consume_block is not None else results
 
-    if client is None:
-        client = dask_client_create()
-        client_is_local = True
-    else:
-        client_is_local = False
 
-    client.run(dask_set_custom_serializers)
-    dask_set_custom_serializers()
+def _create_block_assembler(data_out):
+    """
+    Create the function `consume_block(block, block_slice)`, which copies the computed blocks
+    to the array `data_out`.
+    """
+
+    def _assemble_block(block, block_slice):
+        data_out[block_slice] = block
 
-    n_workers = len(client.scheduler_info()["workers"])
-    logger.info(f"Dask distributed client: {n_workers} workers")
+    return _assemble_block
 
-    matv_fut = client.scatter(matv)
-    result_fut = da.map_blocks(
+
+def _create_fit_graph(data, *, data_sel_indices, matv, snip_param, use_snip, pixel_bin, energy_bin, executor):
+    """
+    Create Dask graph for fitting XRF map `data` (Dask array). The selected range `data_sel_indices`,
+    matrix `matv` and `snip_param` must be already binned (see `_bin_fitting_model`).
+    Returns Dask array with the shape `(ny, nx, n_lines + 4)`.
+    """
+    if (pixel_bin > 1) or (energy_bin > 1):
+        data_fit = bin_xrf_map(data, pixel_bin=pixel_bin, energy_bin=energy_bin)
+    else:
+        data_fit = data
+
+    n_out = matv.shape[1] + 4
+    result = da.map_blocks(
         _fit_xrf_block,
-        data,
+        data_fit,
         # Parameters of the '_fit_xrf_block' function
         data_sel_indices=data_sel_indices,
-        matv=matv_fut,
+        matv=executor.scatter(matv),
         snip_param=snip_param,
         use_snip=use_snip,
-        # Output data type
+        # Output data type and chunks
         dtype="float",
-    ).persist(scheduler=client)
+        chunks=(data_fit.chunks[0], data_fit.chunks[1], (n_out,)),
+    )
+    if pixel_bin > 1:
+        # Results are assigned to each pixel of the original map
+        result = da.map_blocks(
+            _expand_binned_block,
+            result,
+            pixel_bin=pixel_bin,
+            dtype=result.dtype,
+            chunks=(data.chunks[0], data.chunks[1], (n_out,)),
+        )
+    return result
 
-    # Call the progress monitor
-    wait_and_display_progress(result_fut, progress_bar)
 
-    result = result_fut.compute(scheduler=client)
+def _fit_xrf_block_sweep(data, backgrounds, models, use_snip):
+    """
+    Fit a block of XRF dataset with multiple models (parameter sweep). The function is intended
+    to be called using `map_blocks`. SNIP background is computed once for each distinct background
+    setting and shared by all models that use the setting.
 
-    if data_is_from_file:
-        file_obj.close()
+    Parameters
+    ----------
+    data: ndarray
+        block of an XRF dataset. Shape=(ny, nx, ne).
+    backgrounds: list(tuple)
+        list of distinct background settings `(data_sel_indices, snip_param)`
+    models: list(tuple)
+        list of models `(n_background, matv)`, where `n_background` is the index of the background
+        setting in `backgrounds`
+    use_snip: bool
+        enable/disable background removal using snip algorithm
 
-    client.run(dask_close_all_files)
-    dask_close_all_files()
+    Returns
+    -------
+    data_out: ndarray
+        fitting results for all models (see `_fit_xrf_block`) stacked along axis 2 in the order of `models`.
+    """
+    total_cnt = np.sum(data, axis=2)
+    spectra = []
+    for data_sel_indices, snip_param in backgrounds:
+        spec_sel = data[:, :, data_sel_indices[0] : data_sel_indices[1]]
+        spectra.append((spec_sel, _snip_background(spec_sel, snip_param, use_snip)))
+    return np.concatenate(
+        [_fit_selected_spectra(*spectra[n_background], total_cnt, matv) for n_background, matv in models], axis=2
+    )
 
-    # # The following code is needed to cause Dask 'distributed>=2021.7.0' to close the h5file.
-    # del result_fut
-    # _dask_release_file_descriptors(client=client)
 
-    if client_is_local:
-        client.close()
+def fit_xrf_map_sweep(
+    data,
+    models,
+    *,
+    use_snip=True,
+    chunk_pixels="auto",
+    n_chunks_min=4,
+    progress_bar=None,
+    client=None,
+    backend="auto",
+    consume_block=None,
+    cancel_event=None,
+    pixel_bin=1,
+    energy_bin=1,
+):
+    """
+    Fit XRF map with multiple models (parameter sweep), e.g. with different lists of emission lines
+    or energy ranges. Each block of raw data is read once and fitted with all the models. SNIP
+    background is computed once per block for each distinct background setting (selected range and
+    SNIP parameters) and shared by the models with the same setting. The results are the same as
+    if the map was fitted with each model using `fit_xrf_map`.
 
-    return result
+    Parameters
+    ----------
+    data: da.core.Array, np.ndarray or RawHDF5Dataset (this is a custom type)
+        Raw XRF map with dimensions `(ny, nx, ne)` (see `fit_xrf_map`)
+    models: list(dict)
+        list of dictionaries with the keys `data_sel_indices`, `matv` and `snip_param`
+        (see the respective parameters of `fit_xrf_map`). The key `snip_param` is optional.
+    consume_block: list(callable) or None
+        If None, then the results are assembled in memory and returned. Otherwise it must be
+        the list of functions `consume_block(block, block_slice)`, one for each model
+        (see `fit_xrf_map`).
+    use_snip, chunk_pixels, n_chunks_min, progress_bar, client, backend, cancel_event, pixel_bin, energy_bin
+        see the description of the parameters of `fit_xrf_map`. The parameters are the same for all models.
 
+    Returns
+    -------
+    results: list(ndarray) or None
+        list of arrays with fitting results (see `fit_xrf_map`) in the same order as `models`.
+        None if the results are passed to `consume_block`.
 
-def _compute_roi(data, data_sel_indices, roi_bands, snip_param, use_snip):
+    Raises
+    ------
+    TypeError or ValueError if input parameters are invalid.
+    """
+    if not isinstance(models, (list, tuple)) or not models or not all([isinstance(_, dict) for _ in models]):
+        raise TypeError(f"Parameter 'models' must be a non-empty list of dictionaries: models = {models!r}")
+    n_models = len(models)
+    if (consume_block is not None) and (
+        not isinstance(consume_block, (list, tuple)) or (len(consume_block) != n_models)
+    ):
+        raise TypeError(f"Parameter 'consume_block' must be None or a list of {n_models} callable objects")
+
+    logger.info(f"Fitting XRF map with {n_models} models ...")
+    logger.info(f"Baseline subtraction (SNIP): {'enabled' if use_snip else 'disabled'}.")
+
+    _check_bin_size(pixel_bin, "pixel_bin")
+    _check_bin_size(energy_bin, "energy_bin")
+
+    checked = []
+    for model in models:
+        data_sel_indices, matv = model["data_sel_indices"], model["matv"]
+        snip_param = model.get("snip_param", None)
+        if snip_param is None:
+            snip_param = {}  # For consistency
+        _check_data_sel_indices(data_sel_indices)
+        _check_matv(matv, data_sel_indices)
+        _check_snip_param(snip_param, keys_required=use_snip)
+        checked.append((data_sel_indices, matv, snip_param))
+
+    backend = select_execution_backend(data, backend=backend, client=client)
+    with _DaskExecutor(backend=backend, client=client) as executor:
+        data, file_obj = prepare_xrf_map(
+            data, chunk_pixels=chunk_pixels, n_chunks_min=n_chunks_min, client=executor.client, pixel_bin=pixel_bin
+        )
+        try:
+            # Models with the same selected range and SNIP parameters share the background
+            backgrounds, background_index, models_fit = [], {}, []
+            for data_sel_indices, matv, snip_param in checked:
+                _check_data_sel_range(data_sel_indices, data.shape[2])
+                data_sel_fit, matv_fit, snip_param_fit = _bin_fitting_model(
+                    data_sel_indices, matv, snip_param, energy_bin
+                )
+                key = (tuple(data_sel_fit), tuple(sorted(snip_param_fit.items())) if use_snip else None)
+                if key not in background_index:
+                    background_index[key] = len(backgrounds)
+                    backgrounds.append((tuple(data_sel_fit), snip_param_fit))
+                models_fit.append((background_index[key], matv_fit))
+            logger.info(f"The number of distinct background settings: {len(backgrounds)}.")
+
+            if (pixel_bin > 1) or (energy_bin > 1):
+                data_fit = bin_xrf_map(data, pixel_bin=pixel_bin, energy_bin=energy_bin)
+            else:
+                data_fit = data
+
+            n_out = [_[1].shape[1] + 4 for _ in models_fit]
+            # The list is scattered as a single object
+            (models_ref,) = executor.scatter([models_fit])
+            result = da.map_blocks(
+                _fit_xrf_block_sweep,
+                data_fit,
+                backgrounds=backgrounds,
+                models=models_ref,
+                use_snip=use_snip,
+                dtype="float",
+                chunks=(data_fit.chunks[0], data_fit.chunks[1], (sum(n_out),)),
+            )
+            if pixel_bin > 1:
+                result = da.map_blocks(
+                    _expand_binned_block,
+                    result,
+                    pixel_bin=pixel_bin,
+                    dtype=result.dtype,
+                    chunks=(data.chunks[0], data.chunks[1], (sum(n_out),)),
+                )
+
+            # Positions of the results for each model along axis 2
+            bounds = np.cumsum([0] + n_out)
+            model_slices = [slice(bounds[n], bounds[n + 1]) for n in range(n_models)]
+
+            if (consume_block is None) and (cancel_event is None):
+                result = executor.compute(result, progress_bar=progress_bar, workload=data)
+                return [np.array(result[:, :, _]) for _ in model_slices]
+
+            if consume_block is None:
+                results = [np.zeros(shape=data.shape[0:2] + (_,)) for _ in n_out]
+                consume_block = [_create_block_assembler(_) for _ in results]
+            else:
+                results = None
+
+            def _consume_block(block, block_slice):
+                # The block of results is split between the models
+                for consumer, model_slice in zip(consume_block, model_slices):
+                    n = model_slice.stop - model_slice.start
+                    consumer(block[:, :, model_slice], block_slice[0:2] + (slice(0, n),))
+
+            executor.compute_blocks(
+                result,
+                consume_block=_consume_block,
+                progress_bar=progress_bar,
+                workload=data,
+                cancel_event=cancel_event,
+            )
+            return results
+        finally:
+            if file_obj:
+                file_obj.close()
+
+
+def _compute_roi(data, data_sel_indices, roi_bands, snip_param, use_snip, fractional_edges=False):
     """
     Compute intensity for ROIs (energy bands) in XRF datasets. The function is intended to be
     called using `map_blocks` function for parallel processing using Dask distributed
@@ -936,6 +2521,12 @@ def _compute_roi(data, data_sel_indices, roi_bands, snip_param, use_snip):
         need to be always provided.
     use_snip: bool, optional
         enable/disable background removal using snip algorithm
+    fractional_edges: bool, optional
+        if False, then each band includes whole spectrum points between the points closest
+        to the band limits (computed using `e_offset` and `e_linear`). If True, then the band
+        limits are converted to fractional positions using the full energy calibration
+        (including `e_quadratic`) and the partially covered points are included with
+        the respective weights.
 
     Returns
     -------
@@ -946,37 +2537,74 @@ def _compute_roi(data, data_sel_indices, roi_bands, snip_param, use_snip):
     """
     spec = data
     spec_sel = spec[:, :, data_sel_indices[0] : data_sel_indices[1]]
+    bg_sel = _snip_background(spec_sel, snip_param, use_snip)
+    return _sum_roi_bands(spec_sel, bg_sel, data_sel_indices, roi_bands, snip_param, fractional_edges)
 
-    e_offset = snip_param["e_offset"]
-    e_linear = snip_param["e_linear"]
-    e_quadratic = snip_param["e_quadratic"]
 
-    if use_snip:
-        bg_sel = np.apply_along_axis(
-            snip_method_numba, 2, spec_sel, e_offset, e_linear, e_quadratic, width=snip_param["b_width"]
-        )
-        y = spec_sel - bg_sel
+def _energy_to_bin_position(energy, e_offset, e_linear, e_quadratic):
+    """
+    Convert energy to (fractional) position on the axis of spectrum points by inverting
+    the calibration `energy = e_offset + e_linear * n + e_quadratic * n ** 2`. The expression
+    is numerically stable for small and zero values of `e_quadratic`.
+    """
+    de = np.asarray(energy, dtype=float) - e_offset
+    discriminant = np.clip(e_linear**2 + 4 * e_quadratic * de, a_min=0, a_max=None)
+    return 2 * de / (e_linear + np.sqrt(discriminant))
+
 
+def _roi_band_edges(roi_bands, snip_param, n_sel_start, n_pts, fractional_edges):
+    """
+    Compute positions of the edges of ROI bands in the array of selected spectrum points
+    (the edges are positions in the array of cumulative sums, see `_sum_roi_bands`). If
+    `fractional_edges` is False, then the edges are integer indices of the points closest
+    to the band limits (only linear calibration is used), otherwise the edges are fractional
+    positions of the band limits computed using the full calibration (each point represents
+    the interval `n - 0.5 .. n + 0.5`).
+    """
+    energies = np.array(roi_bands, dtype=float).reshape(-1, 2)
+    if not fractional_edges:
+        # 'y' is truncated array, and energy axis is aligned with the full array
+        positions = (energies.ravel() - snip_param["e_offset"]) / snip_param["e_linear"]
+        indices = np.array([round(_) for _ in positions])
+        indices = np.clip(indices.reshape(-1, 2) - n_sel_start, a_min=0, a_max=n_pts - 1).astype(int)
     else:
-        y = spec_sel
+        positions = _energy_to_bin_position(
+            energies, snip_param["e_offset"], snip_param["e_linear"], snip_param["e_quadratic"]
+        )
+        indices = np.clip(positions + 0.5 - n_sel_start, a_min=0, a_max=n_pts)
+    return indices[:, 0], indices[:, 1]
+
+
+def _sum_roi_bands(spec_sel, bg_sel, data_sel_indices, roi_bands, snip_param, fractional_edges=False):
+    """
+    Compute ROI counts for the block of spectra `spec_sel` (selected energy range) with
+    precomputed background `bg_sel` (None if background is not subtracted). Returns the array
+    in the format described for `_compute_roi`. The cumulative sum along the energy axis is
+    computed once and the count for each band is the difference of two values of the cumulative
+    sum, so the cost of computation does not depend on the number and the width of the bands.
+    """
+    y = spec_sel - bg_sel if bg_sel is not None else spec_sel
 
     # The number of available spectrum points
     ny, nx, n_pts = y.shape
     n_sel_start = data_sel_indices[0]
 
-    def _energy_to_index(energy):
-        # 'y' is truncated array, and energy axis is aligned with the full array
-        n_index = int(round((energy - e_offset) / e_linear)) - n_sel_start
-        n_index = int(np.clip(n_index, a_min=0, a_max=n_pts - 1))
-        return n_index
-
-    roi_data = np.zeros(shape=(ny, nx, len(roi_bands)))
-    for n, band in enumerate(roi_bands):
-        n_left = _energy_to_index(band[0])
-        n_right = _energy_to_index(band[1])
-        roi_data[:, :, n] = (
-            np.sum(y[:, :, n_left:n_right], axis=2) if n_right > n_left else np.zeros(shape=(ny, nx))
-        )
+    # 'y_cumsum[:, :, n]' is the sum of the first 'n' points of the spectrum
+    y_cumsum = np.zeros(shape=(ny, nx, n_pts + 1))
+    np.cumsum(y, axis=2, out=y_cumsum[:, :, 1:])
+
+    def _cumsum_at(positions):
+        if not fractional_edges:
+            return y_cumsum[:, :, positions]
+        # Linear interpolation between the values of cumulative sum
+        n_lower = np.clip(np.floor(positions).astype(int), a_min=0, a_max=n_pts - 1)
+        weights = positions - n_lower
+        return y_cumsum[:, :, n_lower] * (1 - weights) + y_cumsum[:, :, n_lower + 1] * weights
+
+    left, right = _roi_band_edges(roi_bands, snip_param, n_sel_start, n_pts, fractional_edges)
+    roi_data = _cumsum_at(right) - _cumsum_at(left)
+    # ROI is zero if the width of the band is zero or negative
+    roi_data[:, :, right <= left] = 0
 
     return roi_data
 
@@ -987,10 +2615,13 @@ def compute_selected_rois(
     roi_dict,
     snip_param=None,
     use_snip=True,
-    chunk_pixels=5000,
+    chunk_pixels="auto",
     n_chunks_min=4,
     progress_bar=None,
     client=None,
+    backend="auto",
+    fractional_edges=False,
+    result_cache=None,
 ):
     """
     Compute XRF map based on ROIs for XRF dataset.
@@ -1017,10 +2648,11 @@ def compute_selected_rois(
         need to be always provided.
     use_snip: bool, optional
         enable/disable background removal using snip algorithm
-    chunk_pixels: int
+    chunk_pixels: int or str
         The number of pixels in a single chunk. The XRF map will be rechunked so that
         each block contains approximately `chunk_pixels` pixels and contain all `ne`
-        spectrum points for each pixel.
+        spectrum points for each pixel. If `"auto"`, then the number of pixels is selected
+        automatically (see `prepare_xrf_map`).
     n_chunks_min: int
         Minimum number of chunks. The algorithm will try to split the map into the number
         of chunks equal or greater than `n_chunks_min`.
@@ -1028,7 +2660,18 @@ def compute_selected_rois(
         reference to the callable object that implements progress bar. The example of
         such a class for progress bar object is `TerminalProgressBar`.
     client: dask.distributed.Client or None
-        Dask client. If None, then local client will be created
+        Dask client. If None, then the shared client (see `dask_client_manager`) is used
+        if distributed backend is selected
+    backend: str
+        Execution backend: `"threads"` (local thread pool), `"distributed"` (Dask distributed client)
+        or `"auto"` (the backend is selected based on the map size, see `select_execution_backend`).
+    fractional_edges: bool, optional
+        use fractional positions of ROI band limits computed using the full energy calibration
+        (see `_compute_roi`).
+    result_cache: ResultCache or None
+        cache for the computed ROI maps (see `ResultCache`). If the maps computed for the same
+        raw data and parameters are found in the cache, then they are returned without computations.
+        No caching if None.
 
     Returns
     -------
@@ -1043,98 +2686,278 @@ def compute_selected_rois(
     logger.info(f"Baseline subtraction (SNIP): {'enabled' if use_snip else 'disabled'}.")
 
     # Verify that input parameters are valid
-    if not isinstance(data_sel_indices, (tuple, list)):
-        raise TypeError(
-            f"Parameter 'data_sel_indices' must be tuple or list: "
-            f"type(data_sel_indices) = {type(data_sel_indices)}"
+    _check_data_sel_indices(data_sel_indices)
+
+    _check_snip_param(snip_param, keys_required=True)
+
+    if result_cache is not None:
+        cache_key = compute_cache_key(
+            data=data,
+            operation="compute_selected_rois",
+            data_sel_indices=tuple(data_sel_indices),
+            roi_dict=roi_dict,
+            snip_param=snip_param,
+            use_snip=use_snip,
+            fractional_edges=fractional_edges,
         )
+        roi_dict_computed = result_cache.get(cache_key)
+        if (roi_dict_computed is not None) and (set(roi_dict_computed) == set(roi_dict)):
+            logger.info("Result cache: ROI maps are loaded from the cache.")
+            return roi_dict_computed
 
-    if not len(data_sel_indices) == 2:
-        raise TypeError(
-            f"Parameter 'data_sel_indices' must contain two elements: data_sel_indices = {data_sel_indices}"
-        )
+    # Prepare ROI bands in the form of a list
+    roi_band_keys = []
+    roi_bands = []
+    for k, v in roi_dict.items():
+        roi_band_keys.append(k)
+        roi_bands.append(v)
 
-    if any([_ < 0 for _ in data_sel_indices]):
-        raise ValueError(
-            f"Some of the indices in 'data_sel_indices' are negative: data_sel_indices = {data_sel_indices}"
+    backend = select_execution_backend(data, backend=backend, client=client)
+    with _DaskExecutor(backend=backend, client=client) as executor:
+        # Convert data to Dask array
+        data, file_obj = prepare_xrf_map(
+            data, chunk_pixels=chunk_pixels, n_chunks_min=n_chunks_min, client=executor.client
         )
 
-    if data_sel_indices[1] <= data_sel_indices[0]:
-        raise ValueError(
-            f"Parameter 'data_sel_indices' must select at least 1 element: "
-            f"data_sel_indices = {data_sel_indices}"
+        # Verify that selection makes sense (data is Dask array at this point)
+        _check_data_sel_range(data_sel_indices, data.shape[2])
+
+        result = da.map_blocks(
+            _compute_roi,
+            data,
+            # Parameters of the '_fit_xrf_block' function
+            data_sel_indices=data_sel_indices,
+            roi_bands=roi_bands,
+            snip_param=snip_param,
+            use_snip=use_snip,
+            fractional_edges=fractional_edges,
+            # Output data type
+            dtype="float",
         )
 
-    if not isinstance(snip_param, dict):
-        raise TypeError(f"Parameter 'snip_param' must be a dictionary: type(snip_param) = {type(snip_param)}")
+        result = executor.compute(result, progress_bar=progress_bar, workload=data)
 
-    required_keys = ("e_offset", "e_linear", "e_quadratic", "b_width")
-    if not all([_ in snip_param.keys() for _ in required_keys]):
-        raise TypeError(
-            f"Parameter 'snip_param' must a dictionary with keys {required_keys}: "
-            f"snip_param.keys() = {snip_param.keys()}"
-        )
+        if file_obj:
+            file_obj.close()
 
-    # Convert data to Dask array
-    data, file_obj = prepare_xrf_map(data, chunk_pixels=chunk_pixels, n_chunks_min=n_chunks_min)
+    roi_dict_computed = {roi_band_keys[_]: result[:, :, _] for _ in range(len(roi_band_keys))}
 
-    # Verify that selection makes sense (data is Dask array at this point)
-    _, _, ne = data.shape
-    if data_sel_indices[0] >= ne or data_sel_indices[1] > ne:
-        raise ValueError(f"Selection indices {data_sel_indices} are outside the allowed range 0 .. {ne}")
+    if result_cache is not None:
+        try:
+            result_cache.put(cache_key, roi_dict_computed)
+        except Exception as ex:
+            logger.warning(f"Failed to save ROI maps to the cache: {ex}")
 
-    if client is None:
-        client = dask_client_create()
-        client_is_local = True
-    else:
-        client_is_local = False
+    return roi_dict_computed
 
-    client.run(dask_set_custom_serializers)
-    dask_set_custom_serializers()
 
-    n_workers = len(client.scheduler_info()["workers"])
-    logger.info(f"Dask distributed client: {n_workers} workers")
+# Products that can be computed by `compute_map_products`
+map_products = ("total_spectrum", "total_count", "max_spectrum", "roi", "fit")
 
-    # Prepare ROI bands in the form of a list
-    roi_band_keys = []
-    roi_bands = []
-    for k, v in roi_dict.items():
-        roi_band_keys.append(k)
-        roi_bands.append(v)
 
-    result_fut = da.map_blocks(
-        _compute_roi,
-        data,
-        # Parameters of the '_fit_xrf_block' function
-        data_sel_indices=data_sel_indices,
-        roi_bands=roi_bands,
-        snip_param=snip_param,
-        use_snip=use_snip,
-        # Output data type
-        dtype="float",
-    ).persist(scheduler=client)
+def _compute_pixel_products_block(
+    data, *, compute_roi, compute_fit, data_sel_indices, matv, roi_bands, snip_param, use_snip, fractional_edges
+):
+    """
+    Compute ROIs and/or fitting results for a block of XRF dataset. The function is intended to be
+    called using `da.map_blocks` function. SNIP background is computed once and shared by ROI
+    computation and fitting. See `compute_map_products` for the description of the parameters.
 
-    # Call the progress monitor
-    wait_and_display_progress(result_fut, progress_bar)
+    Returns
+    -------
+    result: ndarray
+        array with shape `(ny, nx, n_roi + n_fit)`: ROI counts (see `_compute_roi`, present
+        if `compute_roi` is True) followed by fitting results (see `_fit_xrf_block`, present
+        if `compute_fit` is True).
+    """
+    spec_sel = data[:, :, data_sel_indices[0] : data_sel_indices[1]]
+    bg_sel = _snip_background(spec_sel, snip_param, use_snip)
 
-    result = result_fut.compute(scheduler=client)
+    results = []
+    if compute_roi:
+        results.append(_sum_roi_bands(spec_sel, bg_sel, data_sel_indices, roi_bands, snip_param, fractional_edges))
+    if compute_fit:
+        results.append(_fit_selected_spectra(spec_sel, bg_sel, np.sum(data, axis=2), matv))
+    return np.concatenate(results, axis=2)
 
-    roi_dict_computed = {roi_band_keys[_]: result[:, :, _] for _ in range(len(roi_band_keys))}
 
-    if file_obj:
-        file_obj.close()
+def compute_map_products(
+    data,
+    *,
+    products,
+    data_sel_indices=None,
+    matv=None,
+    roi_dict=None,
+    snip_param=None,
+    use_snip=True,
+    chunk_pixels="auto",
+    n_chunks_min=4,
+    progress_bar=None,
+    client=None,
+    backend="auto",
+    roi_fractional_edges=False,
+):
+    """
+    Compute multiple products from the XRF map in a single pass over the data. Each block of
+    raw data is loaded once and all requested products are computed from the loaded block.
+    If both ROIs and fitting results are requested, then SNIP background is computed once
+    and used for both. The function is an efficient replacement for the sequence of calls
+    to `compute_total_spectrum_and_count`, `compute_selected_rois` and `fit_xrf_map`,
+    especially if loading of the data dominates processing time.
 
-    client.run(dask_close_all_files)
-    dask_close_all_files()
+    Parameters
+    ----------
+    data: da.core.Array, np.ndarray or RawHDF5Dataset (this is a custom type)
+        Raw XRF map represented as Dask array, numpy array or reference to a dataset in
+        HDF5 file. The XRF map must have dimensions `(ny, nx, ne)`, where `ny` and `nx`
+        define image size and `ne` is the number of spectrum points
+    products: iterable(str)
+        The list of products to compute. Supported products (see `map_products`):
+        `"total_spectrum"` (the sum of all spectra), `"total_count"` (total count map),
+        `"max_spectrum"` (maximum count for each spectrum point over all pixels),
+        `"roi"` (ROI maps, see `compute_selected_rois`), `"fit"` (results of fitting,
+        see `fit_xrf_map`).
+    data_sel_indices: tuple or None
+        tuple `(n_start, n_end)` which defines the indices along axis 2 of `data` array
+        that are used for fitting and ROI computations. Required if `"roi"` or `"fit"`
+        are computed.
+    matv: ndarray or None
+        Matrix of spectra of the selected elements (emission lines). Shape=(ne_model, n_lines).
+        Required if `"fit"` is computed.
+    roi_dict: dict or None
+        Dictionary that specifies ROIs for the selected emission lines:
+        key - emission line, value - tuple (left_val, right_val). Energy values are in keV.
+        Required if `"roi"` is computed.
+    snip_param: dict or None
+        Dictionary of parameters forwarded to 'snip' method for background removal.
+        Keys: `e_offset`, `e_linear`, `e_quadratic` (parameters of the energy axis approximation),
+        `b_width` (width of the window that defines resolution of the snip algorithm).
+        Required if `"roi"` is computed or if `"fit"` is computed with `use_snip=True`.
+    use_snip: bool, optional
+        enable/disable background removal using snip algorithm
+    chunk_pixels: int or str
+        The number of pixels in a single chunk. The XRF map will be rechunked so that
+        each block contains approximately `chunk_pixels` pixels and contain all `ne`
+        spectrum points for each pixel. If `"auto"`, then the number of pixels is selected
+        automatically (see `prepare_xrf_map`).
+    n_chunks_min: int
+        Minimum number of chunks. The algorithm will try to split the map into the number
+        of chunks equal or greater than `n_chunks_min`.
+    progress_bar: callable or None
+        reference to the callable object that implements progress bar. The example of
+        such a class for progress bar object is `TerminalProgressBar`.
+    client: dask.distributed.Client or None
+        Dask client. If None, then the shared client (see `dask_client_manager`) is used
+        if distributed backend is selected
+    backend: str
+        Execution backend: `"threads"` (local thread pool), `"distributed"` (Dask distributed client)
+        or `"auto"` (the backend is selected based on the map size, see `select_execution_backend`).
+    roi_fractional_edges: bool, optional
+        use fractional positions of ROI band limits computed using the full energy calibration
+        (see `_compute_roi`).
 
-    # The following code is needed to cause Dask 'distributed>=2021.7.0' to close the h5file.
-    # del result_fut
-    # _dask_release_file_descriptors(client=client)
+    Returns
+    -------
+    result: dict
+        Dictionary of computed products. Keys: names of the products. Values:
+        `"total_spectrum"` and `"max_spectrum"` - ndarrays with shape `(ne,)`; `"total_count"` -
+        ndarray with shape `(ny, nx)`; `"roi"` - dictionary of ROI maps in the format returned by
+        `compute_selected_rois`; `"fit"` - ndarray in the format returned by `fit_xrf_map`.
 
-    if client_is_local:
-        client.close()
+    Raises
+    ------
+    ValueError, TypeError
+        Invalid parameters
+    """
+    if isinstance(products, str) or not isinstance(products, Iterable):
+        raise TypeError(f"Parameter 'products' must be a list of strings: products = {products!r}")
+    products = tuple(products)
+    if not products:
+        raise ValueError("Parameter 'products' must contain at least one product")
+    for p in products:
+        if p not in map_products:
+            raise ValueError(f"Product {p!r} is not supported. Supported products: {map_products}")
 
-    return roi_dict_computed
+    compute_roi, compute_fit = "roi" in products, "fit" in products
+
+    if snip_param is None:
+        snip_param = {}  # For consistency
+
+    if compute_roi or compute_fit:
+        if data_sel_indices is None:
+            raise ValueError("Parameter 'data_sel_indices' must be specified to compute ROIs or fit the data")
+        _check_data_sel_indices(data_sel_indices)
+        _check_snip_param(snip_param, keys_required=compute_roi or use_snip)
+    if compute_fit:
+        _check_matv(matv, data_sel_indices)
+    if compute_roi and not isinstance(roi_dict, dict):
+        raise TypeError(f"Parameter 'roi_dict' must be a dictionary: type(roi_dict) = {type(roi_dict)}")
+
+    roi_band_keys = list(roi_dict.keys()) if compute_roi else []
+    roi_bands = list(roi_dict.values()) if compute_roi else []
+
+    logger.info(f"Computing products {products} in a single pass over the data ...")
+    if compute_roi or compute_fit:
+        logger.info(f"Baseline subtraction (SNIP): {'enabled' if use_snip else 'disabled'}.")
+
+    backend = select_execution_backend(data, backend=backend, client=client)
+    with _DaskExecutor(backend=backend, client=client) as executor:
+        # Convert data to Dask array
+        data, file_obj = prepare_xrf_map(
+            data, chunk_pixels=chunk_pixels, n_chunks_min=n_chunks_min, client=executor.client
+        )
+
+        if compute_roi or compute_fit:
+            # Verify that selection makes sense (data is Dask array at this point)
+            _check_data_sel_range(data_sel_indices, data.shape[2])
+
+        # All products are computed as one graph, so each block of data is loaded once
+        arrays = {}
+        # The partial spectra of the blocks are reduced after they are computed
+        if "total_spectrum" in products:
+            arrays["total_spectrum"] = _reduce_spatially_by_block(data, np.sum)
+        if "max_spectrum" in products:
+            arrays["max_spectrum"] = _reduce_spatially_by_block(data, np.max)
+        if "total_count" in products:
+            arrays["total_count"] = da.sum(data, axis=2)
+        if compute_roi or compute_fit:
+            n_roi = len(roi_bands) if compute_roi else 0
+            n_fit = matv.shape[1] + 4 if compute_fit else 0
+            arrays["pixel_products"] = da.map_blocks(
+                _compute_pixel_products_block,
+                data,
+                chunks=data.chunks[0:2] + ((n_roi + n_fit,),),
+                dtype="float",
+                # Parameters of the '_compute_pixel_products_block' function
+                compute_roi=compute_roi,
+                compute_fit=compute_fit,
+                data_sel_indices=data_sel_indices,
+                matv=executor.scatter(matv) if compute_fit else None,
+                roi_bands=roi_bands,
+                snip_param=snip_param,
+                use_snip=use_snip,
+                fractional_edges=roi_fractional_edges,
+            )
+
+        result = dict(
+            zip(arrays.keys(), executor.compute(tuple(arrays.values()), progress_bar=progress_bar, workload=data))
+        )
+
+        if file_obj:
+            file_obj.close()
+
+    # Assemble results
+    output = {_: result[_] for _ in ("total_spectrum", "max_spectrum", "total_count") if _ in result}
+    if "total_spectrum" in output:
+        output["total_spectrum"] = output["total_spectrum"].sum(axis=(0, 1))
+    if "max_spectrum" in output:
+        output["max_spectrum"] = output["max_spectrum"].max(axis=(0, 1))
+    if compute_roi:
+        output["roi"] = {roi_band_keys[_]: result["pixel_products"][:, :, _] for _ in range(n_roi)}
+    if compute_fit:
+        output["fit"] = result["pixel_products"][:, :, n_roi:]
+
+    return output
 
 
 # The following function `snip_method_numba` is a copy of the function
@@ -1355,3 +3178,131 @@ def snip_method_numba(
     background[inf_ind] = 0.0
 
     return background
+
+
+def snip_method_block(
+    data,
+    e_off,
+    e_lin,
+    e_quad,
+    xmin=0,
+    xmax=4096,
+    epsilon=2.96,
+    width=0.5,
+    decrease_factor=np.sqrt(2),
+    spectral_binning=None,
+    con_val=None,
+    iter_num=None,
+    width_threshold=0.5,
+):
+    """
+    Compute SNIP background for a block of spectra. The function is equivalent
+    to calling `snip_method_numba` for each spectrum in the block, but the
+    energy-dependent window and clipping indices are computed only once and
+    the clipping iterations for all spectra run in a single compiled loop,
+    which releases GIL.
+
+    Parameters
+    ----------
+    data : ndarray
+        spectrum or block of spectra. Spectra are located along the last axis,
+        e.g. a block of XRF map has the shape `(ny, nx, ne)`.
+    e_off, e_lin, e_quad, xmin, xmax, epsilon, width, decrease_factor,
+    spectral_binning, con_val, iter_num, width_threshold :
+        parameters of the SNIP algorithm. See the docstring for `snip_method_numba`.
+
+    Returns
+    -------
+    background : ndarray
+        array of the same shape as `data` that contains background for each spectrum.
+        The array has the same dtype as `data` if `data` is floating point array,
+        otherwise the dtype is `float64`.
+    """
+    data = np.asarray(data)
+    if data.ndim < 1:
+        raise ValueError("Parameter 'data' must be an array with at least 1 dimension")
+
+    if con_val is None:
+        con_val = _default_con_val_no_bin if spectral_binning is None else _default_con_val_bin
+    if iter_num is None:
+        iter_num = _default_iter_num_no_bin if spectral_binning is None else _default_iter_num_bin
+
+    out_dtype = data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64
+
+    n_pts = data.shape[-1]
+    spectra = np.ascontiguousarray(np.reshape(data, (-1, n_pts)), dtype=out_dtype)
+
+    energy = np.arange(n_pts, dtype=np.float64)
+    if spectral_binning is not None:
+        energy = energy * spectral_binning
+    energy = e_off + energy * e_lin + energy**2 * e_quad
+
+    # transfer from std to fwhm
+    std_fwhm = 2 * np.sqrt(2 * np.log(2))
+    tmp = (e_off / std_fwhm) ** 2 + energy * epsilon * e_lin
+    tmp[tmp < 0] = 0
+    fwhm = std_fwhm * np.sqrt(tmp)
+
+    window_p = width * fwhm / e_lin
+    if spectral_binning is not None and spectral_binning > 0:
+        window_p = window_p / 2.0
+
+    # Indices used at each clipping step are the same for all spectra in the block. The first
+    #   'iter_num' steps are using the full window, then the window is gradually decreased.
+    index = np.arange(n_pts)
+    v_xmin, v_xmax = max(xmin, 0), min(xmax, n_pts - 1)
+    widths = [window_p] * int(iter_num)
+    current_width = window_p
+    while np.amax(current_width) >= width_threshold:
+        widths.append(current_width)
+        current_width = current_width / decrease_factor
+    n_steps = len(widths)
+    lo_indices = np.zeros(shape=(n_steps, n_pts), dtype=np.int64)
+    hi_indices = np.zeros(shape=(n_steps, n_pts), dtype=np.int64)
+    for n, w in enumerate(widths):
+        lo_indices[n, :] = np.clip(index - w, v_xmin, v_xmax).astype(np.int32)
+        hi_indices[n, :] = np.clip(index + w, v_xmin, v_xmax).astype(np.int32)
+
+    background = _snip_block_numba(spectra, int(con_val), lo_indices, hi_indices)
+
+    return np.reshape(background, data.shape)
+
+
+@jit(nopython=True, nogil=True, cache=True)
+def _snip_block_numba(spectra, con_val, lo_indices, hi_indices):
+    """
+    Compiled part of `snip_method_block`: smoothing, LLS transform, clipping and
+    inverse transform for each spectrum in the 2D array `spectra` of shape `(n_spectra, ne)`.
+    The clipping indices `lo_indices` and `hi_indices` (shape `(n_steps, ne)`) are precomputed.
+    """
+    n_spectra, n_pts = spectra.shape
+    n_steps = lo_indices.shape[0]
+    n_beg = (con_val - 1) // 2
+
+    background = np.empty_like(spectra)
+    bg = np.empty(n_pts, dtype=np.float64)
+    temp = np.empty(n_pts, dtype=np.float64)
+
+    for ns in range(n_spectra):
+        spectrum = spectra[ns, :]
+
+        # Smoothing (boxcar convolution, same as in 'snip_method_numba') and LLS transform
+        for n in range(n_pts):
+            v = 0.0
+            for k in range(max(n - n_beg, 0), min(n - n_beg + con_val, n_pts)):
+                v += spectrum[k]
+            bg[n] = np.log(np.log(v / con_val + 1) + 1)
+
+        # Clipping
+        for j in range(n_steps):
+            for n in range(n_pts):
+                temp[n] = (bg[lo_indices[j, n]] + bg[hi_indices[j, n]]) / 2.0
+            for n in range(n_pts):
+                if bg[n] > temp[n]:
+                    bg[n] = temp[n]
+
+        for n in range(n_pts):
+            v = np.exp(np.exp(bg[n]) - 1) - 1
+            background[ns, n] = v if np.isfinite(v) else 0.0
+
+    return background
@@ -0,0 +1,292 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+import dask
+import dask.array as da
+import h5py
+import numpy as np
+
+from .. import __version__ as pyxrf_version
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Content-addressed on-disk cache for the results of processing of XRF maps (fitted maps,
+    ROI maps). Each entry is a set of named numpy arrays saved as ``.npz`` file with the name
+    generated from the key. The key is a hash of all the inputs that determine the result
+    (see `compute_cache_key`), so the entries never need to be invalidated: changing raw data,
+    processing parameters or PyXRF version changes the key. The total size of the cache
+    is bounded: the least recently used entries are deleted once the size exceeds `max_size`.
+
+    The entries are written to temporary files and then atomically renamed, so the same
+    cache directory may be shared by multiple processes.
+
+    Parameters
+    ----------
+    cache_dir: str
+        path to the cache directory. The directory is created if it does not exist.
+    max_size: int
+        maximum total size of the cache entries, bytes
+
+    Examples
+    --------
+    .. code-block:: python
+
+        cache = ResultCache("~/.pyxrf/cache", max_size=10 * 1024**3)
+        pyxrf_batch(1000, 1100, param_file_name="param.json", result_cache=cache)
+    """
+
+    def __init__(self, cache_dir, *, max_size=4 * 1024**3):
+        if not isinstance(max_size, (int, np.integer)) or (max_size <= 0):
+            raise ValueError(f"Parameter 'max_size' must be a positive integer: max_size = {max_size!r}")
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_size = int(max_size)
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def _list_entries(self):
+        entries = []
+        for fln in os.listdir(self.cache_dir):
+            if fln.endswith(".npz"):
+                try:
+                    st = os.stat(os.path.join(self.cache_dir, fln))
+                    entries.append((st.st_mtime, st.st_size, fln))
+                except FileNotFoundError:
+                    pass  # The file was deleted by another process
+        return entries
+
+    def get(self, key):
+        """
+        Load the cache entry.
+
+        Parameters
+        ----------
+        key: str
+            the key of the entry (see `compute_cache_key`)
+
+        Returns
+        -------
+        dict(ndarray) or None
+            dictionary of arrays or None if the entry is not found
+        """
+        fpath = self._entry_path(key)
+        try:
+            with np.load(fpath, allow_pickle=False) as f:
+                arrays = {k: f[k] for k in f.files}
+        except FileNotFoundError:
+            return None
+        except Exception as ex:
+            logger.warning(f"Failed to load the cache entry '{fpath}': {ex}. The entry is deleted.")
+            self._remove(fpath)
+            return None
+
+        # The time of the last access is used for LRU eviction
+        try:
+            os.utime(fpath)
+        except OSError:
+            pass
+        logger.debug(f"Result cache: entry '{key}' is loaded.")
+        return arrays
+
+    def put(self, key, arrays):
+        """
+        Save the cache entry. The existing entry with the same key is replaced. The least
+        recently used entries are deleted if the size of the cache exceeds the limit.
+
+        Parameters
+        ----------
+        key: str
+            the key of the entry (see `compute_cache_key`)
+        arrays: dict(ndarray)
+            dictionary of arrays. The keys must be strings.
+        """
+        fd, fpath_tmp = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(fpath_tmp, self._entry_path(key))
+        except Exception:
+            self._remove(fpath_tmp)
+            raise
+        logger.debug(f"Result cache: entry '{key}' is saved.")
+        self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the total size of the cache
+        does not exceed the limit.
+        """
+        with self._lock:
+            entries = sorted(self._list_entries())
+            total_size = sum([_[1] for _ in entries])
+            for _, size, fln in entries:
+                if total_size <= self.max_size:
+                    break
+                self._remove(os.path.join(self.cache_dir, fln))
+                total_size -= size
+                logger.debug(f"Result cache: entry '{fln}' is evicted.")
+
+    def clear(self):
+        """
+        Delete all entries from the cache.
+        """
+        with self._lock:
+            for _, _, fln in self._list_entries():
+                self._remove(os.path.join(self.cache_dir, fln))
+
+    @property
+    def size(self):
+        """Total size of the cache entries, bytes"""
+        return sum([_[1] for _ in self._list_entries()])
+
+    def __len__(self):
+        return len(self._list_entries())
+
+    @staticmethod
+    def _remove(fpath):
+        try:
+            os.remove(fpath)
+        except FileNotFoundError:
+            pass
+
+
+def _data_identity(data):
+    """
+    Returns the object that identifies the raw dataset: file path, dataset name and the identity
+    of the dataset for the datasets in HDF5 files (see `_hdf5_dataset_identity`), name of Dask array
+    (Dask names are computed from the contents of the array) or checksum of numpy array.
+    """
+    # Circular import
+    from .map_processing import RawHDF5Dataset
+
+    if isinstance(data, RawHDF5Dataset):
+        identity = _hdf5_dataset_identity(data.abs_path, data.dset_name)
+        return ("hdf5", data.abs_path, data.dset_name, tuple(data.shape), identity)
+    elif isinstance(data, da.core.Array):
+        return ("dask", data.name, tuple(data.shape), str(data.dtype))
+    elif isinstance(data, np.ndarray):
+        return ("ndarray", _array_checksum(data), tuple(data.shape), str(data.dtype))
+    else:
+        raise TypeError(f"The identity of the object of type {type(data)} can not be established")
+
+
+def _hdf5_dataset_identity(fpath, dset_name):
+    """
+    Compute the identity of HDF5 dataset without reading the data. Processing results are typically
+    saved to the same file as the raw data, so the modification time of the file can not be used
+    to identify the raw data. The identity is the hash of the shape, type and filters of
+    the dataset, the location and size of each chunk (or of contiguous data) in the file and
+    the ID of raw data (attribute ``raw_data_id``, which is assigned when the raw data is saved,
+    see `save_data_to_hdf5`). Modification of the data in place (without changing the size of
+    the chunks) is detected only if the ID is changed.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    with h5py.File(fpath, "r") as f:
+        dset = f[dset_name]
+        raw_data_id = dset.attrs.get("raw_data_id", None)
+        h.update(
+            f"{dset.shape}:{dset.dtype}:{dset.chunks}:{dset.compression}:{dset.compression_opts}:"
+            f"{dset.shuffle}:{dset.scaleoffset}:{dset.fletcher32}:{raw_data_id};".encode()
+        )
+        if dset.chunks:
+            for n in range(dset.id.get_num_chunks()):
+                info = dset.id.get_chunk_info(n)
+                h.update(f"{info.chunk_offset}:{info.byte_offset}:{info.size}:{info.filter_mask};".encode())
+        else:
+            h.update(f"{dset.id.get_offset()}:{dset.id.get_storage_size()};".encode())
+    return h.hexdigest()
+
+
+def _array_checksum(data):
+    """Compute checksum of numpy array without creating a contiguous copy of the whole array."""
+    h = hashlib.blake2b(digest_size=20)
+    data = data.reshape(data.shape[0], -1) if data.ndim > 1 else data.reshape(1, -1)
+    for row in data:
+        h.update(np.ascontiguousarray(row).data)
+    return h.hexdigest()
+
+
+def _hash_update(h, obj):
+    """Update the hash `h` with the representation of the object `obj`."""
+    if isinstance(obj, dict):
+        h.update(b"{")
+        for k in sorted(obj, key=str):
+            _hash_update(h, k)
+            _hash_update(h, obj[k])
+        h.update(b"}")
+    elif isinstance(obj, (list, tuple)):
+        h.update(b"[")
+        for v in obj:
+            _hash_update(h, v)
+        h.update(b"]")
+    elif isinstance(obj, np.ndarray):
+        h.update(f"ndarray:{obj.dtype}:{obj.shape}:{_array_checksum(obj)};".encode())
+    else:
+        h.update(f"{type(obj).__name__}:{obj!r};".encode())
+
+
+def compute_cache_key(*, data, **components):
+    """
+    Compute the key of the cache entry. The key is the hash of the identity of the raw dataset
+    ``data`` (see `ResultCache`), all parameters of processing passed as ``components`` and
+    PyXRF version.
+
+    Parameters
+    ----------
+    data: ndarray, dask.array or RawHDF5Dataset
+        raw data
+    components: dict
+        parameters of processing. The values may be numbers, strings, numpy arrays or lists,
+        tuples and dictionaries of those.
+
+    Returns
+    -------
+    str
+        the key
+    """
+    h = hashlib.blake2b(digest_size=20)
+    _hash_update(h, {"version": pyxrf_version, "data": _data_identity(data), "components": components})
+    return h.hexdigest()
+
+
+def get_result_cache(result_cache=None):
+    """
+    Returns the result cache object. The cache may be specified as ``ResultCache`` object,
+    the path to the cache directory or None. If ``result_cache`` is None, then the cache
+    is configured using Dask configuration values ``pyxrf.result-cache.directory`` and
+    ``pyxrf.result-cache.max-size`` (bytes), e.g.
+    ``dask.config.set({"pyxrf.result-cache.directory": "~/.pyxrf/cache"})``, and the caching
+    is disabled if the directory is not set.
+
+    Returns
+    -------
+    ResultCache or None
+        the cache object or None if caching is disabled
+    """
+    if isinstance(result_cache, ResultCache):
+        return result_cache
+
+    kwargs = {}
+    max_size = dask.config.get("pyxrf.result-cache.max-size", None)
+    if max_size:
+        kwargs["max_size"] = int(max_size)
+
+    if result_cache is None:
+        result_cache = dask.config.get("pyxrf.result-cache.directory", None)
+        if not result_cache:
+            return None
+    if isinstance(result_cache, str):
+        return ResultCache(result_cache, **kwargs)
+
+    raise TypeError(
+        f"Parameter 'result_cache' must be ResultCache object, path to the cache directory or None: "
+        f"result_cache = {result_cache!r}"
+    )
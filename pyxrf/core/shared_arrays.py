@@ -0,0 +1,276 @@
+import atexit
+import logging
+import os
+import shutil
+import sys
+import threading
+import uuid
+import weakref
+from multiprocessing import shared_memory
+
+import dask
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Arrays smaller than this are sent to the workers faster than they are copied to shared memory
+_shared_array_size_min = 16 * 1024**2
+
+
+class _SegmentArrayInterface:
+    """
+    Exposes the memory of shared memory segment to numpy (``np.asarray(obj)``). The arrays created
+    from the object and all views of the arrays reference the object, which holds the reference to
+    the ``SharedMemory`` object, so the segment remains mapped as long as any of the arrays exist.
+    The buffer of the segment is not exported to the arrays, so the segment is closed (unmapped)
+    by ``SharedMemory`` once it is no longer referenced.
+
+    Parameters
+    ----------
+    shm: multiprocessing.shared_memory.SharedMemory
+        the shared memory segment
+    shape, dtype, offset, strides
+        parameters of the array (see ``numpy.ndarray``)
+    readonly: bool
+        True - the arrays are read-only
+    """
+
+    def __init__(self, shm, shape, dtype, *, offset=0, strides=None, readonly=False):
+        self._shm = shm
+        # The temporary array validates the parameters and finds the address of the first element
+        data = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset, strides=strides)
+        interface = dict(data.__array_interface__)
+        interface["data"] = (interface["data"][0], readonly)
+        self.__array_interface__ = interface
+
+
+def _segment_array(shm, shape, dtype, *, offset=0, strides=None, readonly=False):
+    """Create numpy array in the shared memory segment ``shm`` (see `_SegmentArrayInterface`)."""
+    return np.asarray(_SegmentArrayInterface(shm, shape, dtype, offset=offset, strides=strides, readonly=readonly))
+
+
+# Arrays registered by this process: name -> SharedArray. The registry does not keep the objects alive.
+_shared_arrays = weakref.WeakValueDictionary()
+_shared_arrays_lock = threading.Lock()
+
+
+class SharedArray:
+    """
+    Numpy array that may be placed in a shared memory segment (``multiprocessing.shared_memory``).
+    The array is registered when the object is created, but copied to the segment only
+    once it is requested (`allocate()`), e.g. when the blocks of the array are processed by
+    the workers of a local process cluster (see `find_shared_array`). The workers attach
+    the segment by name and read the blocks of the array directly from shared memory, so
+    the array is not serialized and sent to each worker process. The array is copied once,
+    so it should not be modified after the segment is allocated.
+
+    The object is expected to be kept by the owner of the array (e.g. the object that holds
+    the loaded raw data). The segment is released (unlinked) when the object is deleted
+    or `release()` is called.
+
+    Parameters
+    ----------
+    data: ndarray
+        C-contiguous array, the object keeps the reference to the array
+    """
+
+    def __init__(self, data):
+        if not isinstance(data, np.ndarray) or not data.flags.c_contiguous:
+            raise ValueError("The array placed in shared memory must be C-contiguous numpy array")
+        self.data = data
+        self.name = f"pyxrf_{uuid.uuid4().hex[:16]}"
+        self._shm = None
+        self._released = False
+        self._allocation_failed = False
+        self._lock = threading.Lock()
+        with _shared_arrays_lock:
+            _shared_arrays[self.name] = self
+
+    @property
+    def is_allocated(self):
+        return self._shm is not None
+
+    @property
+    def is_released(self):
+        return self._released
+
+    def allocate(self):
+        """
+        Copy the array to the shared memory segment. The call has no effect if the segment is
+        already allocated. The array is not placed in shared memory if there is not enough free space.
+
+        Returns
+        -------
+        bool
+            True if the array is in shared memory
+        """
+        with self._lock:
+            if self._shm is not None:
+                return True
+            if self._released or self._allocation_failed:
+                return False
+            # Writing beyond the size of '/dev/shm' crashes the process instead of raising an exception
+            nbytes = self.data.nbytes
+            if os.path.isdir("/dev/shm") and shutil.disk_usage("/dev/shm").free < nbytes:
+                logger.warning(f"Not enough shared memory for the array of {nbytes} bytes")
+                self._allocation_failed = True
+                return False
+            try:
+                shm = shared_memory.SharedMemory(name=self.name, create=True, size=max(nbytes, 1))
+            except OSError as ex:
+                logger.warning(f"Failed to create shared memory segment: {ex}")
+                self._allocation_failed = True
+                return False
+            _segment_array(shm, self.data.shape, self.data.dtype)[...] = self.data
+            self._shm = shm
+        logger.debug(f"Array of shape {self.data.shape} ({nbytes} bytes) is placed in shared memory '{self.name}'")
+        return True
+
+    def release(self):
+        """
+        Release the shared memory segment. The call has no effect if the object is already released.
+        """
+        lock = getattr(self, "_lock", None)
+        if lock is None:
+            return  # The object was not initialized
+        with _shared_arrays_lock:
+            _shared_arrays.pop(self.name, None)
+        with lock:
+            shm, self._shm, self._released = self._shm, None, True
+        if shm is None:
+            return
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+        logger.debug(f"Shared memory '{self.name}' is released")
+
+    def __del__(self):
+        self.release()
+
+
+def create_shared_array(data):
+    """
+    Register numpy array for placing in shared memory if it is useful and possible. Shared memory
+    is used if enabled in Dask configuration (``pyxrf.shared-memory``, default True) and
+    the array is large (at least 16 MB) and C-contiguous. The array is not copied by this function
+    (see `SharedArray`).
+
+    Parameters
+    ----------
+    data: ndarray
+        the array
+
+    Returns
+    -------
+    SharedArray or None
+        the object that registers the array or None if the array can not be placed in shared memory.
+    """
+    if not isinstance(data, np.ndarray) or not dask.config.get("pyxrf.shared-memory", True):
+        return None
+    if (data.nbytes < _shared_array_size_min) or not data.flags.c_contiguous:
+        return None
+    return SharedArray(data)
+
+
+def _array_bounds(data):
+    """Returns the range of addresses `(low, high)` occupied by the elements of the array."""
+    low = high = data.__array_interface__["data"][0]
+    for n, stride in zip(data.shape, data.strides):
+        if n == 0:
+            return low, low
+        low, high = low + min((n - 1) * stride, 0), high + max((n - 1) * stride, 0)
+    return low, high + data.itemsize
+
+
+def find_shared_array(data, *, allocate=False):
+    """
+    Find the registered array (see `SharedArray`) that contains the numpy array `data`. The array
+    may be ``SharedArray.data`` or any view of it.
+
+    Parameters
+    ----------
+    data: ndarray
+        the array
+    allocate: bool
+        True - copy the registered array to shared memory if it is not yet allocated (see
+        `SharedArray.allocate()`), False - only the arrays that are already in shared memory are found.
+
+    Returns
+    -------
+    tuple or None
+        descriptor of the array ``(name, offset, shape, strides, dtype)`` that allows to
+        reconstruct the array in other processes (see `load_shared_block`) or None if the array
+        is not in a shared memory segment.
+    """
+    if not isinstance(data, np.ndarray) or not data.size:
+        return None
+    low, high = _array_bounds(data)
+    with _shared_arrays_lock:
+        shared_arrays = list(_shared_arrays.values())
+    for sa in shared_arrays:
+        base = sa.data.__array_interface__["data"][0]
+        if not (base <= low and high <= base + sa.data.nbytes):
+            continue
+        if not sa.is_allocated and not (allocate and sa.allocate()):
+            return None
+        if sa.is_released:
+            return None
+        offset = data.__array_interface__["data"][0] - base
+        return (sa.name, offset, data.shape, data.strides, data.dtype.str)
+    return None
+
+
+# Segments attached by this (worker) process: name -> SharedMemory
+_attached_segments = {}
+_attached_segments_lock = threading.Lock()
+
+
+def _attach_segment(name):
+    with _attached_segments_lock:
+        shm = _attached_segments.get(name, None)
+        if shm is None:
+            # Older versions of Python register attached segments with the resource tracker.
+            #   Local workers share the tracker with the process that owns the segment, so
+            #   the segment is still unlinked only once.
+            kwargs = {"track": False} if sys.version_info >= (3, 13) else {}
+            shm = shared_memory.SharedMemory(name=name, **kwargs)
+            _attached_segments[name] = shm
+        return shm
+
+
+def load_shared_block(descriptor, index):
+    """
+    Returns the block of the array in shared memory. The function is executed by the workers.
+    The returned block is a read-only view of the shared memory (the data is not copied), so
+    the workers can not modify the original array.
+
+    Parameters
+    ----------
+    descriptor: tuple
+        descriptor of the array (see `find_shared_array`)
+    index: tuple(slice)
+        selection of the block
+    """
+    name, offset, shape, strides, dtype = descriptor
+    shm = _attach_segment(name)
+    data = _segment_array(shm, shape, np.dtype(dtype), offset=offset, strides=strides, readonly=True)
+    return data[index]
+
+
+def detach_shared_segments():
+    """
+    Detach the shared memory segments attached by the process (worker). The memory is unmapped
+    once the blocks of the arrays are deleted.
+    """
+    with _attached_segments_lock:
+        _attached_segments.clear()
+
+
+@atexit.register
+def _release_shared_arrays():
+    with _shared_arrays_lock:
+        shared_arrays = list(_shared_arrays.values())
+    for sa in shared_arrays:
+        sa.release()
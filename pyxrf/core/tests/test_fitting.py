@@ -1,6 +1,7 @@
 import numpy as np
 import numpy.testing as npt
 import pytest
+from scipy.optimize import nnls
 
 from pyxrf.core.fitting import _fitting_admm, _fitting_nnls, fit_spectrum, rfactor_compute
 
@@ -246,6 +247,44 @@ def test_fitting_nnls(dataset_params):
     npt.assert_almost_equal(rfactor[0], rs, err_msg="Residual is computed incorrectly")
 
 
+@pytest.mark.parametrize("n_refs", [1, 5, 20])
+def test_fitting_nnls_compare_scipy(n_refs):
+    r"""
+    Compare the results of `_fitting_nnls` with the results produced by `scipy.optimize.nnls`
+    for the case when some of the weights are constrained to zero.
+    """
+    rng = np.random.default_rng(0)
+    n_pts, n_pixels = 200, 50
+
+    spectra = np.abs(rng.normal(size=(n_pts, n_refs)))
+    weights = rng.normal(size=(n_refs, n_pixels))  # Some weights are negative
+    data_input = np.matmul(spectra, weights) + rng.normal(size=(n_pts, n_pixels)) * 0.1
+
+    weights_estimated, rfactor, residual = _fitting_nnls(data_input, spectra)
+
+    for n in range(n_pixels):
+        w_expected, res_expected = nnls(spectra, data_input[:, n])
+        npt.assert_array_almost_equal(weights_estimated[:, n], w_expected, decimal=10)
+        npt.assert_almost_equal(residual[n], res_expected, decimal=10)
+        npt.assert_almost_equal(rfactor[n], rfactor_compute(data_input[:, n], w_expected, spectra))
+
+
+def test_fitting_nnls_dependent_refs():
+    r"""
+    `_fitting_nnls` must work if references are linearly dependent (singular Gram matrix)
+    """
+    fitting_data = DataForFittingTest(n_data_dimensions=(8,))
+
+    spectra = np.hstack([fitting_data.spectra, fitting_data.spectra[:, :1]])
+    data_input = fitting_data.data_input
+
+    weights_estimated, _, residual = _fitting_nnls(data_input, spectra)
+
+    assert np.all(weights_estimated >= 0)
+    npt.assert_array_almost_equal(np.matmul(spectra, weights_estimated), data_input)
+    npt.assert_array_almost_equal(residual, np.zeros(shape=residual.shape))
+
+
 # fmt: off
 @pytest.mark.parametrize("dataset_params", [
     {"n_data_dimensions": (8,)},
@@ -0,0 +1,244 @@
+import json
+import logging
+import os
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from pyxrf.core.instrumentation import JSONProgressSink, LogProgressSink, ProgressMonitor, QtSignalProgressSink
+from pyxrf.core.map_processing import compute_total_spectrum, fit_xrf_map, fit_xrf_maps
+from pyxrf.core.tests.test_map_processing import _FitXRFMapTesting
+
+_event_keys = {
+    "event",
+    "title",
+    "timestamp",
+    "elapsed",
+    "percent_completed",
+    "n_blocks",
+    "n_blocks_completed",
+    "n_pixels",
+    "n_pixels_completed",
+    "pixels_per_second",
+    "bytes_total",
+    "bytes_read",
+    "bytes_per_second",
+    "seconds_per_block",
+    "worker_memory",
+}
+
+
+def test_ProgressMonitor_1():
+    """Basic functionality of ``ProgressMonitor``"""
+    events = []
+    monitor = ProgressMonitor("Test", sinks=events.append, min_interval=0)
+    monitor.set_workload(n_blocks=10, n_pixels=1000, n_bytes=4000)
+
+    monitor.start()
+    for _ in range(5):
+        monitor.block_completed(n_pixels=100, n_bytes=400)
+    monitor(50)
+    monitor(30)  # Progress may not decrease
+    for _ in range(5):
+        monitor.block_completed(n_pixels=100, n_bytes=400)
+    monitor.finish()
+
+    assert [_["event"] for _ in events] == ["start", "progress", "progress", "finish"]
+    for ev in events:
+        assert set(ev.keys()) == _event_keys
+        assert ev["title"] == "Test"
+        assert ev["n_blocks"] == 10
+        assert ev["n_pixels"] == 1000
+        assert ev["bytes_total"] == 4000
+        # Memory of the local process
+        assert ev["worker_memory"] > 0
+        # Events must be serializable
+        json.dumps(ev)
+
+    assert events[0]["percent_completed"] == 0
+    assert events[0]["n_pixels_completed"] == 0
+    assert events[0]["seconds_per_block"] is None
+
+    assert events[1]["percent_completed"] == 50
+    assert events[1]["n_blocks_completed"] == 5
+    assert events[1]["n_pixels_completed"] == 500
+    assert events[1]["bytes_read"] == 2000
+    assert events[2]["percent_completed"] == 50
+
+    assert events[3]["percent_completed"] == 100
+    assert events[3]["n_blocks_completed"] == 10
+    assert events[3]["n_pixels_completed"] == 1000
+    assert events[3]["bytes_read"] == 4000
+    assert events[3]["elapsed"] >= events[1]["elapsed"]
+
+
+def test_ProgressMonitor_3():
+    """``ProgressMonitor``: the processed blocks are not estimated from percent of completion"""
+    events = []
+    monitor = ProgressMonitor("Test", sinks=events.append, min_interval=0)
+    monitor.set_workload(n_blocks=10, n_pixels=1000, n_bytes=4000)
+
+    monitor.start()
+    monitor(50)
+    monitor.finish()
+    assert [_["percent_completed"] for _ in events] == [0, 50, 100]
+    assert all([_["n_blocks_completed"] == _["n_pixels_completed"] == _["bytes_read"] == 0 for _ in events])
+    assert all([_["seconds_per_block"] is None for _ in events])
+
+    # The counts are reset when the monitor is started
+    monitor.block_completed(n_pixels=100, n_bytes=400)
+    monitor.start()
+    assert events[-1]["n_blocks_completed"] == 0
+
+
+def test_ProgressMonitor_2():
+    """``ProgressMonitor``: rate limiting of the progress events and failing sinks"""
+
+    def _failing_sink(event):
+        raise RuntimeError("Sink failed")
+
+    events = []
+    monitor = ProgressMonitor("Test", sinks=[_failing_sink, events.append], min_interval=1000)
+
+    monitor.start()
+    for n in range(100):
+        monitor(n)
+    monitor.finish()
+
+    # Progress events are not generated, because the interval since 'start' event is too short
+    assert [_["event"] for _ in events] == ["start", "finish"]
+
+
+def test_JSONProgressSink(tmpdir):
+    fln = os.path.join(tmpdir, "progress.jsonl")
+    monitor = ProgressMonitor("Test", sinks=JSONProgressSink(fln), min_interval=0)
+    monitor.start()
+    monitor(50)
+    monitor.finish()
+
+    with open(fln, "r") as f:
+        events = [json.loads(_) for _ in f.readlines()]
+    assert [_["event"] for _ in events] == ["start", "progress", "finish"]
+    assert all([set(_.keys()) == _event_keys for _ in events])
+
+
+def test_LogProgressSink(caplog):
+    caplog.set_level(logging.INFO)
+    monitor = ProgressMonitor("Test monitor", sinks=LogProgressSink(interval=1000), min_interval=0)
+    monitor.start()
+    monitor(30)  # Skipped by the sink
+    monitor.finish()
+
+    records = [_.getMessage() for _ in caplog.records if _.getMessage().startswith("Test monitor")]
+    assert len(records) == 2
+    assert "start" in records[0]
+    assert "finish" in records[1]
+    assert "100.0%" in records[1]
+
+
+def test_QtSignalProgressSink():
+    class _Signal:
+        def __init__(self):
+            self.emitted = []
+
+        def emit(self, value):
+            self.emitted.append(value)
+
+    signal = _Signal()
+    monitor = ProgressMonitor("Test", sinks=QtSignalProgressSink(signal), min_interval=0)
+    monitor.start()
+    monitor(50)
+    monitor.finish()
+
+    assert [_["event"] for _ in signal.emitted] == ["start", "progress", "finish"]
+    assert all([set(_.keys()) == _event_keys for _ in signal.emitted])
+
+
+@pytest.mark.parametrize("backend", ["threads", "distributed"])
+def test_ProgressMonitor_fit_xrf_map(backend):
+    """``ProgressMonitor`` receives information on the workload from ``fit_xrf_map``"""
+    ft = _FitXRFMapTesting(
+        dataset_params={"n_data_dimensions": (20, 20)}, use_snip=False, add_pts_before=15, add_pts_after=10
+    )
+
+    events = []
+    monitor = ProgressMonitor("NNLS fitting", sinks=events.append, min_interval=0)
+    data_out = fit_xrf_map(
+        ft.data_input,
+        data_sel_indices=ft.data_sel_indices,
+        matv=ft.spectra,
+        snip_param=ft.snip_param,
+        use_snip=False,
+        chunk_pixels=100,
+        n_chunks_min=4,
+        progress_bar=monitor,
+        backend=backend,
+    )
+    ft.verify_fit_output(data_out=data_out, snip_param=ft.snip_param)
+
+    assert events[0]["event"] == "start"
+    assert events[-1]["event"] == "finish"
+    ev = events[-1]
+    assert ev["n_pixels"] == ev["n_pixels_completed"] == 400
+    assert ev["n_blocks"] == ev["n_blocks_completed"] == 4
+    assert ev["bytes_total"] == ev["bytes_read"] == ft.data_input.nbytes
+    npt.assert_almost_equal(ev["percent_completed"], 100)
+
+
+@pytest.mark.parametrize("backend", ["threads", "distributed"])
+def test_ProgressMonitor_compute_total_spectrum(backend):
+    """
+    ``ProgressMonitor``: the total spectrum (reduction of the map to one spectrum) is reported block by block
+    """
+    data = np.random.rand(20, 20, 50)
+
+    events = []
+    monitor = ProgressMonitor("Total spectrum", sinks=events.append, min_interval=0)
+    spectrum = compute_total_spectrum(data, chunk_pixels=50, n_chunks_min=8, progress_bar=monitor, backend=backend)
+    npt.assert_array_almost_equal(spectrum, data.sum(axis=(0, 1)))
+
+    assert events[-1]["event"] == "finish"
+    ev = events[-1]
+    assert ev["n_blocks"] == ev["n_blocks_completed"] >= 8
+    assert ev["n_pixels"] == ev["n_pixels_completed"] == 400
+    assert ev["bytes_total"] == ev["bytes_read"] == data.nbytes
+
+    # Progress increases gradually as the blocks are processed
+    progress = [_ for _ in events if _["event"] == "progress"]
+    n_blocks_completed = [_["n_blocks_completed"] for _ in progress]
+    assert n_blocks_completed == sorted(n_blocks_completed)
+    assert len(set(n_blocks_completed)) > 2
+    assert len([_ for _ in progress if 1 < _["percent_completed"] < 100]) > 2
+
+
+@pytest.mark.parametrize("backend", ["threads", "distributed"])
+def test_ProgressMonitor_fit_xrf_maps_blocks(backend):
+    """
+    ``ProgressMonitor``: the blocks consumed during block by block fitting of multiple maps
+    are counted once per block of input data
+    """
+    ft = _FitXRFMapTesting(
+        dataset_params={"n_data_dimensions": (20, 20)}, use_snip=False, add_pts_before=15, add_pts_after=10
+    )
+    datasets = [
+        {"data": ft.data_input, "data_sel_indices": ft.data_sel_indices, "matv": ft.spectra, "snip_param": {}}
+    ] * 2
+
+    events = []
+    monitor = ProgressMonitor("NNLS fitting", sinks=events.append, min_interval=0)
+    fit_xrf_maps(
+        datasets,
+        use_snip=False,
+        chunk_pixels=100,
+        n_chunks_min=4,
+        progress_bar=monitor,
+        backend=backend,
+        pixel_bin=2,
+        consume_block=[lambda block, block_slice: None] * 2,
+    )
+
+    ev = events[-1]
+    assert ev["n_blocks"] == ev["n_blocks_completed"] >= 8
+    assert ev["n_pixels"] == ev["n_pixels_completed"] == 800
+    assert ev["bytes_total"] == ev["bytes_read"] == 2 * ft.data_input.nbytes
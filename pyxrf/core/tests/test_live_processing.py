@@ -0,0 +1,124 @@
+import os
+import threading
+
+import h5py
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from pyxrf.core.live_processing import ArrayRowSource, HDF5RowSource, LiveMapProcessor
+from pyxrf.core.map_processing import fit_xrf_map
+
+_snip_param = {"e_offset": 0, "e_linear": 0.01, "e_quadratic": 0, "b_width": 0.5}
+
+
+def _create_xrf_map(ny=7, nx=5, ne=60):
+    return np.random.rand(ny, nx, ne) + 1, np.random.rand(40, 3)
+
+
+@pytest.mark.parametrize("use_snip", [False, True])
+def test_LiveMapProcessor_1(use_snip):
+    """
+    ``LiveMapProcessor``: the rows are processed incrementally, the results are identical
+    to the results of processing of the complete map
+    """
+    data, matv = _create_xrf_map()
+    fit_kwargs = dict(data_sel_indices=(10, 50), matv=matv, snip_param=_snip_param, use_snip=use_snip)
+
+    blocks = []
+    source = ArrayRowSource(data)
+    processor = LiveMapProcessor(
+        source, **fit_kwargs, n_rows_in_batch=2, consume_block=lambda b, s: blocks.append((b, s))
+    )
+    assert processor.update() == (0, 0)
+    assert not processor.is_complete
+
+    source.set_rows_completed(3)
+    assert processor.update() == (0, 3)
+    npt.assert_array_almost_equal(processor.total_spectrum, np.sum(data[:3], axis=(0, 1)))
+    npt.assert_array_almost_equal(processor.total_count[:3], np.sum(data[:3], axis=2))
+    npt.assert_array_equal(processor.total_count[3:], 0)
+    npt.assert_array_equal(processor.fit_results[3:], 0)
+    assert [_[1][0] for _ in blocks] == [slice(0, 2), slice(2, 3)]
+
+    # Only new rows are processed
+    source.set_rows_completed(7)
+    assert processor.update() == (3, 7)
+    assert processor.is_complete
+    assert [_[1][0] for _ in blocks] == [slice(0, 2), slice(2, 3), slice(3, 5), slice(5, 7)]
+
+    npt.assert_array_almost_equal(processor.total_spectrum, np.sum(data, axis=(0, 1)))
+    npt.assert_array_almost_equal(processor.total_count, np.sum(data, axis=2))
+    npt.assert_array_almost_equal(processor.fit_results, fit_xrf_map(data, **fit_kwargs))
+
+
+def test_LiveMapProcessor_2():
+    """
+    ``LiveMapProcessor``: total spectrum and count map are computed without fitting,
+    invalid parameters are rejected
+    """
+    data, matv = _create_xrf_map()
+    processor = LiveMapProcessor(ArrayRowSource(data, n_rows_completed=7))
+    assert processor.update() == (0, 7)
+    assert processor.fit_results is None
+    npt.assert_array_almost_equal(processor.total_count, np.sum(data, axis=2))
+
+    with pytest.raises(ValueError, match="Parameter 'n_rows_in_batch' must be a positive integer"):
+        LiveMapProcessor(ArrayRowSource(data), n_rows_in_batch=0)
+    with pytest.raises(ValueError, match="are outside the allowed range"):
+        LiveMapProcessor(ArrayRowSource(data), data_sel_indices=(30, 70), matv=matv, use_snip=False)
+
+
+def test_LiveMapProcessor_follow_hdf5(tmp_path):
+    """
+    ``LiveMapProcessor``: follow the HDF5 file written row by row in SWMR mode
+    """
+    data, matv = _create_xrf_map()
+    ny, nx, ne = data.shape
+    fit_kwargs = dict(data_sel_indices=(10, 50), matv=matv, snip_param=_snip_param)
+    fpath = os.path.join(tmp_path, "scan2D.h5")
+
+    with h5py.File(fpath, "w", libver="latest") as f:
+        dset = f.create_dataset("xrfmap/detsum/counts", (0, nx, ne), maxshape=(None, nx, ne), dtype=np.float64)
+        f.swmr_mode = True
+
+        def write_rows(n_end):
+            dset.resize(n_end, axis=0)
+            dset[:n_end] = data[:n_end]
+            dset.flush()
+
+        write_rows(2)
+        with HDF5RowSource(fpath, n_rows=ny) as source:
+            assert source.map_shape == data.shape
+            processor = LiveMapProcessor(source, **fit_kwargs)
+
+            # New rows are written by the callback to keep the test deterministic
+            updates = []
+
+            def callback(p, n_start, n_end):
+                updates.append((n_start, n_end))
+                if n_end < ny:
+                    write_rows(min(n_end + 3, ny))
+
+            assert processor.follow(callback=callback, poll_interval=0.01, idle_timeout=10)
+
+    assert updates == [(0, 2), (2, 5), (5, 7)]
+    npt.assert_array_almost_equal(processor.total_count, np.sum(data, axis=2))
+    npt.assert_array_almost_equal(processor.fit_results, fit_xrf_map(data, **fit_kwargs))
+
+
+def test_LiveMapProcessor_follow_stop():
+    """
+    ``LiveMapProcessor.follow``: following is stopped by the event or idle timeout
+    """
+    data, _ = _create_xrf_map()
+    source = ArrayRowSource(data, n_rows_completed=2)
+    processor = LiveMapProcessor(source)
+    assert processor.follow(poll_interval=0.01, idle_timeout=0.1) is False
+    assert processor.n_rows_processed == 2
+
+    stop_event = threading.Event()
+    stop_event.set()
+    source.set_rows_completed(4)
+    assert processor.follow(poll_interval=0.01, stop_event=stop_event) is False
+    assert processor.n_rows_processed == 4
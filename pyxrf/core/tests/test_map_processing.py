@@ -1,7 +1,10 @@
 import logging
 import os
+import threading
+import time as ttime
 import uuid
 
+import dask
 import dask.array as da
 import h5py
 import numpy as np
@@ -9,25 +12,45 @@ import numpy.testing as npt
 import pytest
 from skbeam.core.fitting.background import snip_method
 
+from pyxrf.core import map_processing
 from pyxrf.core.fitting import fit_spectrum
 from pyxrf.core.map_processing import (
+    ComputationCancelledError,
+    DaskClientManager,
     RawHDF5Dataset,
     TerminalProgressBar,
     _array_numpy_to_dask,
+    _auto_chunk_pixels,
+    _bin_energy_calibration,
+    _bin_fitting_model,
     _chunk_numpy_array,
     _compute_optimal_chunk_size,
     _compute_roi,
+    _DaskExecutor,
+    _energy_to_bin_position,
     _fit_xrf_block,
+    _pixel_chunk_cache,
     _prepare_xrf_mask,
+    _read_hdf5_block,
+    _sum_roi_bands,
+    bin_xrf_map,
+    compute_map_products,
     compute_selected_rois,
     compute_total_spectrum,
     compute_total_spectrum_and_count,
     dask_client_create,
+    dask_client_manager,
     fit_xrf_map,
+    fit_xrf_map_sweep,
+    fit_xrf_maps,
+    get_pixel_spectra,
     prepare_xrf_map,
+    select_execution_backend,
+    snip_method_block,
     snip_method_numba,
     wait_and_display_progress,
 )
+from pyxrf.core.shared_arrays import SharedArray
 from pyxrf.core.tests.test_fitting import DataForFittingTest
 
 logger = logging.getLogger(__name__)
@@ -64,6 +87,65 @@ def test_dask_client_create(tmpdir):
     assert not os.path.exists(dask_worker_space_path), "Temporary directory was created in the current directory"
 
 
+def test_DaskClientManager():
+    """Basic functionality of `DaskClientManager`: shared client and idle shutdown"""
+    manager = DaskClientManager(idle_timeout=1, client_kwargs={"processes": False})
+    assert not manager.is_running
+
+    client1 = manager.acquire()
+    client2 = manager.acquire()
+    assert client1 is client2, "The same client is expected to be returned to all users"
+    assert manager.is_running
+
+    manager.release()
+    ttime.sleep(1.5)
+    assert manager.is_running, "The client was closed while it is still used"
+
+    manager.release()
+    ttime.sleep(1.5)
+    assert not manager.is_running, "The idle client was not closed"
+    assert client1.status != "running"
+
+    # The new client is created if needed
+    client3 = manager.acquire()
+    assert client3 is not client1
+    assert client3.status == "running"
+    manager.release()
+    manager.shutdown()
+    assert not manager.is_running
+
+
+def test_DaskClientManager_stale_timer():
+    """The idle timer that fired after it was replaced by a new timer does not close the client"""
+    manager = DaskClientManager(idle_timeout=100, client_kwargs={"processes": False})
+    manager.acquire()
+    manager.release()
+    stale_timer = manager._idle_timer
+
+    # The client is acquired and released while the stale timer waits for the lock
+    manager.acquire()
+    manager.release()
+    manager._close_if_idle(stale_timer)
+    assert manager.is_running, "The client was closed by the stale timer"
+    assert manager._idle_timer is not None, "The new timer was dropped"
+
+    manager._close_if_idle(manager._idle_timer)
+    assert not manager.is_running
+    manager.shutdown()
+
+
+def test_DaskClientManager_prewarm():
+    """Start the client in the background"""
+    manager = DaskClientManager(idle_timeout=None, client_kwargs={"processes": False})
+    manager.prewarm()
+    client = manager.acquire()  # Waits until the client is started
+    assert client.status == "running"
+    manager.release()
+    assert manager.is_running, "The client is expected to run until it is explicitly closed"
+    manager.shutdown()
+    assert not manager.is_running
+
+
 def test_TerminalProgressBar():
     """Basic functionality of `TerminalProgressBar`"""
 
@@ -143,6 +225,66 @@ def test_wait_and_display_progress(progress_bar, capsys):
         progress_bar._check_output(captured.out)
 
 
+# fmt: off
+@pytest.mark.parametrize("data_shape, backend, client, n_cores, backend_expected", [
+    ((10, 10, 4096), "auto", None, 8, "threads"),
+    ((1000, 1000, 4096), "auto", None, 8, "distributed"),
+    ((1000, 1000, 4096), "auto", None, 1, "threads"),
+    ((10, 10, 4096), "auto", "client", 8, "distributed"),
+    ((10, 10, 4096), "distributed", None, 8, "distributed"),
+    ((1000, 1000, 4096), "threads", "client", 8, "threads"),
+])
+# fmt: on
+def test_select_execution_backend(data_shape, backend, client, n_cores, backend_expected):
+    """Selection of execution backend"""
+    data = da.zeros(shape=data_shape, chunks=(10, 10, data_shape[2]))
+    backend_selected = select_execution_backend(data, backend=backend, client=client, n_cores=n_cores)
+    assert backend_selected == backend_expected
+
+
+def test_select_execution_backend_fail():
+    data = da.zeros(shape=(10, 10, 100))
+    with pytest.raises(ValueError, match="Execution backend 'processes' is not supported"):
+        select_execution_backend(data, backend="processes")
+
+
+@pytest.mark.parametrize("backend", ["threads", "distributed"])
+def test_DaskExecutor(backend, capsys):
+    """Basic test for `_DaskExecutor`: computations with progress bar"""
+    data = da.random.random(size=(100, 100), chunks=(10, 10))
+    sm_expected = np.sum(data.compute(), axis=0)
+
+    progress_bar = _SampleProgressBar("Monitoring progress")
+    with _DaskExecutor(backend=backend) as executor:
+        sm = executor.compute(da.sum(data, axis=0), progress_bar=progress_bar)
+        client = executor.client
+        assert (client is not None) == (backend == "distributed")
+
+    npt.assert_array_almost_equal(sm, sm_expected, err_msg="Computations are incorrect")
+    assert executor.client is None, "Dask client was not released"
+    if backend == "distributed":
+        # The shared client remains open
+        assert client is dask_client_manager.acquire()
+        dask_client_manager.release()
+
+    captured = capsys.readouterr()
+    progress_bar._check_output(captured.out)
+
+
+@pytest.mark.parametrize("backend", ["threads", "distributed"])
+def test_DaskExecutor_multiple_arrays(backend):
+    """`_DaskExecutor`: computing a tuple of Dask arrays as one graph"""
+    data = da.random.random(size=(100, 100), chunks=(10, 10))
+    data_np = data.compute()
+
+    with _DaskExecutor(backend=backend) as executor:
+        result = executor.compute((da.sum(data, axis=0), da.max(data, axis=1)), progress_bar=None)
+
+    assert isinstance(result, tuple) and len(result) == 2
+    npt.assert_array_almost_equal(result[0], np.sum(data_np, axis=0))
+    npt.assert_array_almost_equal(result[1], np.max(data_np, axis=1))
+
+
 def test_RawHDF5Dataset(tmpdir):
     """Class RawHDF5Dataset"""
     dir_list, fln, dset = ("dir1", "dir2"), "tmp.txt", "/some/dataset"
@@ -250,6 +392,72 @@ def test_chunk_numpy_array(chunk_target, data_shape):
     )
 
 
+@pytest.mark.parametrize("use_client", [False, True])
+def test_chunk_numpy_array_graph(use_client):
+    """
+    `_chunk_numpy_array`: the graph contains one entry per chunk. The chunks are views of
+    the original array or references to the data scattered to the workers.
+    """
+    data = np.random.random((20, 30, 5))
+    client = dask_client_create(n_workers=2) if use_client else None
+    try:
+        data_dask = _chunk_numpy_array(data, (5, 10), client=client)
+        graph = dict(data_dask.__dask_graph__())
+        assert len(graph) == data_dask.npartitions == 12
+
+        if use_client:
+            assert all([type(_).__name__ == "Future" for _ in graph.values()])
+            npt.assert_array_equal(client.compute(data_dask).result(), data)
+            npt.assert_array_equal(client.compute(data_dask.sum(axis=2)).result(), data.sum(axis=2))
+        else:
+            assert all([np.shares_memory(_, data) for _ in graph.values()])
+            npt.assert_array_equal(data_dask.compute(scheduler="threads"), data)
+    finally:
+        if client is not None:
+            client.close()
+
+
+def test_chunk_numpy_array_shared():
+    """
+    `_chunk_numpy_array`: the array registered for placing in shared memory is copied to shared
+    memory only if the workers of the local cluster run in separate processes. The chunks are
+    read by the workers directly from shared memory. The array is never sent to the workers.
+    """
+    data = np.random.random((20, 30, 5))
+    shared = SharedArray(data)
+    try:
+        # The workers of the local cluster run in the same process
+        client = dask_client_create(n_workers=1, processes=False)
+        try:
+            data_dask = _chunk_numpy_array(data, (5, 10), client=client)
+            assert all([type(_).__name__ == "Future" for _ in dict(data_dask.__dask_graph__()).values()])
+            npt.assert_array_equal(client.compute(data_dask).result(), data)
+            assert not shared.is_allocated
+        finally:
+            client.close()
+
+        client = dask_client_create(n_workers=2)
+        try:
+            for arr in (data, data[3:17, ::-1]):
+                data_dask = _chunk_numpy_array(arr, (5, 10), client=client)
+                graph = dict(data_dask.__dask_graph__())
+                assert len(graph) == data_dask.npartitions
+                assert not any([type(_).__name__ == "Future" for _ in graph.values()])
+                npt.assert_array_equal(client.compute(data_dask).result(), arr)
+                npt.assert_array_equal(client.compute(data_dask.sum(axis=2)).result(), arr.sum(axis=2))
+            assert shared.is_allocated
+
+            # The array is scattered once the shared memory is released
+            shared.release()
+            data_dask = _chunk_numpy_array(data, (5, 10), client=client)
+            assert all([type(_).__name__ == "Future" for _ in dict(data_dask.__dask_graph__()).values()])
+            npt.assert_array_equal(client.compute(data_dask).result(), data)
+        finally:
+            client.close()
+    finally:
+        shared.release()
+
+
 # fmt: off
 @pytest.mark.parametrize("chunk_pixels, data_shape, res_chunk_size", [
     (4, (10, 10, 3), (2, 2, 3)),
@@ -301,6 +509,68 @@ def test_array_numpy_to_dask_fail(data):
         _array_numpy_to_dask(data, (5, 2))
 
 
+# fmt: off
+@pytest.mark.parametrize("data_shape, dtype, resources, file_chunks, compression, chunk_pixels", [
+    # Small maps: chunk size is limited by the minimum chunk size (scheduling overhead)
+    ((20, 20, 4096), "float32", (8, 1e10), None, None, 28),
+    ((20, 20, 4096), "float64", (8, 1e10), None, None, 25),
+    # Large maps: split between all worker threads
+    ((1000, 1000, 100), "float32", (8, 1e10), None, None, 31250),
+    # Large maps: chunk size is limited by the maximum size of the chunk
+    ((1000, 1000, 4096), "float32", (8, 1e10), None, None, 1820),
+    # Large maps: chunk size is limited by the memory available to the worker thread
+    ((1000, 1000, 4096), "float32", (8, 1e8), None, None, 169),
+    ((1000, 1000, 4096), "float32", (8, 1e5), None, None, 1),
+    # Compressed HDF5 chunks are never split
+    ((1000, 1000, 4096), "float32", (8, 1e10), (50, 50, 4096), "gzip", 2500),
+    ((1000, 1000, 4096), "float32", (8, 1e10), (50, 50, 4096), None, 1820),
+])
+# fmt: on
+def test_auto_chunk_pixels(monkeypatch, data_shape, dtype, resources, file_chunks, compression, chunk_pixels):
+    """Automatic selection of chunk size: `_auto_chunk_pixels`"""
+    monkeypatch.setattr(map_processing, "_get_worker_resources", lambda client: resources)
+
+    res = _auto_chunk_pixels(data_shape, dtype, file_chunksize=file_chunks, compression=compression)
+    assert res == chunk_pixels
+
+    # Override using Dask configuration
+    with dask.config.set({"pyxrf.chunk-pixels": 1234}):
+        res = _auto_chunk_pixels(data_shape, dtype, file_chunksize=file_chunks, compression=compression)
+    assert res == 1234
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+def test_prepare_xrf_data_auto(tmpdir, monkeypatch, compression):
+    """
+    `prepare_xrf_map` with automatically selected chunk size. Large uncompressed HDF5 chunks
+    may be split, compressed chunks are not split.
+    """
+    monkeypatch.setattr(map_processing, "_get_worker_resources", lambda client: (4, 1e10))
+
+    data_shape = (20, 30, 4096)
+    data_numpy = np.random.random(data_shape).astype("float32")
+    os.chdir(tmpdir)
+    fln, dset_name = "test_auto.h5", "level1/level2"
+    with h5py.File(fln, "w") as f:
+        f.create_dataset(dset_name, data=data_numpy, chunks=(20, 30, 256), compression=compression)
+    data = RawHDF5Dataset(fln, dset_name, shape=data_shape)
+
+    data, file_obj = prepare_xrf_map(data)
+    if compression:
+        assert data.chunksize == data_shape
+    else:
+        assert data.chunksize[0] * data.chunksize[1] < data_shape[0] * data_shape[1]
+        assert data.chunksize[2] == data_shape[2]
+    npt.assert_array_equal(data.compute(), data_numpy)
+    file_obj.close()
+
+    data, _ = prepare_xrf_map(data_numpy, chunk_pixels="auto")
+    assert data.chunksize[0] * data.chunksize[1] < data_shape[0] * data_shape[1]
+
+    with pytest.raises(ValueError, match="Parameter 'chunk_pixels' must be an integer or 'auto'"):
+        prepare_xrf_map(data_numpy, chunk_pixels="some-string")
+
+
 def _create_xrf_data(data_dask, data_representation, tmpdir, *, chunked_HDF5=True):
     """Prepare data represented as numpy array, dask array (no change) or HDF5 dataset"""
     if data_representation == "numpy_array":
@@ -328,6 +598,131 @@ def _create_xrf_data(data_dask, data_representation, tmpdir, *, chunked_HDF5=Tru
     return data
 
 
+# fmt: off
+@pytest.mark.parametrize("data_representation, chunked_HDF5", [
+    ("numpy_array", True),
+    ("dask_array", True),
+    ("hdf5_file_dset", True),
+    ("hdf5_file_dset", False),
+])
+# fmt: on
+def test_get_pixel_spectra(data_representation, chunked_HDF5, tmpdir):
+    """
+    ``get_pixel_spectra``: basic functionality. The chunks of HDF5 dataset are cached
+    and the cache is invalidated once the file is modified.
+    """
+    data_dask = da.random.random((15, 12, 30), chunks=(4, 5, 30))
+    data_np = data_dask.compute()
+    data = _create_xrf_data(data_dask, data_representation, tmpdir, chunked_HDF5=chunked_HDF5)
+
+    _pixel_chunk_cache.clear()
+    pixels = [(0, 0), (14, 11), (3, 4), (4, 5), (3, 4)]
+    spectra = get_pixel_spectra(data, pixels)
+    assert spectra.shape == (len(pixels), 30)
+    for n, (ny, nx) in enumerate(pixels):
+        npt.assert_array_equal(spectra[n, :], data_np[ny, nx, :])
+
+    if isinstance(data, RawHDF5Dataset):
+        # The spectra are read from the cache
+        n_blocks = len(_pixel_chunk_cache._blocks)
+        assert n_blocks == (3 if chunked_HDF5 else 4)
+        npt.assert_array_equal(data.get_pixel_spectra([(3, 4)])[0], data_np[3, 4, :])
+        assert len(_pixel_chunk_cache._blocks) == n_blocks
+
+        # The file is modified
+        ttime.sleep(0.01)
+        with h5py.File(data.abs_path, "a") as f:
+            f[data.dset_name][3, 4, :] = 0
+        npt.assert_array_equal(data.get_pixel_spectra([(3, 4)])[0], np.zeros(30))
+
+
+# fmt: off
+@pytest.mark.parametrize("pixels, except_type, err_msg", [
+    ([(0, 0, 0)], TypeError, "Parameter 'pixels' must be a list of pixel coordinates"),
+    ([("a", 0)], TypeError, "Parameter 'pixels' must be a list of pixel coordinates"),
+    ([(0, 12)], ValueError, "Some pixels are outside the map"),
+    ([(-1, 0)], ValueError, "Some pixels are outside the map"),
+])
+# fmt: on
+def test_get_pixel_spectra_fail(pixels, except_type, err_msg):
+    """``get_pixel_spectra``: invalid input parameters"""
+    with pytest.raises(except_type, match=err_msg):
+        get_pixel_spectra(np.zeros((15, 12, 30)), pixels)
+    with pytest.raises(TypeError, match="Type of parameter 'data' is not supported"):
+        get_pixel_spectra([1, 2, 3], [(0, 0)])
+
+
+# fmt: off
+@pytest.mark.parametrize("shuffle, dtype", [(False, np.float32), (True, np.float32), (True, np.int16)])
+@pytest.mark.parametrize("selection", [
+    (slice(None), slice(None), slice(None)),
+    (slice(3, 14), slice(5, 6), slice(2, 25)),
+    (slice(8, 8), slice(None), slice(None)),
+])
+# fmt: on
+def test_read_hdf5_block(tmpdir, shuffle, dtype, selection):
+    """
+    ``_read_hdf5_block``: the block assembled from the chunks decompressed in parallel is
+    identical to the block read by the HDF5 library. Chunks that are not allocated contain the fill value.
+    """
+    data = (np.random.rand(15, 12, 30) * 1000).astype(dtype)
+    data[8:, 10:, :] = 5  # Not allocated chunks (fill value)
+    fpath = os.path.join(tmpdir, "data.h5")
+    with h5py.File(fpath, "w") as f:
+        dset = f.create_dataset(
+            "counts",
+            shape=data.shape,
+            dtype=dtype,
+            chunks=(4, 5, 10),
+            compression="gzip",
+            shuffle=shuffle,
+            fillvalue=5,
+        )
+        dset[0:8, :, :] = data[0:8, :, :]
+        dset[8:, 0:10, :] = data[8:, 0:10, :]
+
+    with h5py.File(fpath, "r") as f:
+        dset = f["counts"]
+        assert dset.id.get_num_chunks() < 36
+        block = _read_hdf5_block(dset, selection)
+        assert block.dtype == dset.dtype
+        npt.assert_array_equal(block, dset[selection])
+        npt.assert_array_equal(block, data[selection])
+
+
+@pytest.mark.parametrize("use_client", [False, True])
+def test_prepare_xrf_data_parallel_decompression(tmpdir, monkeypatch, use_client):
+    """
+    ``prepare_xrf_map``: chunks of gzip-compressed datasets are decompressed in parallel
+    if multiple cores are available
+    """
+    monkeypatch.setattr(map_processing, "_get_number_of_cores", lambda: 4)
+    data_np = np.random.random((15, 12, 30))
+    fpath = os.path.join(tmpdir, "data.h5")
+    with h5py.File(fpath, "w") as f:
+        f.create_dataset("counts", data=data_np, chunks=(4, 5, 30), compression="gzip", shuffle=True)
+    data = RawHDF5Dataset(fpath, "counts", shape=data_np.shape)
+
+    data_prepared, file_obj = prepare_xrf_map(data, chunk_pixels=20)
+    graph = dict(data_prepared.__dask_graph__())
+    assert any([isinstance(_, map_processing._CompressedHDF5Reader) for _ in graph.values()])
+    client = dask_client_create(n_workers=2) if use_client else None
+    try:
+        result = client.compute(data_prepared).result() if use_client else data_prepared.compute()
+        npt.assert_array_equal(result, data_np)
+    finally:
+        if client is not None:
+            client.close()
+    file_obj.close()
+
+    # Parallel decompression is disabled
+    with dask.config.set({"pyxrf.parallel-decompression": False}):
+        data_prepared, file_obj = prepare_xrf_map(data, chunk_pixels=20)
+        graph = dict(data_prepared.__dask_graph__())
+        assert not any([isinstance(_, map_processing._CompressedHDF5Reader) for _ in graph.values()])
+        file_obj.close()
+
+
 def _create_xrf_mask(data_shape, apply_mask, select_area):
     """
     Generate a mask for testing of XRF dataset processing functions.
@@ -523,7 +918,8 @@ class TestComputeTotalSpectrum:
         )
 
 
-def test_compute_total_spectrum2(tmpdir):
+@pytest.mark.parametrize("backend", ["auto", "threads", "distributed"])
+def test_compute_total_spectrum2(tmpdir, backend):
     """Create an instance of Dask client in the 'compute_total_spectrum' function to test if it works"""
 
     # Start with dask array
@@ -536,7 +932,7 @@ def test_compute_total_spectrum2(tmpdir):
     data = _create_xrf_data(data_dask, "dask_array", tmpdir=tmpdir)
 
     # Run computations without the progress bar
-    total_spectrum = compute_total_spectrum(data, chunk_pixels=12)
+    total_spectrum = compute_total_spectrum(data, chunk_pixels=12, backend=backend)
 
     npt.assert_array_almost_equal(
         total_spectrum, total_spectrum_expected, err_msg="Total spectrum was computed incorrectly"
@@ -610,7 +1006,8 @@ class TestComputeTotalSpectrumAndCount:
         )
 
 
-def test_compute_total_spectrum_and_count2(tmpdir):
+@pytest.mark.parametrize("backend", ["auto", "threads", "distributed"])
+def test_compute_total_spectrum_and_count2(tmpdir, backend):
     """Create an instance of Dask client in the 'compute_total_spectrum' function to test if it works"""
 
     # Start with dask array
@@ -624,7 +1021,7 @@ def test_compute_total_spectrum_and_count2(tmpdir):
     data = _create_xrf_data(data_dask, "dask_array", tmpdir=tmpdir)
 
     # Run computations without the progress bar
-    total_spectrum, total_count = compute_total_spectrum_and_count(data, chunk_pixels=12)
+    total_spectrum, total_count = compute_total_spectrum_and_count(data, chunk_pixels=12, backend=backend)
 
     npt.assert_array_almost_equal(
         total_spectrum, total_spectrum_expected, err_msg="Total spectrum was computed incorrectly"
@@ -907,7 +1304,8 @@ class TestFitXRFMap:
         ft.verify_fit_output(data_out=data_out, snip_param=ft.snip_param)
 
 
-def test_fit_xrf_map2():
+@pytest.mark.parametrize("backend", ["auto", "threads", "distributed"])
+def test_fit_xrf_map2(backend):
     """
     Basic functionality of `fit_xrf_map`.
     Tests are run using global Dask clients to inprove testing speed.
@@ -938,10 +1336,244 @@ def test_fit_xrf_map2():
         n_chunks_min=4,
         progress_bar=None,
         client=None,
+        backend=backend,
+    )
+
+    ft.verify_fit_output(data_out=data_out, snip_param=ft.snip_param)
+
+
+@pytest.mark.parametrize("backend", ["threads", "distributed"])
+def test_fit_xrf_map3(backend, capsys):
+    """
+    `fit_xrf_map`: the results are passed to `consume_block` block by block.
+    """
+
+    dataset_params = {"n_data_dimensions": (20, 20)}
+    use_snip = True
+
+    ft = _FitXRFMapTesting(dataset_params=dataset_params, use_snip=use_snip, add_pts_before=15, add_pts_after=10)
+
+    data_out = np.full(shape=(20, 20, ft.spectra.shape[1] + 4), fill_value=np.nan)
+    block_slices = []
+
+    def _consume_block(block, block_slice):
+        assert block.shape == data_out[block_slice].shape
+        data_out[block_slice] = block
+        block_slices.append(block_slice)
+
+    pbar = _SampleProgressBar("Fitting")
+    result = fit_xrf_map(
+        ft.data_input,
+        data_sel_indices=ft.data_sel_indices,
+        matv=ft.spectra,
+        snip_param=ft.snip_param,
+        use_snip=use_snip,
+        chunk_pixels=10,
+        n_chunks_min=4,
+        progress_bar=pbar,
+        backend=backend,
+        consume_block=_consume_block,
+    )
+
+    assert result is None
+    assert len(block_slices) > 1
+    ft.verify_fit_output(data_out=data_out, snip_param=ft.snip_param)
+
+    captured = capsys.readouterr().out
+    for s in pbar._expected_output:
+        assert s in captured
+
+
+@pytest.mark.parametrize("backend", ["threads", "distributed"])
+def test_fit_xrf_map4(backend):
+    """
+    `fit_xrf_map`: cancellation of computations. Results are also assembled correctly
+    if `cancel_event` is passed and not set.
+    """
+
+    dataset_params = {"n_data_dimensions": (20, 20)}
+    use_snip = True
+
+    ft = _FitXRFMapTesting(dataset_params=dataset_params, use_snip=use_snip, add_pts_before=15, add_pts_after=10)
+    fit_kwargs = dict(
+        data_sel_indices=ft.data_sel_indices,
+        matv=ft.spectra,
+        snip_param=ft.snip_param,
+        use_snip=use_snip,
+        chunk_pixels=10,
+        n_chunks_min=4,
+        backend=backend,
     )
 
+    # The event is not set
+    cancel_event = threading.Event()
+    data_out = fit_xrf_map(ft.data_input, **fit_kwargs, cancel_event=cancel_event)
     ft.verify_fit_output(data_out=data_out, snip_param=ft.snip_param)
 
+    # Cancel after the first block is processed
+    block_slices = []
+
+    def _consume_block(block, block_slice):
+        block_slices.append(block_slice)
+        cancel_event.set()
+
+    cancel_event = threading.Event()
+    with pytest.raises(ComputationCancelledError, match="Computations were cancelled"):
+        fit_xrf_map(ft.data_input, **fit_kwargs, consume_block=_consume_block, cancel_event=cancel_event)
+    assert 1 <= len(block_slices) < 40
+
+    # Computations are cancelled before the first block is processed
+    cancel_event = threading.Event()
+    cancel_event.set()
+    with pytest.raises(ComputationCancelledError):
+        fit_xrf_map(ft.data_input, **fit_kwargs, cancel_event=cancel_event)
+
+
+def _bin_xrf_map_reference(data, pixel_bin, energy_bin):
+    """Reference implementation of binning (slow)"""
+    ny, nx, ne = data.shape
+    ny_b, nx_b, ne_b = [int(np.ceil(_ / b)) for _, b in zip(data.shape, (pixel_bin, pixel_bin, energy_bin))]
+    data_out = np.zeros(shape=(ny_b, nx_b, ne_b))
+    for iy in range(ny_b):
+        for ix in range(nx_b):
+            window = data[iy * pixel_bin : (iy + 1) * pixel_bin, ix * pixel_bin : (ix + 1) * pixel_bin, :]
+            spectrum = np.mean(window, axis=(0, 1))
+            for ie in range(ne_b):
+                data_out[iy, ix, ie] = np.sum(spectrum[ie * energy_bin : (ie + 1) * energy_bin])
+    return data_out
+
+
+# fmt: off
+@pytest.mark.parametrize("data_shape, chunk_pixels, pixel_bin, energy_bin", [
+    ((10, 12, 20), 16, 1, 1),
+    ((10, 12, 20), 16, 2, 1),
+    ((10, 12, 20), 16, 1, 2),
+    ((11, 13, 21), 16, 2, 3),
+    ((11, 13, 21), 20, 3, 2),
+    ((11, 13, 21), 1000, 4, 4),
+    ((2, 3, 5), 16, 5, 10),
+])
+# fmt: on
+@pytest.mark.parametrize("data_type", ["numpy", "dask"])
+def test_bin_xrf_map(data_shape, chunk_pixels, pixel_bin, energy_bin, data_type):
+    """
+    `bin_xrf_map` and `prepare_xrf_map` with `pixel_bin` parameter: basic functionality
+    """
+    data = np.random.randint(0, 100, size=data_shape).astype(np.int32)
+    if data_type == "dask":
+        data_in = da.from_array(data, chunks=(3, 3, data_shape[2]))
+    else:
+        data_in = data
+
+    data_dask, _ = prepare_xrf_map(data_in, chunk_pixels=chunk_pixels, n_chunks_min=4, pixel_bin=pixel_bin)
+    for chunks in data_dask.chunks[0:2]:
+        assert all([_ % pixel_bin == 0 for _ in chunks[:-1]])
+
+    data_binned = bin_xrf_map(data_dask, pixel_bin=pixel_bin, energy_bin=energy_bin)
+    data_expected = _bin_xrf_map_reference(data, pixel_bin, energy_bin)
+    assert data_binned.shape == data_expected.shape
+    npt.assert_array_almost_equal(data_binned.compute(scheduler="synchronous"), data_expected)
+
+    # Binning of the array with chunks that are not aligned
+    data_binned = bin_xrf_map(da.from_array(data, chunks=(5, 7, 3)), pixel_bin=pixel_bin, energy_bin=energy_bin)
+    npt.assert_array_almost_equal(data_binned.compute(scheduler="synchronous"), data_expected)
+
+
+# fmt: off
+@pytest.mark.parametrize("params, except_type, err_msg", [
+    ({"pixel_bin": 0}, ValueError, "Parameter 'pixel_bin' must be a positive integer"),
+    ({"pixel_bin": 2.0}, ValueError, "Parameter 'pixel_bin' must be a positive integer"),
+    ({"energy_bin": -1}, ValueError, "Parameter 'energy_bin' must be a positive integer"),
+    ({"energy_bin": None}, ValueError, "Parameter 'energy_bin' must be a positive integer"),
+])
+# fmt: on
+def test_bin_xrf_map_fail(params, except_type, err_msg):
+    data = da.zeros(shape=(10, 10, 20), chunks=(2, 2, 20))
+    with pytest.raises(except_type, match=err_msg):
+        bin_xrf_map(data, **params)
+    with pytest.raises(TypeError, match="Parameter 'data' must be 3D Dask array"):
+        bin_xrf_map(np.zeros(shape=(10, 10, 20)))
+
+
+@pytest.mark.parametrize("energy_bin", [1, 2, 3, 4])
+def test_bin_energy_calibration(energy_bin):
+    e_offset, e_linear, e_quadratic = 0.1, 0.01, 1e-6
+    e_coefs_binned = _bin_energy_calibration(e_offset, e_linear, e_quadratic, energy_bin)
+
+    n_bins = np.arange(100)
+    n_raw = n_bins * energy_bin + (energy_bin - 1) / 2  # Center of the bin
+    energy_binned = np.polyval(list(reversed(e_coefs_binned)), n_bins)
+    energy_expected = np.polyval([e_quadratic, e_linear, e_offset], n_raw)
+    npt.assert_array_almost_equal(energy_binned, energy_expected)
+
+
+def test_bin_fitting_model():
+    matv = np.random.random(size=(20, 3))
+    snip_param = {"e_offset": 0.0, "e_linear": 0.1, "e_quadratic": 0.0, "b_width": 1}
+
+    # Selected range 5..25: complete bins 2..8 (raw channels 6..24)
+    data_sel, matv_binned, snip_binned = _bin_fitting_model((5, 25), matv, snip_param, 3)
+    assert data_sel == (2, 8)
+    npt.assert_array_almost_equal(matv_binned, matv[1:19, :].reshape(6, 3, 3).sum(axis=1))
+    assert snip_binned["e_linear"] == pytest.approx(0.3)
+    assert snip_binned["e_offset"] == pytest.approx(0.1)
+    assert snip_binned["b_width"] == 1
+    assert snip_param["e_linear"] == 0.1  # Original parameters are not changed
+
+    # No binning
+    data_sel, matv_binned, snip_binned = _bin_fitting_model((5, 25), matv, snip_param, 1)
+    assert data_sel == (5, 25)
+    assert matv_binned is matv
+
+    with pytest.raises(ValueError, match="is too narrow for binning"):
+        _bin_fitting_model((5, 7), matv[:2, :], snip_param, 4)
+
+
+# fmt: off
+@pytest.mark.parametrize("pixel_bin, energy_bin, n_trim", [
+    (1, 1, 0),
+    (2, 1, 0),
+    (3, 1, 2),
+    (1, 2, 0),
+    (1, 3, 0),
+    (2, 3, 1),
+])
+# fmt: on
+@pytest.mark.parametrize("backend", ["threads", "distributed"])
+def test_fit_xrf_map5(pixel_bin, energy_bin, n_trim, backend):
+    """
+    `fit_xrf_map`: spatial binning and binning along the energy axis. The map is generated
+    so that all pixels in each binning window have the same spectrum. The weights must be
+    computed correctly for each pixel.
+    """
+    ft = _FitXRFMapTesting(
+        dataset_params={"n_data_dimensions": (5, 6)}, use_snip=False, add_pts_before=15, add_pts_after=10
+    )
+
+    def _expand(d):
+        d = np.repeat(np.repeat(d, pixel_bin, axis=0), pixel_bin, axis=1)
+        return d[: d.shape[0] - n_trim, : d.shape[1] - n_trim]
+
+    data = _expand(ft.data_input)
+
+    data_out = fit_xrf_map(
+        data,
+        data_sel_indices=ft.data_sel_indices,
+        matv=ft.spectra,
+        snip_param=ft.snip_param,
+        use_snip=False,
+        chunk_pixels=10,
+        n_chunks_min=4,
+        backend=backend,
+        pixel_bin=pixel_bin,
+        energy_bin=energy_bin,
+    )
+
+    assert data_out.shape == data.shape[0:2] + (ft.n_lines + 4,)
+    weights_expected = _expand(np.moveaxis(ft.fitting_data.weights, 0, 2))
+    npt.assert_array_almost_equal(data_out[:, :, : ft.n_lines], weights_expected)
+    npt.assert_array_almost_equal(data_out[:, :, ft.n_lines + 3], np.sum(data, axis=2))
+
 
 # fmt: off
 @pytest.mark.parametrize("params, except_type, err_msg", [
@@ -1009,6 +1641,133 @@ def test_fit_xrf_map_fail(params, except_type, err_msg):
         fit_xrf_map(**kwargs)
 
 
+@pytest.mark.parametrize("use_consume_block", [False, True])
+@pytest.mark.parametrize("backend", ["threads", "distributed"])
+def test_fit_xrf_maps(backend, use_consume_block):
+    """
+    `fit_xrf_maps`: multiple maps of different size and with different models are fitted together.
+    """
+
+    ft_list = [
+        _FitXRFMapTesting(
+            dataset_params={"n_data_dimensions": (20, 20)}, use_snip=True, add_pts_before=15, add_pts_after=10
+        ),
+        _FitXRFMapTesting(
+            dataset_params={"n_data_dimensions": (12, 17)}, use_snip=True, add_pts_before=5, add_pts_after=20
+        ),
+    ]
+    datasets = [
+        {
+            "data": _.data_input,
+            "data_sel_indices": _.data_sel_indices,
+            "matv": _.spectra,
+            "snip_param": _.snip_param,
+        }
+        for _ in ft_list
+    ]
+
+    if use_consume_block:
+        data_out = [
+            np.full(shape=_.data_input.shape[0:2] + (_.spectra.shape[1] + 4,), fill_value=np.nan) for _ in ft_list
+        ]
+
+        def _create_consumer(n):
+            def _consume_block(block, block_slice):
+                data_out[n][block_slice] = block
+
+            return _consume_block
+
+        consume_block = [_create_consumer(n) for n in range(len(ft_list))]
+    else:
+        consume_block = None
+
+    result = fit_xrf_maps(
+        datasets,
+        use_snip=True,
+        chunk_pixels=10,
+        n_chunks_min=4,
+        progress_bar=None,
+        backend=backend,
+        consume_block=consume_block,
+    )
+
+    if use_consume_block:
+        assert result is None
+    else:
+        assert isinstance(result, list)
+        data_out = result
+
+    assert len(data_out) == len(ft_list)
+    for ft, d in zip(ft_list, data_out):
+        ft.verify_fit_output(data_out=d, snip_param=ft.snip_param)
+
+
+@pytest.mark.parametrize("use_consume_block", [False, True])
+@pytest.mark.parametrize("backend", ["threads", "distributed"])
+@pytest.mark.parametrize("pixel_bin, energy_bin", [(1, 1), (2, 2)])
+def test_fit_xrf_map_sweep(monkeypatch, backend, use_consume_block, pixel_bin, energy_bin):
+    """
+    `fit_xrf_map_sweep`: the map is fitted with multiple models, the background is computed
+    once for the models with the same selected range and SNIP parameters
+    """
+    data = np.random.rand(9, 11, 120) * 10 + 1
+    snip_param = {"e_offset": 0, "e_linear": 0.01, "e_quadratic": 0, "b_width": 0.5}
+    matv = np.random.rand(80, 5)
+    models = [
+        {"data_sel_indices": (20, 100), "matv": matv, "snip_param": snip_param},
+        {"data_sel_indices": (20, 100), "matv": matv[:, :3], "snip_param": dict(snip_param)},
+        {"data_sel_indices": (10, 90), "matv": matv, "snip_param": snip_param},
+    ]
+    kwargs = dict(use_snip=True, chunk_pixels=20, pixel_bin=pixel_bin, energy_bin=energy_bin)
+
+    n_snip_calls = [0]
+    if backend == "threads":
+        snip_background = map_processing._snip_background
+
+        def _snip_background(spec_sel, *args, **kwargs):
+            n_snip_calls[0] += 1 if spec_sel.size else 0  # Skip calls made to infer metadata
+            return snip_background(spec_sel, *args, **kwargs)
+
+        monkeypatch.setattr(map_processing, "_snip_background", _snip_background)
+
+    if use_consume_block:
+        results = [np.full(data.shape[0:2] + (_["matv"].shape[1] + 4,), np.nan) for _ in models]
+        consumers = [lambda b, s, r=r: r.__setitem__(s, b) for r in results]
+        assert fit_xrf_map_sweep(data, models, backend=backend, consume_block=consumers, **kwargs) is None
+    else:
+        results = fit_xrf_map_sweep(data, models, backend=backend, **kwargs)
+
+    if backend == "threads":
+        n_blocks = len(prepare_xrf_map(data, chunk_pixels=20, pixel_bin=pixel_bin)[0].to_delayed().flatten())
+        assert n_snip_calls[0] == 2 * n_blocks
+        monkeypatch.undo()
+
+    assert len(results) == len(models)
+    for model, result in zip(models, results):
+        expected = fit_xrf_map(data, **model, backend="threads", **kwargs)
+        npt.assert_array_almost_equal(result, expected)
+
+    with pytest.raises(TypeError, match="Parameter 'models' must be a non-empty list of dictionaries"):
+        fit_xrf_map_sweep(data, [])
+    with pytest.raises(TypeError, match="Parameter 'consume_block' must be None or a list of 3 callable"):
+        fit_xrf_map_sweep(data, models, consume_block=[])
+
+
+# fmt: off
+@pytest.mark.parametrize("datasets, consume_block, except_type, err_msg", [
+    ([], None, TypeError, "Parameter 'datasets' must be a non-empty list of dictionaries"),
+    ({"data": None}, None, TypeError, "Parameter 'datasets' must be a non-empty list of dictionaries"),
+    ([{"data": None}, 10], None, TypeError, "Parameter 'datasets' must be a non-empty list of dictionaries"),
+    ([{"data": None}], [], TypeError, "Parameter 'consume_block' must be None or a list of 1 callable"),
+    ([{"data": None}], lambda x, y: None, TypeError, "Parameter 'consume_block' must be None or a list"),
+])
+# fmt: on
+def test_fit_xrf_maps_fail(datasets, consume_block, except_type, err_msg):
+    """Failing cases of `fit_xrf_maps` (wrong input parameters)"""
+    with pytest.raises(except_type, match=err_msg):
+        fit_xrf_maps(datasets, consume_block=consume_block)
+
+
 # fmt: off
 @pytest.mark.parametrize("dataset_params", [
     {"n_data_dimensions": (8, 1)},
@@ -1072,6 +1831,72 @@ def test_compute_roi(dataset_params, add_pts_before, add_pts_after, use_snip):
     ft.verify_roi_output(data_out=data_out, roi_dict=roi_dict, snip_param=snip_param)
 
 
+@pytest.mark.parametrize("e_quadratic", [0, 1e-5, -1e-6])
+def test_energy_to_bin_position(e_quadratic):
+    """`_energy_to_bin_position` inverts energy calibration"""
+    e_offset, e_linear = -0.05, 0.01
+    n = np.linspace(0, 4095, 100)
+    energy = e_offset + e_linear * n + e_quadratic * n**2
+    npt.assert_array_almost_equal(_energy_to_bin_position(energy, e_offset, e_linear, e_quadratic), n)
+
+
+@pytest.mark.parametrize("use_bg", [False, True])
+def test_sum_roi_bands_integer_edges(use_bg):
+    """
+    `_sum_roi_bands`: the results computed using cumulative sum for large number of ROIs are
+    identical to the sums computed directly for each band.
+    """
+    ny, nx, n_pts, n_sel_start = 3, 4, 200, 20
+    spec_sel = np.random.rand(ny, nx, n_pts) * 100
+    bg_sel = np.random.rand(ny, nx, n_pts) if use_bg else None
+    snip_param = {"e_offset": 0.1, "e_linear": 0.01, "e_quadratic": 0}
+    rng = np.random.default_rng(0)
+    roi_bands = [tuple(rng.uniform(0, 2.5, size=2)) for _ in range(50)]
+
+    roi_data = _sum_roi_bands(spec_sel, bg_sel, (n_sel_start, n_sel_start + n_pts), roi_bands, snip_param)
+
+    y = spec_sel - bg_sel if use_bg else spec_sel
+    for n, (e_left, e_right) in enumerate(roi_bands):
+        n_left, n_right = [
+            int(np.clip(round((_ - 0.1) / 0.01) - n_sel_start, 0, n_pts - 1)) for _ in (e_left, e_right)
+        ]
+        expected = np.sum(y[:, :, n_left:n_right], axis=2) if n_right > n_left else np.zeros((ny, nx))
+        npt.assert_array_almost_equal(roi_data[:, :, n], expected)
+
+
+@pytest.mark.parametrize("e_quadratic", [0, 2e-6])
+def test_sum_roi_bands_fractional_edges(e_quadratic):
+    """
+    `_sum_roi_bands`: fractional band edges. The partially covered points are included
+    with weights equal to the covered fraction of the interval represented by the point.
+    """
+    ny, nx, n_pts, n_sel_start = 2, 3, 300, 50
+    spec_sel = np.random.rand(ny, nx, n_pts) * 100
+    e_offset, e_linear = -0.02, 0.01
+    snip_param = {"e_offset": e_offset, "e_linear": e_linear, "e_quadratic": e_quadratic}
+    roi_bands = [(1.0, 1.237), (0.3, 0.8), (2.0, 2.001), (1.5, 1.2), (3.1, 4.0), (0.0, 0.6)]
+
+    roi_data = _sum_roi_bands(
+        spec_sel, None, (n_sel_start, n_sel_start + n_pts), roi_bands, snip_param, fractional_edges=True
+    )
+
+    # Point 'n' represents the interval 'n - 0.5 .. n + 0.5'
+    n_lower = np.arange(n_sel_start, n_sel_start + n_pts) - 0.5
+    for n_band, (e_left, e_right) in enumerate(roi_bands):
+        # Solve quadratic equation to find positions of the band limits
+        pos_left, pos_right = [
+            (
+                np.max(np.roots([e_quadratic, e_linear, e_offset - _]).real)
+                if e_quadratic
+                else (_ - e_offset) / e_linear
+            )
+            for _ in (e_left, e_right)
+        ]
+        weights = np.clip(np.minimum(n_lower + 1, pos_right) - np.maximum(n_lower, pos_left), 0, 1)
+        expected = np.sum(spec_sel * weights, axis=2)
+        npt.assert_array_almost_equal(roi_data[:, :, n_band], expected)
+
+
 @pytest.mark.usefixtures("_start_dask_client")
 class TestComputeSelectedROIs:
     # fmt: off
@@ -1146,7 +1971,8 @@ class TestComputeSelectedROIs:
         ft.verify_roi_output(data_out=data_out, roi_dict=roi_dict, snip_param=snip_param)
 
 
-def test_compute_selected_rois2():
+@pytest.mark.parametrize("backend", ["auto", "threads", "distributed"])
+def test_compute_selected_rois2(backend):
     """
     Basic functionality of `compute_selected_rois`.
     Tests are run using global Dask clients to inprove testing speed.
@@ -1191,7 +2017,12 @@ def test_compute_selected_rois2():
     #   values to make sure that computations are done correctly.
 
     data_out = compute_selected_rois(
-        data, data_sel_indices=ft.data_sel_indices, roi_dict=roi_dict, snip_param=snip_param, use_snip=use_snip
+        data,
+        data_sel_indices=ft.data_sel_indices,
+        roi_dict=roi_dict,
+        snip_param=snip_param,
+        use_snip=use_snip,
+        backend=backend,
     )
 
     # Verify the dictionary
@@ -1277,6 +2108,82 @@ def test_compute_selected_rois_fail(params, except_type, err_msg):
         compute_selected_rois(**kwargs)
 
 
+# fmt: off
+@pytest.mark.parametrize("products", [
+    ("total_spectrum", "total_count", "max_spectrum", "roi", "fit"),
+    ["total_spectrum"],
+    ("total_count", "fit"),
+    ("roi", "max_spectrum"),
+])
+@pytest.mark.parametrize("use_snip", [False, True])
+@pytest.mark.parametrize("backend", ["threads", "distributed"])
+# fmt: on
+def test_compute_map_products(products, use_snip, backend):
+    """
+    `compute_map_products`: the products are identical to the results returned by
+    the functions that compute each product separately.
+    """
+    dataset_params = {"n_data_dimensions": (20, 20)}
+    ft = _FitXRFMapTesting(dataset_params=dataset_params, use_snip=use_snip, add_pts_before=15, add_pts_after=10)
+    data = ft.data_input
+    roi_dict = {"roi-1": (2.5, 3.5), "roi-2": (3.5, 4.8), "roi-3": (5.2, 7.4)}
+    kwargs = dict(snip_param=ft.snip_param, use_snip=use_snip, chunk_pixels=10, n_chunks_min=4, backend=backend)
+
+    result = compute_map_products(
+        data, products=products, data_sel_indices=ft.data_sel_indices, matv=ft.spectra, roi_dict=roi_dict, **kwargs
+    )
+
+    assert set(result.keys()) == set(products)
+
+    if "total_spectrum" in products:
+        npt.assert_array_almost_equal(result["total_spectrum"], np.sum(data, axis=(0, 1)))
+    if "total_count" in products:
+        npt.assert_array_almost_equal(result["total_count"], np.sum(data, axis=2))
+    if "max_spectrum" in products:
+        npt.assert_array_almost_equal(result["max_spectrum"], np.max(data, axis=(0, 1)))
+    if "roi" in products:
+        rois = compute_selected_rois(data, data_sel_indices=ft.data_sel_indices, roi_dict=roi_dict, **kwargs)
+        assert list(result["roi"].keys()) == list(roi_dict.keys())
+        for k, v in rois.items():
+            npt.assert_array_almost_equal(result["roi"][k], v)
+    if "fit" in products:
+        fit = fit_xrf_map(data, data_sel_indices=ft.data_sel_indices, matv=ft.spectra, **kwargs)
+        npt.assert_array_almost_equal(result["fit"], fit)
+
+
+# fmt: off
+@pytest.mark.parametrize("params, except_type, err_msg", [
+    ({"products": "fit"}, TypeError, "Parameter 'products' must be a list of strings"),
+    ({"products": []}, ValueError, "Parameter 'products' must contain at least one product"),
+    ({"products": ["fit", "abc"]}, ValueError, "Product 'abc' is not supported"),
+    ({"products": ["roi"], "data_sel_indices": None}, ValueError,
+     "Parameter 'data_sel_indices' must be specified"),
+    ({"products": ["roi"], "roi_dict": None}, TypeError, "Parameter 'roi_dict' must be a dictionary"),
+    ({"products": ["roi"], "snip_param": {}}, TypeError, "Parameter 'snip_param' must a dictionary with keys"),
+    ({"products": ["fit"], "matv": None}, TypeError, "Parameter 'matv' must be 2D ndarray"),
+    ({"products": ["fit"], "data_sel_indices": (3, 2)}, ValueError,
+     "Parameter 'data_sel_indices' must select at least 1 element"),
+])
+# fmt: on
+def test_compute_map_products_fail(params, except_type, err_msg):
+    """Failing cases of `compute_map_products` (wrong input parameters)"""
+    ft = _FitXRFMapTesting(
+        dataset_params={"n_data_dimensions": (20, 20)}, use_snip=True, add_pts_before=15, add_pts_after=10
+    )
+    kwargs = {
+        "data": ft.data_input,
+        "data_sel_indices": ft.data_sel_indices,
+        "matv": ft.spectra,
+        "roi_dict": {"roi-1": (2.5, 3.5)},
+        "snip_param": ft.snip_param,
+        "use_snip": True,
+    }
+    kwargs.update(params)
+
+    with pytest.raises(except_type, match=err_msg):
+        compute_map_products(**kwargs)
+
+
 def test_snip_method_numba():
     """
     Compare the output of `snip_method_numba` with the output produced
@@ -1309,3 +2216,42 @@ def test_snip_method_numba():
             npt.assert_array_almost_equal(
                 bg, bg_expected, err_msg=f"Background estimates don't match for the pixel ({ny}, {nx})"
             )
+
+
+# fmt: off
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"width": 0.3},
+    {"xmin": 10, "xmax": 500},
+    {"spectral_binning": 2},
+    {"con_val": 4, "iter_num": 2},
+])
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+# fmt: on
+def test_snip_method_block(kwargs, dtype):
+    """
+    Compare the output of `snip_method_block` with the output produced
+    by `snip_method_numba` applied to each pixel of the block.
+    """
+
+    dataset_params = {"n_data_dimensions": (5, 7)}
+    ft = _FitXRFMapTesting(dataset_params=dataset_params, use_snip=True, add_pts_before=0, add_pts_after=0)
+    data = ft.data_input.astype(dtype)
+
+    bg = snip_method_block(data, 0, 0.01, 0, **kwargs)
+    assert bg.shape == data.shape
+    assert bg.dtype == dtype
+
+    for ny in range(data.shape[0]):
+        for nx in range(data.shape[1]):
+            bg_expected = snip_method_numba(data[ny, nx, :].astype(np.float64), 0, 0.01, 0, **kwargs)
+            npt.assert_allclose(
+                bg[ny, nx, :],
+                bg_expected,
+                rtol=1e-5 if dtype == np.float32 else 1e-10,
+                err_msg=f"Background estimates don't match for the pixel ({ny}, {nx})",
+            )
+
+    # Single spectrum
+    bg = snip_method_block(data[0, 0, :], 0, 0.01, 0, **kwargs)
+    assert bg.shape == data[0, 0, :].shape
@@ -0,0 +1,202 @@
+import os
+import time as ttime
+
+import dask
+import dask.array as da
+import h5py
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from pyxrf.core.map_processing import RawHDF5Dataset, compute_selected_rois, fit_xrf_map
+from pyxrf.core.result_cache import ResultCache, compute_cache_key, get_result_cache
+
+
+def test_ResultCache_1(tmp_path):
+    """
+    ``ResultCache``: basic operations
+    """
+    cache_dir = os.path.join(tmp_path, "cache")
+    cache = ResultCache(cache_dir, max_size=1024**2)
+    assert os.path.isdir(cache_dir)
+    assert len(cache) == 0
+
+    arrays = {"Fe_K": np.random.rand(5, 7), "results": np.random.rand(5, 7, 3)}
+    assert cache.get("abc") is None
+    cache.put("abc", arrays)
+    assert len(cache) == 1
+    assert cache.size > 0
+
+    loaded = cache.get("abc")
+    assert set(loaded) == set(arrays)
+    for k, v in arrays.items():
+        npt.assert_array_equal(loaded[k], v)
+
+    # Entries are replaced
+    cache.put("abc", {"a": np.ones(3)})
+    assert list(cache.get("abc")) == ["a"]
+
+    # Corrupt entries are deleted
+    with open(os.path.join(cache_dir, "bad.npz"), "w") as f:
+        f.write("not a valid file")
+    assert cache.get("bad") is None
+    assert len(cache) == 1
+
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_ResultCache_2(tmp_path):
+    """
+    ``ResultCache``: the least recently used entries are evicted
+    """
+    entry = {"a": np.random.rand(100, 100)}  # 80 kB
+    cache = ResultCache(tmp_path, max_size=300 * 1024)
+
+    t = ttime.time() - 100
+    for n in range(3):
+        cache.put(f"key{n}", entry)
+        os.utime(os.path.join(tmp_path, f"key{n}.npz"), times=(t + n, t + n))
+
+    # Access to 'key0' makes it the most recently used entry
+    assert cache.get("key0") is not None
+    cache.put("key3", entry)
+
+    assert cache.get("key1") is None
+    for key in ("key0", "key2", "key3"):
+        assert cache.get(key) is not None
+    assert cache.size <= cache.max_size
+
+
+@pytest.mark.parametrize("max_size", [0, -1, 1.5, None])
+def test_ResultCache_fail(tmp_path, max_size):
+    with pytest.raises(ValueError, match="Parameter 'max_size' must be a positive integer"):
+        ResultCache(tmp_path, max_size=max_size)
+
+
+def test_compute_cache_key():
+    """
+    ``compute_cache_key``: the key depends on the data and all the parameters
+    """
+    data = np.random.rand(5, 6, 20)
+    params = {"matv": np.random.rand(10, 3), "snip_param": {"e_offset": 0.1, "b_width": 0.5}, "use_snip": True}
+
+    key = compute_cache_key(data=data, **params)
+    assert key == compute_cache_key(data=data.copy(), **params)
+    assert key == compute_cache_key(data=data, **{k: params[k] for k in reversed(list(params))})
+
+    data2 = data.copy()
+    data2[3, 3, 3] += 1
+    assert key != compute_cache_key(data=data2, **params)
+    assert key != compute_cache_key(data=data, **dict(params, use_snip=False))
+    assert key != compute_cache_key(data=data, **dict(params, snip_param={"e_offset": 0.1, "b_width": 0.6}))
+    matv2 = params["matv"].copy()
+    matv2[0, 0] += 1
+    assert key != compute_cache_key(data=data, **dict(params, matv=matv2))
+
+    # Dask arrays
+    assert compute_cache_key(data=da.from_array(data), **params) == compute_cache_key(
+        data=da.from_array(data), **params
+    )
+    assert compute_cache_key(data=da.from_array(data), **params) != compute_cache_key(
+        data=da.from_array(data2), **params
+    )
+
+    with pytest.raises(TypeError, match="can not be established"):
+        compute_cache_key(data=[1, 2, 3], **params)
+
+
+# fmt: off
+@pytest.mark.parametrize("dset_kwargs", [
+    {},
+    {"chunks": (2, 3, 20), "compression": "gzip"},
+])
+# fmt: on
+def test_compute_cache_key_hdf5(tmp_path, monkeypatch, dset_kwargs):
+    """
+    ``compute_cache_key``: the key for the data in HDF5 file changes only when the dataset is modified.
+    The key is computed without reading the data.
+    """
+    data = np.random.rand(5, 6, 20)
+    fpath = os.path.join(tmp_path, "data.h5")
+    with h5py.File(fpath, "w") as f:
+        ds = f.create_dataset("counts", data=data, **dset_kwargs)
+        ds.attrs["raw_data_id"] = "abc"
+    rds = RawHDF5Dataset(fpath, "counts", shape=data.shape)
+    key = compute_cache_key(data=rds, use_snip=True)
+    assert key == compute_cache_key(data=rds, use_snip=True)
+
+    # Processing results are saved to the same file
+    with h5py.File(fpath, "a") as f:
+        f.create_dataset("results", data=np.ones(10))
+    assert key == compute_cache_key(data=rds, use_snip=True)
+
+    # The data is not read
+    def _read_data(*args, **kwargs):
+        raise RuntimeError("The data was read")
+
+    with monkeypatch.context() as m:
+        m.setattr(h5py.Dataset, "__getitem__", _read_data)
+        assert key == compute_cache_key(data=rds, use_snip=True)
+
+    # The raw data is saved again (the data may be placed at the same location in the file)
+    with h5py.File(fpath, "a") as f:
+        del f["counts"]
+        ds = f.create_dataset("counts", data=data + 1, **dset_kwargs)
+        ds.attrs["raw_data_id"] = "def"
+    assert key != compute_cache_key(data=rds, use_snip=True)
+
+
+def test_get_result_cache(tmp_path):
+    cache = ResultCache(tmp_path)
+    assert get_result_cache(cache) is cache
+    assert get_result_cache(str(tmp_path)).cache_dir == str(tmp_path)
+
+    assert get_result_cache(None) is None
+    with dask.config.set({"pyxrf.result-cache.directory": str(tmp_path), "pyxrf.result-cache.max-size": 1000}):
+        cache = get_result_cache(None)
+        assert cache.cache_dir == str(tmp_path)
+        assert cache.max_size == 1000
+
+    with pytest.raises(TypeError, match="Parameter 'result_cache' must be ResultCache object"):
+        get_result_cache(10)
+
+
+def test_fit_xrf_map_cached(tmp_path):
+    """
+    ``fit_xrf_map`` and ``compute_selected_rois``: the results are loaded from the cache
+    """
+    data = np.random.rand(8, 9, 50) + 1
+    matv = np.random.rand(30, 3)
+    snip_param = {"e_offset": 0, "e_linear": 0.01, "e_quadratic": 0, "b_width": 0.5}
+    kwargs = dict(data_sel_indices=(10, 40), matv=matv, snip_param=snip_param, use_snip=False, chunk_pixels=20)
+
+    cache = ResultCache(tmp_path)
+    result = fit_xrf_map(data, **kwargs, result_cache=cache)
+    assert len(cache) == 1
+    npt.assert_array_almost_equal(result, fit_xrf_map(data, **kwargs))
+
+    # The result is loaded from the cache
+    (fln,) = os.listdir(tmp_path)
+    cache.put(os.path.splitext(fln)[0], {"results": np.zeros(result.shape)})
+    npt.assert_array_equal(fit_xrf_map(data, **kwargs, result_cache=cache), np.zeros(result.shape))
+
+    blocks = []
+    fit_xrf_map(data, **kwargs, result_cache=cache, consume_block=lambda b, s: blocks.append((b, s)))
+    assert len(blocks) == 1
+    assert blocks[0][1] == (slice(0, 8), slice(0, 9), slice(0, 7))
+
+    # Different parameters: the results are computed and a new entry is created
+    blocks = []
+    fit_xrf_map(
+        data, **dict(kwargs, use_snip=True), result_cache=cache, consume_block=lambda b, s: blocks.append(s)
+    )
+    assert len(blocks) > 1
+    assert len(cache) == 2
+
+    roi_kwargs = dict(data_sel_indices=(10, 40), roi_dict={"Fe_K": (0.15, 0.25)}, snip_param=snip_param)
+    roi_maps = compute_selected_rois(data, **roi_kwargs, result_cache=cache)
+    assert len(cache) == 3
+    roi_maps_cached = compute_selected_rois(data, **roi_kwargs, result_cache=cache)
+    assert set(roi_maps_cached) == set(roi_maps)
+    npt.assert_array_equal(roi_maps_cached["Fe_K"], roi_maps["Fe_K"])
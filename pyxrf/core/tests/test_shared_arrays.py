@@ -0,0 +1,126 @@
+import os
+
+import dask
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from pyxrf.core import shared_arrays
+from pyxrf.core.shared_arrays import (
+    SharedArray,
+    create_shared_array,
+    detach_shared_segments,
+    find_shared_array,
+    load_shared_block,
+)
+
+
+def _segment_exists(name):
+    return os.path.exists(os.path.join("/dev/shm", name))
+
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="Shared memory segments are not visible as files")
+def test_SharedArray_1():
+    """
+    ``SharedArray``: the array is copied to shared memory only when the segment is allocated,
+    the segment is released when the object is deleted
+    """
+    data = np.random.rand(10, 12, 5)
+    shared = SharedArray(data)
+    name = shared.name
+    assert shared.data is data
+    assert not shared.is_allocated
+    assert not _segment_exists(name)
+
+    assert shared.allocate()
+    assert shared.allocate()  # Repeated calls have no effect
+    assert shared.is_allocated
+    assert _segment_exists(name)
+    npt.assert_array_equal(load_shared_block(find_shared_array(data), (slice(None),)), data)
+    detach_shared_segments()
+
+    del shared
+    assert not _segment_exists(name)
+    assert find_shared_array(data, allocate=True) is None
+
+
+def test_SharedArray_2():
+    """
+    ``SharedArray``: only C-contiguous numpy arrays are accepted, released object can not be allocated
+    """
+    for data in ([1.0, 2.0], np.random.rand(10, 12)[:, ::2]):
+        with pytest.raises(ValueError, match="must be C-contiguous numpy array"):
+            SharedArray(data)
+
+    shared = SharedArray(np.random.rand(10, 12))
+    shared.release()
+    assert shared.is_released
+    assert not shared.allocate()
+    assert not shared.is_allocated
+
+
+# fmt: off
+@pytest.mark.parametrize("index", [
+    (slice(None), slice(None)),
+    (slice(2, 7), slice(3, 12, 2)),
+    (slice(None, None, -1), slice(5, 6)),
+    (5,),
+])
+# fmt: on
+def test_find_shared_array(index):
+    """
+    ``find_shared_array``, ``load_shared_block``: views of the array in shared memory are
+    reconstructed from the descriptor
+    """
+    data = np.random.rand(10, 12, 5)
+    shared = SharedArray(data)
+    try:
+        view = data[index]
+        # The segment is not allocated unless requested
+        assert find_shared_array(view) is None
+        assert not shared.is_allocated
+        descriptor = find_shared_array(view, allocate=True)
+        assert shared.is_allocated
+        assert descriptor is not None
+        assert descriptor[0] == shared.name
+        assert find_shared_array(view) == descriptor
+
+        block_index = (slice(1, 3),)
+        block = load_shared_block(descriptor, block_index)
+        npt.assert_array_equal(block, data[index][block_index])
+        assert not np.shares_memory(block, data)
+        # The workers can not modify the original array
+        assert not block.flags.writeable
+        with pytest.raises(ValueError, match="read-only"):
+            block[...] = 0
+        detach_shared_segments()
+        # The block remains valid after the segment is detached
+        npt.assert_array_equal(block, data[index][block_index])
+
+        assert find_shared_array(view.copy(), allocate=True) is None
+    finally:
+        shared.release()
+    assert find_shared_array(view, allocate=True) is None
+
+
+def test_create_shared_array(monkeypatch):
+    """
+    ``create_shared_array``: only large numpy arrays are registered, the arrays are not copied
+    """
+    monkeypatch.setattr(shared_arrays, "_shared_array_size_min", 1000)
+
+    assert create_shared_array(np.zeros(10)) is None
+    assert create_shared_array([1.0] * 1000) is None
+    assert create_shared_array(np.random.rand(1000, 2)[:, 0]) is None
+
+    data = np.random.rand(1000)
+    shared = create_shared_array(data)
+    assert isinstance(shared, SharedArray)
+    assert shared.data is data
+    assert not shared.is_allocated
+    shared.release()
+    shared.release()  # Repeated calls have no effect
+    assert shared.is_released
+
+    with dask.config.set({"pyxrf.shared-memory": False}):
+        assert create_shared_array(data) is None
@@ -37,10 +37,12 @@ class LeftPanel(QTabWidget):
     def update_widget_state(self, condition=None):
         # TODO: this function has to enable tabs and widgets based on the current program state
         state = not self.gui_vars["gui_state"]["running_computations"]
+        # Map fitting may be cancelled from 'Maps' tab
+        state_map_fitting = self.gui_vars["gui_state"]["running_map_fitting"]
         for i in range(self.count()):
             if state or (i != self.currentIndex()):
                 self.setTabEnabled(i, state)
-            self.widget(i).setEnabled(state)
+            self.widget(i).setEnabled(state or (state_map_fitting and self.widget(i) is self.fit_maps_tab))
 
         # Propagate the function call downstream (since the actual tab widget is 'QScrollArea')
         self.load_data_widget.update_widget_state(condition)
@@ -406,6 +406,10 @@ class MainWindow(QMainWindow):
         self.central_widget.left_panel.fit_maps_widget.signal_activate_tab_xrf_maps.connect(
             self.central_widget.right_panel.slot_activate_tab_xrf_maps
         )
+        # Partially completed maps are displayed while fitting is in progress
+        self.central_widget.left_panel.fit_maps_widget.signal_map_fitting_progress.connect(
+            self.central_widget.right_panel.tab_plot_xrf_maps.slot_update_dataset_info
+        )
 
         # Update map datasets (ROI maps)
         self.wnd_compute_roi_maps.signal_roi_computation_complete.connect(
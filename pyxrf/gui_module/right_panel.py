@@ -31,10 +31,16 @@ class RightPanel(QTabWidget):
         # TODO: this function has to enable tabs and widgets based on the current program state
         state_compute = global_gui_variables["gui_state"]["running_computations"]
         if state_compute:
-            # Disable everything
+            # Disable everything. 'XRF Maps' tab remains available during map fitting
+            #   so that partially completed maps could be displayed.
+            state_map_fitting = self.gui_vars["gui_state"]["running_map_fitting"]
+            state_xrf_map_exists = self.gui_vars["gui_state"]["state_xrf_map_exists"]
             for i in range(self.count()):
+                show_maps = (
+                    state_map_fitting and state_xrf_map_exists and (self.widget(i) is self.tab_plot_xrf_maps)
+                )
                 if i != self.currentIndex():
-                    self.setTabEnabled(i, False)
+                    self.setTabEnabled(i, show_maps)
                 self.widget(i).setEnabled(False)
         else:
             state_file_loaded = self.gui_vars["gui_state"]["state_file_loaded"]
@@ -1,9 +1,13 @@
 import logging
 import os
+import threading
+import time as ttime
 
 from qtpy.QtCore import QRunnable, QThreadPool, Signal, Slot
 from qtpy.QtWidgets import QGridLayout, QGroupBox, QLabel, QMessageBox, QPushButton, QVBoxLayout
 
+from ..core.instrumentation import QtSignalProgressSink, TerminalProgressSink
+from ..core.map_processing import ComputationCancelledError
 from .dlg_export_to_tiff_and_txt import DialogExportToTiffAndTxt
 from .dlg_save_calibration import DialogSaveCalibration
 from .form_base_widget import FormBaseWidget
@@ -19,6 +23,15 @@ class FitMapsWidget(FormBaseWidget):
 
     signal_map_fitting_complete = Signal()
     signal_activate_tab_xrf_maps = Signal()
+    # Partially completed maps are available (emitted from the background thread)
+    signal_map_fitting_partial_results = Signal(object)
+    # The list of datasets was updated with partially completed maps
+    signal_map_fitting_progress = Signal()
+    # Progress event (see 'core.instrumentation.ProgressMonitor', emitted from the background thread)
+    signal_map_fitting_progress_event = Signal(object)
+
+    # Minimum time interval between updates of partially completed maps, s
+    _partial_results_interval = 2.0
 
     def __init__(self, *, gpc, gui_vars):
         super().__init__()
@@ -51,6 +64,7 @@ class FitMapsWidget(FormBaseWidget):
         vbox.addSpacing(v_spacing)
 
         vbox.addWidget(self.pb_start_map_fitting)
+        vbox.addWidget(self.pb_cancel_map_fitting)
         vbox.addWidget(self.pb_compute_roi_maps)
         vbox.addSpacing(v_spacing)
 
@@ -66,6 +80,11 @@ class FitMapsWidget(FormBaseWidget):
         self._timer = None
         self._timer_counter = 0
 
+        # The event is set to cancel map fitting
+        self._map_fitting_cancel_event = None
+        self.signal_map_fitting_partial_results.connect(self.slot_map_fitting_partial_results)
+        self.signal_map_fitting_progress_event.connect(self.slot_map_fitting_progress_event)
+
     def _setup_settings(self):
         self.group_settings = QGroupBox("Options")
 
@@ -118,6 +137,10 @@ class FitMapsWidget(FormBaseWidget):
         self.pb_start_map_fitting = QPushButton("Start XRF Map Fitting")
         self.pb_start_map_fitting.clicked.connect(self.pb_start_map_fitting_clicked)
 
+        self.pb_cancel_map_fitting = QPushButton("Cancel XRF Map Fitting")
+        self.pb_cancel_map_fitting.clicked.connect(self.pb_cancel_map_fitting_clicked)
+        self.pb_cancel_map_fitting.setEnabled(False)
+
     def _setup_compute_roi_maps(self):
         self.pb_compute_roi_maps = QPushButton("Compute XRF Maps Based on ROI ...")
         self.pb_compute_roi_maps.clicked.connect(self.pb_compute_roi_maps_clicked)
@@ -187,6 +210,12 @@ class FitMapsWidget(FormBaseWidget):
             "in <b>'XRF Maps' tab</b>",
         )
 
+        set_tooltip(
+            self.pb_cancel_map_fitting,
+            "Click to <b>cancel fitting of the XRF Maps</b>. Partially completed maps remain "
+            "available in <b>'XRF Maps' tab</b>, but they are not saved to file.",
+        )
+
         set_tooltip(
             self.pb_compute_roi_maps,
             "Opens the window for setting up <b>spectral ROIs</b> and computating XRF Maps based on the ROIs",
@@ -219,11 +248,14 @@ class FitMapsWidget(FormBaseWidget):
         state_model_exist = self.gui_vars["gui_state"]["state_model_exists"]
         state_xrf_map_exists = self.gui_vars["gui_state"]["state_xrf_map_exists"]
 
-        self.group_settings.setEnabled(state_file_loaded & state_model_exist)
-        self.pb_start_map_fitting.setEnabled(state_file_loaded & state_model_exist)
-        self.pb_compute_roi_maps.setEnabled(state_file_loaded & state_model_exist)
-        self.group_save_results.setEnabled(state_xrf_map_exists)
-        self.group_quant_analysis.setEnabled(state_xrf_map_exists)
+        state_map_fitting = self.gui_vars["gui_state"]["running_map_fitting"]
+
+        self.group_settings.setEnabled(state_file_loaded & state_model_exist & (not state_map_fitting))
+        self.pb_start_map_fitting.setEnabled(state_file_loaded & state_model_exist & (not state_map_fitting))
+        self.pb_cancel_map_fitting.setEnabled(state_map_fitting and self._map_fitting_cancel_event is not None)
+        self.pb_compute_roi_maps.setEnabled(state_file_loaded & state_model_exist & (not state_map_fitting))
+        self.group_save_results.setEnabled(state_xrf_map_exists & (not state_map_fitting))
+        self.group_quant_analysis.setEnabled(state_xrf_map_exists & (not state_map_fitting))
 
     def slot_update_for_new_loaded_run(self):
         self.gpc.set_enable_save_spectra(False)
@@ -354,25 +386,92 @@ class FitMapsWidget(FormBaseWidget):
         self.ref_main_window.wnd_load_quantitative_calibration.activateWindow()
 
     def pb_start_map_fitting_clicked(self):
+        cancel_event = threading.Event()
+        signal_partial_results = self.signal_map_fitting_partial_results
+        t_last_update = [ttime.time()]
+        interval = self._partial_results_interval
+
+        def partial_results_callback(fit_name, result_map):
+            # Called from the background thread. The number of GUI updates is limited.
+            t = ttime.time()
+            if t - t_last_update[0] >= interval:
+                t_last_update[0] = t
+                # The maps are updated in place while fitting continues, so the copies are displayed
+                signal_partial_results.emit((fit_name, {k: v.copy() for k, v in result_map.items()}))
+
+        progress_sinks = [TerminalProgressSink(), QtSignalProgressSink(self.signal_map_fitting_progress_event)]
+
         def cb():
+            cancelled = False
             try:
-                self.gpc.fit_individual_pixels()
+                self.gpc.fit_individual_pixels(
+                    cancel_event=cancel_event,
+                    partial_results_callback=partial_results_callback,
+                    progress_sinks=progress_sinks,
+                )
                 success, msg = True, ""
+            except ComputationCancelledError:
+                success, msg, cancelled = False, "Fitting of XRF Maps was cancelled", True
             except Exception as ex:
                 success, msg = False, str(ex)
 
-            return {"success": success, "msg": msg}
+            return {"success": success, "msg": msg, "cancelled": cancelled}
 
+        self._map_fitting_cancel_event = cancel_event
+        self.gui_vars["gui_state"]["running_map_fitting"] = True
         self._compute_in_background(cb, self.slot_start_map_fitting_clicked)
 
+    def pb_cancel_map_fitting_clicked(self):
+        if self._map_fitting_cancel_event is not None:
+            logger.info("Cancelling fitting of XRF Maps ...")
+            self._map_fitting_cancel_event.set()
+            self.pb_cancel_map_fitting.setEnabled(False)
+
+    @Slot(object)
+    def slot_map_fitting_partial_results(self, partial_results):
+        # Results may arrive after fitting is completed
+        if self.gui_vars["gui_state"]["running_map_fitting"]:
+            fit_name, result_map = partial_results
+            self.gpc.show_partial_fitting_results(fit_name, result_map)
+            if not self.gui_vars["gui_state"]["state_xrf_map_exists"]:
+                self.gui_vars["gui_state"]["state_xrf_map_exists"] = True
+                self.update_global_state.emit()
+                self.signal_activate_tab_xrf_maps.emit()
+            self.signal_map_fitting_progress.emit()
+
+    @Slot(object)
+    def slot_map_fitting_progress_event(self, event):
+        # Events may arrive after fitting is completed
+        if self.gui_vars["gui_state"]["running_map_fitting"]:
+            self.ref_main_window.statusProgressBar.setValue(int(event["percent_completed"]))
+            status_bar = self.ref_main_window.statusBar()
+            status_bar.showMessage(
+                f"Fitting XRF Maps: {event['n_blocks_completed']}/{event['n_blocks']} blocks, "
+                f"{event['pixels_per_second']:.0f} pixels/s"
+            )
+
     @Slot(object)
     def slot_start_map_fitting_clicked(self, result):
+        self._map_fitting_cancel_event = None
+        self.gui_vars["gui_state"]["running_map_fitting"] = False
+        self.ref_main_window.statusProgressBar.setValue(0)
+        self.ref_main_window.statusBar().clearMessage()
         self._recover_after_compute(self.slot_start_map_fitting_clicked)
+        self.gpc.discard_partial_fitting_results()
 
         success = result["success"]
         if success:
             self.gui_vars["gui_state"]["state_xrf_map_exists"] = True
         else:
+            # The partially completed maps may have been the only maps
+            self.gui_vars["gui_state"]["state_xrf_map_exists"] = self.gpc.is_xrf_maps_available()
+
+        if result["cancelled"]:
+            status_bar = self.ref_main_window.statusBar()
+            status_bar.showMessage(
+                "Fitting of XRF Maps was cancelled. Partially completed maps are not saved.", 5000
+            )
+        elif not success:
             msg = result["msg"]
             msgbox = QMessageBox(
                 QMessageBox.Critical, "Failed to Fit Individual Pixel Spectra", msg, QMessageBox.Ok, parent=self
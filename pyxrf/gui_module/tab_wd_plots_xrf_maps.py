@@ -144,9 +144,10 @@ class PlotXrfMaps(QWidget):
             self._set_tooltips()
         self.mpl_toolbar.setVisible(self.gui_vars["show_matplotlib_toolbar"])
 
-        # Hide Matplotlib canvas during computations
+        # Hide Matplotlib canvas during computations (except map fitting, which displays partial results)
         state_compute = global_gui_variables["gui_state"]["running_computations"]
-        self.mpl_canvas.setVisible(not state_compute)
+        state_map_fitting = global_gui_variables["gui_state"]["running_map_fitting"]
+        self.mpl_canvas.setVisible(not state_compute or state_map_fitting)
 
     @Slot()
     def update_combo_quant_ref(self):
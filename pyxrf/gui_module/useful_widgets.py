@@ -29,6 +29,8 @@ global_gui_variables = {
     "gui_state": {
         "databroker_available": False,
         "running_computations": False,
+        # Map fitting is running (may be cancelled, partial results are displayed)
+        "running_map_fitting": False,
         # The following states are NOT mutually exclusive
         "state_file_loaded": False,
         "state_model_exists": False,
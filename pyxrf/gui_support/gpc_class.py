@@ -28,6 +28,8 @@ class GlobalProcessingClasses:
         self.roi_model = None
         self.img_model_adv = None
         self.img_model_rgb = None
+        # Names of the datasets with partially completed maps (see 'show_partial_fitting_results')
+        self._partial_fit_names = set()
 
     def _get_defaults(self):
         # Set working directory to current working directory (if PyXRF is started from shell)
@@ -1715,10 +1717,21 @@ class GlobalProcessingClasses:
 
     # ==========================================================================
     #          The following methods are used by Maps tab
-    def fit_individual_pixels(self):
+    def fit_individual_pixels(self, *, cancel_event=None, partial_results_callback=None, progress_sinks=None):
+        """
+        Fit the XRF map. Fitting is cancelled if ``cancel_event`` (``threading.Event``) is set.
+        The function ``partial_results_callback(fit_name, result_map)`` is called each time
+        a block of the map is fitted (see ``Fit1D.fit_single_pixel``). The partial results
+        may be displayed by calling ``show_partial_fitting_results``. The progress events
+        are sent to ``progress_sinks`` (e.g. ``QtSignalProgressSink``).
+        """
         self.apply_to_fit()
 
-        self.fit_model.fit_single_pixel()
+        self.fit_model.fit_single_pixel(
+            cancel_event=cancel_event,
+            partial_results_callback=partial_results_callback,
+            progress_sinks=progress_sinks,
+        )
 
         # add scalers to fit dict
         scaler_keys = [v for v in self.io_model.img_dict.keys() if "scaler" in v]
@@ -1729,6 +1742,30 @@ class GlobalProcessingClasses:
 
         self.io_model.update_img_dict(self.fit_model.fit_img)
 
+    def show_partial_fitting_results(self, fit_name, result_map):
+        """
+        Add partially completed maps generated during fitting to the list of datasets,
+        so that they could be displayed in 'XRF Maps' tab. The maps are added under
+        the temporary name ``partial_<fit_name>``, so the existing results with the name
+        ``fit_name`` are not replaced before fitting is completed. The maps must be removed
+        by calling ``discard_partial_fitting_results`` once fitting is completed, cancelled or failed.
+        """
+        partial_fit_name = f"partial_{fit_name}"
+        self._partial_fit_names.add(partial_fit_name)
+        result_map = dict(result_map)
+        scaler_keys = [v for v in self.io_model.img_dict.keys() if "scaler" in v]
+        if len(scaler_keys) > 0:
+            result_map.update(self.io_model.img_dict[scaler_keys[0]])
+        self.io_model.update_img_dict({partial_fit_name: result_map})
+
+    def discard_partial_fitting_results(self):
+        """
+        Remove partially completed maps (see ``show_partial_fitting_results``) from the list of datasets.
+        """
+        if self._partial_fit_names:
+            self.io_model.remove_img_dict_items(self._partial_fit_names)
+            self._partial_fit_names = set()
+
     # ==========================================================================
     #          The following methods are used by ROI window
     def get_roi_selected_element_list(self):
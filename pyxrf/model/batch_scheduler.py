@@ -0,0 +1,321 @@
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time as ttime
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class BatchManifest:
+    """
+    Record of the files processed in a batch (see `pyxrf_batch`). The manifest is a JSON file
+    with one entry per data file, which contains the status of processing (``"completed"`` or
+    ``"failed"``), processing time, the time of completion and the processing key (checksum of
+    the processing parameters). The manifest is saved after each file is processed, so if the batch
+    is interrupted, the files that were completed are skipped when the batch is restarted.
+    A completed file is processed again if the processing parameters are changed or the file
+    is modified after processing.
+
+    Parameters
+    ----------
+    file_path: str
+        path to the manifest file. The file is created if it does not exist.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = os.path.abspath(os.path.expanduser(file_path))
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(self.file_path):
+            try:
+                with open(self.file_path, "r") as f:
+                    self._entries = json.load(f)["files"]
+            except Exception as ex:
+                logger.warning(f"Failed to load batch manifest '{self.file_path}': {ex}. The manifest is reset.")
+
+    @staticmethod
+    def _file_state(fpath):
+        st = os.stat(fpath)
+        return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    def is_completed(self, fpath, processing_key=""):
+        """
+        Check if the file was successfully processed with the same parameters and not modified since.
+        """
+        fpath = os.path.abspath(fpath)
+        with self._lock:
+            entry = self._entries.get(fpath, None)
+        if not entry or (entry.get("status") != "completed") or (entry.get("processing_key") != processing_key):
+            return False
+        try:
+            return entry.get("file_state") == self._file_state(fpath)
+        except OSError:
+            return False
+
+    def record(self, fpath, *, status, processing_time, processing_key="", error=None):
+        """
+        Record the result of processing of the file and save the manifest.
+        """
+        fpath = os.path.abspath(fpath)
+        entry = {
+            "status": status,
+            "processing_key": processing_key,
+            "processing_time": processing_time,
+            "time_completed": ttime.strftime("%Y-%m-%dT%H:%M:%S", ttime.localtime()),
+        }
+        if error is not None:
+            entry["error"] = str(error)
+        try:
+            entry["file_state"] = self._file_state(fpath)
+        except OSError:
+            pass
+        with self._lock:
+            self._entries[fpath] = entry
+            self._save()
+
+    def _save(self):
+        # The manifest is replaced atomically, so it remains valid if the process is killed
+        dir_name = os.path.dirname(self.file_path)
+        os.makedirs(dir_name, exist_ok=True)
+        fd, fpath_tmp = tempfile.mkstemp(suffix=".tmp", dir=dir_name)
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"files": self._entries}, f, indent=2)
+            os.replace(fpath_tmp, self.file_path)
+        except Exception:
+            os.remove(fpath_tmp)
+            raise
+
+
+def compute_processing_key(param_file_names, **options):
+    """
+    Compute the checksum of the contents of the parameter files and processing options.
+    The key is used to detect that a file has to be processed again.
+
+    Parameters
+    ----------
+    param_file_names: list(str)
+        paths to the parameter files
+    options: dict
+        processing options. The values must be representable as JSON.
+
+    Raises
+    ------
+    IOError if one of the parameter files does not exist.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for fln in param_file_names:
+        if not os.path.isfile(fln):
+            raise IOError(f"Processing parameter file '{fln}' does not exist.")
+        h.update(f"{fln};".encode())
+        with open(fln, "rb") as f:
+            h.update(f.read())
+    h.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return h.hexdigest()
+
+
+def prefetch_file(fpath, *, block_size=16 * 1024**2, cancel_event=None):
+    """
+    Read the file sequentially to load it in the page cache of the operating system, so that
+    the raw data is read from memory when the file is processed. The data is not kept by
+    the function. Reading is stopped once ``cancel_event`` is set.
+
+    Returns
+    -------
+    int
+        the number of bytes read
+    """
+    n_bytes = 0
+    with open(fpath, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        buffer = bytearray(block_size)
+        while (cancel_event is None) or not cancel_event.is_set():
+            n = f.readinto(buffer)
+            if not n:
+                break
+            n_bytes += n
+    return n_bytes
+
+
+def run_batch(
+    flist,
+    process_file,
+    *,
+    n_concurrent_files=1,
+    n_prefetch_files=1,
+    manifest=None,
+    processing_key="",
+    raise_exceptions=False,
+):
+    """
+    Process the list of files. Up to ``n_concurrent_files`` files are processed concurrently
+    (e.g. small files that do not fully load the Dask cluster), while up to ``n_prefetch_files`` of
+    the following files are read in the background (see `prefetch_file`), so that reading of the next
+    files overlaps with processing of the current ones. The files that are completed according to
+    the ``manifest`` are skipped and the results of processing are recorded in the manifest.
+
+    Parameters
+    ----------
+    flist: list(str)
+        the list of paths to the files
+    process_file: callable
+        function ``process_file(fpath)`` that processes one file. The function may be called
+        from different threads.
+    n_concurrent_files: int
+        the maximum number of files processed concurrently
+    n_prefetch_files: int
+        the number of files read ahead, 0 - the files are not prefetched
+    manifest: BatchManifest or None
+        the manifest of the batch or None
+    processing_key: str or callable
+        the key that identifies processing parameters (see `compute_processing_key`) or function
+        ``processing_key(fpath)`` that returns the key for the file (e.g. if the parameters
+        depend on the location of the file). The keys are computed before processing is started
+        and only if ``manifest`` is not None. If the key can not be computed for a file (e.g.
+        a parameter file is missing), then processing of the file fails.
+    raise_exceptions: bool
+        if True, then the exception raised while processing a file is reraised and the files
+        that were not started are not processed. Otherwise the error is printed and the processing
+        of the remaining files continues.
+
+    Returns
+    -------
+    list(dict)
+        timing summary: the list of dictionaries with the keys ``file``, ``status`` (``"completed"``,
+        ``"failed"`` or ``"skipped"``), ``wait_time`` (time between the start of the batch and the start
+        of processing of the file, s) and ``processing_time`` (s) in the order of ``flist``.
+    """
+    for name, value, value_min in (
+        ("n_concurrent_files", n_concurrent_files, 1),
+        ("n_prefetch_files", n_prefetch_files, 0),
+    ):
+        if not isinstance(value, int) or isinstance(value, bool) or (value < value_min):
+            raise ValueError(f"Parameter '{name}' must be an integer >= {value_min}: {name} = {value!r}")
+
+    summary = [{"file": _, "status": "skipped", "wait_time": 0.0, "processing_time": 0.0} for _ in flist]
+    keys, key_errors = [processing_key] * len(flist), {}
+    if (manifest is not None) and callable(processing_key):
+        for n, fpath in enumerate(flist):
+            try:
+                keys[n] = processing_key(fpath)
+            except Exception as ex:
+                keys[n], key_errors[n] = "", ex
+    pending = []
+    for n, fpath in enumerate(flist):
+        if (n not in key_errors) and (manifest is not None) and manifest.is_completed(fpath, keys[n]):
+            print(f"File '{fpath}' was already processed. Skipping the file.")
+        else:
+            pending.append(n)
+
+    t_batch_start = ttime.monotonic()
+    cancel_event = threading.Event()
+
+    def _process(n):
+        fpath = flist[n]
+        summary[n]["wait_time"] = ttime.monotonic() - t_batch_start
+        t_start = ttime.monotonic()
+        error = None
+        try:
+            if n in key_errors:
+                raise key_errors[n]
+            process_file(fpath)
+            status = "completed"
+        except Exception as ex:
+            status, error = "failed", ex
+        summary[n]["processing_time"] = ttime.monotonic() - t_start
+        summary[n]["status"] = status
+        if manifest is not None:
+            manifest.record(
+                fpath,
+                status=status,
+                processing_time=summary[n]["processing_time"],
+                processing_key=keys[n],
+                error=error,
+            )
+        if error is not None:
+            raise error
+
+    def _prefetch(n):
+        try:
+            t_start = ttime.monotonic()
+            n_bytes = prefetch_file(flist[n], cancel_event=cancel_event)
+            logger.debug(
+                f"File '{flist[n]}' is prefetched: {n_bytes} bytes in {ttime.monotonic() - t_start:.2f} s"
+            )
+        except Exception as ex:
+            logger.warning(f"Failed to prefetch the file '{flist[n]}': {ex}")
+
+    prefetch_pool = (
+        concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="pyxrf-prefetch")
+        if n_prefetch_files
+        else None
+    )
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=n_concurrent_files, thread_name_prefix="pyxrf-batch"
+        ) as pool:
+            futures, n_next, n_prefetched = {}, 0, 0
+            while (n_next < len(pending)) or futures:
+                while (n_next < len(pending)) and (len(futures) < n_concurrent_files):
+                    n = pending[n_next]
+                    print(f"Processing file '{flist[n]}' ...")
+                    futures[pool.submit(_process, n)] = n
+                    n_next += 1
+                # The files that are started next are read while the current files are processed
+                n_prefetched = max(n_prefetched, n_next)
+                while (prefetch_pool is not None) and (
+                    n_prefetched < min(n_next + n_prefetch_files, len(pending))
+                ):
+                    prefetch_pool.submit(_prefetch, pending[n_prefetched])
+                    n_prefetched += 1
+
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for fut in done:
+                    n = futures.pop(fut)
+                    try:
+                        fut.result()
+                    except Exception as ex:
+                        if raise_exceptions:
+                            for f in futures:
+                                f.cancel()
+                            raise
+                        print(f"ERROR: could not process the file '{flist[n]}'. No results are saved.")
+                        print(f"Exception: {ex}")
+                        traceback.print_tb(ex.__traceback__)
+    finally:
+        cancel_event.set()
+        if prefetch_pool is not None:
+            prefetch_pool.shutdown(wait=True, cancel_futures=True)
+
+    return summary
+
+
+def format_timing_summary(summary):
+    """
+    Format the timing summary returned by `run_batch` as a table.
+
+    Returns
+    -------
+    str
+        the table
+    """
+    lines = [f"{'File':<50} {'Status':<10} {'Started, s':>12} {'Processing, s':>14}"]
+    for entry in summary:
+        fname = os.path.basename(entry["file"])
+        lines.append(
+            f"{fname:<50} {entry['status']:<10} {entry['wait_time']:>12.1f} {entry['processing_time']:>14.1f}"
+        )
+    completed = [_ for _ in summary if _["status"] == "completed"]
+    n_failed = len([_ for _ in summary if _["status"] == "failed"])
+    total_time = sum([_["processing_time"] for _ in completed])
+    lines.append(
+        f"Completed: {len(completed)}, failed: {n_failed}, skipped: {len(summary) - len(completed) - n_failed}. "
+        f"Total processing time of completed files: {total_time:.1f} s"
+    )
+    return "\n".join(lines)
@@ -7,19 +7,22 @@ import logging
 import multiprocessing
 import os
 import re
-import sys
 import time
-import traceback
 from collections.abc import Iterable
 
 import h5py
 import numpy as np
 from skbeam.core.fitting.xrf_model import define_range, linear_spectrum_fitting
 
-from ..core.map_processing import dask_client_create
 from ..core.quant_analysis import ParamQuantitativeAnalysis
-from .fileio import output_data, read_hdf_APS, read_MAPS, sep_v
-from .fit_spectrum import save_fitdata_to_hdf, single_pixel_fitting_controller
+from .batch_scheduler import BatchManifest, compute_processing_key, format_timing_summary, run_batch
+from .fileio import get_fit_data, output_data, read_hdf_APS, read_MAPS, sep_v
+from .fit_spectrum import (
+    multi_map_fitting_controller,
+    parameter_sweep_fitting_controller,
+    save_fitdata_to_hdf,
+    single_pixel_fitting_controller,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -51,6 +54,10 @@ def fit_pixel_data_and_save(
     interpolate_to_uniform_grid=False,
     data_from="NSLS-II",
     dask_client=None,
+    stream_results_to_file=False,
+    fit_channels_together=False,
+    progress_sinks=None,
+    result_cache=None,
 ):
     """
     Do fitting for signle data set, and save data accordingly. Fitting can be performed on
@@ -92,7 +99,9 @@ def fit_pixel_data_and_save(
     method : str, optional
         fitting method, default as nnls
     pixel_bin : int, optional
-        bin pixel as 2by2, or 3by3
+        size of the window for spatial binning (e.g. 2 for 2x2 binning), 0 or 1 - no binning.
+        The fitting results are assigned to each pixel of the window, so the maps are
+        not resized. Binning is intended for fast quick-look processing.
     raise_bg : int, optional
         add a constant value to each spectrum, better for fitting
     comp_elastic_combine : bool, optional
@@ -102,7 +111,7 @@ def fit_pixel_data_and_save(
     use_snip : bool, optional
         use snip method to remove background
     bin_energy : int, optional
-        bin spectrum with given value
+        the number of adjacent spectral channels combined in one bin, 0 or 1 - no binning
     save_txt : bool, optional
         save data to txt or not
     save_tiff : bool, optional
@@ -120,13 +129,135 @@ def fit_pixel_data_and_save(
     data_from : str, optional
         where do data come from? Data format includes data from NSLS-II, or 2IDE-APS
     dask_client: dask.distributed.Client
-        Dask client object. If None, then Dask client is created automatically.
+        Dask client object. If None, then the shared Dask client is used (see ``dask_client_manager``).
         If a batch of files is processed, then creating Dask client and
         passing the reference to it to the processing functions will save
         execution time: `client = Client(processes=True, silence_logs=logging.ERROR)`
+    stream_results_to_file : bool
+        if True, then the fitting results are written to a temporary HDF5 file block by block as
+        they are computed instead of being assembled in memory and are moved to the data file
+        once fitting is completed. The maps are loaded back from the file only if they need
+        to be saved as .txt or .tiff files.
+    fit_channels_together : bool
+        if True, then the sum and the individual detector channels (selected by ``fit_channel_sum``
+        and ``fit_channel_each``) are fitted as one computation instead of one dataset at a time.
+        The workers stay busy between the datasets and the overhead of setting up the computations
+        is paid once. The results are the same.
+    progress_sinks : list(callable) or callable or None
+        sinks that receive structured progress and throughput events during fitting
+        (see ``ProgressMonitor``). If None, then the progress bar is displayed in the terminal.
+    result_cache : ResultCache, str or None
+        cache for fitting results: ``ResultCache`` object or path to the cache directory
+        (see ``single_pixel_fitting_controller``). The datasets processed with the same
+        parameters are not fitted again, the results are loaded from the cache.
     """
     fpath = os.path.join(working_directory, file_name)
 
+    fitting_kwargs = dict(
+        method=method,
+        pixel_bin=pixel_bin,
+        raise_bg=raise_bg,
+        comp_elastic_combine=comp_elastic_combine,
+        linear_bg=linear_bg,
+        use_snip=use_snip,
+        bin_energy=bin_energy,
+        dask_client=dask_client,
+        output_fpath=fpath if stream_results_to_file else None,
+        progress_sinks=progress_sinks,
+        result_cache=result_cache,
+    )
+
+    def _save_or_load(result_map, inner_path):
+        """Save fitting results to the file. Returns the maps if they are needed."""
+        if not stream_results_to_file:
+            # output to .h5 file
+            save_fitdata_to_hdf(fpath, result_map, datapath=inner_path)
+        elif save_txt or save_tiff:
+            with h5py.File(fpath, "r") as f:
+                result_map = get_fit_data(f[inner_path]["xrf_fit_name"][()], f[inner_path]["xrf_fit"][()])
+        else:
+            result_map = {}  # The maps are not used
+        return result_map
+
+    def _fit_and_save(data, param, inner_path):
+        """Fit the data and save results to the file. Returns the maps if they are needed."""
+        result_map, _ = single_pixel_fitting_controller(
+            data, param, incident_energy=incident_energy, output_datapath=inner_path, **fitting_kwargs
+        )
+        return _save_or_load(result_map, inner_path)
+
+    def _fit_and_save_together(tasks):
+        """Fit all the datasets as one computation and save results. Returns the list of maps."""
+        fitting_tasks = [
+            {
+                "input_data": _["data"],
+                "parameter": _["param"],
+                "incident_energy": incident_energy,
+                "output_datapath": _["inner_path"],
+            }
+            for _ in tasks
+        ]
+        results = multi_map_fitting_controller(fitting_tasks, **fitting_kwargs)
+        return [_save_or_load(result_map, task["inner_path"]) for (result_map, _info), task in zip(results, tasks)]
+
+    def _load_param(param_file_name, mdata):
+        """Load parameters from file and select incident energy used for processing."""
+        return _load_fitting_parameters(
+            param_file_name,
+            working_directory=working_directory,
+            file_name=file_name,
+            mdata=mdata,
+            incident_energy=incident_energy,
+            ignore_datafile_metadata=ignore_datafile_metadata,
+        )
+
+    def get_scaler_set(img_dict):
+        sc_set_names = [_ for _ in img_dict if _.endswith("_scaler")]
+        if sc_set_names:
+            return img_dict[sc_set_names[0]]
+        else:
+            return {}
+
+    def get_positions_set(img_dict):
+        if "positions" in img_dict:
+            return img_dict["positions"]
+        else:
+            return {}
+
+    def _output_results(result_map, task):
+        """Save the maps as .txt and .tiff files (if requested)"""
+        img_dict = task["img_dict"]
+        scaler_dict = get_scaler_set(img_dict)
+        scaler_name_list = list(scaler_dict.keys())
+        positions_dict = get_positions_set(img_dict)
+        # Generate dataset
+        dataset = copy.deepcopy(scaler_dict)
+        dataset.update(result_map)
+
+        # Set parameters for quantitative normalization
+        param_quant_analysis.experiment_incident_energy = task["incident_energy_used"]
+        param_quant_analysis.experiment_distance_to_sample = quant_distance_to_sample
+        param_quant_analysis.experiment_detector_channel = task["channel_name"]
+
+        for save_file, file_format in ((save_txt, "txt"), (save_tiff, "tiff")):
+            if save_file is True:
+                output_folder = f"output_{file_format}_" + prefix_fname
+                output_path = os.path.join(working_directory, output_folder)
+                output_data(
+                    output_dir=output_path,
+                    interpolate_to_uniform_grid=interpolate_to_uniform_grid,
+                    dataset_name=task["dataset_name"],
+                    quant_norm=quant_norm,
+                    quant_ref_eline=quant_ref_eline,
+                    param_quant_analysis=param_quant_analysis,
+                    dataset_dict=dataset,
+                    positions_dict=positions_dict,
+                    file_format=file_format,
+                    scaler_name=scaler_name,
+                    scaler_name_list=scaler_name_list,
+                    use_average=use_average,
+                )
+
     # Load quantitative calibration files (if necessary)
     quant_norm = False  # Indicates if at least one calibration file is loaded
     param_quant_analysis = ParamQuantitativeAnalysis()
@@ -147,6 +278,9 @@ def fit_pixel_data_and_save(
 
     t0 = time.time()
     prefix_fname = file_name.split(".")[0]
+
+    # The list of datasets to process. The raw data is not loaded in memory at this point.
+    tasks = []
     if fit_channel_sum is True:
         if data_from == "NSLS-II":
             img_dict, data_sets, mdata = read_hdf_APS(working_directory, file_name, load_each_channel=False)
@@ -160,112 +294,19 @@ def fit_pixel_data_and_save(
         except KeyError:
             data_all_sum = data_sets[prefix_fname].raw_data
 
-        # load param file
-        if not os.path.isabs(param_file_name):
-            param_path = os.path.join(working_directory, param_file_name)
-        else:
-            param_path = param_file_name
-        with open(param_path, "r") as json_data:
-            param_sum = json.load(json_data)
-
-        # update incident energy, required for XANES
-        if incident_energy is not None:
-            param_sum["coherent_sct_energy"]["value"] = incident_energy
-            print("Using incident beam energy passed as the function parameter.")
-        elif (
-            mdata.is_metadata_available()
-            and "instrument_mono_incident_energy" in mdata
-            and not ignore_datafile_metadata
-        ):
-            param_sum["coherent_sct_energy"]["value"] = mdata["instrument_mono_incident_energy"]
-            print(f"Using incident beam energy from the data file '{file_name}'.")
-        else:
-            print(f"Using incident beam energy from the parameter file '{param_path}'.")
-
-        # The value of incident energy that is used for processing
-        incident_energy_used = param_sum["coherent_sct_energy"]["value"]
-        print(f"Incident beam energy: {incident_energy_used}.")
-
-        result_map_sum, calculation_info = single_pixel_fitting_controller(
-            data_all_sum,
-            param_sum,
-            incident_energy=incident_energy,
-            method=method,
-            pixel_bin=pixel_bin,
-            raise_bg=raise_bg,
-            comp_elastic_combine=comp_elastic_combine,
-            linear_bg=linear_bg,
-            use_snip=use_snip,
-            bin_energy=bin_energy,
-            dask_client=dask_client,
+        param_sum, incident_energy_used = _load_param(param_file_name, mdata)
+        tasks.append(
+            {
+                "data": data_all_sum,
+                "param": param_sum,
+                "incident_energy_used": incident_energy_used,
+                "inner_path": "xrfmap/detsum",
+                "channel_name": "sum",
+                "dataset_name": "dataset_fit",  # Sum of all detectors: should end with '_fit'
+                "img_dict": img_dict,
+            }
         )
 
-        # output to .h5 file
-        inner_path = "xrfmap/detsum"
-        # fit_name = prefix_fname+'_fit'
-        save_fitdata_to_hdf(fpath, result_map_sum, datapath=inner_path)
-
-        def get_scaler_set(img_dict):
-            sc_set_names = [_ for _ in img_dict if _.endswith("_scaler")]
-            if sc_set_names:
-                return img_dict[sc_set_names[0]]
-            else:
-                return {}
-
-        def get_positions_set(img_dict):
-            if "positions" in img_dict:
-                return img_dict["positions"]
-            else:
-                return {}
-
-        scaler_dict = get_scaler_set(img_dict)
-        scaler_name_list = list(scaler_dict.keys())
-        positions_dict = get_positions_set(img_dict)
-        # Generate dataset
-        dataset = copy.deepcopy(scaler_dict)
-        dataset.update(result_map_sum)
-
-        # Set parameters for quantitative normalization
-        param_quant_analysis.experiment_incident_energy = incident_energy_used
-        param_quant_analysis.experiment_distance_to_sample = quant_distance_to_sample
-        param_quant_analysis.experiment_detector_channel = "sum"
-
-        if save_txt is True:
-            output_folder = "output_txt_" + prefix_fname
-            output_path = os.path.join(working_directory, output_folder)
-            output_data(
-                output_dir=output_path,
-                interpolate_to_uniform_grid=interpolate_to_uniform_grid,
-                dataset_name="dataset_fit",  # Sum of all detectors: should end with '_fit'
-                quant_norm=quant_norm,
-                quant_ref_eline=quant_ref_eline,
-                param_quant_analysis=param_quant_analysis,
-                dataset_dict=dataset,
-                positions_dict=positions_dict,
-                file_format="txt",
-                scaler_name=scaler_name,
-                scaler_name_list=scaler_name_list,
-                use_average=use_average,
-            )
-
-        if save_tiff is True:
-            output_folder = "output_tiff_" + prefix_fname
-            output_path = os.path.join(working_directory, output_folder)
-            output_data(
-                output_dir=output_path,
-                interpolate_to_uniform_grid=interpolate_to_uniform_grid,
-                dataset_name="dataset_fit",  # Sum of all detectors: should end with '_fit'
-                quant_norm=quant_norm,
-                quant_ref_eline=quant_ref_eline,
-                param_quant_analysis=param_quant_analysis,
-                dataset_dict=dataset,
-                positions_dict=positions_dict,
-                file_format="tiff",
-                scaler_name=scaler_name,
-                scaler_name_list=scaler_name_list,
-                use_average=use_average,
-            )
-
     if fit_channel_each:
         img_dict, data_sets, mdata = read_hdf_APS(working_directory, file_name, load_each_channel=True)
 
@@ -284,120 +325,187 @@ def fit_pixel_data_and_save(
 
         channel_num = len(param_channel_list)
         for i in range(channel_num):
-            inner_path = "xrfmap/" + det_channel_names[i]
             print(f"Processing data from detector channel {det_channel_names[i]} (#{i + 1}) ...")
+            param_det, incident_energy_used = _load_param(param_channel_list[i], mdata)
+            tasks.append(
+                {
+                    "data": data_sets[det_channels[i]].raw_data,
+                    "param": param_det,
+                    "incident_energy_used": incident_energy_used,
+                    "inner_path": "xrfmap/" + det_channel_names[i],
+                    "channel_name": det_channel_names[i],
+                    "dataset_name": f"dataset_{det_channel_names[i]}_fit",  # ..._det1_fit, etc.
+                    "img_dict": img_dict,
+                }
+            )
 
-            # load param file
-            param_file_name = param_channel_list[i]
+    if fit_channels_together and tasks:
+        print(f"Fitting {len(tasks)} dataset(s) as one computation ...")
+        result_maps = _fit_and_save_together(tasks)
+        for result_map, task in zip(result_maps, tasks):
+            _output_results(result_map, task)
+    else:
+        for task in tasks:
+            result_map = _fit_and_save(task["data"], task["param"], task["inner_path"])
+            _output_results(result_map, task)
 
-            # load param file
-            if not os.path.isabs(param_file_name):
-                param_path = os.path.join(working_directory, param_file_name)
-            else:
-                param_path = param_file_name
-            with open(param_path, "r") as json_data:
-                param_det = json.load(json_data)
-
-            # update incident energy, required for XANES
-            if incident_energy is not None:
-                param_det["coherent_sct_energy"]["value"] = incident_energy
-                print("Using incident beam energy passed as the function parameter.")
-            elif (
-                mdata.is_metadata_available()
-                and "instrument_mono_incident_energy" in mdata
-                and not ignore_datafile_metadata
-            ):
-                param_det["coherent_sct_energy"]["value"] = mdata["instrument_mono_incident_energy"]
-                print(f"Using incident beam energy from the data file '{file_name}'.")
-            else:
-                print(f"Using incident beam energy from the parameter file '{param_path}'.")
+    t1 = time.time()
+    print(f"Processing time: {t1 - t0}")
 
-            # The value of incident energy that is used for processing
-            incident_energy_used = param_det["coherent_sct_energy"]["value"]
-            print(f"Incident beam energy: {incident_energy_used}.")
 
-            data_all_det = data_sets[det_channels[i]].raw_data
+def _load_fitting_parameters(
+    param_file_name, *, working_directory, file_name, mdata, incident_energy, ignore_datafile_metadata
+):
+    """
+    Load fitting parameters from the JSON file and select incident energy used for processing
+    (see ``fit_pixel_data_and_save``). Returns the parameters and the incident energy.
+    """
+    if not os.path.isabs(param_file_name):
+        param_path = os.path.join(working_directory, param_file_name)
+    else:
+        param_path = param_file_name
+    with open(param_path, "r") as json_data:
+        param = json.load(json_data)
 
-            result_map_det, calculation_info = single_pixel_fitting_controller(
-                data_all_det,
-                param_det,
-                incident_energy=incident_energy,
-                method=method,
-                pixel_bin=pixel_bin,
-                raise_bg=raise_bg,
-                comp_elastic_combine=comp_elastic_combine,
-                linear_bg=linear_bg,
-                use_snip=use_snip,
-                bin_energy=bin_energy,
-                dask_client=dask_client,
-            )
+    # update incident energy, required for XANES
+    if incident_energy is not None:
+        param["coherent_sct_energy"]["value"] = incident_energy
+        print("Using incident beam energy passed as the function parameter.")
+    elif (
+        mdata.is_metadata_available()
+        and "instrument_mono_incident_energy" in mdata
+        and not ignore_datafile_metadata
+    ):
+        param["coherent_sct_energy"]["value"] = mdata["instrument_mono_incident_energy"]
+        print(f"Using incident beam energy from the data file '{file_name}'.")
+    else:
+        print(f"Using incident beam energy from the parameter file '{param_path}'.")
 
-            # output to .h5 file
-            save_fitdata_to_hdf(fpath, result_map_det, datapath=inner_path)
+    # The value of incident energy that is used for processing
+    incident_energy_used = param["coherent_sct_energy"]["value"]
+    print(f"Incident beam energy: {incident_energy_used}.")
+    return param, incident_energy_used
 
-            def get_scaler_set(img_dict):
-                sc_set_names = [_ for _ in img_dict if _.endswith("_scaler")]
-                if sc_set_names:
-                    return img_dict[sc_set_names[0]]
-                else:
-                    return {}
 
-            def get_positions_set(img_dict):
-                if "positions" in img_dict:
-                    return img_dict["positions"]
-                else:
-                    return {}
-
-            scaler_dict = get_scaler_set(img_dict)
-            scaler_name_list = list(scaler_dict.keys())
-            positions_dict = get_positions_set(img_dict)
-            # Generate dataset
-            dataset = copy.deepcopy(scaler_dict)
-            dataset.update(result_map_det)
-
-            # Set parameters for quantitative normalization
-            param_quant_analysis.experiment_incident_energy = incident_energy_used
-            param_quant_analysis.experiment_distance_to_sample = quant_distance_to_sample
-            param_quant_analysis.experiment_detector_channel = det_channel_names[i]
-
-            if save_txt is True:
-                output_folder = "output_txt_" + prefix_fname
-                output_path = os.path.join(working_directory, output_folder)
-                output_data(
-                    output_dir=output_path,
-                    interpolate_to_uniform_grid=interpolate_to_uniform_grid,
-                    dataset_name=f"dataset_{det_channel_names[i]}_fit",  # ..._det1_fit, etc.
-                    quant_norm=quant_norm,
-                    quant_ref_eline=quant_ref_eline,
-                    param_quant_analysis=param_quant_analysis,
-                    dataset_dict=dataset,
-                    positions_dict=positions_dict,
-                    file_format="txt",
-                    scaler_name=scaler_name,
-                    scaler_name_list=scaler_name_list,
-                    use_average=use_average,
-                )
+def fit_pixel_data_sweep_and_save(
+    working_directory,
+    file_name,
+    *,
+    param_file_names,
+    result_names=None,
+    incident_energy=None,
+    ignore_datafile_metadata=False,
+    pixel_bin=0,
+    comp_elastic_combine=False,
+    linear_bg=False,
+    use_snip=True,
+    bin_energy=0,
+    data_from="NSLS-II",
+    dask_client=None,
+    progress_sinks=None,
+):
+    """
+    Fit the sum of detector channels in a single data file with multiple sets of parameters
+    (parameter sweep), e.g. to compare fitting with different lists of emission lines or energy
+    bounds. The raw data is read once and SNIP background is computed once for each distinct
+    combination of energy bounds and background parameters, so fitting with many sets of parameters
+    takes approximately as long as a single run of ``fit_pixel_data_and_save``. The results
+    for each set of parameters are saved to the group ``xrfmap/detsum`` of the data file as
+    the datasets ``xrf_fit_<name>`` and ``xrf_fit_<name>_name``.
 
-            if save_tiff is True:
-                output_folder = "output_tiff_" + prefix_fname
-                output_path = os.path.join(working_directory, output_folder)
-                output_data(
-                    output_dir=output_path,
-                    interpolate_to_uniform_grid=interpolate_to_uniform_grid,
-                    dataset_name=f"dataset_{det_channel_names[i]}_fit",  # ..._det1_fit, etc.
-                    quant_norm=quant_norm,
-                    quant_ref_eline=quant_ref_eline,
-                    param_quant_analysis=param_quant_analysis,
-                    dataset_dict=dataset,
-                    positions_dict=positions_dict,
-                    file_format="tiff",
-                    scaler_name=scaler_name,
-                    scaler_name_list=scaler_name_list,
-                    use_average=use_average,
-                )
+    Parameters
+    ----------
+    working_directory : str, required
+        path folder
+    file_name : str, required
+        selected h5 file
+    param_file_names : list(str), required
+        the list of parameter files (JSON). If the file name does not contain full path, then it is
+        extended with the path in ``working_directory``.
+    result_names : list(str) or None, optional
+        the names of the results, one name for each parameter file. If None, then the names of
+        the parameter files without extension are used. The names must be unique.
+    incident_energy, ignore_datafile_metadata, pixel_bin, comp_elastic_combine, linear_bg, use_snip, bin_energy
+        parameters of fitting, the same for all sets of parameters (see ``fit_pixel_data_and_save``)
+    data_from, dask_client, progress_sinks
+        see ``fit_pixel_data_and_save``
 
-    t1 = time.time()
-    print(f"Processing time: {t1 - t0}")
+    Returns
+    -------
+    dict
+        the dictionary of the maps (dictionaries) for each result name
+    """
+    if (
+        isinstance(param_file_names, str)
+        or not isinstance(param_file_names, (list, tuple))
+        or not param_file_names
+    ):
+        raise ValueError(
+            f"Parameter 'param_file_names' must be a non-empty list of file names: {param_file_names!r}"
+        )
+    if result_names is None:
+        result_names = [os.path.splitext(os.path.basename(_))[0] for _ in param_file_names]
+    if len(result_names) != len(param_file_names) or len(set(result_names)) != len(result_names):
+        raise ValueError(
+            f"Parameter 'result_names' must contain {len(param_file_names)} unique names: {result_names!r}"
+        )
+
+    fpath = os.path.join(working_directory, file_name)
+    prefix_fname = file_name.split(".")[0]
+
+    t0 = time.time()
+    if data_from == "NSLS-II":
+        img_dict, data_sets, mdata = read_hdf_APS(working_directory, file_name, load_each_channel=False)
+    elif data_from == "2IDE-APS":
+        img_dict, data_sets, mdata = read_MAPS(working_directory, file_name, channel_num=1)
+    else:
+        raise ValueError(f"Unsupported data format: data_from = {data_from!r}")
+
+    try:
+        data_all_sum = data_sets[prefix_fname + "_sum"].raw_data
+    except KeyError:
+        data_all_sum = data_sets[prefix_fname].raw_data
+
+    parameters = [
+        _load_fitting_parameters(
+            _,
+            working_directory=working_directory,
+            file_name=file_name,
+            mdata=mdata,
+            incident_energy=incident_energy,
+            ignore_datafile_metadata=ignore_datafile_metadata,
+        )[0]
+        for _ in param_file_names
+    ]
+
+    print(f"Fitting the data with {len(parameters)} sets of parameters ...")
+    results = parameter_sweep_fitting_controller(
+        data_all_sum,
+        parameters,
+        incident_energy=incident_energy,
+        pixel_bin=pixel_bin,
+        comp_elastic_combine=comp_elastic_combine,
+        linear_bg=linear_bg,
+        use_snip=use_snip,
+        bin_energy=bin_energy,
+        dask_client=dask_client,
+        progress_sinks=progress_sinks,
+    )
+
+    result_maps = {}
+    for name, (result_map, _) in zip(result_names, results):
+        save_fitdata_to_hdf(
+            fpath,
+            result_map,
+            datapath="xrfmap/detsum",
+            data_saveas=f"xrf_fit_{name}",
+            dataname_saveas=f"xrf_fit_{name}_name",
+        )
+        result_maps[name] = result_map
+        print(f"Results for the set of parameters '{name}' are saved to the dataset 'xrf_fit_{name}'")
+
+    print(f"Processing time: {time.time() - t0}")
+    return result_maps
 
 
 def pyxrf_batch(
@@ -422,6 +530,13 @@ def pyxrf_batch(
     use_average=False,
     interpolate_to_uniform_grid=False,
     dask_client=None,
+    stream_results_to_file=False,
+    fit_channels_together=False,
+    progress_sinks=None,
+    result_cache=None,
+    n_concurrent_files=1,
+    n_prefetch_files=0,
+    manifest_file=None,
 ):
     """
     Perform fitting on a batch of data files. The results are saved as new datasets
@@ -491,7 +606,7 @@ def pyxrf_batch(
         The grid dimensions match the dimensions of positional data for X and Y axes.
         The range of axes is chosen to fit the values of X and Y.
     dask_client: dask.distributed.Client
-        Dask client object. If None, then Dask client is created automatically.
+        Dask client object. If None, then the shared Dask client is used (see ``dask_client_manager``).
         If a batch of files is processed, then creating Dask client and
         passing the reference to it to the processing functions will save
         execution time:
@@ -503,6 +618,47 @@ def pyxrf_batch(
             # <-- code that runs computations -->
             client.close()  # Close Dask client
 
+    stream_results_to_file : bool
+        if True, then the fitting results are written to the data files block by block
+        as they are computed. This reduces memory consumption when large maps are processed.
+
+    fit_channels_together : bool
+        if True, then the sum and the individual detector channels of each file are fitted
+        as one computation (see ``fit_pixel_data_and_save``).
+
+    progress_sinks : list(callable) or callable or None
+        sinks that receive structured progress and throughput events during fitting of each file,
+        e.g. ``[LogProgressSink(), JSONProgressSink("batch_progress.jsonl")]``
+        (see ``pyxrf.core.instrumentation.ProgressMonitor``). Each event includes percent
+        completed, processed pixels and blocks, processing and data reading rates and
+        memory used by Dask workers. If None, then the progress bar is displayed in the terminal.
+
+    result_cache : ResultCache, str or None
+        cache for fitting results: ``ResultCache`` object or path to the cache directory, e.g.
+        ``ResultCache("~/.pyxrf/cache", max_size=20 * 1024**3)``. When a range of scans is processed
+        again, the results for the files with unchanged data and processing parameters are
+        loaded from the cache. If None, then the cache is configured using Dask configuration
+        values ``pyxrf.result-cache.directory`` and ``pyxrf.result-cache.max-size``
+        (caching is disabled by default).
+
+    n_concurrent_files : int
+        the number of files processed concurrently using the same Dask client. Processing several
+        small files concurrently keeps the workers busy while the files are opened, the results
+        are saved and the graphs for the next files are prepared. Default: 1.
+
+    n_prefetch_files : int
+        the number of the following files read in the background while the current files are processed,
+        so that the raw data of the next files is already in the page cache of the operating system
+        when processing of the files starts. This is useful if the files are stored on slow (e.g. network)
+        file systems. The raw data is decompressed during processing. Default: 0 (no prefetching).
+
+    manifest_file : str or None
+        path to the JSON file that records the status and processing time of each file (see
+        ``pyxrf.model.batch_scheduler.BatchManifest``). The manifest is updated after each file is
+        processed. If the batch is restarted with the same manifest, then the files that were successfully
+        processed with the same parameters (contents of the parameter files and processing options)
+        and not modified since are skipped. If None, then all files are processed.
+
     Returns
     -------
 
@@ -697,27 +853,14 @@ def pyxrf_batch(
         print(f"Processing parameter file: '{pname}'")
 
     if len(flist) > 0:
-        client_is_local = False
-        # If no external Dask client is provided and we are processing a batch
-        #   then create a local client that will be used to process the whole batch
-        if (len(flist) > 1) and (dask_client is None):
-            logger.info("Creating local Dask client for processing the batch of files ...")
-            dask_client = dask_client_create()
-            client_is_local = True
-
-        def _dask_client_close(is_local):
-            # We don't want to close an externally provided client
-            if is_local:
-                logger.info("Closing the local Dask client ...")
-                dask_client.close()
-
+        # If no external Dask client is provided, then the shared client is used to process
+        #   the whole batch (the client is created only once, see 'dask_client_manager')
         print("The following files are scheduled for processing:")
         for fln in flist:
             print(f"    {fln}")
         print(f"Total number of selected files: {len(flist)}\n")
 
-        for fpath in flist:
-            print(f"Processing file '{fpath}' ...")
+        def process_file(fpath):
             fname = fpath.split(sep_v)[-1]
             working_directory = fpath[: -len(fname)]
             try:
@@ -740,19 +883,56 @@ def pyxrf_batch(
                     use_average=use_average,
                     interpolate_to_uniform_grid=interpolate_to_uniform_grid,
                     dask_client=dask_client,
+                    stream_results_to_file=stream_results_to_file,
+                    fit_channels_together=fit_channels_together,
+                    progress_sinks=progress_sinks,
+                    result_cache=result_cache,
                 )
             except Exception as ex:
                 if allow_raising_exceptions:
-                    _dask_client_close(client_is_local)
                     raise Exception from ex
-                else:
-                    print(f"ERROR: could not process the file '{fname}'. No results are saved.")
-                    print(f"Exception: {ex}")
-                    traceback.print_tb(sys.exc_info()[2])
+                raise
+
+        def get_processing_key(fpath):
+            # The parameter files are found the same way as in 'fit_pixel_data_and_save'
+            working_directory = os.path.dirname(fpath)
+            param_files = [param_file_name] + list(param_channel_list or [])
+            param_files = [_ if os.path.isabs(_) else os.path.join(working_directory, _) for _ in param_files]
+            return compute_processing_key(
+                param_files,
+                fit_channel_sum=fit_channel_sum,
+                fit_channel_each=fit_channel_each,
+                incident_energy=incident_energy,
+                ignore_datafile_metadata=ignore_datafile_metadata,
+                fln_quant_calib_data=fln_quant_calib_data,
+                quant_distance_to_sample=quant_distance_to_sample,
+                quant_ref_eline=quant_ref_eline,
+                use_snip=use_snip,
+                save_txt=save_txt,
+                save_tiff=save_tiff,
+                scaler_name=scaler_name,
+                use_average=use_average,
+                interpolate_to_uniform_grid=interpolate_to_uniform_grid,
+            )
 
-        print("\nAll selected files were processed.")
+        manifest, processing_key = None, ""
+        if manifest_file is not None:
+            manifest = BatchManifest(manifest_file)
+            processing_key = get_processing_key
+
+        summary = run_batch(
+            flist,
+            process_file,
+            n_concurrent_files=n_concurrent_files,
+            n_prefetch_files=n_prefetch_files,
+            manifest=manifest,
+            processing_key=processing_key,
+            raise_exceptions=allow_raising_exceptions,
+        )
 
-        _dask_client_close(client_is_local)
+        print("\nTiming summary:")
+        print(format_timing_summary(summary))
+        print("\nAll selected files were processed.")
 
     else:
         print("No files were selected for processing.")
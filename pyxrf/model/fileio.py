@@ -8,6 +8,7 @@ import logging
 import os
 import re
 import sys
+import tempfile
 import warnings
 from collections import OrderedDict
 from collections.abc import Iterable
@@ -29,9 +30,10 @@ from ..core.map_processing import (
     RawHDF5Dataset,
     TerminalProgressBar,
     compute_total_spectrum_and_count,
-    dask_client_create,
+    get_pixel_spectra,
     prepare_xrf_map,
 )
+from ..core.shared_arrays import create_shared_array
 from ..core.utils import grid_interpolate, normalize_data_by_scaler
 from .load_data_from_db import (
     db,
@@ -382,6 +384,30 @@ class FileIOModel(Atom):
 
         self.select_img_dict_item(selected_item, always_update=True)
 
+    def remove_img_dict_items(self, keys):
+        """
+        Remove the sets of maps from `self.img_dict`. The selected set of maps remains selected
+        unless it is removed, otherwise the first set of maps is selected.
+
+        Parameters
+        ----------
+        keys : iterable(str)
+            keys of the removed sets of maps. The keys that are not in `self.img_dict` are ignored.
+        """
+        n_selected = self.img_dict_default_selected_item
+        selected_key = self.img_dict_keys[n_selected - 1] if 0 < n_selected <= len(self.img_dict_keys) else None
+
+        for key in keys:
+            self.img_dict.pop(key, None)
+        self.img_dict_keys = self._get_img_dict_keys()
+
+        if selected_key in self.img_dict_keys:
+            selected_item = self.img_dict_keys.index(selected_key) + 1
+        else:
+            selected_item = 1 if self.img_dict_keys else 0
+
+        self.select_img_dict_item(selected_item, always_update=True)
+
     def select_img_dict_item(self, selected_item, *, always_update=False):
         """
         Select the set of image maps.
@@ -660,18 +686,14 @@ class FileIOModel(Atom):
         # Select raw data to for single pixel fitting.
         self.data_all = self.data_sets[self.selected_file_name].raw_data
 
-        # Create Dask client to speed up processing of multiple datasets
-        client = dask_client_create()
-        # Run computations with the new selection and mask
+        # Run computations with the new selection and mask (large datasets are processed
+        #   using the shared Dask client, which is created only once)
         #    ... for the dataset selected for processing
-        self.data, self.data_total_count = self.data_sets[self.selected_file_name].get_total_spectrum_and_count(
-            client=client
-        )
+        self.data, self.data_total_count = self.data_sets[self.selected_file_name].get_total_spectrum_and_count()
         #    ... for all datasets selected for preview except the one selected for processing.
         for key in self.data_sets.keys():
             if (key != self.selected_file_name) and self.data_sets[key].selected_for_preview:
-                self.data_sets[key].update_buffers(client=client)
-        client.close()
+                self.data_sets[key].update_buffers()
 
 
 plot_as = ["Sum", "Point", "Roi"]
@@ -710,7 +732,10 @@ class DataSelection(Atom):
         ending position
     roi : list
     raw_data : array
-        experiment 3D data
+        experiment 3D data. Large numpy arrays are placed in shared memory when they are
+        first processed by the workers of local Dask process cluster, so the workers read
+        the data without copying. The shared memory segment is released when the dataset
+        is deleted or `raw_data` is changed.
     data : array
     selected_for_preview : int
         plot data or not, sum or roi or point
@@ -728,6 +753,8 @@ class DataSelection(Atom):
     # 'raw_data' may be numpy array, dask array or core.map_processing.RawHDF5Dataset
     #   Processing functions are expected to support all those types
     raw_data = Typed(object)
+    # 'core.shared_arrays.SharedArray' that registers 'raw_data' for placing in shared memory or None
+    _shared_raw_data = Typed(object)
     selected_for_preview = Bool(False)  # Dataset is currently selected for preview
     data_ready = Bool(False)  # Total spectrum and total count map are computed
     fit_name = Str()
@@ -763,6 +790,13 @@ class DataSelection(Atom):
         total_count = self.get_total_count()
         return total_count.min(), total_count.max()
 
+    @observe(str("raw_data"))
+    def _update_shared_raw_data(self, change):
+        # The array is copied to shared memory only when it is processed using local process cluster
+        if self._shared_raw_data is not None:
+            self._shared_raw_data.release()
+        self._shared_raw_data = create_shared_array(self.raw_data)
+
     @observe(str("selected_for_preview"))
     def _update_roi(self, change):
         if self.selected_for_preview:
@@ -869,6 +903,52 @@ class DataSelection(Atom):
         """
         return self.raw_data.shape
 
+    def get_pixel_spectra(self, pixels):
+        """
+        Returns raw spectra for the list of pixels. Only the parts of the raw data that contain
+        the pixels are loaded (see `core.map_processing.get_pixel_spectra`).
+
+        Parameters
+        ----------
+        pixels: iterable(tuple(int))
+            list of pixel coordinates `(row, col)`
+
+        Returns
+        -------
+        ndarray
+            array of spectra, shape `(n_pixels, n_energy_bins)`
+        """
+        return get_pixel_spectra(self.raw_data, pixels).astype(np.float64, copy=False)
+
+    def get_pixel_spectrum(self, row, col, *, size=1):
+        """
+        Returns the sum of raw spectra for the neighborhood of the pixel. The neighborhood is
+        the window of `size` x `size` pixels centered at the pixel `(row, col)` and clipped at
+        the edges of the map.
+
+        Parameters
+        ----------
+        row, col: int
+            coordinates of the pixel
+        size: int
+            size of the window, 1 - only the selected pixel
+
+        Returns
+        -------
+        ndarray
+            the spectrum, shape `(n_energy_bins,)`
+        """
+        if not isinstance(size, (int, np.integer)) or (size < 1):
+            raise ValueError(f"Parameter 'size' must be a positive integer: size = {size!r}")
+        map_size = self.get_map_size()
+        r0, c0 = row - (size - 1) // 2, col - (size - 1) // 2
+        pixels = [
+            (r, c)
+            for r in range(max(r0, 0), min(r0 + size, map_size[0]))
+            for c in range(max(c0, 0), min(c0 + size, map_size[1]))
+        ]
+        return np.sum(self.get_pixel_spectra(pixels if pixels else [(row, col)]), axis=0)
+
     def _get_sum(self, *, client=None):
         # Only the values of 'mask', 'pos1' and 'pos2' will be cached
         mask = self.mask if self.mask_active else None
@@ -1018,7 +1098,7 @@ class SpectrumCalculator(object):
             data,
             selection=selection,
             mask=self.mask,
-            chunk_pixels=5000,
+            chunk_pixels="auto",
             n_chunks_min=4,
             progress_bar=progress_bar,
             client=client,
@@ -2132,6 +2212,150 @@ def save_fitdata_to_hdf(
     f.close()
 
 
+class StreamingFitDataWriter:
+    """
+    Write fitting results to existing h5 file block by block as the blocks are computed.
+    The output datasets have the same layout as the datasets created by `save_fitdata_to_hdf`.
+    The blocks are written to a temporary h5 file created in the directory of the output file,
+    so the results are not kept in memory and the output file, which usually contains the raw data,
+    is not opened while the raw data is read. The results are moved to the output file
+    and the temporary file is deleted when the writer is closed, i.e. the writer should be
+    closed after processing is completed. If the writer is exited due to an exception, the results
+    are discarded and the output file is not changed.
+
+    Parameters
+    ----------
+    fpath : str
+        path of the hdf5 file
+    namelist : list(str)
+        names of the maps, the maps are saved in the same order
+    map_shape : tuple(int)
+        shape of the maps ``(ny, nx)``
+    datapath : str
+        path inside h5py file
+    data_saveas : str, optional
+        name in hdf for data array
+    dataname_saveas : str, optional
+        name list in hdf to explain what the saved data mean
+
+    Examples
+    --------
+    .. code-block:: python
+
+        with StreamingFitDataWriter(fpath, ["Fe_K", "Ca_K"], (ny, nx)) as writer:
+            # Write the block of maps with shape (10, nx)
+            writer.write_block({"Fe_K": fe_block, "Ca_K": ca_block}, np.s_[0:10, 0:nx])
+        # The maps are saved to 'fpath' at this point
+    """
+
+    def __init__(
+        self,
+        fpath,
+        namelist,
+        map_shape,
+        *,
+        datapath="xrfmap/detsum",
+        data_saveas="xrf_fit",
+        dataname_saveas="xrf_fit_name",
+    ):
+        namelist = [_ if isinstance(_, str) else _.decode() for _ in namelist]
+        map_shape = tuple(map_shape)
+        if len(map_shape) != 2:
+            raise ValueError(f"Parameter 'map_shape' must contain 2 elements: map_shape = {map_shape}")
+
+        self.fpath = fpath
+        self._namelist = namelist
+        self._datapath = datapath
+        self._data_saveas = data_saveas
+        self._dataname_saveas = dataname_saveas
+        self._name_index = {name: n for n, name in enumerate(namelist)}
+        shape = (len(namelist),) + map_shape
+
+        # The name starts with '.', so the temporary file is not selected as a data file
+        fd, self._tmp_fpath = tempfile.mkstemp(
+            prefix=f".{os.path.basename(fpath)}.", suffix=".tmp", dir=os.path.dirname(os.path.abspath(fpath))
+        )
+        os.close(fd)
+        try:
+            self._tmp_file = h5py.File(self._tmp_fpath, "w")
+            self._data = self._tmp_file.create_dataset("data", shape=shape, dtype="<f8")
+        except Exception:
+            self._discard()
+            raise
+
+    def write_block(self, data_dict, block_slice):
+        """
+        Write the block of maps to file.
+
+        Parameters
+        ----------
+        data_dict : dict
+            dictionary of 2D arrays. Keys are the names of the maps, all the maps are
+            expected to be included.
+        block_slice : tuple(slice)
+            position of the block in the map (tuple of two slices)
+        """
+        if self._data is None:
+            raise RuntimeError(f"Attempt to write data to the closed file '{self.fpath}'")
+        for k, v in data_dict.items():
+            if not isinstance(k, str):
+                k = k.decode()
+            self._data[(self._name_index[k],) + tuple(block_slice)] = v
+
+    def close(self):
+        """
+        Move the results to the output file and delete the temporary file. Writing is not allowed
+        after the writer is closed.
+        """
+        if self._data is None:
+            return
+        try:
+            with h5py.File(self.fpath, "a") as f:
+                try:
+                    dataGrp = f.create_group(self._datapath)
+                except ValueError:
+                    dataGrp = f[self._datapath]
+
+                if self._data_saveas in dataGrp:
+                    del dataGrp[self._data_saveas]
+
+                ds_data = dataGrp.create_dataset(self._data_saveas, shape=self._data.shape, dtype="<f8")
+                # Copy map by map to limit memory usage
+                for n in range(self._data.shape[0]):
+                    ds_data[n] = self._data[n]
+                ds_data.attrs["comments"] = " "
+
+                if self._dataname_saveas in dataGrp:
+                    del dataGrp[self._dataname_saveas]
+
+                name_data = dataGrp.create_dataset(
+                    self._dataname_saveas, data=np.array(self._namelist).astype("|S20")
+                )
+                name_data.attrs["comments"] = " "
+        finally:
+            self._discard()
+
+    def _discard(self):
+        """
+        Close and delete the temporary file without saving the results.
+        """
+        self._data = None
+        if getattr(self, "_tmp_file", None) is not None:
+            self._tmp_file.close()
+            self._tmp_file = None
+        if os.path.exists(self._tmp_fpath):
+            os.remove(self._tmp_fpath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+
+
 def export_to_view(fpath, output_name=None, output_folder="", namelist=None):
     """
     Output fitted data to tablet data for visulization.
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 
+import contextlib
 import copy
 import logging
 import math
@@ -34,9 +35,18 @@ from skbeam.core.fitting.xrf_model import (  # sum_area,; ParamController,; line
 from skbeam.fluorescence import XrfElement as Element
 
 from ..core.fitting import rfactor
-from ..core.map_processing import TerminalProgressBar, fit_xrf_map, prepare_xrf_map, snip_method_numba
+from ..core.instrumentation import ProgressMonitor
+from ..core.map_processing import (
+    ComputationCancelledError,
+    TerminalProgressBar,
+    fit_xrf_map_sweep,
+    fit_xrf_maps,
+    prepare_xrf_map,
+    snip_method_numba,
+)
 from ..core.quant_analysis import ParamQuantEstimation
-from .fileio import output_data, save_fitdata_to_hdf
+from ..core.result_cache import get_result_cache
+from .fileio import StreamingFitDataWriter, output_data, save_fitdata_to_hdf
 from .parameters import calculate_profile, define_range, fit_strategy_list, trim_escape_peak
 
 logger = logging.getLogger(__name__)
@@ -645,10 +655,25 @@ class Fit1D(Atom):
         # self.chi2 = np.around(self.fit_result.chisqr, 4)
         self.red_chi2 = np.around(self.fit_result.redchi, 4)
 
-    def fit_single_pixel(self):
+    def fit_single_pixel(self, *, cancel_event=None, partial_results_callback=None, progress_sinks=None):
         """
         This function performs single pixel fitting.
         Multiprocess is considered.
+
+        Parameters
+        ----------
+        cancel_event: threading.Event or None
+            if the event is set during fitting, then fitting is cancelled and
+            ``ComputationCancelledError`` is raised. The results are not saved.
+        partial_results_callback: callable or None
+            function ``partial_results_callback(fit_name, result_map)``, which is called each time
+            a block of the map is fitted. ``fit_name`` is the name of the dataset (e.g. ``scan2D_1_fit``)
+            and ``result_map`` is a dictionary of partially completed maps (not yet fitted pixels
+            are zero). The maps are updated in place as fitting progresses, so the callback must copy
+            the maps if they are used after the callback returns (e.g. displayed by a different thread).
+        progress_sinks: list(callable) or callable or None
+            sinks that receive progress events (see ``single_pixel_fitting_controller``), e.g.
+            ``QtSignalProgressSink``. If None, then the progress bar is displayed in the terminal.
         """
         # app = QApplication.instance()
         raise_bg = self.raise_bg
@@ -670,18 +695,36 @@ class Fit1D(Atom):
         t0 = time.time()
         self.pixel_fit_info = "Pixel fitting is in process."
 
+        fit_name, _ = self._get_fit_map_name()
+        map_shape = self.io_model.data_all.shape[0:2]
+        partial_map = {}
+
+        def _block_callback(block_map, block_slice):
+            # Assemble partially completed maps
+            for key, v in block_map.items():
+                partial_map.setdefault(key, np.zeros(shape=map_shape))[block_slice] = v
+            partial_results_callback(fit_name, partial_map)
+
         # app.processEvents()
-        self.result_map, calculation_info = single_pixel_fitting_controller(
-            self.io_model.data_all,
-            self.param_model.param_new,
-            method=pixel_fit,
-            pixel_bin=pixel_bin,
-            raise_bg=raise_bg,
-            comp_elastic_combine=comp_elastic_combine,
-            linear_bg=linear_bg,
-            use_snip=use_snip,
-            bin_energy=bin_energy,
-        )
+        try:
+            self.result_map, calculation_info = single_pixel_fitting_controller(
+                self.io_model.data_all,
+                self.param_model.param_new,
+                method=pixel_fit,
+                pixel_bin=pixel_bin,
+                raise_bg=raise_bg,
+                comp_elastic_combine=comp_elastic_combine,
+                linear_bg=linear_bg,
+                use_snip=use_snip,
+                bin_energy=bin_energy,
+                cancel_event=cancel_event,
+                partial_results_callback=_block_callback if partial_results_callback else None,
+                progress_sinks=progress_sinks,
+            )
+        except ComputationCancelledError:
+            self.pixel_fit_info = "Pixel fitting was cancelled."
+            logger.info("-------- Fitting of single pixels was cancelled --------")
+            raise
 
         t1 = time.time()
         logger.info("Time used for pixel fitting is : {}".format(t1 - t0))
@@ -751,17 +794,11 @@ class Fit1D(Atom):
         doc["fitted"] = self.fit_y
         save_data_to_db(self.runid, self.result_map, doc)
 
-    def save2Dmap_to_hdf(self, *, calculation_info=None, pixel_fit="nnls"):
+    def _get_fit_map_name(self):
         """
-        Save fitted 2D map of elements into hdf file after fitting is done. User
-        can choose to interpolate the image based on x,y position or not.
-
-        Parameters
-        ----------
-        pixel_fit : str
-            If nonlinear is chosen, more information needs to be saved.
+        Returns the name of the dataset with fitted maps (e.g. ``scan2D_1_fit``) and
+        the path to the group in HDF5 file where the maps are saved (e.g. ``xrfmap/detsum``).
         """
-
         prefix_fname = os.path.basename(self.hdf_path).split(".")[0]
         if len(prefix_fname) == 0:
             prefix_fname = "tmp"
@@ -779,6 +816,20 @@ class Fit1D(Atom):
             det_name = srch.group(0)
             fit_name = f"{prefix_fname}_{det_name}_fit"
         inner_path = f"xrfmap/{det_name}"
+        return fit_name, inner_path
+
+    def save2Dmap_to_hdf(self, *, calculation_info=None, pixel_fit="nnls"):
+        """
+        Save fitted 2D map of elements into hdf file after fitting is done. User
+        can choose to interpolate the image based on x,y position or not.
+
+        Parameters
+        ----------
+        pixel_fit : str
+            If nonlinear is chosen, more information needs to be saved.
+        """
+
+        fit_name, inner_path = self._get_fit_map_name()
 
         # Update GUI so that results can be seen immediately
         self.fit_img[fit_name] = self.result_map
@@ -1098,211 +1149,6 @@ def extract_result(data, element):
     return np.array(data_map)
 
 
-def bin_data_pixel(data, nearest_n=4):
-    """
-    Bin 3D data according to number of pixels defined in dim 1 and 2.
-
-    Parameters
-    ----------
-    data : 3D array
-        exp data with energy channel in 3rd dim.
-    nearest_n : int, optional
-        define how many pixels to be considered.
-    """
-    new_data = np.array(data)
-    d_shape = data.shape
-
-    # if nearest_n == 4:
-    #     for i in [-1, 1]:
-    #         new_data[1:-1, 1:-1, :] += data[1+i:d_shape[0]-1+i, 1:d_shape[1]-1, :]
-    #     for j in [-1, 1]:
-    #         new_data[1:-1, 1:-1, :] += data[1:d_shape[0]-1, 1+j:d_shape[1]-1+j, :]
-
-    if nearest_n == 4:
-        for i in np.arange(d_shape[0] - 1):
-            for j in np.arange(d_shape[1] - 1):
-                new_data[i, j, :] += new_data[i + 1, j, :] + new_data[i, j + 1, :] + new_data[i + 1, j + 1, :]
-        new_data[:-1, :-1, :] /= nearest_n
-
-    if nearest_n == 9:
-        for i in [-1, 0, 1]:
-            for j in [-1, 0, 1]:
-                new_data[1:-1, 1:-1, :] += data[1 + i : d_shape[0] - 1 + i, 1 + j : d_shape[1] - 1 + j, :]
-
-        new_data[1:-1, 1:-1, :] /= nearest_n
-
-    return new_data
-
-
-def bin_data_spacial(data, bin_size=4):
-    """
-    Bin 2D/3D data based on first and second dim, i.e., 2 by 2 window, or 4 by 4.
-
-    Parameters
-    ----------
-    data : array
-        2D or 3D dataset
-    bin_size : int
-        window size. 2 means 2 by 2 window
-    """
-    if bin_size <= 1:
-        return data
-
-    data = np.asarray(data)
-    if data.ndim == 2:
-        d_shape = np.array([data.shape[0], data.shape[1]]) / bin_size
-
-        data_new = np.zeros([d_shape[0], d_shape[1]])
-        for i in np.arange(d_shape[0]):
-            for j in np.arange(d_shape[1]):
-                data_new[i, j] = np.sum(
-                    data[i * bin_size : i * bin_size + bin_size, j * bin_size : j * bin_size + bin_size]
-                )
-    elif data.ndim == 3:
-        d_shape = np.array([data.shape[0], data.shape[1]]) / bin_size
-
-        data_new = np.zeros([d_shape[0], d_shape[1], data.shape[2]])
-        for i in np.arange(d_shape[0]):
-            for j in np.arange(d_shape[1]):
-                data_new[i, j, :] = np.sum(
-                    data[i * bin_size : i * bin_size + bin_size, j * bin_size : j * bin_size + bin_size, :],
-                    axis=(0, 1),
-                )
-    return data_new
-
-
-def conv_expdata_energy(data, width=2):
-    """
-    Do convolution on the 3rd axis, energy axis.
-    Paremeters
-    ----------
-    data : 3D array
-        exp spectrum
-    width : int, optional
-        width of the convolution function.
-    Returns
-    -------
-    array :
-        after convolution
-    """
-    data_new = np.array(data)
-    if width == 2:
-        conv_f = [1.0 / 2, 1.0 / 2]
-    if width == 3:
-        conv_f = [1.0 / 3, 1.0 / 3, 1.0 / 3]
-    for i in np.arange(data.shape[0]):
-        for j in np.arange(data.shape[1]):
-            data_new[i, j, :] = np.convolve(data_new[i, j, :], conv_f, mode="same")
-
-    return data_new
-
-
-def bin_data_energy2D(data, bin_step=2, axis_v=0, sum_data=False):
-    """
-    Bin data based on given dim, i.e., a dim for energy spectrum.
-    Return a copy of the data. Currently only binning along first
-    dim is implemented.
-
-    Parameters
-    ----------
-    data : 2D array
-    bin_step : int, optional
-        size to bin the data
-    axis_v : int, optional
-        along which dir to bin data.
-    sum_data : bool, optional
-        sum data from each bin or not
-
-    Returns
-    -------
-    binned data with reduced dim of the previous size.
-    """
-    if bin_step == 1:
-        return data
-
-    data = np.array(data)
-    if axis_v == 0:
-        if bin_step == 2:
-            new_len = data.shape[0] / bin_step
-            m1 = data[::2, :]
-            m2 = data[1::2, :]
-            if sum_data is True:
-                return (m1[:new_len, :] + m2[:new_len, :]) / bin_step
-            else:
-                return m1[:new_len, :]
-        elif bin_step == 3:
-            new_len = data.shape[0] / bin_step
-            m1 = data[::3, :]
-            m2 = data[1::3, :]
-            m3 = data[2::3, :]
-            if sum_data is True:
-                return (m1[:new_len, :] + m2[:new_len, :] + m3[:new_len, :]) / bin_step
-            else:
-                return m1[:new_len, :]
-        elif bin_step == 4:
-            new_len = data.shape[0] / bin_step
-            m1 = data[::4, :]
-            m2 = data[1::4, :]
-            m3 = data[2::4, :]
-            m4 = data[3::4, :]
-            if sum_data is True:
-                return (m1[:new_len, :] + m2[:new_len, :] + m3[:new_len, :] + m4[:new_len, :]) / bin_step
-            else:
-                return m1[:new_len, :]
-
-
-def bin_data_energy3D(data, bin_step=2, sum_data=False):
-    """
-    Bin 3D data along 3rd axis, i.e., a dim for energy spectrum.
-    Return a copy of the data.
-
-    Parameters
-    ----------
-    data : 3D array
-    sum_data : bool, optional
-        sum data from each bin or not
-
-    Returns
-    -------
-    binned data with reduced dim of the previous size.
-    """
-    if bin_step == 1:
-        return data
-    data = np.array(data)
-    if bin_step == 2:
-        new_len = data.shape[2] / 2
-        new_data1 = data[:, :, ::2]
-        new_data2 = data[:, :, 1::2]
-        if sum_data is True:
-            return (new_data1[:, :, :new_len] + new_data2[:, :, :new_len]) / bin_step
-        else:
-            return new_data1[:, :, :new_len]
-    elif bin_step == 3:
-        new_len = data.shape[2] / 3
-        new_data1 = data[:, :, ::3]
-        new_data2 = data[:, :, 1::3]
-        new_data3 = data[:, :, 2::3]
-        if sum_data is True:
-            return (new_data1[:, :, :new_len] + new_data2[:, :, :new_len] + new_data3[:, :, :new_len]) / bin_step
-        else:
-            return new_data1[:, :, :new_len]
-    elif bin_step == 4:
-        new_len = data.shape[2] / 4
-        new_data1 = data[:, :, ::4]
-        new_data2 = data[:, :, 1::4]
-        new_data3 = data[:, :, 2::4]
-        new_data4 = data[:, :, 3::4]
-        if sum_data is True:
-            return (
-                new_data1[:, :, :new_len]
-                + new_data2[:, :, :new_len]
-                + new_data3[:, :, :new_len]
-                + new_data4[:, :, :new_len]
-            ) / bin_step
-        else:
-            return new_data1[:, :, :new_len]
-
-
 def cal_r2(y, y_cal):
     """
     Calculate r2 statistics.
@@ -1784,6 +1630,12 @@ def single_pixel_fitting_controller(
     use_snip=True,
     bin_energy=1,
     dask_client=None,
+    output_fpath=None,
+    output_datapath="xrfmap/detsum",
+    progress_sinks=None,
+    cancel_event=None,
+    partial_results_callback=None,
+    result_cache=None,
 ):
     """
     Parameters
@@ -1797,7 +1649,9 @@ def single_pixel_fitting_controller(
     method: str, optional
         fitting method, default as nnls
     pixel_bin: int, optional
-        bin pixel as 2by2, or 3by3
+        size of the window for spatial binning, e.g. 2 for 2x2 binning. Spectra in each
+        window are averaged and fitted together, the results are assigned to each pixel
+        of the window. No spatial binning if ``pixel_bin`` is 0 or 1.
     raise_bg: int, optional
         add a constant value to each spectrum, better for fitting
     comp_elastic_combine: bool, optional
@@ -1807,20 +1661,329 @@ def single_pixel_fitting_controller(
     use_snip: bool, optional
         use snip method to remove background
     bin_energy: int, optional
-        bin spectrum with given value
+        the number of adjacent spectral channels combined in one bin. The matrix of reference
+        spectra is binned consistently. No energy binning if ``bin_energy`` is 0 or 1.
     dask_client: dask.distributed.Client
-        Dask client object. If None, then Dask client is created automatically.
+        Dask client object. If None, then the shared Dask client is used (see ``dask_client_manager``).
         If a batch of files is processed, then creating Dask client and
         passing the reference to it to the processing functions will save
         execution time: `client = Client(processes=True, silence_logs=logging.ERROR)`
+    output_fpath: str or None
+        path to the existing HDF5 file. If not None, then the maps are written to the file
+        (group ``output_datapath``, datasets ``xrf_fit`` and ``xrf_fit_name``) block by block
+        as the fitting progresses and the maps are not kept in memory. The blocks are written
+        to a temporary file, which is moved to ``output_fpath`` once fitting is completed
+        (see ``StreamingFitDataWriter``). In this case ``result_map`` and
+        ``calculation_info["results"]`` are None.
+    output_datapath: str
+        path to the group in the HDF5 file ``output_fpath``, e.g. ``xrfmap/detsum``.
+    progress_sinks: list(callable) or callable or None
+        sinks that receive structured progress events (see ``ProgressMonitor``), e.g.
+        ``[LogProgressSink(), JSONProgressSink("progress.jsonl")]``. If None, then
+        the progress bar is displayed in the terminal.
+    cancel_event: threading.Event or None
+        if the event is set while fitting is in progress, then fitting is cancelled,
+        the remaining blocks are released and ``ComputationCancelledError`` is raised.
+    partial_results_callback: callable or None
+        if not None, then the function ``partial_results_callback(block_map, block_slice)``
+        is called as soon as each block of the map is fitted. ``block_map`` is a dictionary
+        of maps computed for the block, ``block_slice`` is a tuple of slices that define
+        position of the block in the map. The function is called from the thread
+        that performs fitting.
+    result_cache: ResultCache, str or None
+        cache for fitting results: ``ResultCache`` object or path to the cache directory.
+        If None, then the cache is configured using Dask configuration (see ``get_result_cache``),
+        caching is disabled by default. If the results of fitting of the same data with the same
+        model and parameters are found in the cache, then they are loaded instead of being computed.
 
     Returns
     -------
-    result_map : dict
+    result_map : dict or None
         of elemental map for given elements
     calculation_info : dict
         dict of fitting information
     """
+    task = {
+        "input_data": input_data,
+        "parameter": parameter,
+        "incident_energy": incident_energy,
+        "output_datapath": output_datapath,
+        "partial_results_callback": partial_results_callback,
+    }
+    ((result_map, calculation_info),) = multi_map_fitting_controller(
+        [task],
+        method=method,
+        pixel_bin=pixel_bin,
+        raise_bg=raise_bg,
+        comp_elastic_combine=comp_elastic_combine,
+        linear_bg=linear_bg,
+        use_snip=use_snip,
+        bin_energy=bin_energy,
+        dask_client=dask_client,
+        output_fpath=output_fpath,
+        progress_sinks=progress_sinks,
+        cancel_event=cancel_event,
+        result_cache=result_cache,
+    )
+    return result_map, calculation_info
+
+
+def multi_map_fitting_controller(
+    tasks,
+    *,
+    method="nnls",
+    pixel_bin=0,
+    raise_bg=0,
+    comp_elastic_combine=False,
+    linear_bg=False,
+    use_snip=True,
+    bin_energy=1,
+    dask_client=None,
+    output_fpath=None,
+    progress_sinks=None,
+    cancel_event=None,
+    result_cache=None,
+):
+    """
+    Fit multiple XRF maps, e.g. the sum and individual channels of the detector, as one
+    Dask computation (see ``fit_xrf_maps``). Each map is fitted with its own set of parameters.
+    The results are the same as if each map was processed by ``single_pixel_fitting_controller``.
+
+    Parameters
+    ----------
+    tasks: list(dict)
+        list of dictionaries, one dictionary per map. The dictionary must contain the keys
+        ``input_data`` (3D array of spectra) and ``parameter`` (parameters for fitting) and
+        may contain the keys ``incident_energy``, ``output_datapath`` and
+        ``partial_results_callback`` (see the parameters of ``single_pixel_fitting_controller``).
+        Each map must be saved to a different group (``output_datapath``) if the results are
+        written to the file.
+    method, pixel_bin, raise_bg, comp_elastic_combine, linear_bg, use_snip, bin_energy
+        parameters of fitting, the same for all maps (see ``single_pixel_fitting_controller``).
+    dask_client, output_fpath, progress_sinks, cancel_event, result_cache
+        see ``single_pixel_fitting_controller``.
+
+    Returns
+    -------
+    list(tuple)
+        list of tuples ``(result_map, calculation_info)`` in the same order as ``tasks``.
+    """
+    if method != "nnls":
+        logger.warning(f"Fitting using '{method}' is not supported: 'nnls' method will be used instead.")
+
+    if raise_bg > 0:
+        logger.warning(
+            f"Option 'raise_bg == {raise_bg}' is enabled. This option is not supported "
+            f"and will be ignored. Disable the option to eliminate this warning."
+        )
+
+    # add const background, so nnls works better for values above zero
+    # if raise_bg > 0:
+    #     exp_data += raise_bg
+
+    # Binning is performed as part of the processing pipeline (see 'fit_xrf_map')
+    pixel_bin, bin_energy = max(pixel_bin, 1), max(bin_energy, 1)
+
+    models = [
+        _create_fitting_model(
+            _["input_data"],
+            _["parameter"],
+            incident_energy=_.get("incident_energy", None),
+            comp_elastic_combine=comp_elastic_combine,
+            linear_bg=linear_bg,
+        )
+        for _ in tasks
+    ]
+
+    logger.info("Fitting method: non-negative least squares")
+
+    datasets = [
+        {
+            "data": _["input_data"],
+            "data_sel_indices": model["fit_range"],
+            "matv": model["matv"],
+            "snip_param": model["snip_param"],
+        }
+        for _, model in zip(tasks, models)
+    ]
+    fit_kwargs = dict(
+        use_snip=use_snip,
+        chunk_pixels="auto",
+        n_chunks_min=4,
+        pixel_bin=pixel_bin,
+        energy_bin=bin_energy,
+        progress_bar=(
+            ProgressMonitor("NNLS fitting", sinks=progress_sinks)
+            if progress_sinks is not None
+            else TerminalProgressBar("NNLS fitting")
+        ),
+        client=dask_client,
+        cancel_event=cancel_event,
+        result_cache=get_result_cache(result_cache),
+    )
+
+    callbacks = [_.get("partial_results_callback", None) for _ in tasks]
+    if (output_fpath is None) and all([_ is None for _ in callbacks]):
+        results_list = fit_xrf_maps(datasets, **fit_kwargs)
+    else:
+        results_list = [None] * len(tasks)
+        with contextlib.ExitStack() as stack:
+            consumers = []
+            for n, (task, model, callback) in enumerate(zip(tasks, models, callbacks)):
+                map_shape = task["input_data"].shape[0:2]
+                if output_fpath is None:
+                    # The results are assembled in memory block by block
+                    results_list[n] = np.zeros(shape=map_shape + (len(model["e_select"]) + 4,))
+                    writer = None
+                else:
+                    namelist = model["e_select"] + ["snip_bkg", "r_factor", "sel_cnt", "total_cnt"]
+                    writer = stack.enter_context(
+                        StreamingFitDataWriter(
+                            output_fpath,
+                            namelist + model["elist_non_activated"],
+                            map_shape,
+                            datapath=task.get("output_datapath", "xrfmap/detsum"),
+                        )
+                    )
+                consumers.append(_create_block_consumer(model, results_list[n], writer, callback))
+
+            fit_xrf_maps(datasets, consume_block=consumers, **fit_kwargs)
+
+        if output_fpath is not None:
+            for task in tasks:
+                output_datapath = task.get("output_datapath", "xrfmap/detsum")
+                logger.info(f"Fitting results were saved to file '{output_fpath}' (group '{output_datapath}')")
+
+    # Alternative fitting method (nonlinear fit). Very slow and nobody seems to be using it
+    # logger.info('Fitting method: nonlinear least squares')
+    # matrix_norm = exp_data.shape[0]*exp_data.shape[1]
+    # fit_results = fit_pixel_multiprocess_nonlinear(exp_data, x, param, matv/matrix_norm,
+    #                                               use_snip=use_snip)
+    # result_map, error_map, results = get_area_and_error_nonlinear_fit(e_select,
+    #                                                                  fit_results,
+    #                                                                  matv/matrix_norm)
+
+    return [
+        _create_fitting_output(task["input_data"], model, results)
+        for task, model, results in zip(tasks, models, results_list)
+    ]
+
+
+def parameter_sweep_fitting_controller(
+    input_data,
+    parameters,
+    *,
+    incident_energy=None,
+    method="nnls",
+    pixel_bin=0,
+    comp_elastic_combine=False,
+    linear_bg=False,
+    use_snip=True,
+    bin_energy=1,
+    dask_client=None,
+    progress_sinks=None,
+    cancel_event=None,
+):
+    """
+    Fit the same XRF map with multiple sets of parameters, e.g. with different lists of emission
+    lines or energy bounds (see ``fit_xrf_map_sweep``). The raw data is read once, SNIP background
+    is computed once for each distinct combination of energy bounds and background parameters.
+    The results are the same as if the map was processed by ``single_pixel_fitting_controller``
+    with each set of parameters.
+
+    Parameters
+    ----------
+    input_data: array
+        3D array of spectra
+    parameters: list(dict)
+        list of sets of parameters for fitting
+    incident_energy, method, pixel_bin, comp_elastic_combine, linear_bg, use_snip, bin_energy
+        parameters of fitting, the same for all sets of parameters (see ``single_pixel_fitting_controller``).
+    dask_client, progress_sinks, cancel_event
+        see ``single_pixel_fitting_controller``.
+
+    Returns
+    -------
+    list(tuple)
+        list of tuples ``(result_map, calculation_info)`` in the same order as ``parameters``.
+    """
+    if method != "nnls":
+        logger.warning(f"Fitting using '{method}' is not supported: 'nnls' method will be used instead.")
+
+    models = [
+        _create_fitting_model(
+            input_data,
+            _,
+            incident_energy=incident_energy,
+            comp_elastic_combine=comp_elastic_combine,
+            linear_bg=linear_bg,
+        )
+        for _ in parameters
+    ]
+
+    logger.info("Fitting method: non-negative least squares")
+
+    results_list = fit_xrf_map_sweep(
+        input_data,
+        [{"data_sel_indices": _["fit_range"], "matv": _["matv"], "snip_param": _["snip_param"]} for _ in models],
+        use_snip=use_snip,
+        chunk_pixels="auto",
+        n_chunks_min=4,
+        pixel_bin=max(pixel_bin, 1),
+        energy_bin=max(bin_energy, 1),
+        progress_bar=(
+            ProgressMonitor("NNLS fitting", sinks=progress_sinks)
+            if progress_sinks is not None
+            else TerminalProgressBar("NNLS fitting")
+        ),
+        client=dask_client,
+        cancel_event=cancel_event,
+    )
+
+    return [_create_fitting_output(input_data, model, results) for model, results in zip(models, results_list)]
+
+
+def _create_fitting_output(input_data, model, results):
+    """
+    Create the maps (``result_map``) and the dictionary with fitting information (``calculation_info``)
+    from the fitting results ``results`` for the map ``input_data`` fitted using ``model``
+    (see ``_create_fitting_model``). ``result_map`` is None if ``results`` is None.
+    """
+    if results is not None:
+        # output area of dict
+        result_map = calculate_area(
+            model["e_select"], model["matv"], results, model["param"], first_peak_area=False
+        )
+        # Generate 'zero' maps for the emission lines that were not activated
+        for eline in model["elist_non_activated"]:
+            result_map[eline] = np.zeros(shape=input_data.shape[0:2])
+    else:
+        result_map = None
+
+    calculation_info = dict()
+    calculation_info["fit_name"] = model["e_select"]
+    calculation_info["regression_mat"] = model["matv"]
+    calculation_info["results"] = results
+    calculation_info["fit_range"] = model["fit_range"]
+    calculation_info["energy_axis"] = model["energy_axis"]
+    # Used to be 'exp_data'(selected data), now it is the full dataset,
+    #   which can be ndarray, Dask array or RawHDF5Dataset. In order
+    #   to get the selected set, 'input_data' must be sliced along axis2
+    #   using 'fit_range' values.
+    calculation_info["input_data"] = input_data
+    calculation_info["data_sel_indices"] = model["fit_range"]
+
+    return result_map, calculation_info
+
+
+def _create_fitting_model(input_data, parameter, *, incident_energy, comp_elastic_combine, linear_bg):
+    """
+    Create the linear model for fitting of the map ``input_data`` based on the set of parameters.
+    Returns the dictionary with the copy of parameters (``param``), the list of components
+    (``e_select``), the matrix of reference spectra (``matv``), the list of the emission lines
+    that are not activated (``elist_non_activated``), the selected range (``fit_range``), the energy
+    axis (``energy_axis``) and parameters for SNIP (``snip_param``).
+    """
     param = copy.deepcopy(parameter)
     if incident_energy is not None:
         param["coherent_sct_energy"]["value"] = incident_energy
@@ -1871,44 +2034,10 @@ def single_pixel_fitting_controller(
 
     logger.info("Matrix used for linear fitting has components: {}".format(e_select))
 
-    def _log_unsupported_option(option):
-        logger.warning(
-            f"Option '{option}' is enabled. This option is not supported "
-            f"and will be ignored. Disable the option to eliminate this warning."
-        )
-
-    if raise_bg > 0:
-        _log_unsupported_option(f"raise_bg == {raise_bg}")
-
-    # add const background, so nnls works better for values above zero
-    # if raise_bg > 0:
-    #     exp_data += raise_bg
-
-    if pixel_bin > 1:
-        _log_unsupported_option(f"pixel_bin == {pixel_bin}")
-
-    # bin data based on nearest pixels, only two options
-    # if pixel_bin in [4, 9]:
-    #     logger.info('Bin pixel data with parameter: {}'.format(pixel_bin))
-    #     exp_data = bin_data_spacial(exp_data, bin_size=int(np.sqrt(pixel_bin)))
-    #     # exp_data = bin_data_pixel(exp_data, nearest_n=pixel_bin)  # return a copy of data
-
-    if bin_energy > 1:
-        _log_unsupported_option(f"pixel_bin == {pixel_bin}")
-    # bin data based on energy spectrum
-    # if bin_energy in [2, 3]:
-    #     exp_data = conv_expdata_energy(exp_data, width=bin_energy)
-
     # make matrix smaller for single pixel fitting
     matv /= input_data.shape[0] * input_data.shape[1]
     # save matrix to analyze collinearity
     # np.save('mat.npy', matv)
-    error_map = None
-
-    if method != "nnls":
-        logger.warning(f"Fitting using '{method}' is not supported: 'nnls' method will be used instead.")
-
-    logger.info("Fitting method: non-negative least squares")
 
     snip_param = {
         "e_offset": param["e_offset"]["value"],
@@ -1916,51 +2045,43 @@ def single_pixel_fitting_controller(
         "e_quadratic": param["e_quadratic"]["value"],
         "b_width": param["non_fitting_values"]["background_width"],
     }
-    results = fit_xrf_map(
-        data=input_data,
-        data_sel_indices=(n_bin_low, n_bin_high),
-        matv=matv,
-        snip_param=snip_param,
-        use_snip=use_snip,
-        chunk_pixels=5000,
-        n_chunks_min=4,
-        progress_bar=TerminalProgressBar("NNLS fitting"),
-        client=dask_client,
-    )
 
-    # output area of dict
-    result_map = calculate_area(e_select, matv, results, param, first_peak_area=False)
-
-    # Alternative fitting method (nonlinear fit). Very slow and nobody seems to be using it
-    # logger.info('Fitting method: nonlinear least squares')
-    # matrix_norm = exp_data.shape[0]*exp_data.shape[1]
-    # fit_results = fit_pixel_multiprocess_nonlinear(exp_data, x, param, matv/matrix_norm,
-    #                                               use_snip=use_snip)
-    # result_map, error_map, results = get_area_and_error_nonlinear_fit(e_select,
-    #                                                                  fit_results,
-    #                                                                  matv/matrix_norm)
-
-    # Generate 'zero' maps for the emission lines that were not activated
-    for eline in elist_non_activated:
-        result_map[eline] = np.zeros(shape=input_data.shape[0:2])
+    return {
+        "param": param,
+        "e_select": e_select,
+        "matv": matv,
+        "elist_non_activated": elist_non_activated,
+        "fit_range": (n_bin_low, n_bin_high),
+        "energy_axis": n_bin,
+        "snip_param": snip_param,
+    }
 
-    calculation_info = dict()
-    if error_map is not None:
-        calculation_info["error_map"] = error_map
 
-    calculation_info["fit_name"] = e_select
-    calculation_info["regression_mat"] = matv
-    calculation_info["results"] = results
-    calculation_info["fit_range"] = (n_bin_low, n_bin_high)
-    calculation_info["energy_axis"] = n_bin
-    # Used to be 'exp_data'(selected data), now it is the full dataset,
-    #   which can be ndarray, Dask array or RawHDF5Dataset. In order
-    #   to get the selected set, 'input_data' must be sliced along axis2
-    #   using 'fit_range' values.
-    calculation_info["input_data"] = input_data
-    calculation_info["data_sel_indices"] = (n_bin_low, n_bin_high)
+def _create_block_consumer(model, results, writer, partial_results_callback):
+    """
+    Create the function ``consume_block(block, block_slice)`` that copies the fitted block to
+    the array ``results`` (if not None), writes the maps computed for the block using
+    ``writer`` (if not None) and passes the maps to ``partial_results_callback`` (if not None).
+    """
 
-    return result_map, calculation_info
+    def _compute_block_map(block, block_slice):
+        block_map = calculate_area(model["e_select"], model["matv"], block, model["param"], first_peak_area=False)
+        for eline in model["elist_non_activated"]:
+            block_map[eline] = np.zeros(shape=block.shape[0:2])
+        return block_map
+
+    def _consume_block(block, block_slice):
+        block_slice = block_slice[0:2]
+        if results is not None:
+            results[block_slice] = block
+        if (writer is not None) or (partial_results_callback is not None):
+            block_map = _compute_block_map(block, block_slice)
+            if writer is not None:
+                writer.write_block(block_map, block_slice)
+            if partial_results_callback is not None:
+                partial_results_callback(block_map, block_slice)
+
+    return _consume_block
 
 
 def get_energy_bin_range(num_energy_bins, low_e, high_e, e_offset, e_linear):
@@ -1,5 +1,6 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
+import concurrent.futures
 import copy
 import json
 import logging
@@ -10,9 +11,11 @@ import platform
 import pprint
 import re
 import time as ttime
+import uuid
 import warnings
 from distutils.version import LooseVersion
 
+import dask
 import dask.array as da
 import h5py
 import numpy as np
@@ -24,6 +27,11 @@ try:
 except ImportError:
     pass
 
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
 import pyxrf
 
 from ..core.utils import convert_time_to_nexus_string
@@ -328,6 +336,7 @@ def make_hdf(
     num_end_lines_excluded=None,
     skip_scan_types=None,
     catalog_name=None,
+    n_workers=1,
 ):
     """
     Load data from database and save it in HDF5 files.
@@ -443,8 +452,18 @@ def make_hdf(
     catalog_name: str or None
         Name of the catalog (e.g. `"srx"`). The function attempts to determine the catalog
         name automatically if the parameter is not specified or `None`.
+    n_workers: int
+        The number of scans converted concurrently if the range of scans is converted
+        (``end`` is specified). Conversion of multiple scans overlaps queries to the database,
+        downloading of data and writing of HDF5 files. Each scan is converted independently:
+        the scans that can not be converted are skipped. The messages are printed in the order
+        in which the conversion of the scans is completed. If ``n_workers=1``, then the scans
+        are converted one by one.
     """
 
+    if not isinstance(n_workers, (int, np.integer)) or (n_workers < 1):
+        raise ValueError(f"Parameter 'n_workers' must be a positive integer: n_workers={n_workers!r}")
+
     if wd:
         # Create the directory
         wd = os.path.expanduser(wd)
@@ -484,30 +503,46 @@ def make_hdf(
         #   ``start`` .. ``end``. If there is a problem reading the scan,
         #   then the scan is skipped and the next scan is processed
         datalist = range(start, end + 1)
-        for v in datalist:
+
+        def convert_scan(v):
             fname = prefix + str(v) + ".h5"
             if wd:
                 fname = os.path.join(wd, fname)
-            try:
-                fetch_data_from_db(
-                    v,
-                    fpath=fname,
-                    create_each_det=create_each_det,
-                    fname_add_version=fname_add_version,
-                    completed_scans_only=completed_scans_only,
-                    successful_scans_only=successful_scans_only,
-                    file_overwrite_existing=file_overwrite_existing,
-                    output_to_file=True,
-                    save_scaler=save_scaler,
-                    num_end_lines_excluded=num_end_lines_excluded,
-                    skip_scan_types=skip_scan_types,
-                    catalog_name=catalog_name,
-                )
+            fetch_data_from_db(
+                v,
+                fpath=fname,
+                create_each_det=create_each_det,
+                fname_add_version=fname_add_version,
+                completed_scans_only=completed_scans_only,
+                successful_scans_only=successful_scans_only,
+                file_overwrite_existing=file_overwrite_existing,
+                output_to_file=True,
+                save_scaler=save_scaler,
+                num_end_lines_excluded=num_end_lines_excluded,
+                skip_scan_types=skip_scan_types,
+                catalog_name=catalog_name,
+            )
+
+        def report_status(v, ex):
+            if ex is None:
                 print(f"Scan #{v}: Conversion completed.\n")
-            except Exception as ex:
+            else:
                 print(f"Scan #{v}: Can not complete the conversion")
                 print(f"    ({ex})\n")
 
+        if n_workers == 1:
+            for v in datalist:
+                try:
+                    convert_scan(v)
+                    report_status(v, None)
+                except Exception as ex:
+                    report_status(v, ex)
+        else:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as pool:
+                futures = {pool.submit(convert_scan, v): v for v in datalist}
+                for fut in concurrent.futures.as_completed(futures):
+                    report_status(futures[fut], fut.exception())
+
 
 def _is_scan_complete(hdr):
     """Checks if the scan is complete ('stop' document exists)
@@ -2208,6 +2243,66 @@ def map_data2D_srx_new(
     return data_output
 
 
+def _stack_detector_channels(channels, *, n_rows, n_cols):
+    """
+    Lazily assemble the data from the channels of the detector into the array of shape
+    ``(n_rows, n_cols, n_channels, n_bins)``. The data from each channel is an array of shape
+    ``(n_points, n_bins)`` (spectra in the order of acquisition). The array is built from the channels
+    without copying the data (``stack`` and ``reshape`` of Dask arrays). If the scan is incomplete
+    (``n_points < n_rows * n_cols``), the missing points are filled with zeros.
+
+    Parameters
+    ----------
+    channels: list(array-like)
+        the data from the channels
+    n_rows, n_cols: int
+        the dimensions of the map
+
+    Returns
+    -------
+    dask.array
+        the assembled array
+    """
+    data = da.stack([da.asarray(_) for _ in channels], axis=1)
+    n_missing_pts = n_rows * n_cols - data.shape[0]
+    if n_missing_pts > 0:
+        data = da.pad(data, ((0, n_missing_pts), (0, 0), (0, 0)), mode="constant")
+    return da.reshape(data, (n_rows, n_cols) + data.shape[1:])
+
+
+def _flip_odd_rows(data, *, row_axis=0, col_axis=1):
+    """
+    Lazy snake correction: reverse the order of points in the odd rows (0-based) of the array.
+    The array is rechunked so that the chunks contain complete rows and the points are reordered
+    independently in each chunk, so the graph remains shallow and the chunks are copied only once.
+
+    Parameters
+    ----------
+    data: array-like
+        the array
+    row_axis, col_axis: int
+        the axes of rows and columns (points within the row) of the map
+
+    Returns
+    -------
+    dask.array
+        the array with reordered points
+    """
+    data = da.asarray(data).rechunk({col_axis: -1})
+
+    def _flip(block, block_info=None):
+        row_start = block_info[0]["array-location"][row_axis][0]
+        index = [slice(None)] * block.ndim
+        index[row_axis] = slice((row_start + 1) % 2, None, 2)
+        index_flipped = list(index)
+        index_flipped[col_axis] = slice(None, None, -1)
+        block_out = block.copy()
+        block_out[tuple(index)] = block[tuple(index_flipped)]
+        return block_out
+
+    return data.map_blocks(_flip, dtype=data.dtype)
+
+
 def map_data2D_srx_new_tiled(
     run_id_uid,
     fpath,
@@ -2410,7 +2505,6 @@ def map_data2D_srx_new_tiled(
         slow_pos = data_primary[slow_key].read()
 
         # Reshape motor positions
-        num_events = len(fast_pos)
         n_scan_fast, n_scan_slow = scan_doc["shape"]
         n_scan_fast, n_scan_slow = int(n_scan_fast), int(n_scan_slow)
         num_rows_float = len(fast_pos) / n_scan_fast
@@ -2452,25 +2546,19 @@ def map_data2D_srx_new_tiled(
                 N_xs, det_name_prefix, ndigits = i, "xs_channels_channel", 2
             else:
                 break
-        N_pts = num_events
-        N_bins = 4096
         if "xs" in dets or "xs4" in dets:
-            d_xs = da.empty((N_xs, N_pts, N_bins))
+            channels = []
             for i in np.arange(0, N_xs):
                 chnum = f"{i + 1}" if ndigits == 1 else f"{i + 1:02d}"
                 dname = det_name_prefix + chnum + det_name_suffix
-                d = data_primary[dname].read()
-                d_xs[i, :, :] = d
-            del d
-
-            if n_missing_pts:
-                _ = da.zeros([d_xs.shape[0], n_missing_pts, d_xs.shape[2]], dtype=d_xs.dtype)
-                d_xs = da.concatenate((d_xs, _), axis=1)
+                channels.append(data_primary[dname].read())
 
-            d_xs = da.reshape(d_xs, (N_xs, num_rows, n_scan_fast, N_bins))
+            # Shape: (num_rows, n_scan_fast, N_xs, N_bins), missing points are filled with zeros
+            d_xs = _stack_detector_channels(channels, n_rows=num_rows, n_cols=n_scan_fast)
+            del channels
 
             # Sum data
-            d_xs_sum = da.squeeze(da.sum(d_xs, axis=0))
+            d_xs_sum = da.sum(d_xs, axis=2)
 
         d_xs2, d_xs2_sum = None, None
 
@@ -2494,20 +2582,21 @@ def map_data2D_srx_new_tiled(
 
     # Consider snake
     # pos_pos, d_xs, d_xs_sum, sclr
+    #   The detector data has the shape (rows, points, channels, bins) for both fly and step scans.
     if snaking_enabled:
-        pos_pos[:, 1::2, :] = pos_pos[:, 1::2, ::-1]
+        pos_pos = _flip_odd_rows(pos_pos, row_axis=1, col_axis=2)
         if "xs" in dets or "xs4" in dets:
             if d_xs is not None:
-                d_xs[:, 1::2, :, :] = d_xs[:, 1::2, ::-1, :]
+                d_xs = _flip_odd_rows(d_xs)
             if d_xs_sum is not None:
-                d_xs_sum[1::2, :, :] = d_xs_sum[1::2, ::-1, :]
+                d_xs_sum = _flip_odd_rows(d_xs_sum)
         if "xs2" in dets:
             if d_xs2 is not None:
-                d_xs2[:, 1::2, :, :] = d_xs2[:, 1::2, ::-1, :]
+                d_xs2 = _flip_odd_rows(d_xs2)
             if d_xs2_sum is not None:
-                d_xs2_sum[1::2, :, :] = d_xs2_sum[1::2, ::-1, :]
+                d_xs2_sum = _flip_odd_rows(d_xs2_sum)
         if sclr is not None:
-            sclr[1::2, :, :] = sclr[1::2, ::-1, :]
+            sclr = _flip_odd_rows(sclr)
 
     def swap_axes():
         nonlocal pos_name, pos_pos, d_xs, d_xs_sum, d_xs2, d_xs2_sum, sclr
@@ -2531,12 +2620,6 @@ def map_data2D_srx_new_tiled(
         if fast_motor in ("nano_stage_sy", "nano_stage_y"):
             swap_axes()
     elif scan_doc["type"] == "XRF_STEP":
-        if "xs" in dets or "xs4" in dets:
-            d_xs = da.swapaxes(d_xs, 0, 1)
-            d_xs = da.swapaxes(d_xs, 1, 2)
-        if "xs2" in dets:
-            d_xs2 = da.swapaxes(d_xs2, 0, 1)
-            d_xs2 = da.swapaxes(d_xs2, 1, 2)
         if fast_motor in ("nano_stage_sy", "nano_stage_y"):
             swap_axes()
             pos_name = pos_name[::-1]  # Swap the positions back
@@ -3854,8 +3937,197 @@ def _get_fpath_not_existing(fpath):
     return fpath
 
 
+def _download_dataset(
+    dset,
+    data,
+    *,
+    n_pixels_in_batch=40000,
+    n_workers=4,
+    n_retries=10,
+    batch_time=2.0,
+    max_bytes_in_flight=2 * 1024**3,
+    backoff_initial=0.5,
+    backoff_max=30.0,
+):
+    """
+    Download the array ``data`` (e.g. Dask array that references data on Tiled server) and write
+    it to HDF5 dataset ``dset`` in batches of rows. Multiple arrays with the same number of rows
+    (e.g. the sum and the channels of a detector) may be passed as lists of datasets and arrays:
+    the batches of all arrays are then downloaded together, so that Dask arrays computed
+    from the same source (e.g. the channel sum) share the downloaded chunks and the source
+    is read only once. Up to ``n_workers`` batches are downloaded
+    concurrently in a thread pool, while the downloaded batches are written to the dataset
+    (and compressed) by the calling thread. The size of the batches is adjusted based on
+    the observed download time, so that each batch takes approximately ``batch_time`` seconds.
+    A batch that failed to download is retried with exponential backoff.
+
+    Parameters
+    ----------
+    dset: h5py.Dataset or list(h5py.Dataset)
+        the dataset, which has the same shape as ``data``, or the list of datasets
+    data: array-like or list(array-like)
+        the source of data or the list of sources (one source per dataset). The object must have
+        the attribute ``shape`` and support slicing along axis 0. The slice must be convertible
+        to numpy array.
+    n_pixels_in_batch: int
+        initial number of pixels in a batch (at least one row is downloaded in a batch)
+    n_workers: int
+        the number of batches downloaded concurrently
+    n_retries: int
+        the number of attempts to download a batch
+    batch_time: float
+        desired time of downloading a batch, s
+    max_bytes_in_flight: int
+        the limit for the total size of the batches downloaded concurrently, bytes
+    backoff_initial, backoff_max: float
+        the delay before the first retry and the maximum delay between retries, s
+
+    Raises
+    ------
+    TimeoutError
+        a batch could not be downloaded after ``n_retries`` attempts
+    """
+    dsets = list(dset) if isinstance(dset, (list, tuple)) else [dset]
+    sources = list(data) if isinstance(data, (list, tuple)) else [data]
+    if len(dsets) != len(sources):
+        raise ValueError(f"The number of datasets ({len(dsets)}) and data sources ({len(sources)}) are different")
+    n_rows, n_cols = sources[0].shape[0], sources[0].shape[1]
+    if any([_.shape[0] != n_rows for _ in sources]):
+        raise ValueError(f"Data sources have different number of rows: {[_.shape for _ in sources]}")
+    row_bytes = max(sum([int(np.prod(s.shape[1:])) * d.dtype.itemsize for s, d in zip(sources, dsets)]), 1)
+    n_rows_max = max(int(max_bytes_in_flight // (row_bytes * n_workers)), 1)
+    n_rows_batch = min(max(int(n_pixels_in_batch / n_cols), 1), n_rows_max)  # Save at least one row
+
+    def load_batch(ns, ne):
+        for retry in range(n_retries):
+            try:
+                t_start = ttime.time()
+                batches = [_[ns:ne, ...] for _ in sources]
+                if all([isinstance(_, da.core.Array) for _ in batches]):
+                    batches = dask.compute(*batches)  # Shared chunks are downloaded once
+                batches = [np.nan_to_num(np.array(_)) for _ in batches]
+                return batches, ttime.time() - t_start
+            except Exception as ex:
+                logger.error(f"Failed to load the batch (rows {ns}..{ne - 1}, attempt {retry + 1}): {ex}")
+            if retry < n_retries - 1:
+                ttime.sleep(min(backoff_initial * 2**retry, backoff_max))
+        raise TimeoutError("Failed to download data from Tiled server")
+
+    n_saved, n_next = 0, 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as pool:
+        futures = {}
+        try:
+            while (n_next < n_rows) or futures:
+                while (n_next < n_rows) and (len(futures) < n_workers):
+                    ne = min(n_next + n_rows_batch, n_rows)
+                    futures[pool.submit(load_batch, n_next, ne)] = (n_next, ne)
+                    n_next = ne
+                done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for fut in done:
+                    ns, ne = futures.pop(fut)
+                    batches, t_batch = fut.result()
+                    for ds, batch in zip(dsets, batches):
+                        ds[ns:ne, ...] = batch
+                    n_saved += ne - ns
+                    # Adjust the batch size (at most by the factor of 2 at a time)
+                    n_rows_desired = int(round((ne - ns) * batch_time / max(t_batch, 1e-3)))
+                    n_rows_batch = min(max(n_rows_desired, n_rows_batch // 2, 1), n_rows_batch * 2, n_rows_max)
+                print(f"  Number of saved rows: {n_saved}")
+        except BaseException:
+            for fut in futures:
+                fut.cancel()
+            raise
+
+
+# Compression codecs supported for raw data and the default compression levels
+_raw_data_codecs = {"none": None, "gzip": 4, "lzf": None, "lz4": None, "zstd": 3, "blosc": 5}
+
+
+def _raw_data_storage_options(data_shape, *, compression=None, compression_level=None, shuffle=None, chunks=None):
+    """
+    Returns the keyword arguments for ``h5py.Group.create_dataset`` used to create datasets with
+    raw XRF data and the dictionary of metadata that describes the storage options. The parameters
+    that are None are set using Dask configuration values ``pyxrf.raw-data.compression``,
+    ``pyxrf.raw-data.compression-level``, ``pyxrf.raw-data.shuffle`` and ``pyxrf.raw-data.chunks``
+    and default to gzip compression with the default level, no shuffling and automatic chunk shape.
+    See `save_data_to_hdf5` for the description of the parameters.
+    """
+    if compression is None:
+        compression = dask.config.get("pyxrf.raw-data.compression", "gzip")
+    if compression_level is None:
+        compression_level = dask.config.get("pyxrf.raw-data.compression-level", None)
+    if shuffle is None:
+        shuffle = dask.config.get("pyxrf.raw-data.shuffle", False)
+    if chunks is None:
+        chunks = dask.config.get("pyxrf.raw-data.chunks", None)
+
+    compression = str(compression).lower()
+    if compression not in _raw_data_codecs:
+        raise ValueError(
+            f"Unsupported compression codec {compression!r}. Supported codecs: {list(_raw_data_codecs)}"
+        )
+    if compression in ("lz4", "zstd", "blosc") and hdf5plugin is None:
+        raise ValueError(f"Compression codec {compression!r} requires 'hdf5plugin' package to be installed")
+    if compression_level is None:
+        compression_level = _raw_data_codecs[compression]
+    elif compression in ("none", "lzf", "lz4"):
+        raise ValueError(f"Compression codec {compression!r} does not support compression levels")
+    elif not isinstance(compression_level, (int, np.integer)) or not (0 <= compression_level <= 9):
+        raise ValueError(f"Compression level must be an integer in the range 0..9: {compression_level!r}")
+
+    ny, nx, ne = data_shape
+    if isinstance(chunks, (int, np.integer)):
+        # The number of pixels in a chunk, each chunk contains full spectra
+        if chunks <= 0:
+            raise ValueError(f"The number of pixels in a chunk must be positive: chunks={chunks!r}")
+        chunk_x = min(int(math.ceil(math.sqrt(chunks))), nx)
+        chunk_y = min(max(int(chunks) // chunk_x, 1), ny)
+        chunks = (chunk_y, chunk_x, ne)
+    elif chunks is not None:
+        chunks = tuple(chunks)
+        if len(chunks) == 2:
+            chunks = chunks + (ne,)
+        if (len(chunks) != 3) or not all([isinstance(_, (int, np.integer)) and _ > 0 for _ in chunks]):
+            raise ValueError(f"Chunk shape must be a tuple of 2 or 3 positive integers: chunks={chunks!r}")
+        chunks = tuple(int(min(c, n)) for c, n in zip(chunks, data_shape))
+
+    shuffle = bool(shuffle) and compression != "none"
+    if compression == "none":
+        kwargs = {}
+    elif compression in ("gzip", "lzf"):
+        kwargs = {"compression": compression, "compression_opts": compression_level, "shuffle": shuffle}
+    elif compression == "lz4":
+        kwargs = dict(hdf5plugin.LZ4(), shuffle=shuffle)
+    elif compression == "zstd":
+        kwargs = dict(hdf5plugin.Zstd(clevel=compression_level), shuffle=shuffle)
+    else:
+        # Blosc performs shuffling internally
+        blosc_shuffle = hdf5plugin.Blosc.SHUFFLE if shuffle else hdf5plugin.Blosc.NOSHUFFLE
+        kwargs = dict(hdf5plugin.Blosc(cname="lz4", clevel=compression_level, shuffle=blosc_shuffle))
+    if chunks is not None:
+        kwargs["chunks"] = chunks
+    elif compression == "none":
+        # Contiguous datasets are processed as one block (see 'prepare_xrf_map')
+        kwargs["chunks"] = True
+
+    metadata = {"raw_data_compression": compression, "raw_data_shuffle": shuffle}
+    if compression_level is not None:
+        metadata["raw_data_compression_level"] = compression_level
+    return kwargs, metadata
+
+
 def save_data_to_hdf5(
-    fpath, data, *, metadata=None, fname_add_version=False, file_overwrite_existing=False, create_each_det=True
+    fpath,
+    data,
+    *,
+    metadata=None,
+    fname_add_version=False,
+    file_overwrite_existing=False,
+    create_each_det=True,
+    compression=None,
+    compression_level=None,
+    shuffle=None,
+    chunks=None,
 ):
     """
     This is the function used to save raw experiment data into HDF5 file. The raw data is
@@ -3899,11 +4171,37 @@ def save_data_to_hdf5(
     create_each_det : boolean
         Save data from individual detectors (``True``) or only the sum of fluorescence from
         all detectors (``False``).
+    compression : str or None
+        Compression codec for raw fluorescence data: ``"gzip"``, ``"lzf"`` (fast, built into h5py),
+        ``"lz4"``, ``"zstd"``, ``"blosc"`` (require ``hdf5plugin`` package to write and read
+        the data) or ``"none"`` (no compression). Default: ``"gzip"``.
+    compression_level : int or None
+        Compression level (0..9) for ``"gzip"``, ``"zstd"`` and ``"blosc"`` codecs. If None,
+        then the default level for the codec is used.
+    shuffle : bool or None
+        Apply shuffle filter before compression. Shuffling typically improves compression ratio
+        of floating point data. Default: ``False``.
+    chunks : int, tuple(int) or None
+        Chunk shape of the datasets with raw fluorescence data. If integer, then the value
+        is the number of pixels in a chunk: each chunk contains full spectra of a nearly square
+        block of pixels. A tuple ``(ny, nx)`` or ``(ny, nx, ne)`` defines the chunk shape explicitly.
+        Chunks that contain full spectra and the number of pixels that divides the number
+        of pixels in the blocks used for processing (see ``pyxrf.core.map_processing.prepare_xrf_map``)
+        allow to read the blocks efficiently. If None, then h5py selects the chunk shape automatically
+        (uncompressed datasets are also chunked).
+
+    The storage parameters that are None are set using Dask configuration values
+    ``pyxrf.raw-data.compression``, ``pyxrf.raw-data.compression-level``, ``pyxrf.raw-data.shuffle``
+    and ``pyxrf.raw-data.chunks`` (if set), e.g. ``dask.config.set({"pyxrf.raw-data.compression": "lzf"})``
+    changes the codec used by ``make_hdf``. The storage parameters are saved as metadata fields
+    ``raw_data_compression``, ``raw_data_compression_level``, ``raw_data_shuffle`` and ``raw_data_chunks``.
 
     Raises
     ------
     IOError
         Failed to write data to HDF5 file.
+    ValueError
+        Invalid storage parameters.
     """
 
     time_start = ttime.time()
@@ -3948,6 +4246,16 @@ def save_data_to_hdf5(
                 else:
                     sum_data += data[detname]
 
+    storage_kwargs, storage_metadata = {}, {}
+    if sum_data is not None:
+        storage_kwargs, storage_metadata = _raw_data_storage_options(
+            sum_data.shape,
+            compression=compression,
+            compression_level=compression_level,
+            shuffle=shuffle,
+            chunks=chunks,
+        )
+
     file_open_mode = "a"
     if os.path.exists(fpath):
         if fname_add_version:
@@ -3979,6 +4287,7 @@ def save_data_to_hdf5(
 
         metadata_prepared = metadata or {}
         metadata_prepared.update(metadata_additional)
+        metadata_prepared.update(storage_metadata)
         if "file_software" not in metadata_prepared:
             metadata_prepared.update(metadata_software_version)
 
@@ -3988,60 +4297,51 @@ def save_data_to_hdf5(
             for key, value in metadata_prepared.items():
                 metadata_grp.attrs[key] = value
 
-        # The following parameters control how data is loaded from Tiled
-        n_pixels_in_batch = 40000
-        n_tiled_download_retries = 10
-
-        def compute_batch_params(shape):
-            n_rows, n_cols = shape[0], shape[1]
-            n_rows_batch = max(int(n_pixels_in_batch / n_cols), 1)  # Save at least one row
-            n_batches = int(n_rows / n_rows_batch)
-            if n_rows % n_rows_batch:
-                n_batches += 1
-            return n_rows, n_rows_batch, n_batches
-
-        def download_dataset(dset, data):
-            n_rows, n_rows_batch, n_batches = compute_batch_params(sum_data.shape)
-            for n in range(n_batches):
-                ns, ne = n * n_rows_batch, min((n + 1) * n_rows_batch, n_rows)
-                for retry in range(n_tiled_download_retries):
-                    try:
-                        dset[ns:ne, ...] = np.nan_to_num(np.array(data[ns:ne, ...]))
-                        # dset[ns:ne, ...] = np.nan_to_num(data[ns:ne, ...].compute())
-                        break
-                    except Exception as ex:
-                        logger.error(f"Failed to load the batch: {ex}")
-                    if retry >= n_tiled_download_retries - 1:
-                        raise TimeoutError("Failed to download data from Tiled server")
-                print(f"  Number of saved rows: {ne}")
+        # Dask arrays (datasets and sources) are downloaded together after all datasets are created
+        download_dsets, download_sources = [], []
 
+        # Each raw dataset is assigned unique ID ('raw_data_id'), which identifies the raw data in the cache
+        #   of processing results (see 'pyxrf.core.result_cache'). Saving the data again changes the ID.
         if create_each_det is True:
             for detname in xrf_det_list:
                 if not isinstance(sum_data, da.core.Array):
                     new_data = data[detname]
                     dataGrp = f.create_group(interpath + "/" + detname)
-                    ds_data = dataGrp.create_dataset("counts", data=new_data, compression="gzip")
+                    ds_data = dataGrp.create_dataset("counts", data=new_data, **storage_kwargs)
                     ds_data.attrs["comments"] = "Experimental data from {}".format(detname)
+                    ds_data.attrs["raw_data_id"] = uuid.uuid4().hex
                 else:
                     new_data = data[detname]
                     dataGrp = f.create_group(interpath + "/" + detname)
-                    ds_data = dataGrp.create_dataset("counts", new_data.shape, compression="gzip")
-                    print(f"Downloading data: channel {detname!r} ...")
-                    download_dataset(ds_data, new_data)
+                    ds_data = dataGrp.create_dataset("counts", new_data.shape, dtype=np.float32, **storage_kwargs)
+                    download_dsets.append(ds_data)
+                    download_sources.append(new_data)
                     ds_data.attrs["comments"] = "Experimental data from {}".format(detname)
+                    ds_data.attrs["raw_data_id"] = uuid.uuid4().hex
 
         # summed data
         if sum_data is not None:
             if not isinstance(sum_data, da.core.Array):
                 dataGrp = f.create_group(interpath + "/detsum")
-                ds_data = dataGrp.create_dataset("counts", data=sum_data, compression="gzip")
+                ds_data = dataGrp.create_dataset("counts", data=sum_data, **storage_kwargs)
                 ds_data.attrs["comments"] = "Experimental data from channel sum"
+                ds_data.attrs["raw_data_id"] = uuid.uuid4().hex
             else:
                 dataGrp = f.create_group(interpath + "/detsum")
-                ds_data = dataGrp.create_dataset("counts", sum_data.shape, compression="gzip")
-                print("Downloading data: the sum of all channels ...")
-                download_dataset(ds_data, sum_data)
+                ds_data = dataGrp.create_dataset("counts", sum_data.shape, dtype=np.float32, **storage_kwargs)
+                download_dsets.append(ds_data)
+                download_sources.append(sum_data)
                 ds_data.attrs["comments"] = "Experimental data from channel sum"
+                ds_data.attrs["raw_data_id"] = uuid.uuid4().hex
+
+            if download_dsets:
+                # The channels and the sum are downloaded in one pass over the source data
+                print(f"Downloading data: the sum of all channels and {len(download_dsets) - 1} channel(s) ...")
+                _download_dataset(download_dsets, download_sources)
+
+            # Actual chunk shape (including the shape selected by h5py)
+            if ds_data.chunks:
+                metadata_grp.attrs["raw_data_chunks"] = ds_data.chunks
 
         # add positions
         if "pos_names" in data:
@@ -20,7 +20,7 @@ from skbeam.core.fitting.xrf_model import (
 )
 from skbeam.fluorescence import XrfElement as Element
 
-from ..core.map_processing import snip_method_numba
+from ..core.map_processing import snip_method_block
 from ..core.utils import gaussian_fwhm_to_sigma, gaussian_sigma_to_fwhm
 from ..core.xrf_utils import check_if_eline_supported, get_element_atomic_number, get_eline_parameters
 
@@ -1316,7 +1316,7 @@ def calculate_profile(x, y, param, elemental_lines, default_area=1e5):
     temp_d = {k: v for (k, v) in zip(total_list, matv.transpose())}
 
     # add background
-    bg = snip_method_numba(
+    bg = snip_method_block(
         y,
         fitting_parameters["e_offset"]["value"],
         fitting_parameters["e_linear"]["value"],
@@ -10,6 +10,7 @@ from skbeam.core.fitting.xrf_model import K_LINE, L_LINE, M_LINE
 from skbeam.fluorescence import XrfElement as Element
 
 from ..core.map_processing import TerminalProgressBar, compute_selected_rois
+from ..core.result_cache import get_result_cache
 from .fileio import save_fitdata_to_hdf
 from .fit_spectrum import get_energy_bin_range
 
@@ -317,10 +318,11 @@ class ROIModel(Atom):
             roi_dict=roi_dict,
             snip_param=snip_param,
             use_snip=self.subtract_background,
-            chunk_pixels=5000,
+            chunk_pixels="auto",
             n_chunks_min=4,
             progress_bar=TerminalProgressBar("Computing ROIs: "),
             client=None,
+            result_cache=get_result_cache(),
         )
 
         # Save ROI data to HDF5 file
@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+import time as ttime
+
+import pytest
+
+from pyxrf.model import command_tools
+from pyxrf.model.batch_scheduler import (
+    BatchManifest,
+    compute_processing_key,
+    format_timing_summary,
+    prefetch_file,
+    run_batch,
+)
+from pyxrf.model.command_tools import pyxrf_batch
+
+
+def _create_files(tmp_path, n_files, size=1000):
+    flist = []
+    for n in range(n_files):
+        fpath = os.path.join(tmp_path, f"scan2D_{1000 + n}.h5")
+        with open(fpath, "wb") as f:
+            f.write(os.urandom(size))
+        flist.append(fpath)
+    return flist
+
+
+@pytest.mark.parametrize("n_concurrent_files", [1, 3])
+def test_run_batch_1(tmp_path, n_concurrent_files):
+    """
+    ``run_batch``: files are processed concurrently, failed files are reported in the timing summary
+    """
+    flist = _create_files(tmp_path, 6)
+    n_active, n_active_max = [0], [0]
+    lock = threading.Lock()
+
+    def process_file(fpath):
+        with lock:
+            n_active[0] += 1
+            n_active_max[0] = max(n_active_max[0], n_active[0])
+        try:
+            ttime.sleep(0.05)
+            if fpath == flist[2]:
+                raise RuntimeError("Processing failed")
+        finally:
+            with lock:
+                n_active[0] -= 1
+
+    summary = run_batch(flist, process_file, n_concurrent_files=n_concurrent_files, n_prefetch_files=2)
+    assert n_active_max[0] == n_concurrent_files
+    assert [_["file"] for _ in summary] == flist
+    assert [_["status"] for _ in summary] == ["completed"] * 2 + ["failed"] + ["completed"] * 3
+    assert all([_["processing_time"] >= 0.05 for _ in summary])
+
+    table = format_timing_summary(summary)
+    assert "scan2D_1002.h5" in table
+    assert "Completed: 5, failed: 1, skipped: 0" in table
+
+    with pytest.raises(RuntimeError, match="Processing failed"):
+        run_batch(flist, process_file, n_concurrent_files=n_concurrent_files, raise_exceptions=True)
+
+    with pytest.raises(ValueError, match="Parameter 'n_concurrent_files' must be an integer >= 1"):
+        run_batch(flist, process_file, n_concurrent_files=0)
+
+
+def test_run_batch_manifest(tmp_path):
+    """
+    ``run_batch``: completed files are recorded in the manifest and skipped when the batch is restarted
+    """
+    flist = _create_files(tmp_path, 4)
+    manifest_path = os.path.join(tmp_path, "manifest", "batch.json")
+    processed, failing_files = [], [flist[1]]
+
+    def process_file(fpath):
+        processed.append(fpath)
+        if fpath in failing_files:
+            raise RuntimeError("Processing failed")
+
+    run_batch(flist, process_file, manifest=BatchManifest(manifest_path), processing_key="abc")
+    with open(manifest_path, "r") as f:
+        entries = json.load(f)["files"]
+    assert [entries[_]["status"] for _ in flist] == ["completed", "failed", "completed", "completed"]
+
+    # Only the failed and modified files are processed again
+    failing_files.clear()
+    with open(flist[3], "ab") as f:
+        f.write(b"new data")
+    processed.clear()
+    summary = run_batch(flist, process_file, manifest=BatchManifest(manifest_path), processing_key="abc")
+    assert processed == [flist[1], flist[3]]
+    assert [_["status"] for _ in summary] == ["skipped", "completed", "skipped", "completed"]
+
+    # All files are processed with different parameters
+    processed.clear()
+    run_batch(flist, process_file, manifest=BatchManifest(manifest_path), processing_key="def")
+    assert processed == flist
+
+    # Corrupt manifest is reset
+    with open(manifest_path, "w") as f:
+        f.write("not JSON")
+    assert not BatchManifest(manifest_path).is_completed(flist[0], "def")
+
+
+def test_compute_processing_key(tmp_path):
+    fpath = os.path.join(tmp_path, "param.json")
+    with open(fpath, "w") as f:
+        f.write('{"a": 1}')
+    key = compute_processing_key([fpath], use_snip=True)
+    assert key == compute_processing_key([fpath], use_snip=True)
+    assert key != compute_processing_key([fpath], use_snip=False)
+    with open(fpath, "w") as f:
+        f.write('{"a": 2}')
+    assert key != compute_processing_key([fpath], use_snip=True)
+
+    with pytest.raises(IOError, match="Processing parameter file .* does not exist"):
+        compute_processing_key([fpath, os.path.join(tmp_path, "missing.json")], use_snip=True)
+
+
+def test_prefetch_file(tmp_path):
+    (fpath,) = _create_files(tmp_path, 1, size=100000)
+    assert prefetch_file(fpath, block_size=30000) == 100000
+    cancel_event = threading.Event()
+    cancel_event.set()
+    assert prefetch_file(fpath, cancel_event=cancel_event) == 0
+
+
+def test_pyxrf_batch_manifest(tmp_path, monkeypatch, capsys):
+    """
+    ``pyxrf_batch``: the files are processed concurrently and the completed files are skipped
+    when the batch is restarted
+    """
+    flist = _create_files(tmp_path, 3)
+    param_path = os.path.join(tmp_path, "param.json")
+    with open(param_path, "w") as f:
+        f.write("{}")
+    manifest_path = os.path.join(tmp_path, "manifest.json")
+
+    processed = []
+
+    def fit_pixel_data_and_save(working_directory, file_name, **kwargs):
+        processed.append(file_name)
+
+    monkeypatch.setattr(command_tools, "fit_pixel_data_and_save", fit_pixel_data_and_save)
+
+    kwargs = dict(param_file_name="param.json", wd=str(tmp_path), n_concurrent_files=2, n_prefetch_files=1)
+    assert pyxrf_batch(**kwargs, manifest_file=manifest_path) == flist
+    assert sorted(processed) == [os.path.basename(_) for _ in flist]
+    assert "Completed: 3, failed: 0, skipped: 0" in capsys.readouterr().out
+
+    processed.clear()
+    pyxrf_batch(**kwargs, manifest_file=manifest_path)
+    assert processed == []
+    assert "Completed: 0, failed: 0, skipped: 3" in capsys.readouterr().out
+
+    # The files are processed again if the parameters are changed
+    pyxrf_batch(**kwargs, use_snip=False, manifest_file=manifest_path)
+    assert len(processed) == 3
+
+
+def test_pyxrf_batch_manifest_data_files(tmp_path, monkeypatch):
+    """
+    ``pyxrf_batch``: the parameter files are found in the directories of the data files
+    (as in ``fit_pixel_data_and_save``), so the files are processed again if those parameters are changed
+    """
+    data_dir = os.path.join(tmp_path, "data")
+    os.makedirs(data_dir)
+    flist = _create_files(data_dir, 2)
+    for d in (tmp_path, data_dir):
+        with open(os.path.join(d, "param.json"), "w") as f:
+            f.write("{}")
+    manifest_path = os.path.join(tmp_path, "manifest.json")
+
+    processed = []
+
+    def fit_pixel_data_and_save(working_directory, file_name, **kwargs):
+        processed.append(file_name)
+
+    monkeypatch.setattr(command_tools, "fit_pixel_data_and_save", fit_pixel_data_and_save)
+
+    kwargs = dict(param_file_name="param.json", wd=str(tmp_path), data_files=flist, manifest_file=manifest_path)
+    pyxrf_batch(**kwargs)
+    assert len(processed) == 2
+
+    processed.clear()
+    pyxrf_batch(**kwargs)
+    assert processed == []
+
+    with open(os.path.join(data_dir, "param.json"), "w") as f:
+        f.write('{"a": 1}')
+    pyxrf_batch(**kwargs)
+    assert len(processed) == 2
+
+    # The parameter file is missing in the directory of one of the data files: only the file fails
+    data_dir2 = os.path.join(tmp_path, "data2")
+    os.makedirs(data_dir2)
+    flist2 = _create_files(data_dir2, 1)
+    processed.clear()
+    pyxrf_batch(**dict(kwargs, data_files=flist + flist2))
+    assert processed == []
+    with open(manifest_path, "r") as f:
+        entries = json.load(f)["files"]
+    assert entries[flist2[0]]["status"] == "failed"
+    assert "does not exist" in entries[flist2[0]]["error"]
+
+    with pytest.raises(IOError, match="Processing parameter file .* does not exist"):
+        # Exceptions are raised if a single file is processed
+        pyxrf_batch(**dict(kwargs, data_files=flist2[0]))
@@ -1,11 +1,20 @@
+import concurrent.futures
 import copy
+import multiprocessing
 import os
+import threading
+import time as ttime
 
+import dask
+import dask.array as da
+import h5py
 import numpy as np
 import numpy.testing as npt
 import pytest
 
 from pyxrf.api_dev import read_data_from_hdf5, save_data_to_hdf5
+from pyxrf.model.fileio import StreamingFitDataWriter, save_fitdata_to_hdf
+from pyxrf.model.load_data_from_db import _download_dataset
 
 
 def _prepare_raw_dataset(N=5, M=10, K=4096):
@@ -22,9 +31,7 @@ def _prepare_raw_dataset(N=5, M=10, K=4096):
     pos_names = ["x_pos", "y_pos"]
     pos_data = np.zeros(shape=[2, N, M])
     pos_data[0, :, :] = np.broadcast_to(np.linspace(1, 1 + (M - 1) * 0.1, M), shape=[N, M])
-    pos_data[1, :, :] = np.broadcast_to(
-        np.reshape(np.linspace(5, 5 + (N - 1) * 0.2, N), newshape=[N, 1]), shape=[N, M]
-    )
+    pos_data[1, :, :] = np.broadcast_to(np.reshape(np.linspace(5, 5 + (N - 1) * 0.2, N), [N, 1]), shape=[N, M])
 
     data = {
         "det_sum": det_sum,
@@ -59,8 +66,15 @@ def test_save_data_to_hdf5_1(tmp_path):
     with pytest.raises(IOError, match="File .* already exists"):
         save_data_to_hdf5(fpath, data, metadata=metadata)
 
+    with h5py.File(fpath, "r") as f:
+        raw_data_id = f["xrfmap/detsum/counts"].attrs["raw_data_id"]
+        assert raw_data_id != f["xrfmap/det1/counts"].attrs["raw_data_id"]
+
     # File should be overwritten
     save_data_to_hdf5(fpath, data, metadata=metadata, file_overwrite_existing=True)
+    with h5py.File(fpath, "r") as f:
+        # The raw data is identified as new data
+        assert f["xrfmap/detsum/counts"].attrs["raw_data_id"] != raw_data_id
 
     # Different version of the file should be created
     save_data_to_hdf5(fpath, data, metadata=metadata, fname_add_version=True)
@@ -182,3 +196,271 @@ def test_save_data_to_hdf5_4(tmp_path):
 
     assert metadata_loaded["file_software"] == application
     assert metadata_loaded["file_software_version"] == version
+
+
+# fmt: off
+@pytest.mark.parametrize("kwargs, compression, compression_level, shuffle, chunks", [
+    ({}, "gzip", 4, False, None),
+    ({"compression": "gzip", "compression_level": 7, "shuffle": True, "chunks": 20}, "gzip", 7, True, (4, 5, 256)),
+    ({"compression": "lzf", "chunks": (2, 3)}, "lzf", None, False, (2, 3, 256)),
+    ({"compression": "none"}, None, None, False, None),
+    ({"compression": "none", "chunks": (2, 3, 64)}, None, None, False, (2, 3, 64)),
+    ({"compression": "zstd", "compression_level": 1, "chunks": 1000}, "zstd", 1, False, (5, 10, 256)),
+])
+# fmt: on
+def test_save_data_to_hdf5_storage(tmp_path, kwargs, compression, compression_level, shuffle, chunks):
+    """
+    ``save_data_to_hdf5``: compression codec, shuffling and chunk shape of raw data are
+    configurable and saved as metadata
+    """
+    if kwargs.get("compression") == "zstd":
+        pytest.importorskip("hdf5plugin")
+    fpath = os.path.join(tmp_path, "test.h5")
+    data, metadata = _prepare_raw_dataset(N=5, M=10, K=256)
+    save_data_to_hdf5(fpath, data, metadata=metadata, **kwargs)
+
+    with h5py.File(fpath, "r") as f:
+        for det in ("detsum", "det1"):
+            dset = f[f"xrfmap/{det}/counts"]
+            if compression in ("gzip", "lzf", None):
+                assert dset.compression == compression
+            else:
+                assert dset.compression == "unknown"  # Filter plugin
+            assert dset.shuffle == shuffle
+            if chunks is not None:
+                assert dset.chunks == chunks
+            else:
+                assert dset.chunks is not None
+        chunks_saved = dset.chunks
+
+    data_loaded, metadata_loaded = read_data_from_hdf5(fpath)
+    npt.assert_array_almost_equal(data_loaded["det_sum"], data["det_sum"])
+    assert metadata_loaded["raw_data_compression"] == kwargs.get("compression", "gzip")
+    assert metadata_loaded["raw_data_shuffle"] == shuffle
+    if compression_level is None:
+        assert "raw_data_compression_level" not in metadata_loaded
+    else:
+        assert metadata_loaded["raw_data_compression_level"] == compression_level
+    assert tuple(metadata_loaded["raw_data_chunks"]) == chunks_saved
+
+
+def test_save_data_to_hdf5_storage_config(tmp_path):
+    """
+    ``save_data_to_hdf5``: storage parameters are set using Dask configuration
+    """
+    fpath = os.path.join(tmp_path, "test.h5")
+    data, _ = _prepare_raw_dataset(N=5, M=10, K=256)
+    with dask.config.set({"pyxrf.raw-data.compression": "lzf", "pyxrf.raw-data.chunks": [1, 2]}):
+        save_data_to_hdf5(fpath, data)
+    with h5py.File(fpath, "r") as f:
+        dset = f["xrfmap/detsum/counts"]
+        assert dset.compression == "lzf"
+        assert dset.chunks == (1, 2, 256)
+
+
+# fmt: off
+@pytest.mark.parametrize("kwargs, err_msg", [
+    ({"compression": "abc"}, "Unsupported compression codec 'abc'"),
+    ({"compression": "lzf", "compression_level": 3}, "does not support compression levels"),
+    ({"compression": "gzip", "compression_level": 10}, "must be an integer in the range 0..9"),
+    ({"chunks": 0}, "The number of pixels in a chunk must be positive"),
+    ({"chunks": (2, 0)}, "Chunk shape must be a tuple of 2 or 3 positive integers"),
+    ({"chunks": (2, 3, 4, 5)}, "Chunk shape must be a tuple of 2 or 3 positive integers"),
+])
+# fmt: on
+def test_save_data_to_hdf5_storage_fail(tmp_path, kwargs, err_msg):
+    fpath = os.path.join(tmp_path, "test.h5")
+    data, _ = _prepare_raw_dataset(N=5, M=10, K=256)
+    with pytest.raises(ValueError, match=err_msg):
+        save_data_to_hdf5(fpath, data, **kwargs)
+    assert not os.path.exists(fpath)
+
+
+class _StandInArraySource:
+    """
+    Local stand-in for the array on Tiled server: each request is delayed and the first
+    ``n_failures`` requests fail. Requested row ranges are recorded.
+    """
+
+    def __init__(self, data, *, delay=0.0, n_failures=0):
+        self._data = data
+        self.shape, self.dtype, self.ndim = data.shape, data.dtype, data.ndim
+        self.delay = delay
+        self.n_failures = n_failures
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def __getitem__(self, index):
+        with self._lock:
+            if self.n_failures > 0:
+                self.n_failures -= 1
+                raise IOError("Connection was lost")
+            self.requests.append(index[0] if isinstance(index, tuple) else index)
+        ttime.sleep(self.delay)
+        return self._data[index]
+
+
+@pytest.mark.parametrize("n_workers", [1, 4])
+def test_download_dataset_1(tmp_path, n_workers):
+    """
+    ``_download_dataset``: batches are downloaded concurrently, failed requests are retried,
+    NaNs are replaced with zeros and the batch size is adjusted based on download time
+    """
+    data = np.random.rand(50, 10, 32).astype(np.float32)
+    data[3, 4, 5] = np.nan
+    source = _StandInArraySource(data, delay=0.01, n_failures=3)
+
+    with h5py.File(os.path.join(tmp_path, "test.h5"), "w") as f:
+        dset = f.create_dataset("counts", data.shape, dtype=np.float32)
+        _download_dataset(
+            dset, source, n_pixels_in_batch=20, n_workers=n_workers, batch_time=0.1, backoff_initial=0
+        )
+        data_saved = dset[...]
+
+    data_expected = np.nan_to_num(data)
+    npt.assert_array_equal(data_saved, data_expected)
+    rows = sorted([(_.start, _.stop) for _ in source.requests])
+    assert rows[0] == (0, 2)
+    assert all([r1[1] == r2[0] for r1, r2 in zip(rows[:-1], rows[1:])]), "Batches must not overlap"
+    assert max([_[1] - _[0] for _ in rows]) > 2, "Batch size was not increased"
+
+
+def test_download_dataset_2(tmp_path):
+    """
+    ``_download_dataset``: the batch size is limited by the size of data in flight
+    and the exception is raised if a batch can not be downloaded
+    """
+    data = np.random.rand(50, 10, 32).astype(np.float32)
+    source = _StandInArraySource(data)
+
+    with h5py.File(os.path.join(tmp_path, "test.h5"), "w") as f:
+        dset = f.create_dataset("counts", data.shape, dtype=np.float32)
+        _download_dataset(dset, source, n_workers=2, max_bytes_in_flight=2 * 3 * 10 * 32 * 4)
+        npt.assert_array_equal(dset[...], data)
+        assert max([_.stop - _.start for _ in source.requests]) == 3
+
+        source = _StandInArraySource(data, n_failures=100)
+        with pytest.raises(TimeoutError, match="Failed to download data"):
+            _download_dataset(dset, source, n_retries=3, backoff_initial=0)
+
+
+def test_download_dataset_3(tmp_path):
+    """
+    ``_download_dataset``: multiple arrays computed from the same source are downloaded in one pass
+    """
+    data = np.random.rand(20, 10, 4, 32).astype(np.float32)
+    source = _StandInArraySource(data)
+    data_source = da.from_array(source, chunks=(2, 10, 4, 32))
+    arrays = [data_source[:, :, n, :] for n in range(data.shape[2])] + [da.sum(data_source, axis=2)]
+
+    with h5py.File(os.path.join(tmp_path, "test.h5"), "w") as f:
+        dsets = [f.create_dataset(f"counts{n}", (20, 10, 32), dtype=np.float32) for n in range(len(arrays))]
+        _download_dataset(dsets, arrays, n_workers=2)
+        for n in range(data.shape[2]):
+            npt.assert_array_equal(dsets[n][...], data[:, :, n, :])
+        npt.assert_array_almost_equal(dsets[-1][...], np.sum(data, axis=2), decimal=5)
+
+    rows = sorted([(_.start, _.stop) for _ in source.requests if _.stop > _.start])
+    assert rows == [(n, n + 2) for n in range(0, 20, 2)], "Each chunk must be downloaded once"
+
+    with pytest.raises(ValueError, match="The number of datasets"):
+        _download_dataset(dsets[:2], arrays)
+
+
+def test_save_data_to_hdf5_dask(tmp_path):
+    """
+    ``save_data_to_hdf5``: Dask arrays (data on Tiled server) are downloaded in batches
+    """
+    fpath = os.path.join(tmp_path, "test.h5")
+    data, metadata = _prepare_raw_dataset(N=5, M=10, K=256)
+    data = dict(data)
+    for key in ("det1", "det2", "det3"):
+        data[key] = da.from_array(
+            _StandInArraySource(data[key].astype(np.float32), n_failures=1), chunks=(2, 10, 256)
+        )
+    del data["det_sum"]
+
+    save_data_to_hdf5(fpath, data, metadata=metadata)
+    data_loaded, _ = read_data_from_hdf5(fpath)
+    npt.assert_array_almost_equal(data_loaded["det1"], np.ones([5, 10, 256]) * 100)
+    npt.assert_array_almost_equal(data_loaded["det_sum"], np.ones([5, 10, 256]) * 450)
+
+
+def _read_dataset(fpath, dset_name):
+    with h5py.File(fpath, "r") as f:
+        return f[dset_name][()]
+
+
+def test_StreamingFitDataWriter(tmp_path):
+    """
+    Check that the maps written block by block using ``StreamingFitDataWriter`` are identical
+    to the maps saved by ``save_fitdata_to_hdf``. The file is expected to contain raw data,
+    which remains readable while the results are written. The results are saved to the file
+    only when the writer is closed.
+    """
+    ny, nx = 7, 9
+    names = ["Ca_K", "Fe_K", "snip_bkg", "r_factor"]
+    maps = {name: np.random.rand(ny, nx) for name in names}
+
+    fpath = os.path.join(tmp_path, "scan_data.h5")
+    fpath_ref = os.path.join(tmp_path, "scan_data_ref.h5")
+    raw_data = np.random.rand(ny, nx, 20)
+    for fp in (fpath, fpath_ref):
+        with h5py.File(fp, "w") as f:
+            f.create_dataset("xrfmap/detsum/counts", data=raw_data)
+
+    save_fitdata_to_hdf(fpath_ref, maps, datapath="xrfmap/detsum")
+
+    with StreamingFitDataWriter(fpath, names, (ny, nx), datapath="xrfmap/detsum") as writer:
+        for n_row in range(0, ny, 3):
+            for n_col in range(0, nx, 4):
+                block_slice = np.s_[n_row : n_row + 3, n_col : n_col + 4]
+                # Read the raw data from the same file while the results are written
+                with h5py.File(fpath, "r") as f:
+                    npt.assert_array_equal(f["xrfmap/detsum/counts"][block_slice], raw_data[block_slice])
+                writer.write_block({k: v[block_slice] for k, v in maps.items()}, block_slice)
+
+        # The raw data can be read by other processes (e.g. workers of Dask cluster)
+        with concurrent.futures.ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            npt.assert_array_equal(pool.submit(_read_dataset, fpath, "xrfmap/detsum/counts").result(), raw_data)
+
+        with h5py.File(fpath, "r") as f:
+            assert "xrf_fit" not in f["xrfmap/detsum"]
+
+    # The temporary file is deleted
+    assert set(os.listdir(tmp_path)) == {"scan_data.h5", "scan_data_ref.h5"}
+
+    with pytest.raises(RuntimeError, match="Attempt to write data to the closed file"):
+        writer.write_block(maps, np.s_[0:ny, 0:nx])
+
+    with h5py.File(fpath, "r") as f, h5py.File(fpath_ref, "r") as f_ref:
+        for name in ("xrf_fit", "xrf_fit_name"):
+            ds, ds_ref = f["xrfmap/detsum"][name], f_ref["xrfmap/detsum"][name]
+            assert ds.dtype == ds_ref.dtype
+            npt.assert_array_equal(ds[()], ds_ref[()])
+        npt.assert_array_equal(f["xrfmap/detsum/counts"][()], raw_data)
+
+
+def test_StreamingFitDataWriter_discard(tmp_path):
+    """
+    The results are discarded and the file is not changed if processing fails.
+    """
+    fpath = os.path.join(tmp_path, "scan_data.h5")
+    with h5py.File(fpath, "w") as f:
+        f.create_dataset("xrfmap/detsum/counts", data=np.ones([5, 6, 20]))
+    save_fitdata_to_hdf(fpath, {"Ca_K": np.ones([5, 6])}, datapath="xrfmap/detsum")
+
+    with pytest.raises(RuntimeError, match="Processing failed"):
+        with StreamingFitDataWriter(fpath, ["Ca_K"], (5, 6), datapath="xrfmap/detsum") as writer:
+            writer.write_block({"Ca_K": np.zeros([5, 6])}, np.s_[0:5, 0:6])
+            raise RuntimeError("Processing failed")
+
+    assert os.listdir(tmp_path) == ["scan_data.h5"]
+    with h5py.File(fpath, "r") as f:
+        npt.assert_array_equal(f["xrfmap/detsum/xrf_fit"][()], np.ones([1, 5, 6]))
+
+
+def test_StreamingFitDataWriter_fail(tmp_path):
+    fpath = os.path.join(tmp_path, "scan_data.h5")
+    with pytest.raises(ValueError, match="Parameter 'map_shape' must contain 2 elements"):
+        StreamingFitDataWriter(fpath, ["Ca_K"], (5, 6, 7))
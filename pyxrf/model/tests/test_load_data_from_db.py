@@ -0,0 +1,100 @@
+import os
+import threading
+import time as ttime
+
+import dask.array as da
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from pyxrf.model import load_data_from_db
+from pyxrf.model.load_data_from_db import _flip_odd_rows, _stack_detector_channels, make_hdf
+
+
+@pytest.mark.parametrize("n_workers", [1, 4])
+def test_make_hdf_range(tmp_path, monkeypatch, capsys, n_workers):
+    """
+    ``make_hdf``: the range of scans is converted sequentially or concurrently. Scans that
+    can not be converted are skipped.
+    """
+    n_active, n_active_max = [0], [0]
+    lock = threading.Lock()
+    scans_converted = []
+
+    def fetch_data_from_db(run_id_uid, *, fpath, completed_scans_only, **kwargs):
+        with lock:
+            n_active[0] += 1
+            n_active_max[0] = max(n_active_max[0], n_active[0])
+        try:
+            ttime.sleep(0.05)
+            if run_id_uid in (1003, 1005):
+                raise RuntimeError(f"Run '{run_id_uid}' does not exist")
+            if completed_scans_only and (run_id_uid == 1006):
+                raise Exception("Scan is not completed")
+            with lock:
+                scans_converted.append((run_id_uid, fpath))
+        finally:
+            with lock:
+                n_active[0] -= 1
+
+    monkeypatch.setattr(load_data_from_db, "fetch_data_from_db", fetch_data_from_db)
+    make_hdf(1000, 1007, wd=tmp_path, completed_scans_only=True, n_workers=n_workers)
+
+    expected = [(_, os.path.join(tmp_path, f"scan2D_{_}.h5")) for _ in (1000, 1001, 1002, 1004, 1007)]
+    assert sorted(scans_converted) == expected
+    assert n_active_max[0] == n_workers
+
+    captured = capsys.readouterr().out
+    for n in (1000, 1001, 1002, 1004, 1007):
+        assert f"Scan #{n}: Conversion completed" in captured
+    for n in (1003, 1005, 1006):
+        assert f"Scan #{n}: Can not complete the conversion" in captured
+    assert "Scan is not completed" in captured
+
+
+@pytest.mark.parametrize("n_workers", [0, -1, 1.5])
+def test_make_hdf_fail(n_workers):
+    with pytest.raises(ValueError, match="Parameter 'n_workers' must be a positive integer"):
+        make_hdf(1000, 1001, n_workers=n_workers)
+
+
+@pytest.mark.parametrize("n_points", [12, 10])
+def test_stack_detector_channels(n_points):
+    """
+    ``_stack_detector_channels``: the channels are stacked, missing points are filled with zeros
+    """
+    channels = [np.random.rand(n_points, 8) for _ in range(3)]
+    data = _stack_detector_channels([da.from_array(_, chunks=(4, 8)) for _ in channels], n_rows=3, n_cols=4)
+    assert isinstance(data, da.core.Array)
+    assert data.shape == (3, 4, 3, 8)
+
+    expected = np.zeros((12, 3, 8))
+    expected[:n_points] = np.stack(channels, axis=1)
+    npt.assert_array_equal(data.compute(), expected.reshape(3, 4, 3, 8))
+
+
+# fmt: off
+@pytest.mark.parametrize("shape, chunks, row_axis, col_axis", [
+    ((7, 5, 3), (7, 5, 3), 0, 1),
+    ((7, 5, 3), (3, 2, 3), 0, 1),
+    ((2, 9, 4), (1, 2, 4), 1, 2),
+])
+# fmt: on
+def test_flip_odd_rows(shape, chunks, row_axis, col_axis):
+    """
+    ``_flip_odd_rows``: the order of points is reversed in odd rows
+    """
+    data = np.random.rand(*shape)
+    expected = np.copy(data)
+    for n_row in range(1, shape[row_axis], 2):
+        row = np.take(data, n_row, axis=row_axis)
+        row = np.flip(row, axis=col_axis - 1 if col_axis > row_axis else col_axis)
+        index = [slice(None)] * data.ndim
+        index[row_axis] = n_row
+        expected[tuple(index)] = row
+
+    data_copy = np.copy(data)
+    result = _flip_odd_rows(da.from_array(data, chunks=chunks), row_axis=row_axis, col_axis=col_axis)
+    assert isinstance(result, da.core.Array)
+    npt.assert_array_equal(result.compute(), expected)
+    npt.assert_array_equal(data, data_copy)  # The source array is not modified
@@ -48,6 +48,21 @@ def run():
         choices=["DEFAULT", "DARK"],
         help="Color theme: DARK theme is only for debugging purposes.",
     )
+    parser.add_argument(
+        "-dp",
+        "--dask-prewarm",
+        action="store_true",
+        dest="dask_prewarm",
+        help="Start Dask client in the background at startup so that it is ready for processing of large maps.",
+    )
+    parser.add_argument(
+        "-dt",
+        "--dask-idle-timeout",
+        default=600,
+        type=float,
+        dest="dask_idle_timeout",
+        help="Time (in seconds) after which the idle Dask client is closed.",
+    )
     args = parser.parse_args()
 
     from .model.catalog_management import catalog_info
@@ -70,6 +85,13 @@ def run():
     if args.loglevel != "DEBUG":
         sys.tracebacklimit = 0
 
+    from .core.map_processing import dask_client_manager
+
+    dask_client_manager.idle_timeout = args.dask_idle_timeout
+    if args.dask_prewarm:
+        logger.info("Starting Dask client in the background ...")
+        dask_client_manager.prewarm()
+
     gpc = GlobalProcessingClasses()
     # Initialize 'gpc' in 'MainWindow.__init__'
 
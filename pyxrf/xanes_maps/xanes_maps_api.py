@@ -15,7 +15,6 @@ from matplotlib.widgets import Button, Slider, TextBox
 from pystackreg import StackReg
 
 from ..core.fitting import fit_spectrum, rfactor_compute
-from ..core.map_processing import dask_client_create
 from ..core.utils import convert_time_to_nexus_string, grid_interpolate, normalize_data_by_scaler
 from ..core.xrf_utils import check_if_eline_is_activated, check_if_eline_supported
 from ..core.yaml_param_files import create_yaml_parameter_file, read_yaml_parameter_file
@@ -181,6 +180,10 @@ def build_xanes_map(
         The list of plan types (e.g. ['FlyPlan1D']) that are skipped while downloading
         data for a range of scan IDs. (Supported only at HXN.)
 
+    n_download_workers : int
+        The number of scans downloaded from databroker concurrently. This parameter is passed
+        directly to ``make_hdf`` as ``n_workers``. Default: 1 (scans are downloaded one by one).
+
     xrf_fitting_param_fln : str
         the name of the JSON parameter file. The parameters are used for automated
         processing of data with ``pyxrf_batch``. The parameter file is typically produced
@@ -353,7 +356,7 @@ def build_xanes_map(
         Default value: False
 
     dask_client : dask.distributed.Client
-        Dask client object. If None, then Dask client is created automatically.
+        Dask client object. If None, then the shared Dask client is used (see ``dask_client_manager``).
         If a batch of files is processed, then creating Dask client and
         passing the reference to it to the processing functions will save
         execution time:
@@ -478,6 +481,7 @@ _build_xanes_map_param_default = {
     "end_id": None,
     "file_overwrite_existing": False,
     "skip_scan_types": None,
+    "n_download_workers": 1,
     "xrf_fitting_param_fln": None,
     "xrf_subtract_baseline": True,
     "scaler_name": None,
@@ -515,6 +519,7 @@ _build_xanes_map_param_schema = {
         "end_id",
         "file_overwrite_existing",
         "skip_scan_types",
+        "n_download_workers",
         "xrf_fitting_param_fln",
         "xrf_subtract_baseline",
         "scaler_name",
@@ -546,6 +551,7 @@ _build_xanes_map_param_schema = {
         "end_id": {"type": ["integer", "null"], "exclusiveMinimum": 0},
         "file_overwrite_existing": {"type": "boolean"},
         "skip_scan_types": {"oneOf": [{"type": "array", "itmes": {"type": "string"}}, {"type": "null"}]},
+        "n_download_workers": {"type": "integer", "minimum": 1},
         "xrf_fitting_param_fln": {"type": ["string", "null"]},
         "xrf_subtract_baseline": {"type": "boolean"},
         "scaler_name": {"type": ["string", "null"]},
@@ -586,6 +592,7 @@ def _build_xanes_map_api(
     end_id=None,
     file_overwrite_existing=False,
     skip_scan_types=None,
+    n_download_workers=1,
     xrf_fitting_param_fln=None,
     xrf_subtract_baseline=True,
     scaler_name=None,
@@ -654,6 +661,10 @@ def _build_xanes_map_api(
         The list of plan types (e.g. ['FlyPlan1D']) that are skipped while downloading
         data for a range of scan IDs. (Supported only at HXN.)
 
+    n_download_workers : int
+        The number of scans downloaded from databroker concurrently. This parameter is passed
+        directly to ``make_hdf`` as ``n_workers``. Default: 1 (scans are downloaded one by one).
+
     xrf_fitting_param_fln : str
         the name of the JSON parameter file. The parameters are used for automated
         processing of data with ``pyxrf_batch``. The parameter file is typically produced
@@ -826,7 +837,7 @@ def _build_xanes_map_api(
         Default value: False
 
     dask_client : dask.distributed.Client
-        Dask client object. If None, then Dask client is created automatically.
+        Dask client object. If None, then the shared Dask client is used (see ``dask_client_manager``).
         If a batch of files is processed, then creating Dask client and
         passing the reference to it to the processing functions will save
         execution time: `client = Client(processes=True, silence_logs=logging.ERROR)`
@@ -965,6 +976,7 @@ def _build_xanes_map_api(
             wd_xrf=wd_xrf,
             file_overwrite_existing=file_overwrite_existing,
             skip_scan_types=skip_scan_types,
+            n_download_workers=n_download_workers,
         )
         logger.info("Loading data from databroker: success.")
     else:
@@ -1040,7 +1052,9 @@ def _build_xanes_map_api(
     logger.info("Processing is complete.")
 
 
-def _load_data_from_databroker(*, start_id, end_id, wd_xrf, file_overwrite_existing, skip_scan_types):
+def _load_data_from_databroker(
+    *, start_id, end_id, wd_xrf, file_overwrite_existing, skip_scan_types, n_download_workers=1
+):
     r"""
     Implements the first step of processing sequence: loading the batch of scan data
     from databroker.
@@ -1065,6 +1079,9 @@ def _load_data_from_databroker(*, start_id, end_id, wd_xrf, file_overwrite_exist
     skip_scan_types : list(str) or None
         The list of plan types (e.g. ['FlyPlan1D']) that are skipped while downloading
         data for a range of scan IDs. (Supported only at HXN.)
+
+    n_download_workers : int
+        the number of scans downloaded concurrently
     """
     # Try to create the directory (does nothing if the directory exists)
     os.makedirs(wd_xrf, exist_ok=True)
@@ -1085,6 +1102,7 @@ def _load_data_from_databroker(*, start_id, end_id, wd_xrf, file_overwrite_exist
         create_each_det=False,
         save_scaler=True,
         skip_scan_types=skip_scan_types,
+        n_workers=n_download_workers,
     )
 
 
@@ -1122,7 +1140,7 @@ def _process_xrf_data(
         by PyXRF.
 
     dask_client : dask.distributed.Client
-        Dask client object. If None, then Dask client is created automatically.
+        Dask client object. If None, then the shared Dask client is used (see ``dask_client_manager``).
         If a batch of files is processed, then creating Dask client and
         passing the reference to it to the processing functions will save
         execution time: `client = Client(processes=True, silence_logs=logging.ERROR)`
@@ -1146,7 +1164,7 @@ def _process_xrf_data(
         this parameter is ignored.
 
     dask_client : dask.distributed.Client
-        Dask client object. If None, then Dask client is created automatically.
+        Dask client object. If None, then the shared Dask client is used (see ``dask_client_manager``).
         If a batch of files is processed, then creating Dask client and
         passing the reference to it to the processing functions will save
         execution time: `client = Client(processes=True, silence_logs=logging.ERROR)`
@@ -1185,14 +1203,6 @@ def _process_xrf_data(
     else:
         scan_energies_adjusted = adjust_incident_beam_energies(scan_energies, eline_selected)
 
-    # Create Dask client for processing the batch of files unless one is provided
-    if dask_client is None:
-        logger.info("Creating local Dask client for processing the batch of files ...")
-        dask_client = dask_client_create()
-        client_is_local = True
-    else:
-        client_is_local = False
-
     # Process data files from the list. Use adjusted energy value.
     for fln, energy in zip(files_h5, scan_energies_adjusted):
         # Process .h5 files in the directory 'wd_xrf'. Processing results are saved
@@ -1208,11 +1218,6 @@ def _process_xrf_data(
             dask_client=dask_client,
         )
 
-    # Close the client if it was created locally
-    if client_is_local:
-        logger.info("Closing Dask client ...")
-        dask_client.close()
-
 
 def _compute_xanes_maps(
     *,